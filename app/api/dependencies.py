@@ -1,16 +1,23 @@
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+import asyncio
+import secrets
+from typing import Dict, Optional
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.security import SECRET_KEY, ALGORITHM
+from app.core.logging import app_logger
+from app.services.rate_limit import get_rate_limiter, rate_limit_headers
 from app.services.user_service import get_user_by_id
 from app.models.user import User
 
 # OAuth2密码流依赖
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/users/token")
+# 监控端点的令牌可选，未提供时只返回基本状态
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/users/token", auto_error=False)
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme), 
@@ -50,4 +57,94 @@ async def get_current_admin_user(current_user: User = Depends(get_current_active
             status_code=status.HTTP_403_FORBIDDEN,
             detail="权限不足，需要管理员权限"
         )
-    return current_user 
\ No newline at end of file
+    return current_user
+
+async def has_monitoring_access(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> bool:
+    """是否可以查看监控数据：令牌为 MONITORING_TOKEN，或者是活跃管理员的登录令牌"""
+    if not token:
+        return False
+    if settings.MONITORING_TOKEN and secrets.compare_digest(token, settings.MONITORING_TOKEN):
+        return True
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+    except JWTError:
+        return False
+    if user_id is None:
+        return False
+    user = get_user_by_id(db, int(user_id))
+    return bool(user and user.is_active and user.is_admin)
+
+async def require_monitoring_access(allowed: bool = Depends(has_monitoring_access)) -> None:
+    """要求可以查看监控数据"""
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="需要管理员或监控令牌",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+def get_client_ip(request: Request) -> str:
+    """获取客户端IP，配置信任代理时使用 X-Forwarded-For 中的第一个地址"""
+    if settings.RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def rate_limit_max_cost(rule_name: str) -> Optional[int]:
+    """规则单次请求允许扣除的最大额度，未启用限流或规则未配置时返回 None"""
+    limiter = get_rate_limiter()
+    return limiter.max_cost(rule_name) if limiter is not None else None
+
+async def charge_rate_limit(rule_name: str, key: str, cost: int = 1) -> Dict[str, str]:
+    """按规则扣除 cost 次请求额度，超出时抛出429，返回应附加到响应上的限流响应头
+
+    cost 超过规则的最大额度（令牌桶的 burst）时等待多久都不会被放行，直接抛出413。
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return {}
+    max_cost = limiter.max_cost(rule_name)
+    if max_cost is not None and cost > max_cost:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次请求最多消耗 {max_cost} 次额度",
+        )
+    if limiter.backend.blocking:
+        # SQLite后端的读写不能阻塞事件循环
+        result = await asyncio.to_thread(limiter.hit, rule_name, key, cost)
+    else:
+        result = limiter.hit(rule_name, key, cost)
+    if result is None:
+        return {}
+    headers = rate_limit_headers(result)
+    if not result.allowed:
+        app_logger.warning(f"请求被限流 [规则: {rule_name}, 键: {key}]")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="请求过于频繁，请稍后再试",
+            headers=headers,
+        )
+    return headers
+
+async def _enforce_rate_limit(rule_name: str, key: str, response: Response) -> None:
+    response.headers.update(await charge_rate_limit(rule_name, key))
+
+def rate_limit(rule_name: str):
+    """按 settings.RATE_LIMIT_RULES 中的规则限流的路由依赖
+
+    规则的 key 为 user 时在认证之后按用户ID限流，为 ip 时在处理请求体之前按客户端IP限流。
+    """
+    rule = settings.RATE_LIMIT_RULES.get(rule_name, {})
+    if rule.get("key", "user") == "user":
+        async def limit_by_user(response: Response, current_user: User = Depends(get_current_user)) -> None:
+            await _enforce_rate_limit(rule_name, f"user:{current_user.id}", response)
+        return limit_by_user
+
+    async def limit_by_ip(request: Request, response: Response) -> None:
+        await _enforce_rate_limit(rule_name, f"ip:{get_client_ip(request)}", response)
+    return limit_by_ip
@@ -1,16 +1,18 @@
 import time
-import asyncio
-from fastapi import APIRouter, HTTPException, Response, Depends, Query, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request, Response, Depends, Query, BackgroundTasks
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import Optional, List
 
 from app.core.logging import api_logger
 from app.services.agent_service import tech_assistant_query
+from app.services.admission import AdmissionRejectedError, lane_for
+from app.services.cancellation import ClientDisconnectedError, run_until_disconnected
 from app.utils.text_utils import extract_urls, extract_marked_content, clean_query
-from app.api.dependencies import get_current_active_user, get_db
+from app.api.dependencies import get_current_active_user, get_db, rate_limit
 from app.models.user import User
-from app.services import chat_service
+from app.services import chat_service, memory_service, prefetch
+from app.services.usage_service import QueryUsage, capture_usage
 from app.api.schemas import MessageCreate, ChatSessionCreate
 
 # 创建API路由器
@@ -20,6 +22,7 @@ router = APIRouter()
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[int] = None
+    use_cache: bool = True  # 为False时跳过答案缓存
 
 class QueryResponse(BaseModel):
     answer: str
@@ -32,15 +35,18 @@ async def health_check():
     return {"status": "ok", "timestamp": time.time()}
 
 # 保存消息到数据库
-async def save_message(db: Session, session_id: int, user_id: int, role: str, content: str):
-    """后台任务：保存消息到数据库"""
+async def save_message(
+    db: Session, session_id: int, user_id: int, role: str, content: str, usage: Optional[QueryUsage] = None
+):
+    """后台任务：保存消息到数据库，usage 为生成助手消息的模型用量"""
     message_data = MessageCreate(role=role, content=content)
-    chat_service.add_message(db, session_id, user_id, message_data)
+    chat_service.add_message(db, session_id, user_id, message_data, usage=usage)
 
 # 查询端点
-@router.post("/query", response_model=QueryResponse)
+@router.post("/query", response_model=QueryResponse, dependencies=[Depends(rate_limit("query"))])
 async def query_endpoint(
     request: QueryRequest,
+    http_request: Request,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -49,7 +55,6 @@ async def query_endpoint(
     query = request.query
     session_id = request.session_id
     api_logger.info(f"收到查询: {query}，用户: {current_user.username}, 会话ID: {session_id}")
-
     # 处理会话
     if session_id is None:
         # 创建新会话
@@ -72,6 +77,8 @@ async def query_endpoint(
 
     urls = extract_urls(query)
     api_logger.info(f"提取的URL: {urls}")
+    # 会话校验通过后才抓取问题中的链接
+    prefetched = await prefetch.collect(prefetch.start_prefetch(query))
     
     # 构造提示词
     if urls:
@@ -82,7 +89,7 @@ async def query_endpoint(
 
         prompt = f"""请严格按照以下要求，为用户提供纯净的Markdown格式技术解答：
 用户原始问题: "{cleaned_query}"
-参考URL（你需要在后台处理这些URL）: {', '.join(urls)}
+参考URL（{"内容已附在下方" if prefetched is not None and prefetched.complete else "你需要在后台处理这些URL"}）: {', '.join(urls)}
 
 你的任务是：
 1. 理解问题和分析URL内容。
@@ -102,35 +109,33 @@ async def query_endpoint(
     api_logger.info(f"构造的提示词: {prompt}")
 
     try:
-        # 设置重试逻辑
-        max_retries = 2
-        retry_delay = 3  # 秒
-        
-        result_raw = None
-        for attempt in range(max_retries):
-            try:
-                # 调用agent服务
-                result_raw = await tech_assistant_query(prompt)
-                api_logger.info(f"Agent响应(原始，前500字符): {result_raw[:500]}...") 
-                break  # 如果成功，跳出循环
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    api_logger.warning(f"处理请求失败 (尝试 {attempt+1}/{max_retries}): {e}，等待{retry_delay}秒后重试...")
-                    await asyncio.sleep(retry_delay)
-                else:
-                    raise  # 最后一次尝试失败时抛出异常
+        # 调用agent服务（提供商失败或变慢时的切换在LLM调用层处理，这里不再整体重试）
+        # 客户端断开时按 CLIENT_DISCONNECT_POLICY 取消调用或在后台执行完（写入答案缓存）
+        with capture_usage() as usage:
+            result_raw = await run_until_disconnected(
+                tech_assistant_query(
+                    prompt, use_cache=request.use_cache,
+                    user_id=current_user.id, lane=lane_for(current_user.is_admin),
+                    context=memory_service.get_session_context(db, session_id, query),
+                    prefetched=prefetched
+                ),
+                http_request.is_disconnected
+            )
+        api_logger.info(f"Agent响应(原始，前500字符): {result_raw[:500]}...")
         
         # 提取最终答案
         final_answer_content = extract_marked_content(result_raw)
         
         # 保存助手响应
         background_tasks.add_task(
-            save_message, db, session_id, current_user.id, "assistant", final_answer_content
+            save_message, db, session_id, current_user.id, "assistant", final_answer_content, usage
         )
         
         # 返回响应和会话ID
         return QueryResponse(answer=final_answer_content, session_id=session_id)
         
+    except (AdmissionRejectedError, ClientDisconnectedError):
+        raise
     except Exception as e:
         api_logger.error(f"处理请求失败: {e}")
         raise HTTPException(status_code=500, detail=f"处理请求失败: {str(e)}")
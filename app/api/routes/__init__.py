@@ -5,4 +5,6 @@
 from app.api.routes.user_routes import router as user_router
 from app.api.routes.chat_routes import router as chat_routes
 from app.api.routes.health import router as health
-from app.api.routes.query import router as query_router 
\ No newline at end of file
+from app.api.routes.query import router as query_router
+from app.api.routes.job_routes import router as job_router
+from app.api.routes.admin_routes import router as admin_router 
\ No newline at end of file
@@ -0,0 +1,39 @@
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+
+from app.api.schemas import User
+from app.api.dependencies import get_current_admin_user, get_db
+from app.services.agent_service import get_admission_stats, get_scheduler_user_stats
+from app.services import usage_service
+
+router = APIRouter(tags=["admin"])
+
+@router.get("/scheduler")
+async def get_scheduler_stats(
+    current_user: User = Depends(get_current_admin_user)
+) -> Dict[str, Any]:
+    """查看agent调度状态：整体准入统计和每个用户的排队情况（仅管理员）"""
+    return {
+        "admission": get_admission_stats(),
+        "users": get_scheduler_user_stats()
+    }
+
+@router.get("/usage")
+async def get_usage(
+    start: Optional[date] = Query(None, description="起始日期（含）"),
+    end: Optional[date] = Query(None, description="结束日期（含）"),
+    user_id: Optional[int] = Query(None, description="只统计该用户"),
+    group_by: str = Query("user", description="分组方式：user、day、route 或 session"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user)
+) -> Dict[str, Any]:
+    """查看模型用量和估计成本：按用户、日期、路由或会话汇总（仅管理员）"""
+    if group_by not in usage_service.GROUP_BY:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"group_by 必须是 {'、'.join(usage_service.GROUP_BY)} 之一"
+        )
+    return usage_service.usage_report(db, start=start, end=end, user_id=user_id, group_by=group_by, limit=limit)
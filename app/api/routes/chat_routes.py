@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
+import asyncio
+import json
 import time
 
 from app.api.schemas import (
     ChatSessionCreate, ChatSessionUpdate, ChatSession, ChatSessionList,
     MessageCreate, Message, User
 )
-from app.api.dependencies import get_current_user, get_db
-from app.services import chat_service
-from app.services.agent_service import tech_assistant_query
+from app.api.dependencies import get_current_user, get_db, rate_limit, charge_rate_limit, rate_limit_max_cost
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services import batch_service, chat_service, memory_service, prefetch
+from app.services.agent_service import tech_assistant_query, tech_assistant_stream, check_admission
+from app.services.admission import AdmissionRejectedError, lane_for
+from app.services.cancellation import ClientDisconnectedError, abandon, run_until_disconnected, track
+from app.services.tool_results import StoredToolResults, capture_tool_calls, reuse_tool_results
+from app.services.usage_service import capture_usage
+from app.utils.text_utils import AnswerStreamExtractor
 from app.core.logging import app_logger, log_query_info, log_response_info, log_error, log_request_info
 from pydantic import BaseModel
 
@@ -18,14 +28,32 @@ router = APIRouter(tags=["chat"])
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[int] = None
+    use_cache: bool = True  # 为False时跳过答案缓存
 
 class QueryResponse(BaseModel):
     answer: str
     session_id: int
 
+class RegenerateResponse(BaseModel):
+    answer: str
+    session_id: int
+    message_id: int
+    reused_tool_results: int  # 复用的保存的工具结果数
+    rerun_tool_calls: int  # 重新调用的工具数
+
 class MessageIdsRequest(BaseModel):
     message_ids: List[int]
 
+class BatchQueryItem(BaseModel):
+    id: Optional[str] = None  # 调用方指定的ID，原样返回；未指定时使用下标
+    query: str
+    session_id: Optional[int] = None  # 未指定时为该问题创建新会话
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem]
+    parallelism: Optional[int] = None  # 同时执行的问题数，不超过 BATCH_MAX_PARALLELISM
+    use_cache: bool = True
+
 @router.post("/", response_model=ChatSession, status_code=status.HTTP_201_CREATED)
 async def create_chat_session(
     session: ChatSessionCreate,
@@ -212,9 +240,26 @@ async def get_chat_messages(
     
     return messages
 
-@router.post("/query", response_model=QueryResponse)
+def _prepare_query_session(db: Session, query_request: QueryRequest, current_user: User) -> int:
+    """校验或创建查询关联的会话，并保存用户消息，返回会话ID"""
+    session_id = chat_service.prepare_query_session(
+        db, current_user.id, query_request.query, query_request.session_id
+    )
+    if session_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在或无权访问"
+        )
+    return session_id
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/query", response_model=QueryResponse, dependencies=[Depends(rate_limit("query"))])
 async def process_query(
     query_request: QueryRequest,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -223,46 +268,51 @@ async def process_query(
     log_query_info(query_request.query)
     
     try:
-        # 检查会话ID是否有效
-        session_id = query_request.session_id
-        if session_id:
-            session = chat_service.get_session(db, session_id, current_user.id)
-            if not session:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="会话不存在或无权访问"
-                )
-            app_logger.info(f"使用现有会话: {session_id}")
-        else:
-            # 创建新会话
-            session_data = ChatSessionCreate(title=f"查询: {query_request.query[:30]}...")
-            session = chat_service.create_session(db, current_user.id, session_data)
-            session_id = session.id
-            app_logger.info(f"创建新会话: {session_id}")
+        # 服务已过载时尽早拒绝，不保存用户消息
+        lane = lane_for(current_user.is_admin)
+        check_admission(user_id=current_user.id, lane=lane)
         
-        # 添加用户消息
-        user_message = MessageCreate(role="user", content=query_request.query)
-        chat_service.add_message(db, session_id, current_user.id, user_message)
+        # 检查会话ID是否有效，并保存用户消息
+        session_id = _prepare_query_session(db, query_request, current_user)
+        # 通过准入控制和会话校验后才开始抓取问题中的链接，与读取会话上下文同时进行
+        prefetch_task = prefetch.start_prefetch(query_request.query)
         
-        # 调用AI处理查询
-        app_logger.info(f"处理查询 [会话ID: {session_id}]")
-        try:
-            response_start = time.time()
-            response = await tech_assistant_query(query_request.query)
-            response_time = time.time() - response_start
-            response_length = len(response) if response else 0
-            log_response_info(response_length, response_time)
-        except Exception as e:
-            log_error(f"AI处理查询失败: {str(e)}", exc_info=True)
-            # 返回友好的错误消息
-            response = "$$$ANSWER_START$$$\n## 处理查询时出错\n\n很抱歉，在处理您的查询时遇到技术问题。请稍后再试。\n$$$ANSWER_END$$$"
+        context = memory_service.get_session_context(db, session_id, query_request.query)
+        user_id = current_user.id
         
-        # 提取答案
-        answer = extract_answer(response)
+        async def answer_query() -> str:
+            # 客户端断开且策略为 finish 时在后台执行完，因此使用独立的数据库会话保存答案
+            app_logger.info(f"处理查询 [会话ID: {session_id}]")
+            try:
+                response_start = time.time()
+                with capture_tool_calls() as tool_calls, capture_usage() as usage:
+                    prefetched = await prefetch.collect(prefetch_task)
+                    response = await tech_assistant_query(
+                        query_request.query, use_cache=query_request.use_cache,
+                        user_id=user_id, lane=lane, context=context, prefetched=prefetched
+                    )
+                response_time = time.time() - response_start
+                response_length = len(response) if response else 0
+                log_response_info(response_length, response_time)
+            except AdmissionRejectedError:
+                raise
+            except Exception as e:
+                log_error(f"AI处理查询失败: {str(e)}", exc_info=True)
+                # 返回友好的错误消息
+                response = "$$$ANSWER_START$$$\n## 处理查询时出错\n\n很抱歉，在处理您的查询时遇到技术问题。请稍后再试。\n$$$ANSWER_END$$$"
+            
+            # 提取答案并添加助手消息
+            answer = extract_answer(response)
+            save_db = SessionLocal()
+            try:
+                assistant_message = MessageCreate(role="assistant", content=answer)
+                chat_service.add_message(save_db, session_id, user_id, assistant_message, tool_calls, usage)
+            finally:
+                save_db.close()
+            return answer
         
-        # 添加助手消息
-        assistant_message = MessageCreate(role="assistant", content=answer)
-        chat_service.add_message(db, session_id, current_user.id, assistant_message)
+        # 客户端断开时按 CLIENT_DISCONNECT_POLICY 取消或在后台执行完
+        answer = await run_until_disconnected(answer_query(), request.is_disconnected)
         
         processing_time = time.time() - start_time
         log_request_info("POST", f"/api/sessions/query", 200, processing_time * 1000)
@@ -271,6 +321,9 @@ async def process_query(
         if isinstance(e, HTTPException):
             log_request_info("POST", f"/api/sessions/query", e.status_code)
             raise e
+        if isinstance(e, (AdmissionRejectedError, ClientDisconnectedError)):
+            # 由全局异常处理器返回503和Retry-After / 499
+            raise e
         
         log_error(f"处理查询失败: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -278,6 +331,187 @@ async def process_query(
             detail=f"处理查询失败: {str(e)}"
         )
 
+@router.post("/query/stream", dependencies=[Depends(rate_limit("query"))])
+async def process_query_stream(
+    query_request: QueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """处理用户查询，以SSE流式返回答案
+
+    事件依次为 session（会话ID）、若干 delta（答案增量文本）、done（完整答案）；
+    出错时发送 error 事件。完整答案仍通过 chat_service.add_message 保存到会话。
+    """
+    start_time = time.time()
+    log_query_info(query_request.query)
+    
+    # 响应一旦开始就无法再返回503，因此在建立流之前判断是否过载
+    lane = lane_for(current_user.is_admin)
+    check_admission(user_id=current_user.id, lane=lane)
+    session_id = _prepare_query_session(db, query_request, current_user)
+    prefetch_task = prefetch.start_prefetch(query_request.query)
+    context = memory_service.get_session_context(db, session_id, query_request.query)
+    user_id = current_user.id
+    
+    async def produce(events: asyncio.Queue) -> None:
+        # 在独立任务中生成事件，客户端断开时可按 CLIENT_DISCONNECT_POLICY 取消或让其执行完
+        extractor = AnswerStreamExtractor()
+        first_delta_time = None
+        try:
+            with capture_tool_calls() as tool_calls, capture_usage() as usage:
+                prefetched = await prefetch.collect(prefetch_task)
+                async for chunk in tech_assistant_stream(
+                    query_request.query, use_cache=query_request.use_cache, user_id=user_id, lane=lane,
+                    context=context, prefetched=prefetched
+                ):
+                    text = extractor.feed(chunk)
+                    if text:
+                        if first_delta_time is None:
+                            first_delta_time = time.time() - start_time
+                            app_logger.info(f"首段答案已发送 [会话ID: {session_id}] (耗时: {first_delta_time:.2f}s)")
+                        events.put_nowait(_sse_event("delta", {"text": text}))
+            text = extractor.finish()
+            if text:
+                events.put_nowait(_sse_event("delta", {"text": text}))
+            answer = extractor.final_answer() or "无法获取回答，请稍后重试"
+        except AdmissionRejectedError as e:
+            app_logger.warning(f"流式查询被准入控制拒绝: {str(e)}")
+            answer = "## 服务繁忙\n\n当前请求过多，请稍后再试。"
+            events.put_nowait(_sse_event("error", {"detail": str(e), "retry_after": e.retry_after}))
+        except Exception as e:
+            log_error(f"流式处理查询失败: {str(e)}", exc_info=True)
+            answer = "## 处理查询时出错\n\n很抱歉，在处理您的查询时遇到技术问题。请稍后再试。"
+            events.put_nowait(_sse_event("error", {"detail": f"处理查询失败: {str(e)}"}))
+        
+        # 请求作用域的数据库会话在流开始前已关闭，这里使用独立会话保存答案
+        save_db = SessionLocal()
+        try:
+            assistant_message = MessageCreate(role="assistant", content=answer)
+            chat_service.add_message(save_db, session_id, user_id, assistant_message, tool_calls, usage)
+        finally:
+            save_db.close()
+        
+        events.put_nowait(_sse_event("done", {"answer": answer, "session_id": session_id}))
+        events.put_nowait(None)
+    
+    async def event_stream():
+        yield _sse_event("session", {"session_id": session_id})
+        
+        events: asyncio.Queue = asyncio.Queue()
+        started_at = time.monotonic()
+        producer = track(asyncio.create_task(produce(events)), started_at)
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # 客户端断开时 StreamingResponse 会取消本生成器
+            abandon(producer, started_at)
+        log_request_info("POST", "/api/sessions/query/stream", 200, (time.time() - start_time) * 1000)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/query/batch")
+async def process_query_batch(
+    batch: BatchQueryRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """批量处理查询，每个问题完成后以一行JSON（NDJSON）返回结果
+
+    结果按完成顺序返回，每行包含 id、index、status（ok/error）以及 answer 或 error；
+    最后一行为 type=summary 的汇总。同一会话的问题按提交顺序依次执行，答案通过 chat_service 保存到会话。
+    """
+    if not batch.queries:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="queries不能为空")
+    # 每个问题扣除一次限流额度，超过令牌桶容量的批次永远不会被放行
+    max_queries = min(settings.BATCH_MAX_QUERIES, rate_limit_max_cost("batch_query") or settings.BATCH_MAX_QUERIES)
+    if len(batch.queries) > max_queries:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多提交 {max_queries} 个问题"
+        )
+    # 按问题数扣除限流额度
+    headers = await charge_rate_limit("batch_query", f"user:{current_user.id}", cost=len(batch.queries))
+    
+    start_time = time.time()
+    user_id = current_user.id
+    lane = lane_for(current_user.is_admin, interactive=False)
+    parallelism = min(batch.parallelism or settings.BATCH_MAX_PARALLELISM, settings.BATCH_MAX_PARALLELISM)
+    app_logger.info(f"收到批量查询: {len(batch.queries)} 个问题，并发 {parallelism}，用户: {user_id}")
+    
+    async def run_item(item: BatchQueryItem) -> Dict[str, Any]:
+        item_start = time.time()
+        check_admission(user_id=user_id, lane=lane)
+        db = SessionLocal()
+        try:
+            session_id = chat_service.prepare_query_session(db, user_id, item.query, item.session_id)
+            if session_id is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="会话不存在或无权访问")
+            context = memory_service.get_session_context(db, session_id, item.query)
+        finally:
+            # agent调用期间不占用数据库连接
+            db.close()
+        
+        with capture_tool_calls() as tool_calls, capture_usage() as usage:
+            prefetched = await prefetch.collect(prefetch.start_prefetch(item.query))
+            response = await tech_assistant_query(
+                item.query, use_cache=batch.use_cache, user_id=user_id, lane=lane, context=context,
+                prefetched=prefetched, raise_errors=True
+            )
+        answer = extract_answer(response)
+        db = SessionLocal()
+        try:
+            chat_service.add_message(
+                db, session_id, user_id, MessageCreate(role="assistant", content=answer), tool_calls, usage
+            )
+        finally:
+            db.close()
+        return {"session_id": session_id, "answer": answer, "elapsed": round(time.time() - item_start, 3)}
+    
+    async def result_lines():
+        succeeded = 0
+        started_at = time.monotonic()
+        async for index, result, error in batch_service.run_batch(
+            batch.queries, run_item, parallelism,
+            chain_key=lambda item: item.session_id,
+            # 客户端断开时按 CLIENT_DISCONNECT_POLICY 取消或让未完成的问题执行完
+            on_abandon=lambda task: abandon(task, started_at)
+        ):
+            item = batch.queries[index]
+            line: Dict[str, Any] = {"type": "result", "id": item.id or str(index), "index": index}
+            if error is None:
+                succeeded += 1
+                line.update(status="ok", **result)
+            else:
+                line.update(status="error", error=getattr(error, "detail", None) or str(error))
+                if isinstance(error, AdmissionRejectedError):
+                    line.update(status_code=error.status_code, retry_after=error.retry_after)
+                elif isinstance(error, HTTPException):
+                    line["status_code"] = error.status_code
+                else:
+                    log_error(f"批量查询第 {index} 个问题失败: {str(error)}", exc_info=error)
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        
+        total = len(batch.queries)
+        elapsed = time.time() - start_time
+        yield json.dumps({
+            "type": "summary", "total": total, "succeeded": succeeded,
+            "failed": total - succeeded, "elapsed": round(elapsed, 3)
+        }, ensure_ascii=False) + "\n"
+        log_request_info("POST", "/api/sessions/query/batch", 200, elapsed * 1000)
+    
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={**headers, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history/{session_id}", response_model=List[Message])
 async def get_chat_history(
     session_id: int,
@@ -370,6 +604,77 @@ async def clear_chat_session_messages(
     
     return {"status": "success", "deleted_count": delete_count}
 
+@router.post(
+    "/{session_id}/messages/{message_id}/regenerate",
+    response_model=RegenerateResponse,
+    dependencies=[Depends(rate_limit("query"))]
+)
+async def regenerate_answer(
+    session_id: int,
+    message_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """重新生成一条助手消息的答案
+
+    模型以相同参数调用同一工具且保存的结果仍在有效期内（REGENERATE_TOOL_MAX_AGE）时，
+    直接使用生成原答案时保存的工具结果，不再调用工具。新答案替换原消息的内容；生成失败时保留原答案。
+    """
+    start_time = time.time()
+    message = chat_service.get_message(db, message_id, session_id, current_user.id)
+    if message is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="消息不存在或无权访问")
+    if message.role != "assistant":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="只能重新生成助手消息")
+    question = chat_service.get_question(db, message)
+    if question is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="找不到该答案对应的问题")
+    
+    lane = lane_for(current_user.is_admin)
+    check_admission(user_id=current_user.id, lane=lane)
+    # 上下文只包含问题之前的对话，与生成原答案时一致
+    context = memory_service.get_session_context(db, session_id, before_id=question.id)
+    stored = StoredToolResults(message.tool_results)
+    query = question.content
+    user_id = current_user.id
+    app_logger.info(f"重新生成答案 [会话ID: {session_id}, 消息ID: {message_id}, 保存的工具结果: {len(stored)}]")
+    
+    async def regenerate() -> Dict[str, Any]:
+        with reuse_tool_results(stored), capture_tool_calls() as tool_calls, capture_usage() as usage:
+            # 跳过答案缓存，否则会得到与原答案相同的缓存结果
+            response = await tech_assistant_query(
+                query, use_cache=False, user_id=user_id, lane=lane, context=context, raise_errors=True
+            )
+        answer = extract_answer(response)
+        save_db = SessionLocal()
+        try:
+            chat_service.replace_answer(save_db, message_id, session_id, user_id, answer, tool_calls, usage)
+        finally:
+            save_db.close()
+        return {
+            "answer": answer,
+            "session_id": session_id,
+            "message_id": message_id,
+            "reused_tool_results": stored.reused,
+            "rerun_tool_calls": len(tool_calls) - stored.reused,
+        }
+    
+    try:
+        result = await run_until_disconnected(regenerate(), request.is_disconnected)
+    except (AdmissionRejectedError, ClientDisconnectedError):
+        raise
+    except Exception as e:
+        log_error(f"重新生成答案失败: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"重新生成答案失败: {str(e)}"
+        )
+    
+    log_request_info("POST", f"/api/sessions/{session_id}/messages/{message_id}/regenerate", 200,
+                     (time.time() - start_time) * 1000)
+    return result
+
 def extract_answer(response: str) -> str:
     """从FastAgent响应中提取最终答案"""
     if not response:
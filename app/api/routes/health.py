@@ -1,17 +1,34 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from datetime import datetime
 from sqlalchemy import text
 
 from app.db.session import get_db
+from app.api.dependencies import has_monitoring_access, require_monitoring_access
 from app.core.logging import app_logger
+from app.core.config import settings
+from app.services.agent_service import (
+    get_agent_pool_stats, get_query_coalescing_stats, get_admission_stats,
+    get_routing_stats,
+)
+from app.services.cache_service import get_answer_cache
+from app.services.llm_failover import get_provider_stats
+from app.services.cancellation import get_disconnect_stats
+from app.services.cassette import get_cassette_stats
+from app.services.tool_results import get_tool_result_stats
+from app.services.compression import get_compression_stats
+from app.services.mcp_service import get_mcp_proxy_stats
+from app.services import metrics
 
 router = APIRouter()
 
 @router.get("/health", status_code=200)
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: Session = Depends(get_db), detailed: bool = Depends(has_monitoring_access)):
     """
     健康检查端点，验证服务器和数据库连接状态
+
+    管理员或携带 MONITORING_TOKEN 时还返回各项运行统计（路由成本、用量等）
     """
     try:
         # 尝试执行一个简单的数据库查询，验证数据库连接
@@ -23,6 +40,20 @@ async def health_check(db: Session = Depends(get_db)):
             "message": "FastAgent API服务正常运行",
             "database": "connected"
         }
+        if detailed:
+            response.update({
+                "agent_pool": get_agent_pool_stats(),
+                "query_coalescing": get_query_coalescing_stats(),
+                "admission": get_admission_stats(),
+                "routing": get_routing_stats(),
+                "llm_providers": get_provider_stats(),
+                "client_disconnects": get_disconnect_stats(),
+                "cassette": get_cassette_stats(),
+                "tool_result_reuse": get_tool_result_stats(),
+                "compression": get_compression_stats(),
+                "answer_cache": get_answer_cache().stats() if settings.ANSWER_CACHE_ENABLED else None,
+                "context7_proxy": get_mcp_proxy_stats("context7-mcp")
+            })
         
         app_logger.info(f"健康检查 - 服务器状态: {response['status']}")
         return response
@@ -34,4 +65,13 @@ async def health_check(db: Session = Depends(get_db)):
             "message": f"服务器运行但数据库连接失败: {str(e)}",
             "database": "disconnected"
         }
-        return response 
\ No newline at end of file
+        return response 
+
+@router.get("/metrics", include_in_schema=False, dependencies=[Depends(require_monitoring_access)])
+async def prometheus_metrics():
+    """
+    Prometheus指标端点，汇总所有worker进程的指标，需要管理员或 MONITORING_TOKEN
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=metrics.collect(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,89 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.orm import Session
+from typing import List
+
+from app.api.schemas import QueryJobCreate, QueryJob, User
+from app.api.dependencies import get_current_user, get_db, rate_limit
+from app.core.config import settings
+from app.services import chat_service, job_service
+from app.core.logging import log_query_info
+
+router = APIRouter(tags=["jobs"])
+
+@router.post(
+    "/", response_model=QueryJob, status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(rate_limit("query"))]
+)
+async def submit_query_job(
+    job_request: QueryJobCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """提交异步查询任务，立即返回任务ID"""
+    log_query_info(job_request.query, job_request.session_id)
+    
+    session_id = chat_service.prepare_query_session(
+        db, current_user.id, job_request.query, job_request.session_id
+    )
+    if session_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在或无权访问"
+        )
+    
+    job = job_service.create_job(
+        db, current_user.id, session_id, job_request.query, job_request.use_cache
+    )
+    job_service.get_job_worker_pool().submit(job.id)
+    return job
+
+@router.get("/", response_model=List[QueryJob])
+async def get_query_jobs(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取当前用户的查询任务"""
+    return job_service.get_jobs(db, current_user.id, skip, limit)
+
+@router.get("/{job_id}", response_model=QueryJob)
+async def get_query_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="长轮询等待任务结束的秒数，0表示立即返回"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取查询任务状态和结果，可选择长轮询等待任务结束"""
+    if wait > 0:
+        timeout = min(wait, settings.QUERY_JOB_MAX_WAIT)
+        job = await job_service.get_job_worker_pool().wait(db, job_id, current_user.id, timeout)
+    else:
+        job = job_service.get_job(db, job_id, current_user.id)
+    
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在或无权访问"
+        )
+    return job
+
+@router.delete("/{job_id}", status_code=status.HTTP_200_OK)
+async def cancel_query_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """取消排队中的查询任务"""
+    job = job_service.get_job(db, job_id, current_user.id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在或无权访问"
+        )
+    if not job_service.cancel_job(db, job_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="任务已开始执行或已结束，无法取消"
+        )
+    return {"status": "success"}
@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Dict, Any
 from pydantic import BaseModel
 
+from app.api.dependencies import rate_limit
 from app.services.agent_service import tech_assistant_query
+from app.services.admission import AdmissionRejectedError
+from app.services.cancellation import ClientDisconnectedError, run_until_disconnected
 from app.core.logging import app_logger
 
 # 查询请求模型
 class QueryRequest(BaseModel):
     query: str
     session_id: int = None  # 可选，如果提供则将消息保存到会话
+    use_cache: bool = True  # 为False时跳过答案缓存
 
 # 查询响应模型
 class QueryResponse(BaseModel):
@@ -17,20 +21,26 @@ class QueryResponse(BaseModel):
 
 router = APIRouter()
 
-@router.post("/query", response_model=QueryResponse)
-async def process_query(query_data: QueryRequest):
+@router.post("/query", response_model=QueryResponse, dependencies=[Depends(rate_limit("anonymous_query"))])
+async def process_query(query_data: QueryRequest, request: Request):
     """处理客户端查询请求"""
     try:
         # 记录接收到的查询
         app_logger.info(f"收到查询请求: {query_data.query[:100]}...")
         
         # 调用FastAgent处理查询
-        response = await tech_assistant_query(query_data.query)
+        response = await run_until_disconnected(
+            tech_assistant_query(query_data.query, use_cache=query_data.use_cache),
+            request.is_disconnected
+        )
         
         # 提取结果
         result = extract_answer(response)
         
         return {"result": result, "session_id": query_data.session_id}
+    except (AdmissionRejectedError, ClientDisconnectedError):
+        # 由全局异常处理器返回503和Retry-After / 499
+        raise
     except Exception as e:
         app_logger.error(f"处理查询失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理查询失败: {str(e)}")
@@ -3,7 +3,7 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.api.dependencies import get_current_active_user, get_current_admin_user
+from app.api.dependencies import get_current_active_user, get_current_admin_user, rate_limit
 from app.api.schemas import UserCreate, UserResponse, UserLogin, Token, UserUpdate
 from app.core.database import get_db
 from app.core.security import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
@@ -15,7 +15,7 @@ from app.services.user_service import (
 
 router = APIRouter(tags=["users"])
 
-@router.post("/register", response_model=UserResponse)
+@router.post("/register", response_model=UserResponse, dependencies=[Depends(rate_limit("register"))])
 async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """注册新用户"""
     # 检查用户名是否已存在
@@ -37,7 +37,7 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     return user
 
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[Depends(rate_limit("login"))])
 async def login_for_access_token(user_data: UserLogin, db: Session = Depends(get_db)):
     """登录获取访问令牌"""
     user = authenticate_user(db, user_data.username, user_data.password)
@@ -122,4 +122,25 @@ class ChatSession(ChatSessionBase):
     messages: List = []
     
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+# 异步查询任务模式
+class QueryJobCreate(BaseModel):
+    query: str
+    session_id: Optional[int] = None
+    use_cache: bool = True
+
+class QueryJob(BaseModel):
+    id: str
+    session_id: int
+    query: str
+    status: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
@@ -4,7 +4,7 @@
 import os
 import secrets
 import yaml
-from typing import List, Union, Optional
+from typing import Any, Dict, List, Union, Optional
 from pathlib import Path
 
 from pydantic import AnyHttpUrl, validator
@@ -20,6 +20,156 @@ class Settings(BaseSettings):
     AGENT_NAME: str = "FastAgent"
     DEFAULT_MODEL: str = "deepseek-chat"  # 默认模型
     DEFAULT_API: Optional[str] = None  # 默认API提供商
+    FASTAGENT_CONFIG_PATH: str = "fastagent.config.yaml"  # FastAgent配置文件，离线测试时使用 fastagent.offline.yaml
+    
+    # agent池配置
+    AGENT_POOL_SIZE: int = 2  # 预热的FastAgent实例数量
+    AGENT_POOL_ACQUIRE_TIMEOUT: float = 30.0  # 等待空闲agent的最长时间（秒）
+    AGENT_MAX_REQUESTS: int = 500  # 实例处理多少次请求后在后台重建，0表示不限
+    AGENT_MAX_AGE: int = 6 * 60 * 60  # 实例存活多久（秒）后在后台重建，0表示不限
+    AGENT_SUPERVISOR_ENABLED: bool = True  # 是否定期检查实例和MCP连接的健康状态
+    AGENT_SUPERVISOR_INTERVAL: float = 60.0  # 检查间隔（秒）
+    AGENT_PROBE_TIMEOUT: float = 10.0  # 单个实例健康检查的超时时间（秒）
+    AGENT_MAX_MEMORY_GROWTH: int = 512 * 1024 * 1024  # 进程内存增长超过该值时重建最早的实例，0表示不检查
+    
+    # 答案缓存配置
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_TTL: int = 60 * 60 * 24  # 1天
+    ANSWER_CACHE_MEMORY_SIZE: int = 256  # 内存LRU条目数
+    ANSWER_CACHE_DISK_PATH: str = "data/answer_cache.db"  # 为空时只使用内存缓存
+    ANSWER_CACHE_DISK_MAX_BYTES: int = 100 * 1024 * 1024  # 100MB
+    
+    # 请求截止时间配置（app/services/deadline.py）
+    REQUEST_DEADLINE_HEADER: str = "X-Request-Timeout"  # 客户端指定请求超时时间（秒）的请求头
+    REQUEST_DEADLINE_DEFAULT: float = 180.0  # 未指定时的请求超时时间（秒）
+    REQUEST_DEADLINE_MAX: float = 600.0  # 客户端可以指定的最长超时时间（秒）
+    REQUEST_DEADLINE_ROUTES: Dict[str, float] = {"/api/sessions/query/batch": 600.0}  # 路径 -> 默认超时时间
+    AGENT_QUERY_TIMEOUT: float = 180.0  # 没有请求截止时间的agent调用（如后台查询任务）的超时时间（秒）
+    DEADLINE_QUEUE_SHARE: float = 0.5  # 准入排队和等待agent最多使用的剩余时间比例
+    DEADLINE_TOOL_SHARE: float = 0.5  # 单次MCP工具调用最多使用的剩余时间比例
+    DEADLINE_SAVE_RESERVE: float = 2.0  # agent调用结束后为保存答案预留的时间（秒）
+    DB_LOCK_TIMEOUT: float = 5.0  # 数据库写入等待锁的最长时间（秒），不超过请求剩余时间
+    
+    # 客户端断开处理配置（app/services/cancellation.py）
+    CLIENT_DISCONNECT_POLICY: str = "cancel"  # cancel：取消agent调用；finish：在后台执行完并缓存、保存答案
+    CLIENT_DISCONNECT_POLL_INTERVAL: float = 1.0  # 检查客户端是否断开的间隔（秒）
+    
+    # 重新生成答案配置（app/services/tool_results.py）
+    REGENERATE_TOOL_MAX_AGE: int = 60 * 60  # 保存的工具结果在该时间（秒）内可以复用，超过后重新调用工具，0表示总是重新调用
+    REGENERATE_TOOL_MAX_AGES: Dict[str, int] = {  # 按工具名前缀单独设置的有效期
+        "context7-mcp": 24 * 60 * 60,
+    }
+    
+    # 录制/回放配置（app/services/cassette.py）
+    CASSETTE_MODE: str = "off"  # off；record：录制agent调用；replay：由录像提供agent调用，不访问模型和MCP服务器
+    CASSETTE_DIR: str = "data/cassettes"  # 录像目录
+    CASSETTE_NAME: str = "default"  # 录像名，对应 CASSETTE_DIR 下的 <名称>.jsonl
+    CASSETTE_TIME_SCALE: float = 1.0  # 回放时间缩放系数，1为原速，0为不等待
+    CASSETTE_REPLAY_MISS: str = "cycle"  # 录像中没有对应查询时：cycle 依次使用录像中的调用；error 查询失败
+    
+    # 响应压缩配置（app/services/compression.py，br 需要 brotli 包，zstd 需要 zstandard 包）
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024  # 普通响应小于该字节数时不压缩，SSE/NDJSON流式响应总是压缩
+    COMPRESSION_ENCODINGS: List[str] = ["zstd", "br", "gzip"]  # 客户端q值相同时的优先顺序
+    COMPRESSION_MEDIA_TYPES: List[str] = ["application/json", "application/x-ndjson", "text/"]  # 压缩的内容类型前缀
+    COMPRESSION_LEVELS: Dict[str, int] = {"gzip": 6, "br": 4, "zstd": 3}  # 默认压缩级别，流式响应也使用该级别
+    COMPRESSION_BANDWIDTH_LEVELS: Dict[str, int] = {"gzip": 9, "br": 9, "zstd": 12}  # 以带宽为主的路由的压缩级别
+    COMPRESSION_BANDWIDTH_ROUTES: List[str] = [  # 以带宽为主的路由（路由模板），返回整个会话的消息
+        "/api/sessions/{session_id}",
+        "/api/sessions/{session_id}/messages",
+        "/api/sessions/history/{session_id}",
+    ]
+    
+    # 监控指标配置（app/services/metrics.py，/metrics 以Prometheus文本格式输出）
+    METRICS_ENABLED: bool = True
+    METRICS_DIR: str = "data/metrics"  # 每个worker进程定期写入指标快照的目录，/metrics 汇总所有进程
+    METRICS_WRITE_INTERVAL: float = 5.0  # 写入快照的间隔（秒），即其他worker的指标最多延迟的时间
+    MONITORING_TOKEN: Optional[str] = None  # 访问 /metrics 和 /health 详细统计的令牌（Authorization: Bearer <令牌>），管理员的登录令牌同样可以访问
+    
+    # 批量查询配置
+    BATCH_MAX_QUERIES: int = 50  # 单次批量查询的问题数上限
+    BATCH_MAX_PARALLELISM: int = 8  # 单次批量查询同时执行的问题数上限（实际并发还受准入控制和每用户并发限制）
+    
+    # 会话记忆配置（app/services/memory_service.py）
+    SESSION_CONTEXT_ENABLED: bool = True  # 是否把会话历史作为上下文发送给agent
+    SESSION_CONTEXT_TOKEN_BUDGET: int = 2000  # 最近对话的token预算，超出的部分压缩进摘要
+    SESSION_SUMMARY_TOKEN_BUDGET: int = 500  # 滚动摘要的token预算
+    SESSION_CONTEXT_MAX_MESSAGES: int = 40  # 每次最多读取的最近消息数
+    
+    # 异步查询任务配置
+    QUERY_JOB_WORKERS: int = 2  # 后台执行查询任务的worker数量
+    QUERY_JOB_MAX_WAIT: int = 60  # 长轮询最长等待时间（秒）
+    QUERY_JOB_LEASE: int = 600  # 执行中的任务超过该时间（秒）未结束时，视为执行它的进程已卡住，可由其他进程重新执行
+    
+    # 准入控制配置
+    ADMISSION_ENABLED: bool = True  # 是否启用agent调用的准入控制
+    ADMISSION_INITIAL_LIMIT: int = 2  # 初始并发限制
+    ADMISSION_MIN_LIMIT: int = 1  # 并发限制下限
+    ADMISSION_MAX_LIMIT: int = 8  # 并发限制上限（实际不超过agent池大小）
+    ADMISSION_MAX_QUEUE: int = 50  # 等待队列最大长度
+    ADMISSION_LATENCY_THRESHOLD: float = 90.0  # 单次调用超过该耗时（秒）视为过载
+    
+    # 公平调度配置
+    SCHEDULER_USER_MAX_IN_FLIGHT: int = 1  # 每个用户同时执行的agent调用数上限
+    SCHEDULER_USER_MAX_QUEUE: int = 10  # 每个用户排队中的查询数上限，超出返回429
+    SCHEDULER_USER_WEIGHTS: Dict[int, float] = {}  # 用户ID -> 调度权重，默认为1
+    
+    # 网页抓取配置（本地fetch MCP服务器使用）
+    FETCH_CACHE_DIR: str = "data/fetch_cache"  # 页面缓存目录
+    FETCH_CACHE_MAX_BYTES: int = 200 * 1024 * 1024  # 200MB
+    FETCH_CACHE_TTL: int = 60 * 60  # 响应未声明有效期时缓存1小时
+    FETCH_TIMEOUT: float = 20.0  # 单次请求超时（秒）
+    FETCH_MAX_RESPONSE_BYTES: int = 5 * 1024 * 1024  # 响应体上限5MB
+    FETCH_MAX_REDIRECTS: int = 5  # 最多跟随的重定向次数，每一跳都重新检查目标地址
+    FETCH_ALLOW_PRIVATE_HOSTS: bool = False  # 是否允许抓取回环、内网、链路本地（如云元数据 169.254.169.254）等非公网地址
+    
+    # 链接预先抓取配置（app/services/prefetch.py，页面大小上限和缓存沿用上面的 FETCH_* 配置）
+    PREFETCH_ENABLED: bool = True  # 请求到达时是否并发抓取问题中的链接并随问题发送
+    PREFETCH_MAX_URLS: int = 5  # 每个问题最多预先抓取的链接数，其余留给fetch工具
+    PREFETCH_TIMEOUT: float = 8.0  # 单个链接的最长等待时间（秒），不超过请求剩余时间的 DEADLINE_TOOL_SHARE
+    PREFETCH_TOKEN_BUDGET: int = 6000  # 所有页面合计的token预算，超出时按页面截断
+    
+    # context7-mcp 缓存代理配置（app/mcp_servers/context7_proxy.py）
+    CONTEXT7_UPSTREAM_URL: Optional[str] = None  # 为空时使用secrets中 context7-mcp 的url
+    CONTEXT7_PROXY_TOOL_TTLS: Dict[str, int] = {  # 需要缓存的工具及其缓存有效期（秒）
+        "resolve-library-id": 7 * 24 * 60 * 60,
+        "get-library-docs": 24 * 60 * 60,
+    }
+    CONTEXT7_PROXY_CACHE_PATH: str = "data/context7_cache.db"
+    CONTEXT7_PROXY_CACHE_MAX_BYTES: int = 50 * 1024 * 1024  # 50MB
+    CONTEXT7_PROXY_MEMORY_SIZE: int = 256  # 每个代理进程内存中保存的结果数
+    MCP_PROXY_STATS_DIR: str = "data/mcp_proxy_stats"  # 代理进程定期写入统计信息的目录
+    
+    # LLM提供商故障转移配置（app/services/llm_failover.py）
+    LLM_REQUEST_TIMEOUT: float = 120.0  # 单次模型调用超时（秒），超时后切换到备用提供商
+    LLM_FAILOVER_PROVIDERS: List[str] = []  # 按优先顺序排列的备用提供商，需配置对应的API密钥
+    LLM_FAILOVER_MODELS: Dict[str, str] = {  # 备用提供商使用的模型
+        "deepseek": "deepseek-chat",
+        "openai": "gpt-4o-mini",
+        "anthropic": "claude-3-5-haiku-latest",
+        "openrouter": "deepseek/deepseek-chat",
+    }
+    LLM_PROVIDER_FAILURE_THRESHOLD: int = 3  # 连续失败多少次后暂停使用该提供商
+    LLM_PROVIDER_COOLDOWN: float = 30.0  # 暂停使用的时长（秒）
+    LLM_HEDGE_ENABLED: bool = False  # 主提供商响应慢时是否同时请求备用提供商（会增加调用成本）
+    LLM_HEDGE_PERCENTILE: float = 95.0  # 超过主提供商最近延迟的该分位数后发出对冲请求
+    LLM_HEDGE_MIN_DELAY: float = 2.0  # 对冲请求的最短等待时间（秒）
+    LLM_HEDGE_DEFAULT_DELAY: float = 30.0  # 延迟样本不足时的等待时间（秒）
+    
+    # 限流配置
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # memory（单进程）或 sqlite（多worker共享）
+    RATE_LIMIT_SQLITE_PATH: str = "data/rate_limit.db"
+    RATE_LIMIT_TRUST_FORWARDED: bool = False  # 部署在反向代理后时按 X-Forwarded-For 识别客户端IP
+    # 规则名 -> 策略配置；key 为 user 时按用户限流，为 ip 时按客户端IP限流
+    RATE_LIMIT_RULES: Dict[str, Dict[str, Any]] = {
+        "login": {"policy": "sliding_window", "limit": 10, "window": 60, "key": "ip"},
+        "register": {"policy": "sliding_window", "limit": 5, "window": 3600, "key": "ip"},
+        "query": {"policy": "token_bucket", "rate": 0.1, "burst": 10, "key": "user"},
+        "anonymous_query": {"policy": "token_bucket", "rate": 0.05, "burst": 5, "key": "ip"},
+        # 批量查询按问题数扣除额度
+        "batch_query": {"policy": "token_bucket", "rate": 0.2, "burst": 50, "key": "user"},
+    }
     
     # 服务器配置
     HOST: str = "0.0.0.0"
@@ -59,6 +209,9 @@ class Settings(BaseSettings):
     # MCP服务器配置
     MCP_SERVER_CONFIGS: dict = {}
     
+    # 查询路由配置（来自fastagent.config.yaml的routing节）
+    ROUTING_CONFIG: dict = {}
+    
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -68,8 +221,8 @@ settings = Settings()
 
 # 从fastagent.config.yaml加载配置
 def load_fastagent_config():
-    """从fastagent.config.yaml加载FastAgent配置"""
-    config_path = Path("fastagent.config.yaml")
+    """从fastagent.config.yaml（或 FASTAGENT_CONFIG_PATH 指定的文件）加载FastAgent配置"""
+    config_path = Path(settings.FASTAGENT_CONFIG_PATH)
     
     if config_path.exists():
         try:
@@ -86,6 +239,11 @@ def load_fastagent_config():
                     settings.MCP_SERVER_CONFIGS = config["mcp"]["servers"]
                     print(f"已加载MCP服务器基础配置")
                 
+                # 读取查询路由配置
+                if "routing" in config:
+                    settings.ROUTING_CONFIG = config["routing"] or {}
+                    print(f"已加载查询路由配置: {', '.join((settings.ROUTING_CONFIG.get('routes') or {}).keys())}")
+                
                 # 可以在此处添加其他需要的配置项
                 
         except Exception as e:
@@ -1,10 +1,12 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.core.logging import app_logger
 from app.core.config import settings
+from app.services.deadline import remaining
+from app.services.metrics import instrument_engine
 
 # 创建数据库目录
 database_path = 'data'
@@ -20,6 +22,18 @@ engine = create_engine(
     echo=False
 )
 
+@event.listens_for(engine, "checkout")
+def _set_lock_timeout(dbapi_connection, connection_record, connection_proxy):
+    """取出连接时按请求剩余时间设置等待数据库锁的时间"""
+    left = remaining()
+    timeout = settings.DB_LOCK_TIMEOUT if left is None else min(settings.DB_LOCK_TIMEOUT, max(left, 0.1))
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    cursor.close()
+
+# 统计每条语句的耗时（见 /metrics）
+instrument_engine(engine)
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -42,8 +56,25 @@ def init_db():
     
     # 导入所有模型以确保它们被Base注册
     from app.models.user import User
-    from app.models.chat import ChatSession, ChatMessage
+    from app.models.chat import ChatSession, ChatMessage, ChatSessionSummary, ChatToolResult
+    from app.models.job import QueryJob
+    from app.models.usage import MessageUsage, DailyUsage
     
     app_logger.info("正在创建数据库表...")
     Base.metadata.create_all(bind=engine)
-    app_logger.info("数据库表创建完成") 
\ No newline at end of file
+    _add_missing_columns(Base)
+    app_logger.info("数据库表创建完成")
+
+def _add_missing_columns(Base):
+    """create_all 不会为已有的表添加新列，为旧数据库补上模型中新增的可空列"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    app_logger.info(f"已为表 {table.name} 添加列 {column.name}") 
\ No newline at end of file
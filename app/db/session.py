@@ -4,6 +4,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
+from app.services.metrics import instrument_engine
 
 # 创建数据库目录
 os.makedirs(os.path.dirname(settings.DATABASE_URL.replace('sqlite:///', '')), exist_ok=True)
@@ -15,6 +16,9 @@ engine = create_engine(
     echo=settings.DEBUG
 )
 
+# 统计每条语句的耗时（见 /metrics）
+instrument_engine(engine)
+
 # 创建数据库会话
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -37,6 +41,8 @@ def init_db():
     from app.db.base_class import Base
     # 导入所有模型确保它们注册到Base中
     from app.models.user import User
-    from app.models.chat import ChatSession, ChatMessage
+    from app.models.chat import ChatSession, ChatMessage, ChatSessionSummary, ChatToolResult
+    from app.models.job import QueryJob
+    from app.models.usage import MessageUsage, DailyUsage
     
     Base.metadata.create_all(bind=engine) 
\ No newline at end of file
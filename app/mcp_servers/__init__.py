@@ -0,0 +1,6 @@
+# 本地MCP服务器模块初始化
+"""
+本地MCP服务器
+
+由 fast-agent 按 fastagent.config.yaml 以 stdio 方式启动，为agent提供工具。
+"""
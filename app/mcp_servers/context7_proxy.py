@@ -0,0 +1,176 @@
+"""
+context7-mcp 缓存代理
+
+位于agent和远程 context7-mcp 之间：工具列表和未配置缓存的工具原样转发，
+resolve-library-id、get-library-docs 等工具的结果按工具名和参数缓存
+（进程内LRU + 按字节上限淘汰的SQLite缓存，多个代理进程共享磁盘缓存）。
+命中率和节省的上游耗时写入 settings.MCP_PROXY_STATS_DIR，由 /health 汇总。
+
+由 fast-agent 以 stdio 方式启动：python -m app.mcp_servers.context7_proxy
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# stdout 是 MCP 协议通道，导入应用模块时的打印和控制台日志都改写到 stderr
+with contextlib.redirect_stdout(sys.stderr):
+    from mcp import ClientSession, types
+    from mcp.client.sse import sse_client
+    from mcp.server.lowlevel import Server
+    from mcp.server.stdio import stdio_server
+
+    from app.core.config import settings
+    from app.core.logging import app_logger
+    from app.services.cache_service import AnswerCache
+    from app.services.mcp_service import write_proxy_stats
+    from app.utils.singleflight import SingleFlight
+
+PROXY_NAME = "context7-mcp"
+
+
+def make_tool_cache_key(name: str, arguments: Dict[str, Any]) -> str:
+    """由工具名和参数（键排序后）生成缓存键"""
+    raw = f"{name}\n{json.dumps(arguments, sort_keys=True, ensure_ascii=False)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CachingToolProxy:
+    """缓存工具调用结果的MCP代理
+
+    Args:
+        upstream: 已初始化的上游 ClientSession
+        cache: 结果缓存
+        tool_ttls: 需要缓存的工具名 -> 缓存有效期（秒），其他工具直接转发
+        on_stats: 统计信息变化时的回调（用于写入统计文件）
+    """
+
+    def __init__(
+        self,
+        upstream: ClientSession,
+        cache: AnswerCache,
+        tool_ttls: Dict[str, float],
+        on_stats: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.upstream = upstream
+        self.cache = cache
+        self.tool_ttls = tool_ttls
+        self.on_stats = on_stats
+        self._tools: Optional[List[types.Tool]] = None
+        self._flights = SingleFlight()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _tool_stats(self, name: str) -> Dict[str, float]:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {
+                "hits": 0, "misses": 0, "errors": 0,
+                "upstream_calls": 0, "upstream_seconds": 0.0, "saved_seconds": 0.0,
+            }
+        return stats
+
+    async def list_tools(self) -> List[types.Tool]:
+        """上游工具列表（只查询一次）"""
+        if self._tools is None:
+            self._tools = (await self.upstream.list_tools()).tools
+        return self._tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> types.CallToolResult:
+        """调用工具，可缓存的工具先查缓存，相同参数的并发调用只转发一次"""
+        if name not in self.tool_ttls:
+            return await self._call_upstream(name, arguments)
+
+        stats = self._tool_stats(name)
+        key = make_tool_cache_key(name, arguments)
+        cached = self.cache.get(key)
+        if cached is not None:
+            stats["hits"] += 1
+            if stats["upstream_calls"]:
+                stats["saved_seconds"] += stats["upstream_seconds"] / stats["upstream_calls"]
+            self._report()
+            return types.CallToolResult.model_validate_json(cached)
+
+        stats["misses"] += 1
+        result = await self._flights.do(key, lambda: self._call_upstream(name, arguments))
+        if not result.isError:
+            self.cache.set(key, result.model_dump_json(), ttl=self.tool_ttls[name])
+        self._report()
+        return result
+
+    async def _call_upstream(self, name: str, arguments: Dict[str, Any]) -> types.CallToolResult:
+        stats = self._tool_stats(name)
+        start = time.monotonic()
+        try:
+            result = await self.upstream.call_tool(name, arguments)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        stats["upstream_calls"] += 1
+        stats["upstream_seconds"] += time.monotonic() - start
+        if result.isError:
+            stats["errors"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tools": {name: dict(stats) for name, stats in self._stats.items()}}
+
+    def _report(self) -> None:
+        if self.on_stats is not None:
+            try:
+                self.on_stats(self.stats())
+            except OSError as e:
+                app_logger.warning(f"写入代理统计信息失败: {e}")
+
+
+def build_proxy_server(proxy: CachingToolProxy) -> Server:
+    """创建对外提供代理工具的MCP服务器"""
+    server = Server(PROXY_NAME)
+
+    @server.list_tools()
+    async def list_tools() -> List[types.Tool]:
+        return await proxy.list_tools()
+
+    @server.call_tool()
+    async def call_tool(name: str, arguments: Dict[str, Any]):
+        result = await proxy.call_tool(name, arguments)
+        if result.isError:
+            # 由服务器框架转换为 isError 结果返回给agent
+            raise RuntimeError("\n".join(c.text for c in result.content if isinstance(c, types.TextContent)))
+        return result.content
+
+    return server
+
+
+def _upstream_url() -> str:
+    url = settings.CONTEXT7_UPSTREAM_URL or settings.MCP_SERVER_CONFIGS.get(PROXY_NAME, {}).get("url")
+    if not url:
+        raise RuntimeError("未配置 context7-mcp 上游地址（CONTEXT7_UPSTREAM_URL 或 secrets 中的 url）")
+    return url
+
+
+async def main() -> None:
+    cache = AnswerCache(
+        memory_size=settings.CONTEXT7_PROXY_MEMORY_SIZE,
+        disk_path=settings.CONTEXT7_PROXY_CACHE_PATH or None,
+        disk_max_bytes=settings.CONTEXT7_PROXY_CACHE_MAX_BYTES,
+    )
+    try:
+        async with sse_client(_upstream_url()) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as upstream:
+                await upstream.initialize()
+                proxy = CachingToolProxy(
+                    upstream, cache, settings.CONTEXT7_PROXY_TOOL_TTLS,
+                    on_stats=lambda stats: write_proxy_stats(PROXY_NAME, stats),
+                )
+                server = build_proxy_server(proxy)
+                async with stdio_server() as (read, write):
+                    await server.run(read, write, server.create_initialization_options())
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
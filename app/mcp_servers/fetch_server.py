@@ -0,0 +1,47 @@
+"""
+本地 fetch MCP 服务器
+
+替代远程 fetch 服务器，工具接口与之兼容（fetch(url, max_length, start_index)）。
+由 fast-agent 以 stdio 方式启动：python -m app.mcp_servers.fetch_server
+"""
+import contextlib
+import sys
+
+# stdout 是 MCP 协议通道，导入应用模块时的打印和控制台日志都改写到 stderr
+with contextlib.redirect_stdout(sys.stderr):
+    from mcp.server.fastmcp import FastMCP
+    from app.services.fetch_service import FetchError, get_page_fetcher
+
+mcp = FastMCP("fetch")
+
+
+@mcp.tool()
+async def fetch(url: str, max_length: int = 5000, start_index: int = 0) -> str:
+    """Fetches a URL from the internet and extracts its contents as markdown.
+
+    Args:
+        url: URL to fetch
+        max_length: Maximum number of characters to return
+        start_index: Start returning output at this character index, useful if a previous fetch was truncated
+    """
+    try:
+        result = await get_page_fetcher().fetch(url)
+    except FetchError as e:
+        return f"Failed to fetch {url}: {e}"
+
+    content = result.content
+    if start_index >= len(content):
+        return f"Contents of {url}:\n<error>No more content available.</error>"
+    chunk = content[start_index:start_index + max_length]
+    text = f"Contents of {url}:\n{chunk}"
+    end_index = start_index + len(chunk)
+    if end_index < len(content):
+        text += (
+            f"\n\n<error>Content truncated. Call the fetch tool with a start_index of {end_index} "
+            f"to get more content.</error>"
+        )
+    return text
+
+
+if __name__ == "__main__":
+    mcp.run()
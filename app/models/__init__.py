@@ -3,4 +3,6 @@
 提供数据库模型定义
 """
 from app.models.user import User
-from app.models.chat import ChatSession, ChatMessage 
\ No newline at end of file
+from app.models.chat import ChatSession, ChatMessage, ChatSessionSummary, ChatToolResult
+from app.models.job import QueryJob
+from app.models.usage import MessageUsage, DailyUsage
\ No newline at end of file
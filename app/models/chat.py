@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -17,6 +17,7 @@ class ChatSession(Base):
     
     # 关联关系
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    summary = relationship("ChatSessionSummary", back_populates="session", uselist=False, cascade="all, delete-orphan")
     user = relationship("User", back_populates="chat_sessions")
     
     def __repr__(self):
@@ -35,6 +36,42 @@ class ChatMessage(Base):
     
     # 关联关系
     session = relationship("ChatSession", back_populates="messages")
+    tool_results = relationship("ChatToolResult", back_populates="message", cascade="all, delete-orphan")
+    usage = relationship("MessageUsage", back_populates="message", uselist=False, cascade="all, delete-orphan")
     
     def __repr__(self):
-        return f"<ChatMessage(id={self.id}, role='{self.role}', session_id={self.session_id})>" 
\ No newline at end of file
+        return f"<ChatMessage(id={self.id}, role='{self.role}', session_id={self.session_id})>" 
+
+class ChatSessionSummary(Base):
+    """会话早期对话的滚动摘要（超出上下文预算的消息被压缩到这里）"""
+    __tablename__ = "chat_session_summaries"
+    
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(Text, nullable=False, default="")
+    last_message_id = Column(Integer, nullable=False, default=0)  # 已压缩进摘要的最后一条消息ID
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    
+    # 关联关系
+    session = relationship("ChatSession", back_populates="summary")
+    
+    def __repr__(self):
+        return f"<ChatSessionSummary(session_id={self.session_id}, last_message_id={self.last_message_id})>"
+
+class ChatToolResult(Base):
+    """生成助手消息时的MCP工具调用结果，重新生成答案时复用"""
+    __tablename__ = "chat_tool_results"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), nullable=False, index=True)
+    tool_name = Column(String(255), nullable=False)
+    arguments = Column(Text, nullable=False, default="{}")  # 调用参数（JSON）
+    result = Column(Text, nullable=False)  # CallToolResult（JSON）
+    is_error = Column(Boolean, default=False)
+    duration = Column(Float, nullable=False, default=0.0)  # 调用耗时（秒）
+    called_at = Column(DateTime(timezone=True), nullable=False)  # 实际调用工具的时间，复用的结果保留原时间
+    
+    # 关联关系
+    message = relationship("ChatMessage", back_populates="tool_results")
+    
+    def __repr__(self):
+        return f"<ChatToolResult(id={self.id}, tool='{self.tool_name}', message_id={self.message_id})>"
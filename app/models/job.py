@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime
+
+from app.db.base_class import Base
+
+class QueryJob(Base):
+    """异步查询任务模型"""
+    __tablename__ = "query_jobs"
+    
+    id = Column(String(36), primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
+    query = Column(Text, nullable=False)
+    use_cache = Column(Boolean, default=True)
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, running, succeeded, failed, cancelled
+    answer = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker = Column(String(64), nullable=True)  # 执行任务的进程，格式为 <pid>:<进程启动时间>
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    def __repr__(self):
+        return f"<QueryJob(id={self.id}, status='{self.status}', user_id={self.user_id})>"
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date, UniqueConstraint
+from sqlalchemy.orm import relationship
+
+from app.db.base_class import Base
+
+class MessageUsage(Base):
+    """生成一条助手消息的模型用量和估计成本"""
+    __tablename__ = "message_usage"
+
+    message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    route = Column(String(50), nullable=True)  # 查询路由，见 app/services/routing.py
+    model = Column(String(100), nullable=True)
+    source = Column(String(20), nullable=False)  # agent：调用了模型；cache：命中答案缓存；coalesced：等待了相同查询的结果；error：查询失败
+    llm_calls = Column(Integer, nullable=False, default=0)  # 模型请求次数（工具循环中的每一轮）
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)  # prompt_tokens 中命中提供商前缀缓存的部分
+    tool_calls = Column(Integer, nullable=False, default=0)  # 实际执行的MCP工具调用次数
+    cost = Column(Float, nullable=False, default=0.0)  # 按路由价格估计的成本
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    # 关联关系
+    message = relationship("ChatMessage", back_populates="usage")
+
+    def __repr__(self):
+        return f"<MessageUsage(message_id={self.message_id}, route='{self.route}', cost={self.cost})>"
+
+class DailyUsage(Base):
+    """每个用户每天每条路由的用量汇总，删除消息后仍然保留"""
+    __tablename__ = "daily_usage"
+    __table_args__ = (UniqueConstraint("user_id", "day", "route", name="uq_daily_usage"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    route = Column(String(50), nullable=False, default="")  # 没有选择路由的查询为空字符串
+    queries = Column(Integer, nullable=False, default=0)  # 保存的答案数
+    cache_hits = Column(Integer, nullable=False, default=0)
+    coalesced = Column(Integer, nullable=False, default=0)
+    llm_calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    tool_calls = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailyUsage(user_id={self.user_id}, day={self.day}, route='{self.route}', cost={self.cost})>"
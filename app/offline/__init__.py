@@ -0,0 +1,12 @@
+"""
+离线替身服务
+
+在没有网络和真实API密钥的机器上运行服务并做性能测试：
+- llm_server：OpenAI 兼容的 chat completions 接口（支持流式输出和工具调用）
+- mcp_servers：fetch 和 context7-mcp 的 SSE MCP 服务器
+
+延迟分布、输出速度、错误率和答案长度由 fastagent.offline.yaml 中的 offline.profiles 配置，
+使用 FASTAGENT_CONFIG_PATH=fastagent.offline.yaml 启动服务即连接到这些替身。
+
+启动：python -m app.offline --profile realistic
+"""
@@ -0,0 +1,41 @@
+"""
+启动全部离线替身服务
+
+    python -m app.offline --profile realistic [--config fastagent.offline.yaml]
+"""
+import argparse
+import asyncio
+
+import uvicorn
+
+from app.offline.llm_server import create_llm_app
+from app.offline.mcp_servers import create_context7_server, create_fetch_server
+from app.offline.profiles import load_profile
+
+
+async def serve(profile_name: str, config_path: str) -> None:
+    profile = load_profile(profile_name, config_path)
+    apps = {
+        "llm": create_llm_app(profile),
+        "fetch": create_fetch_server(profile).sse_app(),
+        "context7-mcp": create_context7_server(profile).sse_app(),
+    }
+    servers = []
+    for name, app in apps.items():
+        port = profile.ports[name]
+        print(f"离线替身 {name}: http://{profile.host}:{port}" + ("/v1" if name == "llm" else "/sse"))
+        servers.append(uvicorn.Server(uvicorn.Config(app, host=profile.host, port=port, log_level="warning")))
+    print(f"使用离线配置 {profile.name}，按 Ctrl+C 停止")
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="启动离线 LLM 和 MCP 替身服务")
+    parser.add_argument("--profile", default="realistic", help="offline.profiles 中的配置名")
+    parser.add_argument("--config", default="fastagent.offline.yaml", help="配置文件路径")
+    args = parser.parse_args()
+    asyncio.run(serve(args.profile, args.config))
+
+
+if __name__ == "__main__":
+    main()
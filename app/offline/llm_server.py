@@ -0,0 +1,218 @@
+"""
+离线 LLM 替身
+
+OpenAI 兼容的 POST /v1/chat/completions：
+- 按配置的延迟分布等待首个token，再按 tokens_per_second 输出（stream=True 时以SSE逐个分片返回）
+- 请求带有工具且对话中还没有工具结果时，按 tool_call_rate 的概率先返回一次工具调用
+- 最终答案包裹在 $$$ANSWER_START$$$ / $$$ANSWER_END$$$ 之间，长度为 answer_tokens 个token
+- 按 error_rate 的概率返回 error_status 错误
+
+LLM配置的可选参数：answer_tokens（默认200）、tool_call_rate（默认0.5）。
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.offline.profiles import OfflineProfile, ServiceProfile
+from app.utils.text_utils import extract_urls
+
+_ANSWER_WORDS = (
+    "离线 替身 返回 的 示例 回答 ， 用于 在 没有 网络 的 环境 中 测量 服务 的 延迟 和 吞吐 。"
+).split()
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _last_user_message(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return _message_text(message)
+    return ""
+
+
+def _tool_arguments(tool: Dict[str, Any], query: str) -> Dict[str, Any]:
+    """按工具参数的JSON Schema为必填参数生成取值"""
+    parameters = tool.get("function", {}).get("parameters") or {}
+    properties = parameters.get("properties") or {}
+    urls = extract_urls(query)
+    arguments = {}
+    for name in parameters.get("required") or []:
+        schema = properties.get(name) or {}
+        if schema.get("type") in ("integer", "number"):
+            arguments[name] = schema.get("default", 1)
+        elif schema.get("type") == "boolean":
+            arguments[name] = False
+        elif "url" in name.lower() and urls:
+            arguments[name] = urls[0]
+        else:
+            arguments[name] = query[:100]
+    return arguments
+
+
+def _choose_tool(tools: List[Dict[str, Any]], query: str) -> Dict[str, Any]:
+    """问题包含URL时优先使用fetch工具，否则使用第一个工具"""
+    if extract_urls(query):
+        for tool in tools:
+            if tool.get("function", {}).get("name", "").endswith("fetch"):
+                return tool
+    return tools[0]
+
+
+class FakeLLM:
+    """按配置生成回答的LLM替身
+
+    Args:
+        profile: LLM服务的行为配置
+        rng: 随机数生成器
+        sleep: 等待函数（测试中可替换）
+    """
+
+    def __init__(self, profile: ServiceProfile, rng: Optional[random.Random] = None, sleep=asyncio.sleep):
+        self.profile = profile
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+        self.requests = 0
+        self.errors = 0
+        self.tool_calls = 0
+
+    def _answer_tokens(self) -> List[str]:
+        count = int(self.profile.option("answer_tokens", 200))
+        words = [_ANSWER_WORDS[i % len(_ANSWER_WORDS)] for i in range(count)]
+        return ["$$$ANSWER_START$$$\n## 离线回答\n\n"] + words + ["\n$$$ANSWER_END$$$"]
+
+    def plan(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """决定本次请求的延迟、是否出错、以及返回工具调用还是答案"""
+        self.requests += 1
+        messages = body.get("messages") or []
+        tools = body.get("tools") or []
+        plan: Dict[str, Any] = {"latency": self.profile.latency.sample(self.rng), "error": False}
+        if self.rng.random() < self.profile.error_rate:
+            self.errors += 1
+            plan["error"] = True
+            return plan
+
+        has_tool_result = any(message.get("role") == "tool" for message in messages)
+        if tools and not has_tool_result and self.rng.random() < float(self.profile.option("tool_call_rate", 0.5)):
+            self.tool_calls += 1
+            query = _last_user_message(messages)
+            tool = _choose_tool(tools, query)
+            plan["tool_call"] = {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {
+                    "name": tool["function"]["name"],
+                    "arguments": json.dumps(_tool_arguments(tool, query), ensure_ascii=False),
+                },
+            }
+        else:
+            plan["tokens"] = self._answer_tokens()
+        plan["prompt_tokens"] = sum(len(_message_text(m)) for m in messages) // 4 + 1
+        return plan
+
+    def _usage(self, plan: Dict[str, Any]) -> Dict[str, int]:
+        completion_tokens = len(plan.get("tokens") or []) or 20
+        return {
+            "prompt_tokens": plan["prompt_tokens"],
+            "completion_tokens": completion_tokens,
+            "total_tokens": plan["prompt_tokens"] + completion_tokens,
+        }
+
+    async def _emit_delay(self) -> None:
+        if self.profile.tokens_per_second > 0:
+            await self.sleep(1.0 / self.profile.tokens_per_second)
+
+    async def complete(self, body: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Any]:
+        """非流式响应"""
+        await self.sleep(plan["latency"])
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        if "tool_call" in plan:
+            message["tool_calls"] = [plan["tool_call"]]
+            finish_reason = "tool_calls"
+        else:
+            if self.profile.tokens_per_second > 0:
+                await self.sleep(len(plan["tokens"]) / self.profile.tokens_per_second)
+            message["content"] = "".join(plan["tokens"])
+            finish_reason = "stop"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "offline"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(plan),
+        }
+
+    async def stream(self, body: Dict[str, Any], plan: Dict[str, Any]) -> AsyncIterator[str]:
+        """流式响应（SSE）"""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "offline")
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage=None) -> str:
+            data = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            }
+            if usage is not None:
+                data["usage"] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        await self.sleep(plan["latency"])
+        yield chunk({"role": "assistant", "content": ""})
+        if "tool_call" in plan:
+            yield chunk({"tool_calls": [dict(plan["tool_call"], index=0)]})
+            finish_reason = "tool_calls"
+        else:
+            for token in plan["tokens"]:
+                yield chunk({"content": token})
+                await self._emit_delay()
+            finish_reason = "stop"
+        yield chunk({}, finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=self._usage(plan))
+        yield "data: [DONE]\n\n"
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "tool_calls": self.tool_calls}
+
+
+def create_llm_app(profile: OfflineProfile, fake: Optional[FakeLLM] = None) -> FastAPI:
+    """创建LLM替身的ASGI应用"""
+    fake = fake or FakeLLM(profile.service("llm"), profile.rng("llm"))
+    app = FastAPI(title="offline-llm")
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "offline", "object": "model", "owned_by": "offline"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return fake.stats()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        plan = fake.plan(body)
+        if plan["error"]:
+            await fake.sleep(plan["latency"])
+            status_code = fake.profile.error_status
+            return JSONResponse(
+                status_code=status_code,
+                content={"error": {"message": f"offline fault injection ({status_code})", "type": "server_error"}},
+            )
+        if body.get("stream"):
+            return StreamingResponse(fake.stream(body, plan), media_type="text/event-stream")
+        return await fake.complete(body, plan)
+
+    return app
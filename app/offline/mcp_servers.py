@@ -0,0 +1,107 @@
+"""
+离线 MCP 替身
+
+fetch 和 context7-mcp 的 SSE MCP 服务器，工具名和参数与真实服务器一致：
+- fetch(url, max_length, start_index)：返回由URL确定的合成页面，长度为 page_chars（默认8000）
+- resolve-library-id(libraryName)、get-library-docs(context7CompatibleLibraryID, topic, tokens)：
+  返回合成的库ID和文档，文档长度不超过 doc_tokens（默认4000）
+
+每次调用按配置的延迟分布等待，按 error_rate 的概率返回工具错误。
+"""
+import asyncio
+import hashlib
+import random
+from typing import Optional
+
+from mcp.server.fastmcp import FastMCP
+
+from app.offline.profiles import OfflineProfile, ServiceProfile
+
+_FILLER = "这是离线替身生成的内容，用于在没有网络的环境中测试工具调用的延迟和结果处理。"
+
+
+def _synthetic_text(seed: str, chars: int) -> str:
+    """由 seed 确定的合成文本"""
+    digest = hashlib.sha256(seed.encode("utf-8")).hexdigest()[:8]
+    paragraph = f"[{digest}] {_FILLER}\n"
+    return (paragraph * (chars // len(paragraph) + 1))[:chars]
+
+
+class _FaultInjector:
+    """按配置等待并注入错误"""
+
+    def __init__(self, profile: ServiceProfile, rng: random.Random):
+        self.profile = profile
+        self.rng = rng
+        self.calls = 0
+        self.errors = 0
+
+    async def __call__(self, tool: str) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.profile.latency.sample(self.rng))
+        if self.rng.random() < self.profile.error_rate:
+            self.errors += 1
+            raise RuntimeError(f"offline fault injection: {tool}")
+
+
+def create_fetch_server(profile: OfflineProfile, injector: Optional[_FaultInjector] = None) -> FastMCP:
+    """创建 fetch 替身"""
+    service = profile.service("fetch")
+    inject = injector or _FaultInjector(service, profile.rng("fetch"))
+    page_chars = int(service.option("page_chars", 8000))
+    mcp = FastMCP("fetch")
+
+    @mcp.tool()
+    async def fetch(url: str, max_length: int = 5000, start_index: int = 0) -> str:
+        """Fetches a URL from the internet and extracts its contents as markdown.
+
+        Args:
+            url: URL to fetch
+            max_length: Maximum number of characters to return
+            start_index: Start returning output at this character index, useful if a previous fetch was truncated
+        """
+        await inject("fetch")
+        content = f"# {url}\n\n" + _synthetic_text(url, page_chars)
+        if start_index >= len(content):
+            return f"Contents of {url}:\n<error>No more content available.</error>"
+        chunk = content[start_index:start_index + max_length]
+        text = f"Contents of {url}:\n{chunk}"
+        end_index = start_index + len(chunk)
+        if end_index < len(content):
+            text += (
+                f"\n\n<error>Content truncated. Call the fetch tool with a start_index of {end_index} "
+                f"to get more content.</error>"
+            )
+        return text
+
+    return mcp
+
+
+def create_context7_server(profile: OfflineProfile, injector: Optional[_FaultInjector] = None) -> FastMCP:
+    """创建 context7-mcp 替身"""
+    service = profile.service("context7-mcp")
+    inject = injector or _FaultInjector(service, profile.rng("context7-mcp"))
+    doc_tokens = int(service.option("doc_tokens", 4000))
+    mcp = FastMCP("context7-mcp")
+
+    @mcp.tool(name="resolve-library-id")
+    async def resolve_library_id(libraryName: str) -> str:
+        """Resolves a package/product name to a Context7-compatible library ID and returns a list of matching libraries."""
+        await inject("resolve-library-id")
+        slug = "-".join(libraryName.lower().split()) or "library"
+        return (
+            f"Available Libraries (top matches):\n\n"
+            f"- Title: {libraryName}\n- Context7-compatible library ID: /offline/{slug}\n"
+            f"- Description: Offline stand-in documentation\n- Code Snippets: 100\n- Trust Score: 9"
+        )
+
+    @mcp.tool(name="get-library-docs")
+    async def get_library_docs(context7CompatibleLibraryID: str, topic: str = "", tokens: int = 10000) -> str:
+        """Fetches up-to-date documentation for a library."""
+        await inject("get-library-docs")
+        chars = min(tokens, doc_tokens) * 4
+        return f"# {context7CompatibleLibraryID} {topic}\n\n" + _synthetic_text(
+            f"{context7CompatibleLibraryID}\n{topic}", chars
+        )
+
+    return mcp
@@ -0,0 +1,155 @@
+"""
+离线替身的延迟和故障配置
+
+配置格式（fastagent.offline.yaml 的 offline 节）：
+
+    offline:
+      seed: 42
+      servers:
+        llm: {port: 8090}
+      profiles:
+        realistic:
+          llm:
+            latency: {distribution: lognormal, median: 0.8, sigma: 0.5}
+            tokens_per_second: 40
+            error_rate: 0.01
+
+延迟可以写成数字（固定值），或指定分布：
+fixed(value)、uniform(min, max)、normal(mean, stddev)、lognormal(median, sigma)。
+"""
+import math
+import random
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import yaml
+
+# 各替身服务的默认端口
+DEFAULT_PORTS = {"llm": 8090, "fetch": 8091, "context7-mcp": 8092}
+
+
+class LatencyDistribution:
+    """延迟分布（秒），采样结果不小于0
+
+    Args:
+        distribution: fixed / uniform / normal / lognormal
+        params: 分布参数
+    """
+
+    def __init__(self, distribution: str = "fixed", **params: float):
+        if distribution not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {distribution}")
+        self.distribution = distribution
+        self.params = params
+
+    @classmethod
+    def from_config(cls, config: Union[None, float, Dict[str, Any]]) -> "LatencyDistribution":
+        if config is None:
+            return cls("fixed", value=0.0)
+        if isinstance(config, (int, float)):
+            return cls("fixed", value=float(config))
+        config = dict(config)
+        return cls(config.pop("distribution", "fixed"), **{k: float(v) for k, v in config.items()})
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.distribution == "fixed":
+            value = p.get("value", 0.0)
+        elif self.distribution == "uniform":
+            value = rng.uniform(p.get("min", 0.0), p.get("max", 0.0))
+        elif self.distribution == "normal":
+            value = rng.gauss(p.get("mean", 0.0), p.get("stddev", 0.0))
+        else:
+            median = p.get("median", 0.0)
+            value = rng.lognormvariate(math.log(median), p.get("sigma", 0.0)) if median > 0 else 0.0
+        return max(0.0, value)
+
+
+class ServiceProfile:
+    """单个替身服务的行为
+
+    Args:
+        latency: 响应延迟（LLM为首个token前的延迟，工具为整个调用的耗时）
+        error_rate: 返回错误的概率
+        error_status: LLM返回错误时的HTTP状态码
+        tokens_per_second: LLM输出速度，0表示不限速
+        options: 其他服务相关的参数（答案长度、工具调用概率、页面长度等）
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyDistribution] = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        tokens_per_second: float = 0.0,
+        options: Optional[Dict[str, Any]] = None,
+    ):
+        self.latency = latency or LatencyDistribution()
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.tokens_per_second = tokens_per_second
+        self.options = options or {}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "ServiceProfile":
+        options = dict(config or {})
+        return cls(
+            latency=LatencyDistribution.from_config(options.pop("latency", None)),
+            error_rate=float(options.pop("error_rate", 0.0)),
+            error_status=int(options.pop("error_status", 500)),
+            tokens_per_second=float(options.pop("tokens_per_second", 0.0)),
+            options=options,
+        )
+
+    def option(self, name: str, default: Any) -> Any:
+        return self.options.get(name, default)
+
+
+class OfflineProfile:
+    """一组替身服务的配置
+
+    Args:
+        name: 配置名
+        services: 服务名（llm / fetch / context7-mcp）-> 服务行为
+        seed: 随机数种子，相同的种子和请求顺序得到相同的延迟和错误
+        ports: 服务名 -> 端口
+        host: 监听地址
+    """
+
+    def __init__(
+        self,
+        name: str,
+        services: Optional[Dict[str, ServiceProfile]] = None,
+        seed: Optional[int] = None,
+        ports: Optional[Dict[str, int]] = None,
+        host: str = "127.0.0.1",
+    ):
+        self.name = name
+        self.services = services or {}
+        self.seed = seed
+        self.ports = {**DEFAULT_PORTS, **(ports or {})}
+        self.host = host
+
+    def service(self, name: str) -> ServiceProfile:
+        return self.services.get(name) or ServiceProfile()
+
+    def rng(self, name: str) -> random.Random:
+        """每个服务独立的随机数生成器"""
+        return random.Random(None if self.seed is None else f"{self.seed}:{name}")
+
+
+def load_profile(name: str, config_path: Union[str, Path] = "fastagent.offline.yaml") -> OfflineProfile:
+    """从配置文件的 offline 节读取指定的配置"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        offline = (yaml.safe_load(f) or {}).get("offline") or {}
+    profiles = offline.get("profiles") or {}
+    if name not in profiles:
+        raise ValueError(f"{config_path} 中没有离线配置 {name}，可用的配置: {', '.join(profiles) or '无'}")
+    servers = offline.get("servers") or {}
+    return OfflineProfile(
+        name,
+        services={service: ServiceProfile.from_config(config) for service, config in (profiles[name] or {}).items()},
+        seed=offline.get("seed"),
+        ports={service: int(config["port"]) for service, config in servers.items() if config and "port" in config},
+        host=offline.get("host", "127.0.0.1"),
+    )
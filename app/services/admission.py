@@ -0,0 +1,336 @@
+"""
+agent调用的准入控制与调度
+
+限制同时进行的agent调用数量，并根据观察到的提供商延迟自适应调整（AIMD：
+延迟正常时每轮加性增加，延迟超标或出错时乘性减少）。超出并发限制的请求进入有界等待队列；
+队列已满或预计等待时间超过请求的截止时间时立即拒绝，而不是让所有请求一起拖到超时。
+
+等待队列按优先级通道和用户做加权公平调度：先服务优先级高的通道（管理员 > 交互 > 批量），
+同一通道内按用户的虚拟开始时间（start-time fair queueing）排序，某个用户一次提交很多查询
+也只会轮流占用名额；每个用户同时执行的调用数另有上限。
+"""
+import asyncio
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Hashable, List, Optional
+
+# 优先级通道，数值越小越先服务
+LANE_ADMIN = "admin"
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_PRIORITIES = {LANE_ADMIN: 0, LANE_INTERACTIVE: 1, LANE_BATCH: 2}
+
+
+def lane_for(is_admin: bool, interactive: bool = True) -> str:
+    """根据用户身份和请求类型选择优先级通道，非交互请求（后台任务等）一律走批量通道"""
+    if not interactive:
+        return LANE_BATCH
+    return LANE_ADMIN if is_admin else LANE_INTERACTIVE
+
+
+class AdmissionRejectedError(Exception):
+    """请求被准入控制拒绝
+
+    Args:
+        message: 拒绝原因
+        retry_after: 建议客户端重试前等待的秒数
+        status_code: 返回给客户端的HTTP状态码（整体过载为503，单个用户超限为429）
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = status_code
+
+
+class _Waiter:
+    """等待队列中的一个请求"""
+
+    __slots__ = ("future", "user", "lane", "start_tag", "seq", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, user: Hashable, lane: str, start_tag: float, seq: int):
+        self.future = future
+        self.user = user
+        self.lane = lane
+        self.start_tag = start_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+    def order(self):
+        return (LANE_PRIORITIES.get(self.lane, len(LANE_PRIORITIES)), self.start_tag, self.seq)
+
+
+class _UserStats:
+    """单个用户的调度统计"""
+
+    __slots__ = ("in_flight", "queued", "admitted", "rejected", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class AdmissionController:
+    """自适应并发限制 + 按用户公平调度的有界等待队列
+
+    Args:
+        initial_limit: 初始并发限制
+        min_limit: 并发限制下限
+        max_limit: 并发限制上限
+        max_queue: 等待队列最大长度
+        latency_threshold: 单次调用延迟超过该值（秒）视为过载信号
+        backoff: 过载时并发限制的缩减比例
+        smoothing: 平均延迟的指数平滑系数
+        max_user_in_flight: 每个用户同时执行的调用数上限（匿名请求不受限制）
+        max_user_queue: 每个用户在等待队列中的请求数上限
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        max_queue: int = 50,
+        latency_threshold: float = 90.0,
+        backoff: float = 0.8,
+        smoothing: float = 0.2,
+        max_user_in_flight: int = 1,
+        max_user_queue: int = 10,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_queue = max_queue
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.max_user_in_flight = max(1, max_user_in_flight)
+        self.max_user_queue = max_user_queue
+
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiters: List[_Waiter] = []
+        self._avg_latency: Optional[float] = None
+
+        # 公平调度状态：系统虚拟时间和每个用户上一个请求的虚拟结束时间
+        self._virtual_time = 0.0
+        self._user_finish: Dict[Hashable, float] = {}
+        self._users: Dict[Hashable, _UserStats] = {}
+        self._seq = itertools.count()
+
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_user_limit = 0
+        self._rejected_deadline = 0
+        self._rejected_timeout = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def _user(self, user: Hashable) -> _UserStats:
+        stats = self._users.get(user)
+        if stats is None:
+            stats = self._users[user] = _UserStats()
+        return stats
+
+    def _user_capped(self, user: Hashable) -> bool:
+        if user is None:
+            return False
+        stats = self._users.get(user)
+        return stats is not None and stats.in_flight >= self.max_user_in_flight
+
+    def predict_wait(self, ahead: Optional[int] = None) -> Optional[float]:
+        """预计排在 ahead 个请求之后需要等待的时间，尚无延迟样本时返回 None"""
+        if self._avg_latency is None:
+            return None
+        ahead = len(self._waiters) if ahead is None else ahead
+        return (ahead + 1) * self._avg_latency / self.limit
+
+    def _retry_after(self) -> float:
+        predicted = self.predict_wait()
+        return predicted if predicted is not None else 1.0
+
+    def _can_run_now(self, user: Hashable, lane: str) -> bool:
+        """有空闲名额、用户未超限，且没有应当排在前面的等待者"""
+        if self._in_flight >= self.limit or self._user_capped(user):
+            return False
+        priority = LANE_PRIORITIES.get(lane, len(LANE_PRIORITIES))
+        return not any(
+            LANE_PRIORITIES.get(w.lane, len(LANE_PRIORITIES)) <= priority and not self._user_capped(w.user)
+            for w in self._waiters
+        )
+
+    def check(self, max_wait: Optional[float] = None, user: Hashable = None, lane: str = LANE_INTERACTIVE) -> None:
+        """不占用名额，只判断现在提交是否会被拒绝（用于开始流式响应之前提前返回错误）"""
+        if self._can_run_now(user, lane):
+            return
+        self._reject_if_overloaded(max_wait, user, len(self._waiters))
+
+    def _reject_if_overloaded(self, max_wait: Optional[float], user: Hashable, ahead: int) -> None:
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_queue_full += 1
+            raise AdmissionRejectedError("服务繁忙，等待队列已满", self._retry_after())
+
+        if user is not None and self._user(user).queued >= self.max_user_queue:
+            self._rejected_user_limit += 1
+            self._user(user).rejected += 1
+            raise AdmissionRejectedError("排队中的查询过多，请等待之前的查询完成", self._retry_after(), 429)
+
+        predicted = self.predict_wait(ahead)
+        if max_wait is not None and predicted is not None and predicted > max_wait:
+            self._rejected_deadline += 1
+            raise AdmissionRejectedError(
+                f"服务繁忙，预计等待 {predicted:.0f}s 超过请求时限 {max_wait:.0f}s", predicted
+            )
+
+    def _grant(self, user: Hashable) -> None:
+        self._in_flight += 1
+        self._user(user).in_flight += 1
+
+    async def _acquire(self, max_wait: Optional[float], user: Hashable, lane: str, weight: float) -> None:
+        if self._can_run_now(user, lane):
+            self._grant(user)
+            return
+
+        # 虚拟开始时间：不早于系统虚拟时间，也不早于该用户上一个请求的结束时间
+        start_tag = max(self._virtual_time, self._user_finish.get(user, 0.0))
+        waiter = _Waiter(
+            asyncio.get_running_loop().create_future(), user, lane, start_tag, next(self._seq)
+        )
+        ahead = sum(1 for w in self._waiters if w.order() < waiter.order())
+        self._reject_if_overloaded(max_wait, user, ahead)
+
+        self._user_finish[user] = start_tag + 1.0 / max(weight, 0.01)
+        self._waiters.append(waiter)
+        self._user(user).queued += 1
+        try:
+            await asyncio.wait_for(waiter.future, timeout=max_wait)
+        except asyncio.TimeoutError:
+            self._rejected_timeout += 1
+            self._user(user).rejected += 1
+            raise AdmissionRejectedError("服务繁忙，排队等待超时", self._retry_after())
+        except asyncio.CancelledError:
+            # 已分配到名额后才被取消，需要把名额还回去
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._in_flight -= 1
+                self._user(user).in_flight -= 1
+                self._dispatch()
+            raise
+        finally:
+            self._user(user).queued -= 1
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+        wait_time = time.monotonic() - waiter.enqueued_at
+        stats = self._user(user)
+        stats.total_wait += wait_time
+        stats.max_wait = max(stats.max_wait, wait_time)
+
+    def _dispatch(self) -> None:
+        """把空闲名额按通道优先级和虚拟开始时间分配给等待者"""
+        while self._in_flight < self.limit:
+            best = None
+            for waiter in self._waiters:
+                if waiter.future.done() or self._user_capped(waiter.user):
+                    continue
+                if best is None or waiter.order() < best.order():
+                    best = waiter
+            if best is None:
+                return
+            self._waiters.remove(best)
+            self._virtual_time = max(self._virtual_time, best.start_tag)
+            self._grant(best.user)
+            best.future.set_result(True)
+
+    def _release(self, user: Hashable, latency: float, succeeded: Optional[bool]) -> None:
+        self._in_flight -= 1
+        self._user(user).in_flight -= 1
+        if self._user_finish.get(user, 0.0) <= self._virtual_time:
+            # 已落后于系统虚拟时间的记录与不存在等价，及时清理
+            self._user_finish.pop(user, None)
+        if succeeded is not None:
+            if self._avg_latency is None:
+                self._avg_latency = latency
+            else:
+                self._avg_latency += self.smoothing * (latency - self._avg_latency)
+
+            if succeeded and latency <= self.latency_threshold:
+                # 加性增加：大约每完成一轮（limit 个请求）增加 1
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            else:
+                # 乘性减少
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        max_wait: Optional[float] = None,
+        user: Hashable = None,
+        lane: str = LANE_INTERACTIVE,
+        weight: float = 1.0,
+    ):
+        """获取执行名额，退出时根据耗时和结果调整并发限制
+
+        Args:
+            max_wait: 请求最多愿意等待的时间（秒），预计或实际等待超过该值时拒绝
+            user: 发起请求的用户（通常为用户ID），用于公平调度和单用户上限
+            lane: 优先级通道
+            weight: 用户在同一通道内的权重，权重越大分到的名额越多
+        """
+        await self._acquire(max_wait, user, lane, weight)
+        self._admitted += 1
+        self._user(user).admitted += 1
+        start = time.monotonic()
+        succeeded: Optional[bool] = False
+        try:
+            yield
+            succeeded = True
+        except asyncio.CancelledError:
+            # 客户端取消不代表提供商过载，不参与限制调整
+            succeeded = None
+            raise
+        finally:
+            self._release(user, time.monotonic() - start, succeeded)
+
+    def user_stats(self) -> Dict[str, Dict[str, Any]]:
+        """每个用户的排队和执行统计"""
+        result = {}
+        for user, stats in self._users.items():
+            result[str(user) if user is not None else "anonymous"] = {
+                "in_flight": stats.in_flight,
+                "queued": stats.queued,
+                "admitted": stats.admitted,
+                "rejected": stats.rejected,
+                "avg_wait": round(stats.total_wait / stats.admitted, 3) if stats.admitted else 0.0,
+                "max_wait": round(stats.max_wait, 3),
+            }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """准入控制统计信息"""
+        lanes = {lane: 0 for lane in LANE_PRIORITIES}
+        for waiter in self._waiters:
+            lanes[waiter.lane] = lanes.get(waiter.lane, 0) + 1
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "queued_by_lane": lanes,
+            "active_users": sum(1 for s in self._users.values() if s.in_flight or s.queued),
+            "avg_latency": round(self._avg_latency, 3) if self._avg_latency is not None else None,
+            "admitted": self._admitted,
+            "rejected_queue_full": self._rejected_queue_full,
+            "rejected_user_limit": self._rejected_user_limit,
+            "rejected_deadline": self._rejected_deadline,
+            "rejected_timeout": self._rejected_timeout,
+        }
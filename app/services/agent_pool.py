@@ -0,0 +1,308 @@
+"""
+FastAgent实例池
+
+维护N个预热好的 FastAgent.run() 上下文，并发查询各自借用一个实例，
+避免所有会话挤在同一个agent对象上串行执行。
+实例可以按请求数、存活时间或健康检查结果在后台重建，见 app.services.agent_supervisor。
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.core.logging import app_logger
+
+
+class AgentPoolTimeoutError(Exception):
+    """在限定时间内未能借到空闲agent"""
+
+
+class _PoolMember:
+    """池中的一个实例及其生命周期状态
+
+    实例的上下文在专属任务中进入和退出（FastAgent.run() 内部使用任务组，
+    必须在同一个任务中进入和退出），设置 stop 事件后该任务退出上下文。
+    """
+
+    def __init__(self, member_id: int):
+        self.id = member_id
+        self.instance: Any = None
+        self.created_at = time.monotonic()
+        self.requests = 0
+        self.busy = False
+        self.retired = False
+        self.replacing = False
+        self.stop = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class AgentPool:
+    """FastAgent实例池
+
+    实例可以在后台重建后原子替换（见 replace）：新实例就绪后立即接收新的请求，
+    旧实例上正在执行的调用结束后再关闭。
+
+    Args:
+        factory: 无参异步上下文工厂，返回一个可 `async with` 的对象（通常是 FastAgent.run()）
+        size: 池中实例数量
+        acquire_timeout: 默认借用等待时间（秒）
+        max_requests: 实例处理多少次请求后重建，0表示不限
+        max_age: 实例存活多久（秒）后重建，0表示不限
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int = 2,
+        acquire_timeout: float = 30.0,
+        max_requests: int = 0,
+        max_age: float = 0,
+    ):
+        if size < 1:
+            raise ValueError("agent池大小必须至少为1")
+        self._factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.max_requests = max_requests
+        self.max_age = max_age
+
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._members: List[_PoolMember] = []
+        self._by_instance: Dict[int, _PoolMember] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._init_lock = asyncio.Lock()
+        self._started = False
+        self._next_id = 0
+
+        # 统计信息
+        self._busy = 0
+        self._waiters = 0
+        self._total_acquired = 0
+        self._total_timeouts = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._replaced: Dict[str, int] = {}
+        self._replace_failures = 0
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    async def _keep(self, member: _PoolMember, ready: asyncio.Future) -> None:
+        """在专属任务中持有实例上下文，直到实例被停止"""
+        try:
+            async with self._factory() as instance:
+                member.instance = instance
+                ready.set_result(instance)
+                await member.stop.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                app_logger.error(f"agent池实例 {member.id} 异常退出: {e}")
+
+    async def _spawn(self) -> _PoolMember:
+        """创建一个新实例，初始化失败时抛出异常"""
+        self._next_id += 1
+        member = _PoolMember(self._next_id)
+        ready = asyncio.get_running_loop().create_future()
+        member.task = asyncio.create_task(self._keep(member, ready))
+        try:
+            await ready
+        except BaseException:
+            member.task.cancel()
+            raise
+        member.created_at = time.monotonic()
+        return member
+
+    def _add(self, member: _PoolMember) -> None:
+        self._members.append(member)
+        self._by_instance[id(member.instance)] = member
+        self._idle.put_nowait(member)
+
+    def _stop_member(self, member: _PoolMember) -> None:
+        self._by_instance.pop(id(member.instance), None)
+        member.stop.set()
+        if member.task is not None:
+            self._background.add(member.task)
+            member.task.add_done_callback(self._background.discard)
+
+    async def start(self) -> None:
+        """初始化池中所有实例（只会执行一次，并发调用安全）"""
+        if self._started:
+            return
+        async with self._init_lock:
+            if self._started:
+                return
+            try:
+                for index in range(self.size):
+                    app_logger.info(f"初始化agent池实例 {index + 1}/{self.size}")
+                    self._add(await self._spawn())
+            except BaseException:
+                await self._stop_all()
+                raise
+            self._started = True
+            app_logger.info(f"agent池初始化完成，共 {self.size} 个实例")
+
+    async def acquire(self, timeout: Optional[float] = None) -> Any:
+        """借用一个空闲agent，超过等待时间抛出 AgentPoolTimeoutError"""
+        if not self._started:
+            await self.start()
+
+        timeout = self.acquire_timeout if timeout is None else timeout
+        wait_start = time.monotonic()
+        deadline = wait_start + timeout
+        self._waiters += 1
+        try:
+            while True:
+                member = await asyncio.wait_for(self._idle.get(), timeout=max(deadline - time.monotonic(), 0))
+                # 跳过空闲时被替换掉的实例
+                if not member.retired:
+                    break
+        except asyncio.TimeoutError:
+            self._total_timeouts += 1
+            raise AgentPoolTimeoutError(f"等待空闲agent超时 (timeout={timeout}s)")
+        finally:
+            self._waiters -= 1
+
+        wait_time = time.monotonic() - wait_start
+        member.busy = True
+        self._busy += 1
+        self._total_acquired += 1
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        return member.instance
+
+    def release(self, instance: Any) -> None:
+        """归还agent，不属于本池或已归还的实例忽略"""
+        member = self._by_instance.get(id(instance))
+        if member is None or not member.busy:
+            app_logger.warning("归还的agent实例不在使用中，已忽略")
+            return
+        self._busy -= 1
+        member.busy = False
+        member.requests += 1
+        if member.retired:
+            # 已被替换，最后一个调用结束后关闭
+            self._stop_member(member)
+            return
+        self._idle.put_nowait(member)
+        reason = self._recycle_reason(member)
+        if reason is not None:
+            self._replace_in_background(member, reason)
+
+    @asynccontextmanager
+    async def checkout(self, timeout: Optional[float] = None):
+        """借用agent的上下文管理器，退出时自动归还"""
+        instance = await self.acquire(timeout)
+        try:
+            yield instance
+        finally:
+            self.release(instance)
+
+    def _recycle_reason(self, member: _PoolMember) -> Optional[str]:
+        if self.max_requests and member.requests >= self.max_requests:
+            return "max_requests"
+        if self.max_age and time.monotonic() - member.created_at >= self.max_age:
+            return "max_age"
+        return None
+
+    def instances(self) -> List[Any]:
+        """当前在用的实例，按创建时间从早到晚排列"""
+        return [member.instance for member in self._members]
+
+    def recycle_due(self) -> None:
+        """在后台重建超过请求数或存活时间上限的实例"""
+        for member in list(self._members):
+            reason = self._recycle_reason(member)
+            if reason is not None:
+                self._replace_in_background(member, reason)
+
+    def _replace_in_background(self, member: _PoolMember, reason: str) -> None:
+        if member.replacing or member.retired:
+            return
+        task = asyncio.create_task(self.replace(member.instance, reason), name=f"agent-pool-replace-{member.id}")
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def replace(self, instance: Any, reason: str = "manual") -> bool:
+        """在后台创建新实例并原子替换指定实例
+
+        新实例就绪后立即加入空闲队列，旧实例不再借出，正在执行的调用结束后关闭。
+
+        Returns:
+            bool: 是否替换成功（新实例初始化失败时旧实例继续使用）
+        """
+        member = self._by_instance.get(id(instance))
+        if member is None or member.retired or member.replacing or not self._started:
+            return False
+        member.replacing = True
+        app_logger.info(f"重建agent池实例 {member.id} (原因: {reason}, 已处理 {member.requests} 次请求)")
+        try:
+            new_member = await self._spawn()
+        except Exception as e:
+            self._replace_failures += 1
+            member.replacing = False
+            app_logger.error(f"重建agent池实例 {member.id} 失败，继续使用旧实例: {e}")
+            return False
+        if not self._started:
+            # 重建期间池已关闭
+            self._stop_member(new_member)
+            return False
+
+        self._add(new_member)
+        member.retired = True
+        self._members.remove(member)
+        if not member.busy:
+            self._stop_member(member)
+        self._replaced[reason] = self._replaced.get(reason, 0) + 1
+        app_logger.info(f"agent池实例 {member.id} 已替换为实例 {new_member.id}")
+        return True
+
+    async def _stop_all(self) -> None:
+        for task in list(self._background):
+            if task.get_name().startswith("agent-pool-replace"):
+                task.cancel()
+        for member in list(self._members):
+            self._stop_member(member)
+        for member in list(self._by_instance.values()):
+            self._stop_member(member)
+        if self._background:
+            await asyncio.gather(*list(self._background), return_exceptions=True)
+        self._members.clear()
+        self._by_instance.clear()
+        self._idle = asyncio.Queue()
+
+    async def close(self) -> None:
+        """关闭池中所有实例"""
+        async with self._init_lock:
+            self._started = False
+            await self._stop_all()
+            self._busy = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """池统计信息"""
+        avg_wait = self._total_wait_time / self._total_acquired if self._total_acquired else 0.0
+        now = time.monotonic()
+        return {
+            "size": self.size,
+            "started": self._started,
+            "busy": self._busy,
+            "idle": sum(1 for member in self._members if not member.busy),
+            "waiters": self._waiters,
+            "total_acquired": self._total_acquired,
+            "total_timeouts": self._total_timeouts,
+            "avg_wait_time": round(avg_wait, 4),
+            "max_wait_time": round(self._max_wait_time, 4),
+            "replaced": dict(self._replaced),
+            "replace_failures": self._replace_failures,
+            "instances": [
+                {
+                    "id": member.id,
+                    "age": round(now - member.created_at, 1),
+                    "requests": member.requests,
+                    "busy": member.busy,
+                }
+                for member in self._members
+            ],
+        }
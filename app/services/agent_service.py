@@ -1,32 +1,29 @@
 import asyncio
+import sys
 import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from mcp_agent.core.fastagent import FastAgent
 from app.core.logging import app_logger, log_error, log_response_info
 from app.core.config import settings
+from app.services.agent_pool import AgentPool, AgentPoolTimeoutError
+from app.services.agent_supervisor import AgentSupervisor
+from app.services.admission import AdmissionController, AdmissionRejectedError, LANE_INTERACTIVE
+from app.services.llm_client import install_llm_client, stream_sink, usage_recorder
+from app.services.routing import QueryRoute, QueryRouter, build_router
+from app.services.cache_service import get_answer_cache, make_cache_key
+from app.services import cassette
+from app.services.deadline import budget, deadline_scope, install_tool_timeout
+from app.services.memory_service import compose_query
+from app.services.prefetch import PrefetchResult
+from app.services.tool_results import install_tool_reuse
+from app.services import metrics, usage_service
+from app.utils.singleflight import SingleFlight
 
-# 使用单例模式，在模块加载时初始化FastAgent，避免重复初始化
-_fast_agent_instance = None
-_agent_instance = None
-_agent_context = None
-
-async def get_agent_instance():
-    """获取FastAgent实例（单例模式）"""
-    global _fast_agent_instance, _agent_instance, _agent_context
-    
-    if _fast_agent_instance is None:
-        app_logger.info(f"初始化FastAgent [模型: {settings.DEFAULT_MODEL}]")
-        _fast_agent_instance = FastAgent(settings.AGENT_NAME)
-        
-        # 定义tech_assistant agent
-        @_fast_agent_instance.agent(
-            name="tech_assistant",
-            instruction="""你是一个专业的技术开发助手，专注于提供清晰、简洁、针对性的技术解答。
+# tech_assistant的系统提示词，工具相关的步骤按路由挂载的MCP服务器生成
+_INSTRUCTION_TEMPLATE = """你是一个专业的技术开发助手，专注于提供清晰、简洁、针对性的技术解答。
             你的核心职责是：
-            1. 深入分析用户的技术问题，理解其核心需求。
-            2. 如果用户提供了URL，使用fetch工具默默获取内容作为背景知识。
-            3. 使用context7-mcp工具默默查询相关的权威技术文档作为参考。
-            4. 彻底消化和整合所有收集到的信息。
-            5. **最终输出的唯一要求：生成一份纯净的Markdown文档。**
+{steps}
                 - **请务必、务必、务必使用 `$$$ANSWER_START$$$` 作为你最终答案 Markdown 的开始标记。**
                 - **请务必、务必、务必使用 `$$$ANSWER_END$$$` 作为你最终答案 Markdown 的结束标记。**
                 - 在这两个标记之间的内容，应该是直接回答用户原始问题的、结构清晰的Markdown，只包含必要的解释、说明和代码示例。
@@ -34,62 +31,447 @@ async def get_agent_instance():
                 - 以中文回复。
 
             用户只想看到被 `$$$ANSWER_START$$$` 和 `$$$ANSWER_END$$$` 包裹的最终答案。
-            """,
-            servers=["fetch", "context7-mcp"],
-            model=settings.DEFAULT_MODEL  # 使用配置文件中的默认模型设置
+            """
+
+_TOOL_STEPS = {
+    "fetch": "如果用户提供了URL，使用fetch工具默默获取内容作为背景知识。",
+    "context7-mcp": "使用context7-mcp工具默默查询相关的权威技术文档作为参考。",
+}
+
+def build_instruction(servers: List[str]) -> str:
+    """生成挂载指定MCP服务器的tech_assistant系统提示词"""
+    steps = ["深入分析用户的技术问题，理解其核心需求。"]
+    steps += [_TOOL_STEPS[server] for server in ("fetch", "context7-mcp") if server in servers]
+    steps.append("彻底消化和整合所有收集到的信息。" if len(steps) > 1 else "基于你已有的知识直接作答。")
+    steps.append("**最终输出的唯一要求：生成一份纯净的Markdown文档。**")
+    return _INSTRUCTION_TEMPLATE.format(
+        steps="\n".join(f"            {index}. {step}" for index, step in enumerate(steps, 1))
+    )
+
+# agent池（在首次使用或启动时初始化）
+_agent_pool: Optional[AgentPool] = None
+_pool_lock = asyncio.Lock()
+_supervisor: Optional[AgentSupervisor] = None
+
+# 合并相同的进行中查询
+_query_flights = SingleFlight()
+
+# agent调用的准入控制（首次使用时按配置创建）
+_admission: Optional[AdmissionController] = None
+
+# 查询路由（首次使用时按配置创建）
+_router: Optional[QueryRouter] = None
+
+def get_query_router() -> QueryRouter:
+    """获取查询路由器"""
+    global _router
+    if _router is None:
+        _router = build_router(settings.ROUTING_CONFIG, settings.DEFAULT_MODEL, build_instruction)
+        app_logger.info(
+            "查询路由: " + ", ".join(f"{r.name}({r.model}, 工具: {r.servers or '无'})" for r in _router.routes.values())
+        )
+    return _router
+
+def get_routing_stats() -> Dict[str, Any]:
+    """获取每条路由的延迟和成本统计"""
+    return get_query_router().stats()
+
+def _use_current_interpreter(fast_agent: FastAgent) -> None:
+    """配置为 command: "python" 的stdio MCP服务器（本地代理、fetch）改用运行本服务的解释器启动
+
+    保证子进程与本服务使用同一个虚拟环境，而不是 PATH 中第一个 python（可能没有安装依赖）
+    """
+    config = getattr(fast_agent.app, "_config_or_path", None)
+    servers = getattr(getattr(config, "mcp", None), "servers", None) or {}
+    for server in servers.values():
+        if server.transport == "stdio" and server.command == "python":
+            server.command = sys.executable
+
+def _create_fast_agent() -> FastAgent:
+    """创建一个FastAgent应用，为每条路由定义一个tech_assistant agent"""
+    fast_agent = FastAgent(settings.AGENT_NAME, config_path=settings.FASTAGENT_CONFIG_PATH, parse_cli_args=False)
+    _use_current_interpreter(fast_agent)
+
+    for route in get_query_router().routes.values():
+        # 定义该路由的tech_assistant agent，函数体不会被调用，仅作为装饰器的要求
+        @fast_agent.agent(
+            name=route.agent_name,
+            instruction=route.instruction,
+            servers=route.servers,
+            model=route.model,
+            # 每次调用都是无状态的，会话上下文由调用方通过 context 传入
+            use_history=False
         )
         async def tech_assistant_func():
-            # 这个函数体不会被调用，仅作为装饰器的要求
             pass
-        
-        # 使用异步上下文管理器预先初始化，避免每次查询都重新建立连接
-        # 保存上下文管理器而不是直接获取实例，这样可以正确关闭
-        _agent_context = _fast_agent_instance.run()
-        _agent_instance = await _agent_context.__aenter__()
-    
-    return _agent_instance
 
-# 关闭FastAgent实例
-async def close_agent_instance():
-    """关闭FastAgent实例，释放资源"""
-    global _agent_instance, _fast_agent_instance, _agent_context
-    
-    if _agent_instance is not None and _agent_context is not None:
+    return fast_agent
+
+@asynccontextmanager
+async def _agent_context_factory():
+    """为池中每个实例创建独立的 FastAgent.run() 上下文"""
+    async with _create_fast_agent().run() as agent_app:
+        # 替换为复用连接、支持流式输出的LLM客户端，并按请求剩余时间限制工具调用
+        for route in get_query_router().routes.values():
+            install_llm_client(agent_app[route.agent_name])
+            install_tool_timeout(agent_app[route.agent_name])
+            # 记录工具结果，重新生成答案时复用
+            install_tool_reuse(agent_app[route.agent_name])
+            if cassette.is_recording():
+                cassette.install_tool_recorder(agent_app[route.agent_name])
+        yield agent_app
+
+async def get_agent_pool() -> AgentPool:
+    """获取agent池（首次调用时初始化，并发调用只会初始化一次）"""
+    global _agent_pool
+
+    if _agent_pool is not None and _agent_pool.started:
+        return _agent_pool
+
+    async with _pool_lock:
+        if _agent_pool is None:
+            app_logger.info(
+                f"初始化FastAgent池 [模型: {settings.DEFAULT_MODEL}, 大小: {settings.AGENT_POOL_SIZE}]"
+            )
+            _agent_pool = AgentPool(
+                _agent_context_factory,
+                size=settings.AGENT_POOL_SIZE,
+                acquire_timeout=settings.AGENT_POOL_ACQUIRE_TIMEOUT,
+                max_requests=settings.AGENT_MAX_REQUESTS,
+                max_age=settings.AGENT_MAX_AGE,
+            )
+        await _agent_pool.start()
+        _start_supervisor(_agent_pool)
+    return _agent_pool
+
+def _start_supervisor(pool: AgentPool) -> None:
+    """启动agent池的后台监督任务（只启动一次）"""
+    global _supervisor
+    if _supervisor is None and settings.AGENT_SUPERVISOR_ENABLED:
+        _supervisor = AgentSupervisor(
+            pool,
+            interval=settings.AGENT_SUPERVISOR_INTERVAL,
+            probe_timeout=settings.AGENT_PROBE_TIMEOUT,
+            max_memory_growth=settings.AGENT_MAX_MEMORY_GROWTH,
+        )
+        _supervisor.start()
+
+def get_agent_pool_stats() -> Dict[str, Any]:
+    """获取agent池统计信息，池尚未创建时返回空统计"""
+    if _agent_pool is None:
+        return {"size": settings.AGENT_POOL_SIZE, "started": False}
+    stats = _agent_pool.stats()
+    stats["supervisor"] = _supervisor.stats() if _supervisor is not None else None
+    return stats
+
+# 关闭agent池
+async def close_agent_pool():
+    """关闭agent池中所有FastAgent实例，释放资源"""
+    global _agent_pool, _supervisor
+
+    if _supervisor is not None:
+        await _supervisor.stop()
+        _supervisor = None
+
+    if _agent_pool is not None:
         try:
-            # 正确地关闭上下文管理器
-            await _agent_context.__aexit__(None, None, None)
-            app_logger.info("已关闭FastAgent实例")
+            await _agent_pool.close()
+            app_logger.info("已关闭FastAgent池")
         except Exception as e:
-            app_logger.error(f"关闭FastAgent实例时出错: {str(e)}")
+            app_logger.error(f"关闭FastAgent池时出错: {str(e)}")
         finally:
-            _agent_instance = None
-            _fast_agent_instance = None
-            _agent_context = None
+            _agent_pool = None
 
-# tech_assistant调用函数
-async def tech_assistant_query(query: str, timeout: float = 180.0):
-    """使用tech_assistant agent处理查询"""
+def _is_cacheable(response: Optional[str]) -> bool:
+    """只缓存包含完整答案标记的正常响应"""
+    if not response:
+        return False
+    start_index = response.find("$$$ANSWER_START$$$")
+    end_index = response.find("$$$ANSWER_END$$$")
+    return start_index != -1 and start_index < end_index
+
+def _route_and_prompt(
+    query: str, context: Optional[str], prefetched: Optional[PrefetchResult]
+) -> Tuple[QueryRoute, str]:
+    """选择路由并组合发送给agent的查询；链接已全部预先抓取时按不需要fetch工具的问题选择路由"""
+    if prefetched is None:
+        return get_query_router().route(query), compose_query(query, context)
+    route = get_query_router().route(prefetched.routing_query(query))
+    return route, compose_query(query, context, prefetched.section())
+
+async def _lookup_cache(query: str, use_cache: bool, route: QueryRoute):
+    """查询答案缓存，返回 (缓存键, 缓存的响应)"""
+    cache_key = make_cache_key(query, route.model, route.instruction_version)
+    if not settings.ANSWER_CACHE_ENABLED:
+        usage_service.set_route(route)
+        return cache_key, None
+    cache = get_answer_cache()
+    if not use_cache:
+        cache.record_bypass()
+        usage_service.set_route(route)
+        return cache_key, None
+    cached = await cache.get_async(cache_key)
+    if cached is not None:
+        app_logger.info("命中答案缓存")
+    usage_service.set_route(route, cache_hit=cached is not None)
+    return cache_key, cached
+
+async def _store_cache(cache_key: str, response: Optional[str]) -> None:
+    """把正常响应写入答案缓存"""
+    if settings.ANSWER_CACHE_ENABLED and _is_cacheable(response):
+        await get_answer_cache().set_async(cache_key, response)
+
+def get_query_coalescing_stats() -> Dict[str, int]:
+    """获取相同查询合并的统计信息"""
+    return _query_flights.stats()
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """获取准入控制器，未启用时返回 None"""
+    global _admission
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if _admission is None:
+        # 并发限制超过agent池大小没有意义，多出的请求只会在池里等待
+        max_limit = max(1, min(settings.ADMISSION_MAX_LIMIT, settings.AGENT_POOL_SIZE))
+        _admission = AdmissionController(
+            initial_limit=settings.ADMISSION_INITIAL_LIMIT,
+            min_limit=settings.ADMISSION_MIN_LIMIT,
+            max_limit=max_limit,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+            latency_threshold=settings.ADMISSION_LATENCY_THRESHOLD,
+            max_user_in_flight=settings.SCHEDULER_USER_MAX_IN_FLIGHT,
+            max_user_queue=settings.SCHEDULER_USER_MAX_QUEUE,
+        )
+    return _admission
+
+def get_admission_stats() -> Optional[Dict[str, Any]]:
+    """获取准入控制统计信息，未启用时返回 None"""
+    controller = get_admission_controller()
+    return controller.stats() if controller is not None else None
+
+def get_scheduler_user_stats() -> Dict[str, Dict[str, Any]]:
+    """获取每个用户的排队和执行统计"""
+    controller = get_admission_controller()
+    return controller.user_stats() if controller is not None else {}
+
+def check_admission(user_id: Optional[int] = None, lane: str = LANE_INTERACTIVE) -> None:
+    """判断现在提交查询是否会被拒绝，会被拒绝时抛出 AdmissionRejectedError"""
+    controller = get_admission_controller()
+    if controller is not None:
+        max_wait = budget(settings.DEADLINE_QUEUE_SHARE, default=settings.AGENT_QUERY_TIMEOUT)
+        controller.check(max_wait=max_wait, user=user_id, lane=lane)
+
+def _admit(user_id: Optional[int], lane: str):
+    """在剩余时间的 DEADLINE_QUEUE_SHARE 内获取执行名额"""
+    controller = get_admission_controller()
+    if controller is None:
+        return nullcontext()
+    weight = settings.SCHEDULER_USER_WEIGHTS.get(user_id, 1.0) if user_id is not None else 1.0
+    max_wait = budget(settings.DEADLINE_QUEUE_SHARE)
+    return controller.admit(max_wait=max_wait, user=user_id, lane=lane, weight=weight)
+
+def _checkout(pool: AgentPool):
+    """在剩余时间的 DEADLINE_QUEUE_SHARE 内借用agent"""
+    return pool.checkout(budget(settings.DEADLINE_QUEUE_SHARE, default=pool.acquire_timeout))
+
+@asynccontextmanager
+async def _agent_slot(user_id: Optional[int], lane: str):
+    """通过准入控制后借用一个agent；回放录像时不需要agent，产出 None"""
+    if cassette.is_replaying():
+        async with _admit(user_id, lane):
+            yield None
+        return
+    # 先通过准入控制，再从池中借用一个预初始化的agent实例
+    pool = await get_agent_pool()
+    async with _admit(user_id, lane), _checkout(pool) as agent:
+        yield agent
+
+async def _send_routed(agent, route: QueryRoute, query: str) -> str:
+    """把查询发给路由对应的agent，并记录该路由的耗时和token用量（同时计入当前查询的用量，见 app.services.usage_service）
+
+    录制模式下把本次调用写入录像，回放模式下由录像提供响应（agent 为 None），见 app.services.cassette。
+    """
+    usages: List[Any] = []
+    usage_recorder.set(usages.append)
+    start_time = time.time()
+    ok = False
     try:
-        start_time = time.time()
-        
-        # 获取预初始化的agent实例
-        agent = await get_agent_instance()
-        
-        # 发送查询
-        app_logger.info("向agent发送查询...")
+        if agent is None:
+            response = await cassette.get_player().play(
+                make_cache_key(query, route.model, route.instruction_version),
+                query, sink=stream_sink.get(), on_usage=usages.append,
+            )
+        elif cassette.is_recording():
+            recording = cassette.Recording(
+                make_cache_key(query, route.model, route.instruction_version), query, route.name, route.model
+            )
+            cassette.current_recording.set(recording)
+            response = await agent[route.agent_name].send(query)
+            cassette.get_recorder().save(recording, response)
+        else:
+            response = await agent[route.agent_name].send(query)
+        ok = True
+        return response
+    finally:
+        elapsed = time.time() - start_time
+        get_query_router().record(route, elapsed, usages, ok)
+        usage_service.record_call(route, usages)
+        metrics.AGENT_CALL_SECONDS.observe(elapsed, route.name, "ok" if ok else "error")
+
+async def _query_agent(
+    query: str, cache_key: str, user_id: Optional[int], lane: str, route: QueryRoute
+) -> str:
+    """借用agent执行一次查询，并把正常响应写入缓存"""
+    start_time = time.time()
+    
+    async with _agent_slot(user_id, lane) as agent:
+        # 发送查询，为之后保存答案预留时间
+        app_logger.info(f"向agent发送查询 (路由: {route.name})...")
         response = await asyncio.wait_for(
-            agent.tech_assistant.send(query),
-            timeout=timeout
+            _send_routed(agent, route, query),
+            timeout=budget(reserve=settings.DEADLINE_SAVE_RESERVE)
         )
-        
-        processing_time = time.time() - start_time
-        response_length = len(response) if response else 0
-        log_response_info(response_length, processing_time)
-        return response
+    
+    processing_time = time.time() - start_time
+    response_length = len(response) if response else 0
+    log_response_info(response_length, processing_time)
+    await _store_cache(cache_key, response)
+    return response
+
+# tech_assistant调用函数
+async def tech_assistant_query(
+    query: str,
+    timeout: Optional[float] = None,
+    use_cache: bool = True,
+    user_id: Optional[int] = None,
+    lane: str = LANE_INTERACTIVE,
+    context: Optional[str] = None,
+    raise_errors: bool = False,
+    prefetched: Optional[PrefetchResult] = None,
+):
+    """使用tech_assistant agent处理查询
+
+    查询先经分类器选择路由（模型和工具集），见 app.services.routing。
+    相同（归一化后）的查询正在执行时，后来的请求会等待同一次调用的结果
+    （按第一个请求的用户、通道和截止时间参与调度），各自到达截止时间时不再等待。
+
+    Args:
+        query: 发送给agent的查询
+        timeout: 超时时间（秒），默认为 settings.AGENT_QUERY_TIMEOUT；请求的截止时间更早时以截止时间为准
+        use_cache: 为 False 时跳过答案缓存读取（新答案仍会写入缓存）
+        user_id: 发起查询的用户ID，用于按用户公平调度
+        lane: 优先级通道，见 app.services.admission.lane_for
+        context: 会话上下文（见 app.services.memory_service），与查询一起发送并参与缓存键
+        raise_errors: 为 True 时agent调用失败抛出异常，而不是返回说明错误的答案
+        prefetched: 问题中链接的预先抓取结果（见 app.services.prefetch），内容随查询发送
+    """
+    route, prompt = _route_and_prompt(query, context, prefetched)
+    cache_key, cached = await _lookup_cache(prompt, use_cache, route)
+    if cached is not None:
+        return cached
+
+    timeout = settings.AGENT_QUERY_TIMEOUT if timeout is None else timeout
+    try:
+        with deadline_scope(timeout):
+            return await asyncio.wait_for(
+                _query_flights.do(cache_key, lambda: _query_agent(prompt, cache_key, user_id, lane, route)),
+                timeout=budget()
+            )
     except asyncio.TimeoutError:
+        usage_service.record_failure()
         log_error(f"请求处理超时 (timeout={timeout}s)")
         raise Exception("请求处理超时")
+    except AgentPoolTimeoutError as e:
+        usage_service.record_failure()
+        log_error(f"agent池已满: {e}")
+        raise
+    except AdmissionRejectedError as e:
+        usage_service.record_failure()
+        app_logger.warning(f"查询被准入控制拒绝: {e}")
+        raise
     except Exception as e:
+        usage_service.record_failure()
         log_error(f"Agent查询失败: {e}", exc_info=True)
+        if raise_errors:
+            raise
         # 返回友好错误信息，保持格式与正常回答一致
-        return "$$$ANSWER_START$$$\n## 处理查询时出错\n\n很抱歉，在处理您的查询时遇到技术问题。请稍后再试。\n\n错误详情: " + str(e) + "\n$$$ANSWER_END$$$" 
\ No newline at end of file
+        return "$$$ANSWER_START$$$\n## 处理查询时出错\n\n很抱歉，在处理您的查询时遇到技术问题。请稍后再试。\n\n错误详情: " + str(e) + "\n$$$ANSWER_END$$$"
+
+# tech_assistant流式调用函数
+async def tech_assistant_stream(
+    query: str,
+    timeout: Optional[float] = None,
+    use_cache: bool = True,
+    user_id: Optional[int] = None,
+    lane: str = LANE_INTERACTIVE,
+    context: Optional[str] = None,
+    prefetched: Optional[PrefetchResult] = None,
+) -> AsyncIterator[str]:
+    """使用tech_assistant agent处理查询，模型输出到达时逐段产出原始文本
+
+    模型不支持流式输出时，会在调用结束后一次性产出完整响应；命中答案缓存时直接产出缓存的响应。
+    """
+    route, prompt = _route_and_prompt(query, context, prefetched)
+    cache_key, cached = await _lookup_cache(prompt, use_cache, route)
+    if cached is not None:
+        yield cached
+        return
+
+    start_time = time.time()
+    queue: asyncio.Queue = asyncio.Queue()
+    streamed = False
+    # 请求的截止时间更早时以截止时间为准
+    timeout = budget(default=settings.AGENT_QUERY_TIMEOUT if timeout is None else timeout)
+
+    async def run_query() -> str:
+        # 在独立任务中登记接收器和截止时间，使LLM客户端把增量文本写入队列
+        stream_sink.set(queue.put_nowait)
+        with deadline_scope(timeout):
+            async with _agent_slot(user_id, lane) as agent:
+                app_logger.info(f"向agent发送流式查询 (路由: {route.name})...")
+                return await _send_routed(agent, route, prompt)
+
+    task = asyncio.create_task(run_query())
+    try:
+        deadline = start_time + timeout
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            remaining = deadline - time.time()
+            done, _ = await asyncio.wait(
+                {getter, task}, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter in done:
+                if not streamed:
+                    metrics.AGENT_FIRST_TOKEN_SECONDS.observe(time.time() - start_time, route.name)
+                streamed = True
+                yield getter.result()
+                continue
+            getter.cancel()
+            if task in done:
+                break
+            log_error(f"流式请求处理超时 (timeout={timeout}s)")
+            raise Exception("请求处理超时")
+
+        # 取出任务结束前已写入但尚未产出的文本
+        while not queue.empty():
+            if not streamed:
+                metrics.AGENT_FIRST_TOKEN_SECONDS.observe(time.time() - start_time, route.name)
+            streamed = True
+            yield queue.get_nowait()
+
+        response = task.result()
+        if not streamed and response:
+            # 模型不支持流式输出时，整个响应即首个片段
+            metrics.AGENT_FIRST_TOKEN_SECONDS.observe(time.time() - start_time, route.name)
+            yield response
+
+        processing_time = time.time() - start_time
+        response_length = len(response) if response else 0
+        log_response_info(response_length, processing_time)
+        await _store_cache(cache_key, response)
+    except Exception:
+        usage_service.record_failure()
+        raise
+    finally:
+        if not task.done():
+            task.cancel()
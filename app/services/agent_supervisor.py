@@ -0,0 +1,143 @@
+"""
+agent池监督
+
+后台定期检查agent池：
+- 对每个实例执行健康检查（默认检查每个MCP服务器连接并发送ping），失败的实例在后台重建
+- 重建处理请求数或存活时间超过上限的实例
+- 进程内存相对启动时增长超过上限时，重建最早创建的实例
+
+重建通过 AgentPool.replace 完成：新实例就绪后原子替换旧实例，进行中的调用在旧实例上完成。
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.logging import app_logger
+from app.services.agent_pool import AgentPool
+
+
+def current_memory_usage() -> Optional[int]:
+    """当前进程的常驻内存（字节），无法获取时返回 None"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except Exception:
+        return None
+
+
+async def probe_mcp_servers(agent_app: Any) -> None:
+    """检查 FastAgent 应用中每个agent的MCP服务器连接，连接断开或ping失败时抛出异常"""
+    for name, agent in getattr(agent_app, "_agents", {}).items():
+        manager = getattr(agent, "_persistent_connection_manager", None)
+        if manager is None:
+            continue
+        for server_name in agent.server_names:
+            connection = manager.running_servers.get(server_name)
+            if connection is None or not connection.is_healthy():
+                raise RuntimeError(f"agent {name} 的MCP服务器 {server_name} 连接不可用")
+            await connection.session.send_ping()
+
+
+class AgentSupervisor:
+    """agent池的后台监督任务
+
+    Args:
+        pool: 被监督的agent池
+        health_check: 实例健康检查函数，抛出异常或超时视为不健康
+        interval: 检查间隔（秒）
+        probe_timeout: 单个实例健康检查的超时时间（秒）
+        max_memory_growth: 进程内存相对基线增长超过该值（字节）时重建最早的实例，0表示不检查
+        memory_usage: 获取当前进程内存的函数
+    """
+
+    def __init__(
+        self,
+        pool: AgentPool,
+        health_check: Optional[Callable[[Any], Awaitable[None]]] = probe_mcp_servers,
+        interval: float = 60.0,
+        probe_timeout: float = 10.0,
+        max_memory_growth: int = 0,
+        memory_usage: Callable[[], Optional[int]] = current_memory_usage,
+    ):
+        self.pool = pool
+        self.health_check = health_check
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.max_memory_growth = max_memory_growth
+        self.memory_usage = memory_usage
+        self._memory_baseline: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._checks = 0
+        self._probe_failures = 0
+        self._last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check_once()
+            except Exception as e:
+                app_logger.error(f"agent池监督检查出错: {e}", exc_info=True)
+
+    async def check_once(self) -> None:
+        """执行一轮检查"""
+        if not self.pool.started:
+            return
+        self._checks += 1
+
+        if self.health_check is not None:
+            for instance in self.pool.instances():
+                try:
+                    await asyncio.wait_for(self.health_check(instance), timeout=self.probe_timeout)
+                except Exception as e:
+                    self._probe_failures += 1
+                    self._last_error = str(e) or type(e).__name__
+                    app_logger.warning(f"agent池实例健康检查失败: {self._last_error}")
+                    await self.pool.replace(instance, reason="unhealthy")
+
+        self.pool.recycle_due()
+        await self._check_memory()
+
+    async def _check_memory(self) -> None:
+        if not self.max_memory_growth:
+            return
+        usage = self.memory_usage()
+        if usage is None:
+            return
+        if self._memory_baseline is None:
+            self._memory_baseline = usage
+            return
+        if usage - self._memory_baseline <= self.max_memory_growth:
+            return
+        instances = self.pool.instances()
+        if not instances:
+            return
+        app_logger.warning(
+            f"进程内存增长 {(usage - self._memory_baseline) / 1024 / 1024:.1f}MB，重建最早的agent池实例"
+        )
+        if await self.pool.replace(instances[0], reason="memory"):
+            # 以重建后的内存作为新的基线，避免释放不及时时连续重建
+            self._memory_baseline = self.memory_usage() or usage
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "checks": self._checks,
+            "probe_failures": self._probe_failures,
+            "last_error": self._last_error,
+            "memory_usage": self.memory_usage() if self.max_memory_growth else None,
+            "memory_baseline": self._memory_baseline,
+        }
@@ -0,0 +1,64 @@
+"""
+批量查询服务
+
+并发执行一批查询，按完成顺序逐个返回结果：
+- 整批同时执行的查询数不超过 parallelism
+- 属于同一个会话的查询按提交顺序依次执行，后面的问题能看到前面的回答
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+async def run_batch(
+    items: List[Any],
+    handler: Callable[[Any], Awaitable[Any]],
+    parallelism: int,
+    chain_key: Optional[Callable[[Any], Optional[Hashable]]] = None,
+    on_abandon: Optional[Callable[[asyncio.Task], None]] = None,
+) -> AsyncIterator[Tuple[int, Any, Optional[BaseException]]]:
+    """并发处理 items，按完成顺序产出 (下标, 结果, 异常)
+
+    Args:
+        items: 待处理的条目
+        handler: 处理单个条目的协程函数，抛出的异常随结果一起产出
+        parallelism: 同时处理的条目数上限
+        chain_key: 返回相同非空键的条目按提交顺序依次处理
+        on_abandon: 迭代提前结束（如客户端断开）时对每个未完成条目的任务调用，默认取消任务
+    """
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+    results: asyncio.Queue = asyncio.Queue()
+    last_in_chain: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(index: int, item: Any, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            async with semaphore:
+                result = await handler(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            results.put_nowait((index, None, e))
+        else:
+            results.put_nowait((index, result, None))
+
+    tasks = []
+    for index, item in enumerate(items):
+        key = chain_key(item) if chain_key is not None else None
+        previous = last_in_chain.get(key) if key is not None else None
+        task = asyncio.create_task(run(index, item, previous))
+        if key is not None:
+            last_in_chain[key] = task
+        tasks.append(task)
+
+    try:
+        for _ in items:
+            yield await results.get()
+    finally:
+        for task in tasks:
+            if task.done():
+                continue
+            if on_abandon is not None:
+                on_abandon(task)
+            else:
+                task.cancel()
@@ -0,0 +1,288 @@
+"""
+答案缓存服务
+
+在 tech_assistant_query 之前缓存agent的原始响应，相同（归一化后）的问题直接返回。
+两级缓存：进程内LRU + 按大小限制的SQLite磁盘缓存（重启后仍然有效）。
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils.text_utils import extract_urls
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询：URL排序后单独拼接，其余文本折叠空白并忽略大小写"""
+    urls = sorted(extract_urls(query))
+    text = query
+    for url in urls:
+        text = text.replace(f"@{url}", " ").replace(url, " ")
+    text = re.sub(r"\s+", " ", text).strip().casefold()
+    return text + ("\n" + "\n".join(urls) if urls else "")
+
+
+def make_cache_key(query: str, model: str, instruction_version: str) -> str:
+    """由归一化查询、模型名和提示词版本生成缓存键"""
+    raw = f"{model}\n{instruction_version}\n{normalize_query(query)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """两级答案缓存
+
+    内存LRU在调用方线程中直接读写；SQLite磁盘缓存的读写可能等待磁盘或其他进程的写锁，
+    在事件循环中应使用 get_async / set_async，磁盘部分在线程池中执行。
+
+    Args:
+        ttl: 缓存有效期（秒）
+        memory_size: 内存LRU最多保存的条目数
+        disk_path: SQLite缓存文件路径，为 None 时只使用内存缓存
+        disk_max_bytes: 磁盘缓存的最大字节数，超出后按最近访问时间淘汰
+    """
+
+    # 超过字节上限时每批淘汰的条目数
+    EVICT_BATCH = 64
+
+    def __init__(
+        self,
+        ttl: float = 86400,
+        memory_size: int = 256,
+        disk_path: Optional[str] = None,
+        disk_max_bytes: int = 100 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 本进程估计的磁盘缓存字节数，超过上限时才重新统计并淘汰（其他进程的写入在那时计入）
+        self._disk_bytes = 0
+        if disk_path:
+            self._conn = self._open_disk(disk_path)
+            self._disk_bytes = self._disk_total()
+
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "bypassed": 0,
+            "expired": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    def _open_disk(self, path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_answer_cache_last_access ON answer_cache(last_access)")
+        conn.commit()
+        return conn
+
+    def _disk_total(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answer_cache").fetchone()[0]
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self._stats["expired"] += 1
+            return None
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        """从磁盘缓存读取（阻塞），命中时放入内存LRU"""
+        with self._disk_lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT value, expires_at, size FROM answer_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, size = row
+            if expires_at > now:
+                self._conn.execute("UPDATE answer_cache SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                with self._lock:
+                    self._remember(key, value, expires_at)
+                    self._stats["disk_hits"] += 1
+                return value
+            self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            self._disk_bytes -= size
+            with self._lock:
+                self._stats["expired"] += 1
+            return None
+
+    def _record_miss(self) -> None:
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，依次查内存和磁盘，未命中返回 None（磁盘部分在当前线程中执行）"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._conn is not None:
+            value = self._get_disk(key, now)
+        if value is None:
+            self._record_miss()
+        return value
+
+    async def get_async(self, key: str) -> Optional[str]:
+        """与 get 相同，内存未命中时在线程池中读取磁盘缓存"""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._conn is not None:
+            value = await asyncio.to_thread(self._get_disk, key, now)
+        if value is None:
+            self._record_miss()
+        return value
+
+    def _set_memory(self, key: str, value: str, ttl: Optional[float]) -> Tuple[float, float]:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._stats["sets"] += 1
+        return now, expires_at
+
+    def _set_disk(self, key: str, value: str, expires_at: float, now: float) -> None:
+        """写入磁盘缓存（阻塞），超过字节上限时淘汰"""
+        with self._disk_lock:
+            if self._conn is None:
+                return
+            size = len(value.encode("utf-8"))
+            old = self._conn.execute("SELECT size FROM answer_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now),
+            )
+            self._disk_bytes += size - (old[0] if old is not None else 0)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk(now)
+            self._conn.commit()
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """写入缓存（磁盘部分在当前线程中执行）"""
+        now, expires_at = self._set_memory(key, value, ttl)
+        if self._conn is not None:
+            self._set_disk(key, value, expires_at, now)
+
+    async def set_async(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """与 set 相同，磁盘部分在线程池中执行"""
+        now, expires_at = self._set_memory(key, value, ttl)
+        if self._conn is not None:
+            await asyncio.to_thread(self._set_disk, key, value, expires_at, now)
+
+    def _evict_disk(self, now: float) -> None:
+        """删除过期条目，仍超过字节上限时按最近访问时间分批淘汰"""
+        self._conn.execute("DELETE FROM answer_cache WHERE expires_at <= ?", (now,))
+        total = self._disk_total()
+        evicted = 0
+        while total > self.disk_max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM answer_cache ORDER BY last_access ASC LIMIT ?", (self.EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.disk_max_bytes:
+                    break
+                self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        self._disk_bytes = total
+        with self._lock:
+            self._stats["disk_evictions"] += evicted
+
+    def record_bypass(self) -> None:
+        """记录一次跳过缓存的请求"""
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self) -> None:
+        """清空两级缓存"""
+        with self._disk_lock:
+            with self._lock:
+                self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM answer_cache")
+                self._conn.commit()
+                self._disk_bytes = 0
+
+    def close(self) -> None:
+        with self._disk_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self, include_disk: bool = True) -> Dict[str, Any]:
+        """缓存统计信息，include_disk 为 False 时不查询磁盘缓存的条目数和大小"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        if include_disk:
+            with self._disk_lock:
+                if self._conn is not None:
+                    count, total = self._conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answer_cache"
+                    ).fetchone()
+                    stats["disk_entries"] = count
+                    stats["disk_bytes"] = total
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """获取全局答案缓存（按配置懒加载）"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            ttl=settings.ANSWER_CACHE_TTL,
+            memory_size=settings.ANSWER_CACHE_MEMORY_SIZE,
+            disk_path=settings.ANSWER_CACHE_DISK_PATH or None,
+            disk_max_bytes=settings.ANSWER_CACHE_DISK_MAX_BYTES,
+        )
+        app_logger.info(f"答案缓存已启用 [磁盘: {settings.ANSWER_CACHE_DISK_PATH or '无'}]")
+    return _answer_cache
@@ -0,0 +1,137 @@
+"""
+客户端断开处理
+
+查询请求的客户端断开后，按 settings.CLIENT_DISCONNECT_POLICY 处理仍在执行的agent调用：
+- cancel：取消调用（连同进行中的模型请求和MCP工具调用），不保存答案
+- finish：让调用在后台执行完，答案照常写入缓存和会话
+
+并统计断开次数、取消的调用以及据此节省的agent时间（按已完成调用的平均耗时估算）。
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.core.logging import app_logger
+
+POLICY_CANCEL = "cancel"
+POLICY_FINISH = "finish"
+
+
+class ClientDisconnectedError(Exception):
+    """客户端在查询完成前断开连接"""
+
+
+class DisconnectStats:
+    """客户端断开统计
+
+    Args:
+        smoothing: 调用耗时滑动平均的平滑系数
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.avg_duration: Optional[float] = None
+        self.completed = 0
+        self.disconnects = 0
+        self.cancelled = 0
+        self.finished_in_background = 0
+        self.cancelled_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def record_completed(self, duration: float) -> None:
+        self.completed += 1
+        if self.avg_duration is None:
+            self.avg_duration = duration
+        else:
+            self.avg_duration += self.smoothing * (duration - self.avg_duration)
+
+    def record_cancelled(self, elapsed: float) -> None:
+        self.disconnects += 1
+        self.cancelled += 1
+        self.cancelled_seconds += elapsed
+        if self.avg_duration is not None:
+            self.saved_seconds += max(0.0, self.avg_duration - elapsed)
+
+    def record_detached(self) -> None:
+        self.disconnects += 1
+        self.finished_in_background += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "policy": settings.CLIENT_DISCONNECT_POLICY,
+            "disconnects": self.disconnects,
+            "cancelled": self.cancelled,
+            "finished_in_background": self.finished_in_background,
+            "cancelled_seconds": round(self.cancelled_seconds, 3),
+            "saved_seconds": round(self.saved_seconds, 3),
+            "avg_duration": round(self.avg_duration, 3) if self.avg_duration is not None else None,
+        }
+
+
+_stats = DisconnectStats()
+# 断开后仍在后台执行的调用，保留引用避免任务被回收
+_detached: Set[asyncio.Task] = set()
+
+
+def get_disconnect_stats() -> Dict[str, Any]:
+    """获取客户端断开统计"""
+    stats = _stats.snapshot()
+    stats["running_in_background"] = len(_detached)
+    return stats
+
+
+def _record_task_duration(task: asyncio.Task, started_at: float) -> None:
+    if not task.cancelled() and task.exception() is None:
+        _stats.record_completed(time.monotonic() - started_at)
+
+
+def track(task: asyncio.Task, started_at: Optional[float] = None) -> asyncio.Task:
+    """记录任务正常完成时的耗时，用于估算取消节省的时间"""
+    started_at = time.monotonic() if started_at is None else started_at
+    task.add_done_callback(lambda t: _record_task_duration(t, started_at))
+    return task
+
+
+def abandon(task: asyncio.Task, started_at: float, policy: Optional[str] = None) -> None:
+    """客户端已断开，按策略取消任务或让其在后台执行完"""
+    if task.done():
+        return
+    policy = policy or settings.CLIENT_DISCONNECT_POLICY
+    elapsed = time.monotonic() - started_at
+    if policy == POLICY_FINISH:
+        _stats.record_detached()
+        _detached.add(task)
+        task.add_done_callback(_detached.discard)
+        app_logger.info(f"客户端已断开，查询在后台继续执行 (已执行 {elapsed:.1f}s)")
+    else:
+        _stats.record_cancelled(elapsed)
+        task.cancel()
+        app_logger.info(f"客户端已断开，已取消查询 (已执行 {elapsed:.1f}s)")
+
+
+async def run_until_disconnected(
+    coro: Awaitable[Any],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: Optional[float] = None,
+    policy: Optional[str] = None,
+) -> Any:
+    """执行 coro 并定期检查客户端是否断开
+
+    断开时按策略取消或在后台执行完 coro，并抛出 ClientDisconnectedError。
+    """
+    poll_interval = settings.CLIENT_DISCONNECT_POLL_INTERVAL if poll_interval is None else poll_interval
+    started_at = time.monotonic()
+    task = track(asyncio.ensure_future(coro), started_at)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                abandon(task, started_at, policy)
+                raise ClientDisconnectedError("客户端已断开连接")
+    except asyncio.CancelledError:
+        # 请求处理本身被取消（如服务器关闭），不保留后台任务
+        task.cancel()
+        raise
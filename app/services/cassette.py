@@ -0,0 +1,319 @@
+"""
+agent调用的录制和回放
+
+settings.CASSETTE_MODE 为 record 时，每次agent调用中的模型请求/响应（含流式片段的到达时间）和MCP工具调用
+连同各自的耗时写入 CASSETTE_DIR 下的录像文件（JSON Lines，每行一次agent调用）；
+为 replay 时，agent调用直接由录像提供：按录制时的时间线（乘以 CASSETTE_TIME_SCALE）等待并产出流式片段，
+不启动agent池，也不访问模型提供商和MCP服务器。准入控制、相同查询合并、缓存、数据库和答案提取照常执行，
+可以用真实的流量形态测量这些环节的开销。
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from openai.types import CompletionUsage
+
+from app.core.config import settings
+from app.core.logging import app_logger
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+MISS_ERROR = "error"
+MISS_CYCLE = "cycle"
+
+
+class CassetteMissError(Exception):
+    """回放时录像中没有对应的agent调用"""
+
+
+def _jsonable(value: Any) -> Any:
+    """把模型和工具的请求/响应转换为可以写入JSON的结构"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class _LLMCall:
+    """录制中的一次模型调用"""
+
+    def __init__(self, recording: "Recording", arguments: Dict[str, Any], sink: Optional[Callable[[str], None]]):
+        self._recording = recording
+        self._arguments = arguments
+        self._sink = sink
+        self._started = time.monotonic()
+        self._deltas: List[List[Any]] = []
+        self.sink = self._record_delta if sink is not None else None
+
+    def _record_delta(self, text: str) -> None:
+        self._deltas.append([round(time.monotonic() - self._started, 4), text])
+        self._sink(text)
+
+    def finish(self, completion: Any) -> None:
+        request = {k: v for k, v in self._arguments.items() if k not in ("timeout", "extra_headers")}
+        self._recording.add({
+            "type": "llm",
+            "start": round(self._started - self._recording.started, 4),
+            "duration": round(time.monotonic() - self._started, 4),
+            "request": _jsonable(request),
+            "response": _jsonable(completion),
+            "deltas": self._deltas,
+        })
+
+
+class Recording:
+    """一次agent调用的录制内容
+
+    Args:
+        key: 调用的缓存键（查询、模型和系统提示词版本），回放时按它查找
+        query: 发送给agent的查询（含会话上下文）
+        route: 路由名
+        model: 路由使用的模型
+    """
+
+    def __init__(self, key: str, query: str, route: str, model: str):
+        self.key = key
+        self.query = query
+        self.route = route
+        self.model = model
+        self.started = time.monotonic()
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def start_llm(self, arguments: Dict[str, Any], sink: Optional[Callable[[str], None]]) -> _LLMCall:
+        """开始录制一次模型调用，流式调用时通过返回对象的 sink 转发增量文本"""
+        return _LLMCall(self, arguments, sink)
+
+    def add_tool(self, name: str, arguments: Optional[dict], result: Any, started: float) -> None:
+        self.add({
+            "type": "tool",
+            "start": round(started - self.started, 4),
+            "duration": round(time.monotonic() - started, 4),
+            "name": name,
+            "arguments": _jsonable(arguments),
+            "result": _jsonable(result),
+            "is_error": bool(getattr(result, "isError", False)),
+        })
+
+    def to_dict(self, response: str) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "query": self.query,
+            "route": self.route,
+            "model": self.model,
+            "recorded_at": datetime.now().isoformat(),
+            "duration": round(time.monotonic() - self.started, 4),
+            "response": response,
+            "events": sorted(self.events, key=lambda event: event["start"]),
+        }
+
+
+# 当前agent调用的录制内容，为 None 时不录制
+current_recording: contextvars.ContextVar[Optional[Recording]] = contextvars.ContextVar(
+    "current_recording", default=None
+)
+
+
+def _cassette_path(name: Optional[str] = None) -> str:
+    return os.path.join(settings.CASSETTE_DIR, f"{name or settings.CASSETTE_NAME}.jsonl")
+
+
+class CassetteRecorder:
+    """把录制的agent调用追加写入录像文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def save(self, recording: Recording, response: str) -> None:
+        line = json.dumps(recording.to_dict(response), ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": MODE_RECORD, "path": self.path, "recorded": self.recorded}
+
+
+class CassettePlayer:
+    """按录制时的时间线回放agent调用
+
+    Args:
+        recordings: 录制的agent调用
+        time_scale: 时间缩放系数，1为原速，0为不等待
+        on_miss: 找不到对应调用时的处理：error 抛出 CassetteMissError，cycle 依次使用录像中的调用
+        sleep: 等待函数（测试时替换）
+    """
+
+    def __init__(
+        self,
+        recordings: List[Dict[str, Any]],
+        time_scale: float = 1.0,
+        on_miss: str = MISS_CYCLE,
+        sleep: Callable[[float], Any] = asyncio.sleep,
+    ):
+        self.recordings = recordings
+        self.time_scale = max(0.0, time_scale)
+        self.on_miss = on_miss
+        self._sleep = sleep
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_query: Dict[str, List[Dict[str, Any]]] = {}
+        for recording in recordings:
+            self._by_key.setdefault(recording["key"], []).append(recording)
+            self._by_query.setdefault(recording["query"].strip(), []).append(recording)
+        # 同一个查询录制了多次时轮流使用
+        self._turns: Dict[str, int] = {}
+        self._cycle = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "CassettePlayer":
+        recordings = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                recordings = [json.loads(line) for line in f if line.strip()]
+        app_logger.info(f"加载录像 {path}: {len(recordings)} 次agent调用")
+        return cls(recordings, **kwargs)
+
+    def _take(self, bucket: str, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        turn = self._turns.get(bucket, 0)
+        self._turns[bucket] = turn + 1
+        return candidates[turn % len(candidates)]
+
+    def find(self, key: str, query: str) -> Dict[str, Any]:
+        """按缓存键查找录制的调用，其次按查询文本，都找不到时按 on_miss 处理"""
+        if key in self._by_key:
+            self.hits += 1
+            return self._take(key, self._by_key[key])
+        if query.strip() in self._by_query:
+            self.hits += 1
+            return self._take(query.strip(), self._by_query[query.strip()])
+        self.misses += 1
+        if self.on_miss != MISS_CYCLE or not self.recordings:
+            raise CassetteMissError(f"录像中没有该查询的agent调用: {query[:50]}")
+        recording = self.recordings[self._cycle % len(self.recordings)]
+        self._cycle += 1
+        return recording
+
+    async def _wait_until(self, base: float, offset: float) -> None:
+        delay = base + offset * self.time_scale - time.monotonic()
+        if delay > 0:
+            await self._sleep(delay)
+
+    async def play(
+        self,
+        key: str,
+        query: str,
+        sink: Optional[Callable[[str], None]] = None,
+        on_usage: Optional[Callable[[Any], None]] = None,
+    ) -> str:
+        """回放一次agent调用，返回录制的响应
+
+        Args:
+            key: 调用的缓存键
+            query: 发送给agent的查询
+            sink: 流式接收器，按录制时的到达时间转发模型输出的增量文本
+            on_usage: 每次模型调用结束时以录制的 usage 调用
+        """
+        recording = self.find(key, query)
+        base = time.monotonic()
+        for event in recording["events"]:
+            await self._wait_until(base, event["start"])
+            if event["type"] == "llm":
+                for offset, text in event.get("deltas") or []:
+                    await self._wait_until(base, event["start"] + offset)
+                    if sink is not None:
+                        sink(text)
+            await self._wait_until(base, event["start"] + event["duration"])
+            if event["type"] == "llm" and on_usage is not None:
+                usage = (event.get("response") or {}).get("usage")
+                on_usage(CompletionUsage.model_validate(usage) if usage else None)
+        await self._wait_until(base, recording["duration"])
+        return recording["response"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": MODE_REPLAY,
+            "recordings": len(self.recordings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "time_scale": self.time_scale,
+        }
+
+
+_recorder: Optional[CassetteRecorder] = None
+_player: Optional[CassettePlayer] = None
+
+
+def is_recording() -> bool:
+    return settings.CASSETTE_MODE == MODE_RECORD
+
+
+def is_replaying() -> bool:
+    return settings.CASSETTE_MODE == MODE_REPLAY
+
+
+def get_recorder() -> CassetteRecorder:
+    """获取录像写入器（首次使用时创建）"""
+    global _recorder
+    if _recorder is None:
+        _recorder = CassetteRecorder(_cassette_path())
+    return _recorder
+
+
+def get_player() -> CassettePlayer:
+    """获取回放器（首次使用时加载录像）"""
+    global _player
+    if _player is None:
+        _player = CassettePlayer.load(
+            _cassette_path(),
+            time_scale=settings.CASSETTE_TIME_SCALE,
+            on_miss=settings.CASSETTE_REPLAY_MISS,
+        )
+    return _player
+
+
+def get_cassette_stats() -> Optional[Dict[str, Any]]:
+    """获取录制/回放统计，未启用时返回 None"""
+    if is_recording():
+        return get_recorder().stats()
+    if is_replaying():
+        return get_player().stats()
+    return None
+
+
+def install_tool_recorder(agent: Any) -> None:
+    """录制agent的MCP工具调用（只在录制中的agent调用内生效）"""
+    call_tool = agent.call_tool
+
+    async def call_tool_with_recording(name: str, arguments: Optional[dict] = None):
+        recording = current_recording.get()
+        if recording is None:
+            return await call_tool(name, arguments)
+        started = time.monotonic()
+        result = await call_tool(name, arguments)
+        recording.add_tool(name, arguments, result, started)
+        return result
+
+    # 与 install_tool_timeout 相同，替换 aggregator（即agent本身）的 call_tool
+    agent.call_tool = call_tool_with_recording
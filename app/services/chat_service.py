@@ -6,6 +6,7 @@ from datetime import datetime
 from app.models.chat import ChatSession, ChatMessage
 from app.api.schemas import ChatSessionCreate, ChatSessionUpdate, MessageCreate
 from app.core.logging import app_logger
+from app.services import tool_results, usage_service
 
 def create_session(db: Session, user_id: int, session_data: ChatSessionCreate) -> ChatSession:
     """创建新的聊天会话"""
@@ -92,8 +93,16 @@ def delete_session(db: Session, session_id: int, user_id: int) -> bool:
     app_logger.info(f"用户 {user_id} 删除了会话 {session_id}")
     return True
 
-def add_message(db: Session, session_id: int, user_id: int, message_data: MessageCreate) -> Optional[ChatMessage]:
-    """添加聊天消息"""
+def add_message(
+    db: Session, session_id: int, user_id: int, message_data: MessageCreate,
+    tool_calls: Optional[List[Dict[str, Any]]] = None,
+    usage: Optional[usage_service.QueryUsage] = None
+) -> Optional[ChatMessage]:
+    """添加聊天消息
+
+    tool_calls 为生成该消息时记录的工具调用（见 app.services.tool_results），
+    usage 为生成该消息的模型用量（见 app.services.usage_service），同时累加到用户当天的用量汇总。
+    """
     # 验证会话存在且属于该用户
     db_session = get_session(db, session_id, user_id)
     if not db_session:
@@ -104,7 +113,9 @@ def add_message(db: Session, session_id: int, user_id: int, message_data: Messag
         session_id=session_id,
         role=message_data.role,
         content=message_data.content,
-        created_at=datetime.now()
+        created_at=datetime.now(),
+        tool_results=tool_results.to_records(tool_calls),
+        usage=usage_service.to_record(db, user_id, usage)
     )
     
     # 更新会话的更新时间
@@ -142,6 +153,33 @@ def get_message(db: Session, message_id: int, session_id: int, user_id: int) ->
         ChatMessage.session_id == session_id
     ).first()
 
+def get_question(db: Session, message: ChatMessage) -> Optional[ChatMessage]:
+    """获取助手消息所回答的问题（之前最近的一条用户消息）"""
+    return db.query(ChatMessage).filter(
+        ChatMessage.session_id == message.session_id,
+        ChatMessage.id < message.id,
+        ChatMessage.role == "user"
+    ).order_by(desc(ChatMessage.id)).first()
+
+def replace_answer(
+    db: Session, message_id: int, session_id: int, user_id: int, content: str,
+    tool_calls: Optional[List[Dict[str, Any]]] = None,
+    usage: Optional[usage_service.QueryUsage] = None
+) -> Optional[ChatMessage]:
+    """用重新生成的答案替换助手消息的内容、工具结果和用量（重新生成的用量另外累加到当天的汇总）"""
+    db_message = get_message(db, message_id, session_id, user_id)
+    if not db_message:
+        return None
+    
+    db_message.content = content
+    db_message.tool_results = tool_results.to_records(tool_calls)
+    db_message.usage = usage_service.to_record(db, user_id, usage, db_message.usage)
+    db_message.session.updated_at = datetime.now()
+    
+    db.commit()
+    db.refresh(db_message)
+    return db_message
+
 def delete_message(db: Session, message_id: int, session_id: int, user_id: int) -> bool:
     """删除特定消息，并验证消息所属的会话是否属于当前用户"""
     # 获取消息，并验证权限
@@ -216,10 +254,33 @@ def clear_session_messages(db: Session, session_id: int, user_id: int) -> int:
         db.delete(message)
         delete_count += 1
     
+    # 摘要由已删除的消息生成，一并删除
+    if db_session.summary is not None:
+        db.delete(db_session.summary)
+    
     # 更新会话的更新时间
     db_session.updated_at = datetime.now()
     
     # 提交更改
     db.commit()
     app_logger.info(f"用户 {user_id} 清空了会话 {session_id} 中的所有消息，共 {delete_count} 条")
-    return delete_count 
\ No newline at end of file
+    return delete_count 
+
+def prepare_query_session(db: Session, user_id: int, query: str, session_id: Optional[int] = None) -> Optional[int]:
+    """校验或创建查询关联的会话，并保存用户消息
+    
+    返回：会话ID；指定的会话不存在或不属于该用户时返回None
+    """
+    if session_id:
+        if not get_session(db, session_id, user_id):
+            return None
+        app_logger.info(f"使用现有会话: {session_id}")
+    else:
+        # 创建新会话
+        session_data = ChatSessionCreate(title=f"查询: {query[:30]}...")
+        session_id = create_session(db, user_id, session_data).id
+        app_logger.info(f"创建新会话: {session_id}")
+    
+    # 添加用户消息
+    add_message(db, session_id, user_id, MessageCreate(role="user", content=query))
+    return session_id
@@ -0,0 +1,321 @@
+"""
+HTTP响应压缩
+
+按请求的 Accept-Encoding 协商压缩算法（gzip，安装了 brotli / zstandard 包时还支持 br / zstd），
+压缩JSON、Markdown等文本响应：
+- 普通响应小于 COMPRESSION_MIN_SIZE 时不压缩，否则整体压缩并设置 Content-Length
+- 流式响应（SSE、NDJSON）每个片段压缩后立即flush发出，不在服务端积攒，客户端按原节奏收到事件
+- 会话详情、历史消息等以带宽为主的路由使用 COMPRESSION_BANDWIDTH_LEVELS 中更高的压缩级别
+
+按路由统计压缩前后的字节数和压缩消耗的CPU时间，见健康检查的 compression 项。
+"""
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipEncoder:
+    """gzip压缩"""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    """brotli压缩（需要安装 brotli 包）"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.process(data)
+        return output + self._compressor.flush() if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    """zstd压缩（需要安装 zstandard 包）"""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else output
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+
+
+def available_encodings() -> List[str]:
+    """按 COMPRESSION_ENCODINGS 的优先顺序返回当前环境支持的压缩算法"""
+    return [name for name in settings.COMPRESSION_ENCODINGS if name in ENCODERS]
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩算法，q值相同时按服务端的优先顺序，不压缩时返回 None"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+    candidates = []
+    for index, name in enumerate(available_encodings()):
+        quality = weights.get(name, weights.get("*", 0.0))
+        if quality > 0:
+            candidates.append((-quality, index, name))
+    return min(candidates)[2] if candidates else None
+
+
+def compression_level(encoding: str, route: str) -> int:
+    """路由使用的压缩级别：以带宽为主的路由使用更高的级别"""
+    if route in settings.COMPRESSION_BANDWIDTH_ROUTES:
+        return settings.COMPRESSION_BANDWIDTH_LEVELS[encoding]
+    return settings.COMPRESSION_LEVELS[encoding]
+
+
+def create_encoder(encoding: str, level: int) -> Any:
+    return ENCODERS[encoding](level)
+
+
+# 逐个事件发出的流式内容类型，收到响应头时就开始压缩，每个片段都flush
+STREAM_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson")
+# 其他响应最多收集的字节数，超过后边收边压缩
+_BUFFER_LIMIT = 1024 * 1024
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return any(media_type.startswith(prefix) for prefix in settings.COMPRESSION_MEDIA_TYPES)
+
+
+class EndpointCompressionStats:
+    """单个路由的压缩统计"""
+
+    def __init__(self):
+        self.responses = 0
+        self.compressed = 0
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "compressed": self.compressed,
+            "streamed": self.streamed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "saved_bytes": self.bytes_in - self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            "cpu_ms": round(self.cpu_seconds * 1000, 3),
+            "cpu_us_per_kb": round(self.cpu_seconds * 1e6 / (self.bytes_in / 1024), 2) if self.bytes_in else None,
+        }
+
+
+class CompressionStats:
+    """按路由汇总的压缩统计，只统计可压缩类型的响应"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointCompressionStats] = {}
+        self.encodings: Dict[str, int] = {}
+
+    def endpoint(self, key: str) -> EndpointCompressionStats:
+        if key not in self.endpoints:
+            self.endpoints[key] = EndpointCompressionStats()
+        return self.endpoints[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "available": available_encodings(),
+            "encodings": dict(self.encodings),
+            "endpoints": {key: stats.snapshot() for key, stats in sorted(self.endpoints.items())},
+        }
+
+
+_stats = CompressionStats()
+
+
+def get_compression_stats() -> Dict[str, Any]:
+    """获取响应压缩统计"""
+    return _stats.snapshot()
+
+
+def _route_path(scope: Dict[str, Any]) -> str:
+    """响应对应的路由模板（如 /api/sessions/history/{session_id}），未匹配到路由时为请求路径"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "")
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 压缩响应的ASGI中间件，流式响应逐个片段压缩并flush"""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not settings.COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        request_headers = dict(scope.get("headers") or [])
+        encoding = negotiate(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        responder = _CompressionResponder(scope, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """处理一次响应的压缩
+
+    SSE、NDJSON响应在收到响应头时就开始压缩，每个片段压缩后立即flush发出；
+    其他响应（经过 BaseHTTPMiddleware 时一次性响应也会分成多个片段）先收集响应体，
+    结束时按大小决定是否整体压缩，超过 _BUFFER_LIMIT 仍未结束时改为边收边压缩。
+    """
+
+    def __init__(self, scope: Dict[str, Any], send: Any, encoding: Optional[str]):
+        self.scope = scope
+        self._send = send
+        self.encoding = encoding
+        self.start: Optional[Dict[str, Any]] = None
+        self.encoder: Any = None
+        self.flush = False
+        self.stats: Optional[EndpointCompressionStats] = None
+        self.passthrough = False
+        self.buffer: List[bytes] = []
+        self.buffered = 0
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            await self._on_start(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough or self.start is None:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            self.buffer.append(body)
+            self.buffered += len(body)
+            if more_body and self.buffered < _BUFFER_LIMIT:
+                return
+            body = b"".join(self.buffer)
+            self.buffer = []
+            if not more_body:
+                if len(body) < settings.COMPRESSION_MIN_SIZE:
+                    self.passthrough = True
+                    await self._send(self.start)
+                    await self._send({"type": "http.response.body", "body": body, "more_body": False})
+                else:
+                    await self._start_encoding(body=body)
+                return
+            await self._start_encoding()
+
+        started = time.thread_time()
+        output = self.encoder.compress(body, flush=self.flush) if body else b""
+        if not more_body:
+            output += self.encoder.finish()
+        self._record(len(body), len(output), time.thread_time() - started)
+        if output or not more_body:
+            await self._send({"type": "http.response.body", "body": output, "more_body": more_body})
+
+    async def _on_start(self, message: Dict[str, Any]) -> None:
+        headers = list(message.get("headers") or [])
+        status = message["status"]
+        content_type = _header(headers, b"content-type") or ""
+        if (
+            status < 200 or status in (204, 304) or not is_compressible(content_type)
+            or _header(headers, b"content-encoding") is not None
+            or _header(headers, b"content-range") is not None
+            or self.scope.get("method") == "HEAD"
+        ):
+            self.passthrough = True
+            await self._send(message)
+            return
+        vary = _header(headers, b"vary")
+        if vary is None:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif "accept-encoding" not in vary.lower():
+            headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+            headers.append((b"vary", f"{vary}, Accept-Encoding".encode("latin-1")))
+        self.start = {**message, "headers": headers}
+        self.stats = _stats.endpoint(f"{self.scope.get('method', '')} {_route_path(self.scope)}")
+        self.stats.responses += 1
+        if self.encoding is None:
+            self.passthrough = True
+            await self._send(self.start)
+        elif content_type.split(";")[0].strip().lower() in STREAM_MEDIA_TYPES:
+            # 事件流的响应头立即发出，之后每个片段压缩后flush，客户端不必等待后续事件
+            self.flush = True
+            await self._start_encoding()
+
+    async def _start_encoding(self, body: Optional[bytes] = None) -> None:
+        """发出带 Content-Encoding 的响应头；body 不为 None 时为完整的响应体，整体压缩后一起发出"""
+        started = time.thread_time()
+        self.encoder = create_encoder(self.encoding, compression_level(self.encoding, _route_path(self.scope)))
+        output = None if body is None else self.encoder.compress(body) + self.encoder.finish()
+        self.stats.compressed += 1
+        if body is None:
+            self.stats.streamed += 1
+        _stats.encodings[self.encoding] = _stats.encodings.get(self.encoding, 0) + 1
+
+        headers = [(k, v) for k, v in self.start["headers"] if k.lower() != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        if output is not None:
+            self._record(len(body), len(output), time.thread_time() - started)
+            headers.append((b"content-length", str(len(output)).encode("latin-1")))
+        await self._send({**self.start, "headers": headers})
+        if output is not None:
+            await self._send({"type": "http.response.body", "body": output, "more_body": False})
+
+    def _record(self, bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+        self.stats.bytes_in += bytes_in
+        self.stats.bytes_out += bytes_out
+        self.stats.cpu_seconds += cpu_seconds
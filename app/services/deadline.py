@@ -0,0 +1,105 @@
+"""
+请求截止时间
+
+每个请求有一个截止时间（客户端通过 settings.REQUEST_DEADLINE_HEADER 请求头指定，
+否则使用路由的默认值），保存在上下文变量中，随调用链传到各个阶段：
+- 准入控制和agent池：最多等待剩余时间的 DEADLINE_QUEUE_SHARE
+- agent调用：剩余时间扣除 DEADLINE_SAVE_RESERVE（留给保存答案）
+- 模型请求：单次请求不超过剩余时间，预算用完后不再切换备用提供商
+- MCP工具调用：最多使用剩余时间的 DEADLINE_TOOL_SHARE，超时返回工具错误让模型直接作答
+- 数据库写入：等待数据库锁的时间不超过剩余时间
+
+没有截止时间的调用（如后台查询任务）由 tech_assistant_query 按自身的超时时间设置。
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from mcp.types import CallToolResult, TextContent
+
+from app.core.config import settings
+from app.core.logging import app_logger
+
+# 当前请求的截止时间（time.monotonic() 时钟），为 None 时没有截止时间
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """请求的截止时间已过"""
+
+
+def parse_timeout(value: Optional[str], default: float) -> float:
+    """解析客户端指定的超时时间（秒），无效时使用默认值，并限制在 REQUEST_DEADLINE_MAX 以内"""
+    try:
+        timeout = float(value) if value else default
+    except ValueError:
+        timeout = default
+    if timeout <= 0:
+        timeout = default
+    return min(timeout, settings.REQUEST_DEADLINE_MAX)
+
+
+def route_timeout(path: str) -> float:
+    """路由的默认超时时间（秒）"""
+    return settings.REQUEST_DEADLINE_ROUTES.get(path, settings.REQUEST_DEADLINE_DEFAULT)
+
+
+@contextmanager
+def deadline_scope(timeout: float) -> Iterator[float]:
+    """在 timeout 秒后截止，已有更早的截止时间时保持不变"""
+    deadline = time.monotonic() + timeout
+    current = _deadline.get()
+    if current is not None and current <= deadline:
+        yield current
+        return
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """距离截止时间的秒数（可能为负），没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def budget(share: float = 1.0, default: Optional[float] = None, reserve: float = 0.0) -> Optional[float]:
+    """当前阶段可以使用的时间（秒）
+
+    取剩余时间扣除 reserve 后的 share 部分，不超过 default；没有截止时间时返回 default。
+    截止时间已过时抛出 DeadlineExceededError。
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceededError("请求已超过截止时间")
+    # 剩余时间不足 reserve 时不再预留，全部用于当前阶段
+    usable = left - reserve if left > reserve else left
+    allowed = usable * share
+    return allowed if default is None else min(default, allowed)
+
+
+def install_tool_timeout(agent: Any) -> None:
+    """按剩余时间限制agent的MCP工具调用，超时返回工具错误而不是中断整个查询"""
+    call_tool = agent.call_tool
+
+    async def call_tool_with_deadline(name: str, arguments: Optional[dict] = None) -> CallToolResult:
+        timeout = budget(settings.DEADLINE_TOOL_SHARE)
+        if timeout is None:
+            return await call_tool(name, arguments)
+        try:
+            return await asyncio.wait_for(call_tool(name, arguments), timeout=timeout)
+        except asyncio.TimeoutError:
+            app_logger.warning(f"工具 {name} 调用超过剩余时间预算 ({timeout:.1f}s)，已放弃")
+            return CallToolResult(
+                isError=True,
+                content=[TextContent(type="text", text=f"工具 {name} 调用超时，请不使用该工具直接作答")],
+            )
+
+    # fast-agent 的LLM通过 aggregator.call_tool 调用工具，aggregator 即agent本身
+    agent.call_tool = call_tool_with_deadline
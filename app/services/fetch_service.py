@@ -0,0 +1,534 @@
+"""
+网页抓取服务
+
+供本地 fetch MCP 服务器（app.mcp_servers.fetch_server）使用：
+- 复用一个保持长连接的 httpx 客户端
+- 按内容寻址的磁盘缓存：转换后的文本按 sha256 存成文件，SQLite 记录 URL 到内容的映射、
+  ETag/Last-Modified 和访问时间；过期后用条件请求校验，超过大小上限时按最近访问时间淘汰
+- HTML 只在写入缓存时转换一次为 Markdown
+- 对持续失败的 URL 做负缓存，按失败次数指数退避
+- URL来自用户输入，只允许 http/https，请求前（包括每次重定向）解析主机名，拒绝非公网地址
+"""
+import asyncio
+import hashlib
+import ipaddress
+import os
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils.singleflight import SingleFlight
+
+
+class FetchError(Exception):
+    """抓取失败"""
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_public_url(url: str) -> None:
+    """只允许抓取公网的 http/https 地址，主机名解析到回环、内网、链路本地等地址时抛出 FetchError
+
+    解析结果中有任何一个非公网地址都会拒绝，避免通过多条DNS记录绕过检查。
+    """
+    try:
+        parsed = httpx.URL(url)
+    except Exception:
+        raise FetchError(f"无效的URL: {url}")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise FetchError(f"只支持抓取 http/https 地址: {url}")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        addresses = [ipaddress.ip_address(parsed.host).compressed]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(parsed.host, port)
+        except OSError as e:
+            raise FetchError(f"无法解析主机 {parsed.host}: {e}")
+        addresses = [info[4][0] for info in infos]
+    if not addresses or not all(_is_public_address(address) for address in addresses):
+        raise FetchError(f"不允许抓取非公网地址: {parsed.host}")
+
+
+class FetchResult(NamedTuple):
+    url: str
+    content: str
+    content_type: str
+    from_cache: bool
+
+
+class _MarkdownConverter(HTMLParser):
+    """把HTML转换为简单的Markdown，只保留正文结构（标题、段落、列表、链接、代码）"""
+
+    _SKIP = {"script", "style", "noscript", "svg", "nav", "footer", "header", "form", "iframe", "head"}
+    _BLOCK = {"p", "div", "section", "article", "main", "table", "tr", "blockquote", "dl", "dd", "dt", "br", "hr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+        self._pre_depth = 0
+        self._list_stack: List[str] = []
+        self._href: Optional[str] = None
+        self._title = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag == "title":
+            self._in_title = True
+        if self._skip_depth or tag in self._SKIP:
+            if tag in self._SKIP:
+                self._skip_depth += 1
+            return
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._parts.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag == "pre":
+            self._pre_depth += 1
+            self._parts.append("\n\n```\n")
+        elif tag == "code" and not self._pre_depth:
+            self._parts.append("`")
+        elif tag in ("ul", "ol"):
+            self._list_stack.append(tag)
+        elif tag == "li":
+            indent = "  " * max(0, len(self._list_stack) - 1)
+            bullet = "1." if self._list_stack and self._list_stack[-1] == "ol" else "-"
+            self._parts.append(f"\n{indent}{bullet} ")
+        elif tag == "a":
+            self._href = dict(attrs).get("href")
+            self._parts.append("[")
+        elif tag in ("strong", "b"):
+            self._parts.append("**")
+        elif tag in ("td", "th"):
+            self._parts.append(" | ")
+        elif tag in self._BLOCK:
+            self._parts.append("\n\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title":
+            self._in_title = False
+        if tag in self._SKIP:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth:
+            return
+        if tag == "pre":
+            self._pre_depth = max(0, self._pre_depth - 1)
+            self._parts.append("\n```\n\n")
+        elif tag == "code" and not self._pre_depth:
+            self._parts.append("`")
+        elif tag in ("ul", "ol"):
+            if self._list_stack:
+                self._list_stack.pop()
+            self._parts.append("\n")
+        elif tag == "a":
+            href = self._href
+            self._href = None
+            self._parts.append(f"]({href})" if href and not href.startswith("#") else "]")
+        elif tag in ("strong", "b"):
+            self._parts.append("**")
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6") or tag in self._BLOCK:
+            self._parts.append("\n\n")
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self._title += data
+        if self._skip_depth:
+            return
+        if self._pre_depth:
+            self._parts.append(data)
+        else:
+            self._parts.append(re.sub(r"\s+", " ", data))
+
+    def markdown(self) -> str:
+        text = "".join(self._parts)
+        text = re.sub(r"\[\s*\]\([^)]*\)", "", text)
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        text = re.sub(r"\n{3,}", "\n\n", text).strip()
+        title = self._title.strip()
+        if title and not text.startswith("#"):
+            text = f"# {title}\n\n{text}"
+        return text
+
+
+def html_to_markdown(html: str) -> str:
+    """把HTML页面转换为Markdown正文"""
+    converter = _MarkdownConverter()
+    converter.feed(html)
+    converter.close()
+    return converter.markdown()
+
+
+def _max_age(headers: httpx.Headers) -> Optional[float]:
+    """从 Cache-Control/Expires 头中读取缓存有效期"""
+    cache_control = headers.get("cache-control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0.0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if match:
+        return float(match.group(1))
+    expires = headers.get("expires")
+    if expires:
+        try:
+            return max(0.0, parsedate_to_datetime(expires).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class PageCache:
+    """按内容寻址的磁盘页面缓存
+
+    Args:
+        directory: 缓存目录，内容文件保存在 blobs/ 下，索引保存在 index.db
+        max_bytes: 内容文件总大小上限，超出后按最近访问时间淘汰
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fresh_until REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS failures (
+                url TEXT PRIMARY KEY,
+                failures INTEGER NOT NULL,
+                last_error TEXT,
+                retry_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, "blobs", content_hash[:2], content_hash)
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """读取URL对应的缓存条目（包括已过期的，供条件请求使用）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, content_type, etag, last_modified, fresh_until FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            content_hash, content_type, etag, last_modified, fresh_until = row
+            try:
+                with open(self._blob_path(content_hash), "r", encoding="utf-8") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        return {
+            "content": content,
+            "content_type": content_type,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": fresh_until > time.time(),
+        }
+
+    def store(
+        self, url: str, content: str, content_type: str,
+        etag: Optional[str], last_modified: Optional[str], ttl: float,
+    ) -> None:
+        """保存页面内容，相同内容只保存一份"""
+        data = content.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(content_hash)
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (content_hash, size) VALUES (?, ?)", (content_hash, len(data))
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, content_hash, content_type, etag, last_modified, fresh_until, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, content_hash, content_type, etag, last_modified, now + ttl, now),
+            )
+            self._conn.execute("DELETE FROM failures WHERE url = ?", (url,))
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, url: str, ttl: float) -> None:
+        """条件请求返回304时延长缓存有效期"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fresh_until = ?, last_access = ? WHERE url = ?", (now + ttl, now, url)
+            )
+            self._conn.execute("DELETE FROM failures WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """删除没有URL引用的内容，并在超出大小上限时按最近访问时间淘汰页面"""
+        orphans = self._conn.execute(
+            "SELECT content_hash FROM blobs WHERE content_hash NOT IN (SELECT content_hash FROM pages)"
+        ).fetchall()
+        for (content_hash,) in orphans:
+            self._delete_blob(content_hash)
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT url, content_hash FROM pages ORDER BY last_access ASC").fetchall()
+        for url, content_hash in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            still_used = self._conn.execute(
+                "SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1", (content_hash,)
+            ).fetchone()
+            if still_used is None:
+                size = self._conn.execute(
+                    "SELECT size FROM blobs WHERE content_hash = ?", (content_hash,)
+                ).fetchone()
+                total -= size[0] if size else 0
+                self._delete_blob(content_hash)
+
+    def _delete_blob(self, content_hash: str) -> None:
+        self._conn.execute("DELETE FROM blobs WHERE content_hash = ?", (content_hash,))
+        try:
+            os.remove(self._blob_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def failure_retry_at(self, url: str) -> Optional[Tuple[float, str]]:
+        """URL处于负缓存中时返回 (可以重试的时间, 上次错误)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT retry_at, last_error FROM failures WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0], row[1]
+
+    def record_failure(self, url: str, error: str, base_delay: float, max_delay: float) -> float:
+        """记录一次失败，返回下次允许重试前的等待时间"""
+        with self._lock:
+            row = self._conn.execute("SELECT failures FROM failures WHERE url = ?", (url,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            delay = min(max_delay, base_delay * 2 ** (failures - 1))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO failures (url, failures, last_error, retry_at) VALUES (?, ?, ?, ?)",
+                (url, failures, error[:500], time.time() + delay),
+            )
+            self._conn.commit()
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pages = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            failures = self._conn.execute(
+                "SELECT COUNT(*) FROM failures WHERE retry_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {"pages": pages, "blobs": blobs, "bytes": size, "negative_entries": failures}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PageFetcher:
+    """带缓存的网页抓取器
+
+    Args:
+        cache: 页面缓存
+        timeout: 单次请求超时（秒）
+        max_response_bytes: 响应体大小上限，超出部分被截断
+        default_ttl: 响应未声明缓存有效期时使用的有效期（秒）
+        failure_base_delay: 负缓存的初始退避时间（秒）
+        failure_max_delay: 负缓存的最长退避时间（秒）
+        max_connections: 连接池大小
+        max_redirects: 最多跟随的重定向次数
+        url_guard: 每次请求前（包括每次重定向）检查URL的函数，不允许时抛出 FetchError；为 None 时不检查
+    """
+
+    def __init__(
+        self,
+        cache: PageCache,
+        timeout: float = 20.0,
+        max_response_bytes: int = 5 * 1024 * 1024,
+        default_ttl: float = 3600,
+        failure_base_delay: float = 30.0,
+        failure_max_delay: float = 3600.0,
+        max_connections: int = 20,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_redirects: int = 5,
+        url_guard: Optional[Callable[[str], Awaitable[None]]] = check_public_url,
+    ):
+        self.cache = cache
+        self.max_response_bytes = max_response_bytes
+        self.default_ttl = default_ttl
+        self.failure_base_delay = failure_base_delay
+        self.failure_max_delay = failure_max_delay
+        self.max_redirects = max_redirects
+        self.url_guard = url_guard
+        # 重定向由 _download 逐跳处理，以便检查每一跳的目标地址
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            follow_redirects=False,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"User-Agent": "FastDoc-AI/1.0 (+documentation fetcher)"},
+            transport=transport,
+        )
+        self._flights = SingleFlight()
+        self._stats = {"requests": 0, "cache_hits": 0, "revalidated": 0, "downloads": 0, "negative_hits": 0, "failures": 0}
+
+    async def fetch(self, url: str) -> FetchResult:
+        """抓取URL并返回Markdown（HTML）或原始文本，相同URL的并发抓取会合并"""
+        self._stats["requests"] += 1
+        return await self._flights.do(url, lambda: self._fetch(url))
+
+    async def _fetch(self, url: str) -> FetchResult:
+        if self.url_guard is not None:
+            await self.url_guard(url)
+        cached = await asyncio.to_thread(self.cache.lookup, url)
+        if cached is not None and cached["fresh"]:
+            self._stats["cache_hits"] += 1
+            return FetchResult(url, cached["content"], cached["content_type"], True)
+
+        blocked = await asyncio.to_thread(self.cache.failure_retry_at, url)
+        if blocked is not None:
+            self._stats["negative_hits"] += 1
+            if cached is not None:
+                # 源站暂时不可用时返回过期的缓存内容
+                return FetchResult(url, cached["content"], cached["content_type"], True)
+            retry_at, last_error = blocked
+            raise FetchError(f"{url} 最近多次抓取失败（{last_error}），请在 {retry_at - time.time():.0f} 秒后重试")
+
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            status_code, response_headers, body = await self._download(url, headers)
+        except (httpx.HTTPError, FetchError) as e:
+            return await self._handle_failure(url, f"{type(e).__name__}: {e}", cached)
+
+        ttl = _max_age(response_headers)
+        ttl = self.default_ttl if ttl is None else ttl
+        if status_code == 304 and cached is not None:
+            self._stats["revalidated"] += 1
+            await asyncio.to_thread(self.cache.touch, url, ttl)
+            return FetchResult(url, cached["content"], cached["content_type"], True)
+        if status_code >= 400:
+            return await self._handle_failure(url, f"HTTP {status_code}", cached)
+
+        self._stats["downloads"] += 1
+        content_type = response_headers.get("content-type", "").split(";")[0].strip() or "text/plain"
+        text = body.decode(self._charset(response_headers), errors="replace")
+        if "html" in content_type:
+            content = html_to_markdown(text)
+            content_type = "text/markdown"
+        else:
+            content = text
+        await asyncio.to_thread(
+            self.cache.store, url, content, content_type,
+            response_headers.get("etag"), response_headers.get("last-modified"), ttl,
+        )
+        return FetchResult(url, content, content_type, False)
+
+    async def _download(self, url: str, headers: Dict[str, str]) -> Tuple[int, httpx.Headers, bytes]:
+        for _ in range(self.max_redirects + 1):
+            async with self._client.stream("GET", url, headers=headers) as response:
+                if response.has_redirect_location:
+                    url = str(response.url.join(response.headers["location"]))
+                    if self.url_guard is not None:
+                        await self.url_guard(url)
+                    continue
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_response_bytes:
+                        app_logger.warning(f"响应超过 {self.max_response_bytes} 字节，已截断: {url}")
+                        break
+                return response.status_code, response.headers, b"".join(chunks)[: self.max_response_bytes]
+        raise FetchError(f"重定向超过 {self.max_redirects} 次")
+
+    @staticmethod
+    def _charset(headers: httpx.Headers) -> str:
+        match = re.search(r"charset=([\w-]+)", headers.get("content-type", ""))
+        return match.group(1) if match else "utf-8"
+
+    async def _handle_failure(self, url: str, error: str, cached: Optional[Dict[str, Any]]) -> FetchResult:
+        self._stats["failures"] += 1
+        delay = await asyncio.to_thread(
+            self.cache.record_failure, url, error, self.failure_base_delay, self.failure_max_delay
+        )
+        app_logger.warning(f"抓取失败: {url} ({error})，{delay:.0f} 秒内不再重试")
+        if cached is not None:
+            return FetchResult(url, cached["content"], cached["content_type"], True)
+        raise FetchError(f"抓取 {url} 失败: {error}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["cache"] = self.cache.stats()
+        return stats
+
+    async def close(self) -> None:
+        await self._client.aclose()
+        self.cache.close()
+
+
+_page_fetcher: Optional[PageFetcher] = None
+
+
+def get_page_fetcher() -> PageFetcher:
+    """获取当前进程的网页抓取器（按配置懒加载）"""
+    global _page_fetcher
+    if _page_fetcher is None:
+        _page_fetcher = PageFetcher(
+            PageCache(settings.FETCH_CACHE_DIR, max_bytes=settings.FETCH_CACHE_MAX_BYTES),
+            timeout=settings.FETCH_TIMEOUT,
+            max_response_bytes=settings.FETCH_MAX_RESPONSE_BYTES,
+            default_ttl=settings.FETCH_CACHE_TTL,
+            max_redirects=settings.FETCH_MAX_REDIRECTS,
+            url_guard=None if settings.FETCH_ALLOW_PRIVATE_HOSTS else check_public_url,
+        )
+    return _page_fetcher
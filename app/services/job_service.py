@@ -0,0 +1,292 @@
+"""
+异步查询任务服务
+
+提交查询后立即返回任务ID，由后台worker池调用agent处理。任务保存在 query_jobs 表中，
+进程重启后未完成的任务会重新排队。uvicorn 以多个worker运行时，每个任务由原子的状态更新
+认领，只会被一个进程执行；只有执行它的进程已退出或超过 QUERY_JOB_LEASE 仍未结束的任务才会被恢复。
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import psutil
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.logging import app_logger, log_error
+from app.models.job import QueryJob
+from app.api.schemas import MessageCreate
+from app.services import chat_service, memory_service, prefetch
+from app.services.agent_service import tech_assistant_query
+from app.services.admission import AdmissionRejectedError, LANE_BATCH
+from app.services.tool_results import capture_tool_calls
+from app.services.usage_service import capture_usage
+from app.utils.text_utils import extract_marked_content
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+def create_job(db: Session, user_id: int, session_id: int, query: str, use_cache: bool = True) -> QueryJob:
+    """创建查询任务"""
+    job = QueryJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        session_id=session_id,
+        query=query,
+        use_cache=use_cache,
+        status=JOB_QUEUED,
+        created_at=datetime.now()
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    app_logger.info(f"用户 {user_id} 提交了查询任务: {job.id}")
+    return job
+
+def get_job(db: Session, job_id: str, user_id: int) -> Optional[QueryJob]:
+    """获取指定用户的查询任务"""
+    return db.query(QueryJob).filter(
+        QueryJob.id == job_id,
+        QueryJob.user_id == user_id
+    ).first()
+
+def get_jobs(db: Session, user_id: int, skip: int = 0, limit: int = 50) -> List[QueryJob]:
+    """获取用户的查询任务，最新的在前"""
+    return db.query(QueryJob).filter(
+        QueryJob.user_id == user_id
+    ).order_by(
+        QueryJob.created_at.desc()
+    ).offset(skip).limit(limit).all()
+
+def cancel_job(db: Session, job_id: str, user_id: int) -> bool:
+    """取消排队中的任务，已开始执行的任务无法取消"""
+    updated = db.query(QueryJob).filter(
+        QueryJob.id == job_id,
+        QueryJob.user_id == user_id,
+        QueryJob.status == JOB_QUEUED
+    ).update({"status": JOB_CANCELLED, "finished_at": datetime.now()})
+    db.commit()
+    if updated:
+        app_logger.info(f"用户 {user_id} 取消了查询任务: {job_id}")
+    return bool(updated)
+
+_worker_id: Optional[str] = None
+
+def worker_id() -> str:
+    """本进程的标识，包含进程启动时间，PID被复用（如容器中总是1）时也不会误认为仍在运行"""
+    global _worker_id
+    if _worker_id is None:
+        _worker_id = f"{os.getpid()}:{psutil.Process().create_time():.3f}"
+    return _worker_id
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """执行任务的进程是否仍在运行"""
+    if worker == worker_id():
+        return True
+    try:
+        pid, created = worker.split(":")
+        return f"{psutil.Process(int(pid)).create_time():.3f}" == created
+    except (AttributeError, ValueError, psutil.Error):
+        return False
+
+def _claim_job(db: Session, job_id: str) -> bool:
+    """原子地把任务从排队状态改为执行中，避免同一任务被重复执行（包括被多个进程同时排队时）"""
+    claimed = db.query(QueryJob).filter(
+        QueryJob.id == job_id,
+        QueryJob.status == JOB_QUEUED
+    ).update({
+        "status": JOB_RUNNING,
+        "started_at": datetime.now(),
+        "attempts": QueryJob.attempts + 1,
+        "worker": worker_id()
+    })
+    db.commit()
+    return bool(claimed)
+
+def _finish_job(db: Session, job_id: str, status: str, answer: Optional[str] = None, error: Optional[str] = None) -> None:
+    db.query(QueryJob).filter(QueryJob.id == job_id).update({
+        "status": status,
+        "answer": answer,
+        "error": error,
+        "finished_at": datetime.now()
+    })
+    db.commit()
+
+def _requeue_job(db: Session, job_id: str) -> None:
+    """把执行中的任务放回排队状态"""
+    db.query(QueryJob).filter(
+        QueryJob.id == job_id,
+        QueryJob.status == JOB_RUNNING
+    ).update({"status": JOB_QUEUED, "started_at": None, "worker": None})
+    db.commit()
+
+
+class QueryJobWorkerPool:
+    """查询任务worker池
+
+    Args:
+        workers: 并发执行任务的worker数量
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        # 本进程内等待任务完成的事件，用于长轮询
+        self._events: Dict[str, asyncio.Event] = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """恢复未完成的任务并启动worker"""
+        if self._tasks:
+            return
+        self._recover_jobs()
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index)))
+        app_logger.info(f"查询任务worker池已启动，共 {self.workers} 个worker")
+
+    async def stop(self) -> None:
+        """停止所有worker，执行中的任务会在下次启动时重新排队"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _recover_jobs(self) -> None:
+        """把执行它的进程已退出（或超过 QUERY_JOB_LEASE 仍未结束）的任务重新排队，并排队所有等待中的任务
+
+        其他进程可能同时排队相同的任务，执行前的认领保证每个任务只执行一次。
+        """
+        db = SessionLocal()
+        try:
+            expired = datetime.now() - timedelta(seconds=settings.QUERY_JOB_LEASE)
+            interrupted = 0
+            running = db.query(QueryJob.id, QueryJob.worker, QueryJob.started_at).filter(
+                QueryJob.status == JOB_RUNNING
+            ).all()
+            for job_id, worker, started_at in running:
+                if _worker_alive(worker) and started_at is not None and started_at > expired:
+                    continue
+                # 条件更新，多个进程同时恢复时只有一个生效
+                interrupted += db.query(QueryJob).filter(
+                    QueryJob.id == job_id,
+                    QueryJob.status == JOB_RUNNING,
+                    QueryJob.worker.is_(None) if worker is None else QueryJob.worker == worker
+                ).update({"status": JOB_QUEUED, "started_at": None, "worker": None})
+            db.commit()
+            pending = db.query(QueryJob.id).filter(
+                QueryJob.status == JOB_QUEUED
+            ).order_by(QueryJob.created_at).all()
+            for (job_id,) in pending:
+                self._queue.put_nowait(job_id)
+            if pending:
+                app_logger.info(f"恢复了 {len(pending)} 个未完成的查询任务（其中 {interrupted} 个在执行中被中断）")
+        finally:
+            db.close()
+
+    def submit(self, job_id: str) -> None:
+        """把任务加入执行队列"""
+        self._queue.put_nowait(job_id)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def wait(self, db: Session, job_id: str, user_id: int, timeout: float) -> Optional[QueryJob]:
+        """长轮询：等待任务结束或超时，返回任务的最新状态"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = None
+        try:
+            while True:
+                # 任务被重新排队时事件已触发，需要换一个新的事件继续等待
+                event = self._events.setdefault(job_id, asyncio.Event())
+                db.expire_all()
+                job = get_job(db, job_id, user_id)
+                remaining = deadline - loop.time()
+                if job is None or job.status in FINISHED_STATUSES or remaining <= 0:
+                    return job
+                # 任务可能由其他进程执行，因此最多等待1秒后重新查询数据库
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if event is not None and not event.is_set():
+                self._events.pop(job_id, None)
+
+    def _notify(self, job_id: str) -> None:
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_error(f"执行查询任务 {job_id} 时出错: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            if not _claim_job(db, job_id):
+                return
+            job = db.query(QueryJob).filter(QueryJob.id == job_id).first()
+            app_logger.info(f"开始执行查询任务: {job_id} [会话ID: {job.session_id}]")
+            try:
+                # 后台任务走批量通道，让交互请求优先
+                prefetched = await prefetch.collect(prefetch.start_prefetch(job.query))
+                with capture_tool_calls() as tool_calls, capture_usage() as usage:
+                    response = await tech_assistant_query(
+                        job.query, use_cache=job.use_cache, user_id=job.user_id, lane=LANE_BATCH,
+                        context=memory_service.get_session_context(db, job.session_id, job.query),
+                        prefetched=prefetched, raise_errors=True
+                    )
+                answer = extract_marked_content(response) or "无法获取回答，请稍后重试"
+            except AdmissionRejectedError as e:
+                # 服务过载时任务不算失败，稍后重新排队
+                app_logger.info(f"查询任务 {job_id} 被准入控制拒绝，{e.retry_after}秒后重试")
+                _requeue_job(db, job_id)
+                asyncio.get_running_loop().call_later(e.retry_after, self.submit, job_id)
+                return
+            except Exception as e:
+                log_error(f"查询任务 {job_id} 失败: {str(e)}")
+                _finish_job(db, job_id, JOB_FAILED, error=str(e))
+                return
+
+            # 与同步查询一样，把答案写入会话消息
+            chat_service.add_message(
+                db, job.session_id, job.user_id, MessageCreate(role="assistant", content=answer), tool_calls, usage
+            )
+            _finish_job(db, job_id, JOB_SUCCEEDED, answer=answer)
+            app_logger.info(f"查询任务完成: {job_id}")
+        finally:
+            db.close()
+            self._notify(job_id)
+
+
+_worker_pool: Optional[QueryJobWorkerPool] = None
+
+def get_job_worker_pool() -> QueryJobWorkerPool:
+    """获取全局查询任务worker池"""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = QueryJobWorkerPool(workers=settings.QUERY_JOB_WORKERS)
+    return _worker_pool
@@ -0,0 +1,262 @@
+"""
+agent LLM调用层
+
+fast-agent 的 OpenAI 兼容实现（DeepSeek/OpenAI/OpenRouter/Generic）每轮都会新建一个
+同步 OpenAI 客户端并在线程池中等待完整响应。这里把 tech_assistant 的客户端替换为
+一个复用连接的异步客户端：当前请求登记了流式接收器时以 stream=True 调用，
+把增量文本实时转发出去，再拼装成完整的 ChatCompletion 交还给 fast-agent 的工具循环。
+主提供商失败或变慢时切换到备用提供商，见 app.services.llm_failover。
+"""
+import asyncio
+import contextvars
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services import deadline
+from app.services.cassette import current_recording
+from app.services.llm_failover import LLMProvider, ProviderRegistry, get_provider_registry, is_retryable_error
+
+# 当前请求的流式接收器，为 None 时按普通方式调用
+stream_sink: contextvars.ContextVar[Optional[Callable[[str], None]]] = contextvars.ContextVar(
+    "stream_sink", default=None
+)
+
+# 当前请求的用量记录器，每次模型调用结束后以 ChatCompletion.usage 调用（可能为 None）
+usage_recorder: contextvars.ContextVar[Optional[Callable[[Any], None]]] = contextvars.ContextVar(
+    "usage_recorder", default=None
+)
+
+
+def _assemble_completion(chunks: List[Any], model: str) -> ChatCompletion:
+    """把流式返回的分片拼装成完整的 ChatCompletion"""
+    content_parts: List[str] = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    finish_reason = None
+    completion_id = ""
+    created = int(time.time())
+    usage = None
+
+    for chunk in chunks:
+        completion_id = chunk.id or completion_id
+        created = chunk.created or created
+        model = chunk.model or model
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta.content:
+            content_parts.append(delta.content)
+        for tool_delta in delta.tool_calls or []:
+            entry = tool_calls.setdefault(
+                tool_delta.index,
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if tool_delta.id:
+                entry["id"] = tool_delta.id
+            if tool_delta.function:
+                if tool_delta.function.name:
+                    entry["function"]["name"] += tool_delta.function.name
+                if tool_delta.function.arguments:
+                    entry["function"]["arguments"] += tool_delta.function.arguments
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+
+    message: Dict[str, Any] = {
+        "role": "assistant",
+        "content": "".join(content_parts) or None,
+    }
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+
+    return ChatCompletion.model_validate({
+        "id": completion_id or "stream",
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": finish_reason or ("tool_calls" if tool_calls else "stop"),
+        }],
+        "usage": usage,
+    })
+
+
+async def _call_provider(
+    provider: LLMProvider, arguments: Dict[str, Any], emit: Optional[Callable[[str], None]]
+) -> ChatCompletion:
+    """调用一个提供商，emit 不为 None 时以流式调用并转发增量文本"""
+    if provider.model:
+        arguments = dict(arguments, model=provider.model)
+    if emit is None:
+        return await provider.client.chat.completions.create(**arguments)
+
+    stream = await provider.client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **arguments
+    )
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if chunk.choices and chunk.choices[0].delta.content:
+            emit(chunk.choices[0].delta.content)
+    return _assemble_completion(chunks, arguments.get("model", ""))
+
+
+class _ChatCompletions:
+    """替代 client.chat.completions 的异步实现
+
+    主提供商失败（连接错误、超时、限流、服务端错误）时依次切换到备用提供商；
+    启用对冲时，主提供商超过其延迟分位数仍未返回就同时请求下一个提供商，先返回的结果生效，另一个请求被取消。
+    流式调用中先输出文本的请求生效，开始输出后不再切换。
+    单次请求的超时不超过请求的剩余时间，剩余时间用完后不再切换或对冲。
+    """
+
+    def __init__(self, primary: LLMProvider, registry: ProviderRegistry):
+        self._primary = primary
+        self._registry = registry
+
+    async def create(self, **arguments: Any) -> ChatCompletion:
+        sink = stream_sink.get()
+        # 录制中的agent调用同时记录请求、响应和流式片段的到达时间
+        recording = current_recording.get()
+        call = recording.start_llm(arguments, sink) if recording is not None else None
+        completion = await self._race(arguments, call.sink if call is not None else sink)
+        if call is not None:
+            call.finish(completion)
+        recorder = usage_recorder.get()
+        if recorder is not None:
+            recorder(completion.usage)
+        return completion
+
+    async def _race(self, arguments: Dict[str, Any], sink: Optional[Callable[[str], None]]) -> ChatCompletion:
+        registry = self._registry
+        remaining = registry.candidates(self._primary)
+        pending: Dict[asyncio.Task, Tuple[LLMProvider, float]] = {}
+        # 流式调用时第一个输出文本的提供商
+        streaming: Optional[LLMProvider] = None
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def start(provider: LLMProvider) -> None:
+            # 剩余时间用完时抛出 DeadlineExceededError，不再发出新的请求
+            request_arguments = dict(arguments, timeout=deadline.budget(default=settings.LLM_REQUEST_TIMEOUT))
+
+            def emit(text: str) -> None:
+                nonlocal streaming
+                if streaming is None:
+                    streaming = provider
+                    for task, (other, _) in pending.items():
+                        if other is not provider:
+                            task.cancel()
+                if streaming is provider:
+                    sink(text)
+
+            task = asyncio.create_task(_call_provider(provider, request_arguments, emit if sink else None))
+            pending[task] = (provider, time.monotonic())
+
+        start(remaining.pop(0))
+        try:
+            while pending:
+                timeout = None
+                if not hedged and remaining and streaming is None:
+                    first_provider, first_started = next(iter(pending.values()))
+                    delay = registry.hedge_delay(first_provider)
+                    if delay is not None:
+                        timeout = max(0.0, first_started + delay - time.monotonic())
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    left = deadline.remaining()
+                    if left is not None and left <= 0:
+                        # 剩余时间已用完，不再对冲，等待已发出的请求超时
+                        continue
+                    registry.hedges += 1
+                    provider = remaining.pop(0)
+                    app_logger.info(f"LLM调用超过对冲等待时间，同时请求备用提供商 {provider.name}")
+                    start(provider)
+                    continue
+
+                for task in done:
+                    provider, started = pending.pop(task)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        registry.record_success(provider, time.monotonic() - started)
+                        if hedged and provider is not self._primary:
+                            registry.hedge_wins += 1
+                        return task.result()
+                    registry.record_failure(provider, error)
+                    last_error = error
+                    # 已经开始输出或换提供商也无济于事的错误直接抛出
+                    if streaming is provider or not is_retryable_error(error):
+                        raise error
+
+                if not pending and remaining and streaming is None:
+                    registry.failovers += 1
+                    provider = remaining.pop(0)
+                    app_logger.info(f"切换到备用LLM提供商 {provider.name}")
+                    start(provider)
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class _Chat:
+    def __init__(self, primary: LLMProvider, registry: ProviderRegistry):
+        self.completions = _ChatCompletions(primary, registry)
+
+
+class AgentLLMClient:
+    """与 OpenAI 客户端接口兼容的最小封装（只实现 chat.completions.create）
+
+    Args:
+        api_key: 主提供商的API密钥
+        base_url: 主提供商的接口地址
+        provider_name: 主提供商名，用于记录健康状态
+        registry: 备用提供商和健康状态，默认使用进程内共享的注册表
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        provider_name: str = "default",
+        registry: Optional[ProviderRegistry] = None,
+    ):
+        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=settings.LLM_REQUEST_TIMEOUT)
+        primary = LLMProvider(provider_name, self._client)
+        self.chat = _Chat(primary, registry or get_provider_registry())
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def install_llm_client(agent: Any) -> bool:
+    """为agent的LLM安装异步客户端
+
+    Returns:
+        bool: 是否安装成功（非 OpenAI 兼容的提供商保持原样，不支持流式）
+    """
+    llm = getattr(agent, "_llm", None)
+    if llm is None or not hasattr(llm, "_openai_client"):
+        app_logger.info("当前模型不是OpenAI兼容接口，流式输出不可用")
+        return False
+
+    provider = getattr(llm, "provider", None)
+    client = AgentLLMClient(
+        api_key=llm._api_key(),
+        base_url=llm._base_url(),
+        provider_name=getattr(provider, "value", None) or "default",
+    )
+    llm._openai_client = lambda: client
+    return True
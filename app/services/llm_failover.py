@@ -0,0 +1,249 @@
+"""
+LLM提供商故障转移
+
+记录每个提供商最近的成功率和延迟，为每次模型调用给出候选提供商顺序：
+主提供商（agent模型所属的提供商）优先，连续失败后进入冷却期，期间排到健康的备用提供商之后。
+备用提供商按 settings.LLM_FAILOVER_PROVIDERS 的顺序使用，
+均通过各自的 OpenAI 兼容接口调用，模型名见 settings.LLM_FAILOVER_MODELS。
+
+实际的调用、失败切换和对冲请求见 app.services.llm_client。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services.routing import percentile as compute_percentile
+
+# 各提供商的 OpenAI 兼容接口地址
+PROVIDER_BASE_URLS = {
+    "deepseek": "https://api.deepseek.com/v1",
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com/v1/",
+    "openrouter": "https://openrouter.ai/api/v1",
+}
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """换一个提供商可能成功的错误：连接失败、超时、限流和服务端错误"""
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class ProviderHealth:
+    """单个提供商的健康状态
+
+    Args:
+        smoothing: 成功率滑动平均的平滑系数
+        failure_threshold: 连续失败多少次后进入冷却期
+        cooldown: 冷却期时长（秒）
+        window: 计算延迟分位数使用的最近成功调用数
+        clock: 时钟函数
+    """
+
+    def __init__(
+        self,
+        smoothing: float = 0.2,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        window: int = 200,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.smoothing = smoothing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self.score = 1.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.score += self.smoothing * (1.0 - self.score)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self._latencies.append(latency)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.score -= self.smoothing * self.score
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.cooldown_until = self._clock() + self.cooldown
+
+    @property
+    def available(self) -> bool:
+        return self._clock() >= self.cooldown_until
+
+    def latency_percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        latencies = list(self._latencies)
+        if len(latencies) < min_samples:
+            return None
+        return compute_percentile(latencies, percentile)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "score": round(self.score, 3),
+            "available": self.available,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "p50_latency": round(p50, 3) if p50 is not None else None,
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class LLMProvider:
+    """一个可调用的提供商
+
+    Args:
+        name: 提供商名（deepseek / openai / anthropic / openrouter 等）
+        client: OpenAI 兼容的异步客户端
+        model: 使用的模型名，为 None 时沿用请求中的模型
+    """
+
+    def __init__(self, name: str, client: AsyncOpenAI, model: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.model = model
+
+
+class ProviderRegistry:
+    """进程内共享的提供商健康状态、备用提供商和对冲配置
+
+    Args:
+        backups: 按优先顺序排列的备用提供商
+        hedge_enabled: 是否在主提供商响应慢时向备用提供商发出对冲请求
+        hedge_percentile: 主提供商超过其最近延迟的该分位数仍未返回时发出对冲请求
+        hedge_min_delay: 对冲请求的最短等待时间（秒）
+        hedge_default_delay: 延迟样本不足时的等待时间（秒）
+        hedge_min_samples: 使用分位数所需的最少延迟样本数
+        health_factory: 创建提供商健康状态的函数
+    """
+
+    def __init__(
+        self,
+        backups: Optional[List[LLMProvider]] = None,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 2.0,
+        hedge_default_delay: float = 30.0,
+        hedge_min_samples: int = 10,
+        health_factory: Callable[[], ProviderHealth] = ProviderHealth,
+    ):
+        self.backups = list(backups or [])
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._health_factory = health_factory
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def health(self, name: str) -> ProviderHealth:
+        with self._lock:
+            health = self._health.get(name)
+            if health is None:
+                health = self._health[name] = self._health_factory()
+            return health
+
+    def candidates(self, primary: LLMProvider) -> List[LLMProvider]:
+        """本次调用的候选提供商顺序：可用的排在冷却中的之前，同类中保持配置顺序"""
+        providers = [primary] + [p for p in self.backups if p.name != primary.name]
+        # 全部在冷却期时仍按配置顺序尝试，不直接拒绝请求
+        return sorted(providers, key=lambda p: not self.health(p.name).available)
+
+    def hedge_delay(self, provider: LLMProvider) -> Optional[float]:
+        """等待多久后发出对冲请求，未启用对冲时返回 None"""
+        if not self.hedge_enabled or not self.backups:
+            return None
+        percentile = self.health(provider.name).latency_percentile(
+            self.hedge_percentile, self.hedge_min_samples
+        )
+        if percentile is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, percentile)
+
+    def record_success(self, provider: LLMProvider, latency: float) -> None:
+        self.health(provider.name).record_success(latency)
+
+    def record_failure(self, provider: LLMProvider, error: BaseException) -> None:
+        health = self.health(provider.name)
+        health.record_failure()
+        app_logger.warning(
+            f"LLM提供商 {provider.name} 调用失败 (连续 {health.consecutive_failures} 次): {error}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = {name: health.snapshot() for name, health in self._health.items()}
+        return {
+            "providers": providers,
+            "backups": [p.name for p in self.backups],
+            "hedge_enabled": self.hedge_enabled,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def _provider_api_key(name: str) -> Optional[str]:
+    return getattr(settings, f"{name.upper()}_API_KEY", None)
+
+
+def build_backup_providers() -> List[LLMProvider]:
+    """按配置创建备用提供商，跳过未配置API密钥或接口地址的提供商"""
+    backups = []
+    for name in settings.LLM_FAILOVER_PROVIDERS:
+        api_key = _provider_api_key(name)
+        base_url = PROVIDER_BASE_URLS.get(name)
+        if not api_key or not base_url:
+            app_logger.warning(f"备用LLM提供商 {name} 未配置API密钥或接口地址，已跳过")
+            continue
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=settings.LLM_REQUEST_TIMEOUT)
+        backups.append(LLMProvider(name, client, settings.LLM_FAILOVER_MODELS.get(name)))
+    return backups
+
+
+_registry: Optional[ProviderRegistry] = None
+
+
+def get_provider_registry() -> ProviderRegistry:
+    """获取进程内共享的提供商注册表"""
+    global _registry
+    if _registry is None:
+        _registry = ProviderRegistry(
+            backups=build_backup_providers(),
+            hedge_enabled=settings.LLM_HEDGE_ENABLED,
+            hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+            hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY,
+            hedge_default_delay=settings.LLM_HEDGE_DEFAULT_DELAY,
+            health_factory=lambda: ProviderHealth(
+                failure_threshold=settings.LLM_PROVIDER_FAILURE_THRESHOLD,
+                cooldown=settings.LLM_PROVIDER_COOLDOWN,
+            ),
+        )
+    return _registry
+
+
+def get_provider_stats() -> Dict[str, Any]:
+    """获取各LLM提供商的健康状态和故障转移统计"""
+    return get_provider_registry().stats()
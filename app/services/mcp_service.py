@@ -2,7 +2,12 @@
 MCP服务管理模块 - 使用SSE方式连接
 """
 import asyncio
+import os
+from typing import Any, Dict, List
+
+from app.core.config import settings
 from app.core.logging import app_logger
+from app.utils import pid_files
 
 async def verify_mcp_servers():
     """验证MCP服务器连接
@@ -16,4 +21,42 @@ async def verify_mcp_servers():
 async def retry_verify_mcp_servers(max_retries=3, retry_interval=2):
     """使用SSE方式时，无需重试验证MCP服务器连接"""
     app_logger.info("使用SSE方式连接MCP服务器，无需验证连接")
-    return True 
\ No newline at end of file
+    return True
+
+def write_proxy_stats(name: str, stats: Dict[str, Any]) -> None:
+    """由本地MCP代理进程调用，把本进程的统计信息写入 {name}-{pid}.json"""
+    os.makedirs(settings.MCP_PROXY_STATS_DIR, exist_ok=True)
+    pid_files.write_json(os.path.join(settings.MCP_PROXY_STATS_DIR, f"{name}-{os.getpid()}.json"), stats)
+
+def _merge_proxy_stats(stats_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """按工具累加多个代理进程的统计"""
+    tools: Dict[str, Dict[str, Any]] = {}
+    for stats in stats_list:
+        for tool, tool_stats in stats.get("tools", {}).items():
+            merged = tools.setdefault(tool, {})
+            for key, value in tool_stats.items():
+                merged[key] = merged.get(key, 0) + value
+    return {"tools": tools}
+
+def get_mcp_proxy_stats(name: str) -> Dict[str, Any]:
+    """汇总所有代理进程（包括已退出的）写入的统计信息，已退出进程的文件会先合并到汇总文件"""
+    prefix = f"{name}-"
+    pid_files.compact(settings.MCP_PROXY_STATS_DIR, prefix, _merge_proxy_stats)
+    stats_list = []
+    processes = 0
+    for path in pid_files.stats_files(settings.MCP_PROXY_STATS_DIR, prefix):
+        stats = pid_files.read_json(path)
+        if stats is None:
+            continue
+        stats_list.append(stats)
+        if not os.path.basename(path).startswith(prefix + pid_files.ROLLUP):
+            processes += 1
+    totals: Dict[str, Any] = {"processes": processes, **_merge_proxy_stats(stats_list)}
+
+    hits = sum(t.get("hits", 0) for t in totals["tools"].values())
+    misses = sum(t.get("misses", 0) for t in totals["tools"].values())
+    totals["hits"] = hits
+    totals["misses"] = misses
+    totals["hit_ratio"] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+    totals["saved_seconds"] = round(sum(t.get("saved_seconds", 0) for t in totals["tools"].values()), 3)
+    return totals
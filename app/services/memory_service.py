@@ -0,0 +1,194 @@
+"""
+会话记忆服务
+
+agent本身不保留跨调用的历史（每次调用都是无状态的），对话上下文来自该会话在
+chat_messages 中的消息：
+- 最近的若干轮对话按token预算原样带上（从新到旧，超出预算为止）
+- 更早的对话压缩为滚动摘要，保存在 chat_session_summaries 中，
+  每次只把新滑出窗口的消息追加进摘要，摘要超出自己的预算时丢弃最早的条目
+
+摘要是抽取式的（问题原文 + 回答中的标题和首句），不额外调用模型。
+"""
+import math
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.models.chat import ChatMessage, ChatSessionSummary
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+_CODE_BLOCK_PATTERN = re.compile(r"```.*?```", re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中日韩字符按每字1个，其余按每4个字符1个"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """截断到大约 max_tokens 个token"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…"
+
+
+def _one_line(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+
+def summarize_turn(role: str, content: str) -> str:
+    """把一条消息压缩为一行摘要"""
+    if role == "user":
+        return f"- 用户: {_one_line(content, 120)}"
+    text = _CODE_BLOCK_PATTERN.sub(" ", content)
+    points = [_one_line(heading, 40) for heading in _HEADING_PATTERN.findall(text)[:4]]
+    body = _HEADING_PATTERN.sub(" ", text)
+    first_sentence = re.split(r"(?<=[。！？.!?])\s*", " ".join(body.split()), maxsplit=1)[0]
+    if first_sentence:
+        points.insert(0, _one_line(first_sentence, 80))
+    return f"  助手: {'；'.join(points) or '（代码示例）'}"
+
+
+def _trim_summary(lines: List[str], max_tokens: int) -> List[str]:
+    """丢弃最早的摘要条目直到不超过预算"""
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return lines
+
+
+def _update_summary(
+    db: Session, session_id: int, boundary_id: int, summary_tokens: int
+) -> str:
+    """把ID不超过 boundary_id 的消息增量压缩进会话摘要，返回摘要内容"""
+    record = db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).first()
+    if record is not None and record.last_message_id > boundary_id:
+        # 消息被删除或清空后窗口回退，摘要可能包含窗口内的消息，重新生成
+        db.delete(record)
+        db.commit()
+        record = None
+    if boundary_id <= 0:
+        return ""
+    if record is not None and record.last_message_id == boundary_id:
+        return record.content
+
+    since = record.last_message_id if record is not None else 0
+    evicted = db.query(ChatMessage).filter(
+        ChatMessage.session_id == session_id,
+        ChatMessage.id > since,
+        ChatMessage.id <= boundary_id,
+        ChatMessage.role.in_(("user", "assistant")),
+    ).order_by(ChatMessage.id).all()
+
+    lines = record.content.split("\n") if record is not None and record.content else []
+    lines.extend(summarize_turn(message.role, message.content) for message in evicted)
+    content = "\n".join(_trim_summary(lines, summary_tokens))
+
+    if record is None:
+        record = ChatSessionSummary(session_id=session_id)
+        db.add(record)
+    record.content = content
+    record.last_message_id = boundary_id
+    record.updated_at = datetime.now()
+    db.commit()
+    app_logger.info(f"会话 {session_id} 的摘要已更新到消息 {boundary_id} (新增 {len(evicted)} 条)")
+    return content
+
+
+def build_session_context(
+    db: Session,
+    session_id: int,
+    query: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    summary_tokens: Optional[int] = None,
+    before_id: Optional[int] = None,
+) -> str:
+    """生成会话的对话上下文，会话没有历史时返回空字符串
+
+    Args:
+        db: 数据库会话
+        session_id: 会话ID
+        query: 当前问题，会话最后一条用户消息与之相同时不计入历史（已由 prepare_query_session 保存）
+        token_budget: 最近对话的token预算
+        summary_tokens: 滚动摘要的token预算
+        before_id: 只使用ID小于该值的消息（重新生成较早的答案时使用）
+    """
+    token_budget = settings.SESSION_CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    summary_tokens = settings.SESSION_SUMMARY_TOKEN_BUDGET if summary_tokens is None else summary_tokens
+
+    messages = db.query(ChatMessage).filter(
+        ChatMessage.session_id == session_id,
+        ChatMessage.role.in_(("user", "assistant")),
+    )
+    if before_id is not None:
+        messages = messages.filter(ChatMessage.id < before_id)
+    recent = messages.order_by(ChatMessage.id.desc()).limit(settings.SESSION_CONTEXT_MAX_MESSAGES).all()
+    more_before = len(recent) == settings.SESSION_CONTEXT_MAX_MESSAGES
+    if recent and query is not None and recent[0].role == "user" and recent[0].content == query:
+        recent = recent[1:]
+    if not recent:
+        _update_summary(db, session_id, 0, summary_tokens)
+        return ""
+
+    # 从新到旧放入窗口，直到超出预算
+    window: List[str] = []
+    used = 0
+    boundary_id = 0
+    per_message = max(1, token_budget // 2)
+    for message in recent:
+        speaker = "用户" if message.role == "user" else "助手"
+        text = f"{speaker}: {_truncate(message.content, per_message)}"
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            boundary_id = message.id
+            break
+        window.append(text)
+        used += tokens
+    else:
+        # 取回的消息全部放入窗口时，更早的消息（如有）都归入摘要
+        boundary_id = recent[-1].id - 1 if more_before else 0
+
+    summary = _update_summary(db, session_id, boundary_id, summary_tokens)
+
+    sections = []
+    if summary:
+        sections.append(f"### 更早对话的摘要\n{summary}")
+    if window:
+        sections.append("### 最近的对话\n" + "\n\n".join(reversed(window)))
+    return "\n\n".join(sections)
+
+
+def get_session_context(
+    db: Session, session_id: int, query: Optional[str] = None, before_id: Optional[int] = None
+) -> Optional[str]:
+    """按配置生成会话上下文，未启用会话记忆时返回 None"""
+    if not settings.SESSION_CONTEXT_ENABLED:
+        return None
+    return build_session_context(db, session_id, query, before_id=before_id)
+
+
+def compose_query(query: str, context: Optional[str], pages: Optional[str] = None) -> str:
+    """把会话上下文、当前问题和预先抓取的网页内容（见 app.services.prefetch）组合为发送给agent的查询"""
+    if pages:
+        query = f"{query}\n\n### 链接内容\n{pages}"
+    if not context:
+        return query
+    return (
+        "以下是本次会话之前的对话，仅作为理解当前问题的背景，不要重复回答其中的问题。\n\n"
+        f"{context}\n\n### 当前问题\n{query}"
+    )
@@ -0,0 +1,445 @@
+"""
+Prometheus监控指标
+
+进程内的计数器、仪表和直方图，在请求路径上更新时只做一次字典查找和几次加法：
+- HTTP请求按方法、路由模板和状态码统计耗时，以及正在处理的请求数
+- agent调用按路由统计耗时，流式查询统计首个输出片段的等待时间
+- MCP工具调用按服务器和工具统计耗时
+- 数据库语句按类型（SELECT、INSERT 等）统计耗时
+- 排队数、缓存命中等已有统计在写入快照时读取（见 install_service_metrics，应用启动时注册）
+
+uvicorn 以多个worker运行时，每个进程定期把指标快照写入 METRICS_DIR 下的 worker-{pid}.json，
+/metrics 汇总所有进程的快照：计数器和直方图包括已退出的进程（与 MCP_PROXY_STATS_DIR 相同），
+仪表只统计仍在运行的进程；已退出进程的快照会被合并到汇总文件（见 app/utils/pid_files.py）。
+"""
+import asyncio
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import psutil
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils import pid_files
+
+PREFIX = "fastagent_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+AGENT_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0, 180.0, 300.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Metric:
+    """一个指标的所有标签组合，标签值按 labelnames 的顺序以元组作为键"""
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        # 数据库事件可能在线程池中触发，各指标各用一把锁（几乎没有竞争）
+        self._lock = threading.Lock()
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        with self._lock:
+            return {labels: self._copy(value) for labels, value in self._values.items()}
+
+    def _copy(self, value: Any) -> Any:
+        return value
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+
+    type = COUNTER
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的当前值"""
+
+    type = GAUGE
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """按桶统计的耗时分布，每个标签组合保存 [各桶计数（不累计）, 总和]"""
+
+    type = HISTOGRAM
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # 最后一个计数对应 +Inf 桶
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _copy(self, value: Any) -> Any:
+        return [list(value[0]), value[1]]
+
+
+class CallbackMetric:
+    """写入快照时才读取的指标，fn 返回 {标签值元组: 值}，用于导出已有的统计"""
+
+    def __init__(self, name: str, help: str, type: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        try:
+            return {tuple(str(v) for v in labels): float(value) for labels, value in self.fn().items()}
+        except Exception as e:
+            app_logger.warning(f"读取指标 {self.name} 失败: {str(e)}")
+            return {}
+
+
+class Registry:
+    """本进程的所有指标"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric: Any) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已存在")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(PREFIX + name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(PREFIX + name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(PREFIX + name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, type: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]) -> CallbackMetric:
+        return self.register(CallbackMetric(PREFIX + name, help, type, labelnames, fn))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """本进程的指标快照（可序列化为JSON）"""
+        metrics = {}
+        for name, metric in self._metrics.items():
+            entry = {
+                "type": metric.type,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "samples": [[list(labels), value] for labels, value in metric.samples().items()],
+            }
+            if metric.type == HISTOGRAM:
+                entry["buckets"] = list(metric.buckets)
+            metrics[name] = entry
+        return {"pid": os.getpid(), "written_at": time.time(), "metrics": metrics}
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（流式响应到开始发送为止）", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "正在处理的HTTP请求数")
+AGENT_CALL_SECONDS = registry.histogram(
+    "agent_call_duration_seconds", "agent调用耗时（含工具循环中的每轮模型请求）", ("route", "outcome"), AGENT_BUCKETS
+)
+AGENT_FIRST_TOKEN_SECONDS = registry.histogram(
+    "agent_time_to_first_token_seconds", "流式查询从开始处理到产出首个片段的时间（含排队）", ("route",), AGENT_BUCKETS
+)
+TOOL_CALL_SECONDS = registry.histogram(
+    "mcp_tool_call_duration_seconds", "实际执行的MCP工具调用耗时", ("server", "tool", "outcome")
+)
+DB_STATEMENT_SECONDS = registry.histogram(
+    "db_statement_duration_seconds", "数据库语句执行耗时", ("operation",), DB_BUCKETS
+)
+
+_DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """请求匹配的路由模板，未匹配任何路由时为 unmatched（避免按原始路径产生大量标签）"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def observe_request(method: str, scope: Dict[str, Any], status_code: int, seconds: float) -> None:
+    HTTP_REQUEST_SECONDS.observe(seconds, method, route_label(scope), str(status_code))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    words = statement[:32].split(None, 1)
+    operation = words[0].upper() if words else ""
+    DB_STATEMENT_SECONDS.observe(elapsed, operation if operation in _DB_OPERATIONS else "OTHER")
+
+
+def instrument_engine(engine: Engine) -> None:
+    """统计该数据库引擎执行每条语句的耗时"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+SNAPSHOT_PREFIX = "worker-"
+
+
+def write_snapshot() -> None:
+    """把本进程的指标快照写入 worker-{pid}.json"""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    pid_files.write_json(os.path.join(settings.METRICS_DIR, f"{SNAPSHOT_PREFIX}{os.getpid()}.json"), registry.snapshot())
+
+
+def _rollup_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把已退出进程的快照合并为一份汇总快照（只保留计数器和直方图，pid 为 None）"""
+    merged, _ = merge_snapshots(snapshots)
+    metrics = {}
+    for name, metric in merged.items():
+        entry = {key: metric[key] for key in ("type", "help", "labelnames")}
+        entry["samples"] = [[list(labels), value] for labels, value in metric.get("values", {}).items()]
+        if metric["type"] == HISTOGRAM:
+            entry["buckets"] = metric["buckets"]
+        metrics[name] = entry
+    return {"pid": None, "written_at": time.time(), "metrics": metrics}
+
+
+def _read_snapshots() -> List[Dict[str, Any]]:
+    """本进程的当前快照，加上其他进程写入的快照（已退出进程的快照先合并到汇总文件）"""
+    pid_files.compact(settings.METRICS_DIR, SNAPSHOT_PREFIX, _rollup_snapshots)
+    snapshots = [registry.snapshot()]
+    for path in pid_files.stats_files(settings.METRICS_DIR, SNAPSHOT_PREFIX):
+        snapshot = pid_files.read_json(path)
+        if snapshot is not None and snapshot.get("pid") != os.getpid():
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], int]:
+    """汇总多个进程的快照，返回 (指标, 仍在运行的进程数)
+
+    计数器和直方图累加所有进程，仪表只累加仍在运行的进程；直方图的桶不同时（配置变更前写入的快照）忽略该进程。
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    live = 0
+    for snapshot in snapshots:
+        pid = snapshot.get("pid")
+        alive = pid is not None and (pid == os.getpid() or psutil.pid_exists(pid))
+        live += 1 if alive else 0
+        for name, metric in snapshot.get("metrics", {}).items():
+            if metric["type"] == GAUGE and not alive:
+                continue
+            target = merged.setdefault(name, {key: metric.get(key) for key in ("type", "help", "labelnames", "buckets")})
+            if target["type"] != metric["type"] or target.get("buckets") != metric.get("buckets"):
+                continue
+            values = target.setdefault("values", {})
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["type"] == HISTOGRAM:
+                    entry = values.setdefault(key, [[0] * len(value[0]), 0.0])
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+                else:
+                    values[key] = values.get(key, 0.0) + value
+    return merged, live
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: Dict[str, Dict[str, Any]]) -> str:
+    """按Prometheus文本格式（0.0.4）输出汇总后的指标"""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labelnames"]
+        for labels, value in sorted(metric.get("values", {}).items()):
+            if metric["type"] != HISTOGRAM:
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(bound)
+                bucket_labels = _labels(names, labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def collect() -> str:
+    """汇总所有worker进程的指标，返回Prometheus文本格式"""
+    merged, live = merge_snapshots(_read_snapshots())
+    merged[PREFIX + "metrics_processes"] = {
+        "type": GAUGE, "help": "写入指标快照且仍在运行的进程数", "labelnames": [], "values": {(): live},
+    }
+    return render(merged)
+
+
+_service_metrics_installed = False
+
+
+def install_service_metrics() -> None:
+    """
+    注册读取已有统计的指标（排队数、缓存命中等），在写入指标快照时读取，不增加请求路径上的开销
+
+    由应用启动时调用，重复调用不会重复注册
+    """
+    global _service_metrics_installed
+    if _service_metrics_installed:
+        return
+    # 延迟导入，避免 metrics 模块依赖业务服务（数据库引擎导入 metrics）
+    from app.services.agent_service import get_admission_stats, get_agent_pool_stats, get_query_coalescing_stats
+    from app.services.cache_service import get_answer_cache
+    from app.services.job_service import get_job_worker_pool
+    from app.services.tool_results import get_tool_result_stats
+
+    def answer_cache_lookups():
+        if not settings.ANSWER_CACHE_ENABLED:
+            return {}
+        stats = get_answer_cache().stats(include_disk=False)
+        return {("memory_hit",): stats["memory_hits"], ("disk_hit",): stats["disk_hits"], ("miss",): stats["misses"]}
+
+    registry.callback(
+        "admission_in_flight", "通过准入控制正在执行的agent调用数", GAUGE, (),
+        lambda: {(): (get_admission_stats() or {}).get("in_flight", 0)},
+    )
+    registry.callback(
+        "admission_queue_depth", "等待准入控制的查询数", GAUGE, ("lane",),
+        lambda: {(lane,): count for lane, count in (get_admission_stats() or {}).get("queued_by_lane", {}).items()},
+    )
+    registry.callback(
+        "admission_rejected_total", "被准入控制拒绝的查询数", COUNTER, ("reason",),
+        lambda: {
+            (key[len("rejected_"):],): value
+            for key, value in (get_admission_stats() or {}).items() if key.startswith("rejected_")
+        },
+    )
+    registry.callback(
+        "agent_pool_busy", "正在使用的agent实例数", GAUGE, (),
+        lambda: {(): get_agent_pool_stats().get("busy", 0)},
+    )
+    registry.callback(
+        "agent_pool_waiters", "等待空闲agent实例的调用数", GAUGE, (),
+        lambda: {(): get_agent_pool_stats().get("waiters", 0)},
+    )
+    registry.callback(
+        "query_jobs_queued", "排队中的异步查询任务数", GAUGE, (),
+        lambda: {(): get_job_worker_pool().queue_depth()},
+    )
+    registry.callback(
+        "query_coalescing_total", "查询数，按是否等待了相同查询的结果区分", COUNTER, ("role",),
+        lambda: {
+            ("leader",): get_query_coalescing_stats()["leaders"],
+            ("coalesced",): get_query_coalescing_stats()["coalesced"],
+        },
+    )
+    registry.callback(
+        "answer_cache_lookups_total", "答案缓存查找次数，按结果区分", COUNTER, ("result",), answer_cache_lookups
+    )
+    registry.callback(
+        "tool_result_reuse_total", "重新生成答案时的工具调用数，按是否复用保存的结果区分", COUNTER, ("result",),
+        lambda: {("reused",): get_tool_result_stats()["reused"], ("rerun",): get_tool_result_stats()["rerun"]},
+    )
+    _service_metrics_installed = True
+
+
+class SnapshotWriter:
+    """定期把本进程的指标快照写入 METRICS_DIR，停止时再写入一次"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._write()
+
+    def _write(self) -> None:
+        try:
+            write_snapshot()
+        except Exception as e:
+            app_logger.warning(f"写入指标快照失败: {str(e)}")
+
+    async def _run(self) -> None:
+        while True:
+            self._write()
+            await asyncio.sleep(self.interval)
+
+
+_writer: Optional[SnapshotWriter] = None
+
+
+def get_snapshot_writer() -> SnapshotWriter:
+    """获取本进程的快照写入任务"""
+    global _writer
+    if _writer is None:
+        _writer = SnapshotWriter(settings.METRICS_WRITE_INTERVAL)
+    return _writer
@@ -0,0 +1,161 @@
+"""
+查询中链接的预先抓取
+
+请求到达时就并发抓取问题中的全部URL（复用 app.services.fetch_service 的带缓存抓取器），
+每个URL受 PREFETCH_TIMEOUT 和请求剩余时间限制，内容按 PREFETCH_TOKEN_BUDGET 在各页面间分配并截断，
+随问题一起发送给agent。所有URL都抓取成功时，查询按去掉URL后的问题选择路由，不再挂载fetch工具，
+省去模型先调用fetch工具、再根据结果作答的一轮往返；有URL抓取失败或超过 PREFETCH_MAX_URLS 未抓取时，
+保留fetch工具由模型自行获取。
+"""
+import asyncio
+import re
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services import deadline
+from app.services.fetch_service import get_page_fetcher
+from app.services.memory_service import estimate_tokens
+from app.utils.text_utils import extract_urls
+
+_URL_PATTERN = re.compile(r"@?https?://[^\s'\"\\)]+")
+_TRUNCATED = "\n\n...（内容过长，已截断）"
+
+
+class PrefetchedPage:
+    """一个URL的抓取结果，抓取失败时 error 为失败原因"""
+
+    def __init__(self, url: str, content: str = "", from_cache: bool = False, error: Optional[str] = None):
+        self.url = url
+        self.content = content
+        self.from_cache = from_cache
+        self.error = error
+        self.truncated = False
+
+
+class PrefetchResult:
+    """一次查询中所有URL的预先抓取结果
+
+    Args:
+        pages: 抓取的页面
+        skipped: 超过 PREFETCH_MAX_URLS 而没有抓取的URL
+    """
+
+    def __init__(self, pages: List[PrefetchedPage], skipped: Optional[List[str]] = None):
+        self.pages = pages
+        self.skipped = list(skipped or [])
+
+    @property
+    def complete(self) -> bool:
+        """问题中的URL是否全部抓取成功"""
+        return bool(self.pages) and not self.skipped and all(page.error is None for page in self.pages)
+
+    def routing_query(self, query: str) -> str:
+        """选择路由时使用的问题：全部抓取成功时去掉已抓取的URL，使查询不再需要fetch工具"""
+        if not self.complete:
+            return query
+        fetched = {page.url for page in self.pages if page.error is None}
+
+        def strip(match: "re.Match[str]") -> str:
+            return " " if match.group(0).lstrip("@") in fetched else match.group(0)
+
+        return " ".join(_URL_PATTERN.sub(strip, query).split())
+
+    def section(self) -> str:
+        """附在问题后面的网页内容，没有抓取到任何内容时返回空字符串"""
+        fetched = [page for page in self.pages if page.error is None]
+        missing = [page.url for page in self.pages if page.error is not None] + self.skipped
+        if not fetched:
+            return ""
+        parts = ["以下是问题中链接的网页内容（已转换为Markdown，较长的内容经过截断），无需再使用fetch工具获取这些链接。"]
+        parts += [f"#### {page.url}\n{page.content}" for page in fetched]
+        if missing:
+            parts.append("以下链接未能预先获取，如有需要请使用fetch工具获取：" + "、".join(missing))
+        return "\n\n".join(parts)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使其估计的token数不超过 max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip()
+
+
+def allocate_budget(pages: List[PrefetchedPage], token_budget: int) -> None:
+    """在抓取成功的页面之间分配token预算：较短的页面用不完的份额留给较长的页面"""
+    fetched = sorted((page for page in pages if page.error is None), key=lambda page: estimate_tokens(page.content))
+    remaining = token_budget
+    for index, page in enumerate(fetched):
+        share = remaining // (len(fetched) - index)
+        trimmed = trim_to_tokens(page.content, share)
+        if trimmed != page.content:
+            page.content = trimmed + _TRUNCATED
+            page.truncated = True
+        remaining -= estimate_tokens(trimmed)
+
+
+async def _fetch_page(url: str, timeout: float) -> PrefetchedPage:
+    try:
+        result = await asyncio.wait_for(get_page_fetcher().fetch(url), timeout=timeout)
+    except asyncio.TimeoutError:
+        return PrefetchedPage(url, error=f"超过 {timeout:.1f} 秒未返回")
+    except Exception as e:
+        return PrefetchedPage(url, error=str(e))
+    return PrefetchedPage(url, content=result.content, from_cache=result.from_cache)
+
+
+async def prefetch_urls(urls: List[str], token_budget: Optional[int] = None) -> PrefetchResult:
+    """并发抓取URL，返回按token预算截断后的内容
+
+    Args:
+        urls: 要抓取的URL，超过 PREFETCH_MAX_URLS 的部分不抓取（留给fetch工具）
+        token_budget: 所有页面合计的token预算，默认为 PREFETCH_TOKEN_BUDGET
+    """
+    urls, skipped = urls[:settings.PREFETCH_MAX_URLS], urls[settings.PREFETCH_MAX_URLS:]
+    if skipped:
+        app_logger.info(f"问题中的链接超过 {settings.PREFETCH_MAX_URLS} 个，其余 {len(skipped)} 个留给fetch工具")
+    # 单个URL的等待时间不超过请求剩余时间中留给工具调用的部分
+    timeout = min(
+        settings.PREFETCH_TIMEOUT,
+        deadline.budget(settings.DEADLINE_TOOL_SHARE, default=settings.PREFETCH_TIMEOUT),
+    )
+    pages = list(await asyncio.gather(*(_fetch_page(url, timeout) for url in urls)))
+    allocate_budget(pages, settings.PREFETCH_TOKEN_BUDGET if token_budget is None else token_budget)
+    for page in pages:
+        if page.error is not None:
+            app_logger.warning(f"预先抓取失败: {page.url} ({page.error})")
+    return PrefetchResult(pages, skipped)
+
+
+def start_prefetch(query: str) -> Optional[asyncio.Task]:
+    """问题包含URL时立即在后台开始抓取，未启用或没有URL时返回 None"""
+    if not settings.PREFETCH_ENABLED:
+        return None
+    # extract_urls 返回的顺序不固定，按在问题中出现的位置排序
+    urls = sorted(extract_urls(query), key=query.find)
+    if not urls:
+        return None
+    app_logger.info(f"开始预先抓取 {len(urls)} 个URL")
+    task = asyncio.create_task(prefetch_urls(urls))
+    # 请求在取得结果前失败时，记录抓取的异常，而不是留下未取出的异常
+    task.add_done_callback(_log_failure)
+    return task
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        app_logger.warning(f"预先抓取出错: {task.exception()}")
+
+
+async def collect(task: Optional[asyncio.Task]) -> Optional[PrefetchResult]:
+    """等待预先抓取完成，task 为 None 时返回 None"""
+    if task is None:
+        return None
+    return await task
@@ -0,0 +1,311 @@
+"""
+限流服务
+
+限流策略（令牌桶、滑动窗口）只负责根据旧状态计算新状态和判定结果，状态由后端保存：
+内存后端只在当前进程内生效，SQLite后端在同一台机器的多个worker进程之间共享限额。
+路由通过 app.api.dependencies.rate_limit 按规则名接入，规则在 settings.RATE_LIMIT_RULES 中配置。
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import app_logger
+
+# 策略状态，固定为三个浮点数，便于两种后端统一保存
+State = Tuple[float, float, float]
+
+
+class RateLimitResult(NamedTuple):
+    """一次限流判定的结果"""
+    allowed: bool
+    limit: int  # 策略允许的最大请求数（令牌桶容量或窗口内请求数）
+    remaining: int  # 本次判定后剩余的请求数
+    reset_after: float  # 额度完全恢复还需的秒数
+    retry_after: float  # 被拒绝时建议等待的秒数，允许时为0
+    policy: str  # 用于 RateLimit-Policy 响应头的策略描述
+
+
+class TokenBucketPolicy:
+    """令牌桶：以固定速率补充令牌，最多积攒 burst 个，允许短时突发
+
+    Args:
+        rate: 每秒补充的令牌数
+        burst: 桶容量
+    """
+
+    name = "token_bucket"
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+    @property
+    def ttl(self) -> float:
+        # 桶装满后状态与不存在等价
+        return self.burst / self.rate
+
+    @property
+    def max_cost(self) -> int:
+        # 桶里最多只有 burst 个令牌，cost 更大的请求永远不会被放行
+        return self.burst
+
+    def describe(self) -> str:
+        return f"{self.burst};w={max(1, round(self.burst / self.rate))}"
+
+    def evaluate(self, state: Optional[State], now: float, cost: int = 1) -> Tuple[State, RateLimitResult]:
+        tokens, updated_at = (self.burst, now) if state is None else (state[0], state[1])
+        tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        retry_after = 0.0 if allowed else (cost - tokens) / self.rate
+        result = RateLimitResult(
+            allowed=allowed,
+            limit=self.burst,
+            remaining=int(tokens),
+            reset_after=(self.burst - tokens) / self.rate,
+            retry_after=retry_after,
+            policy=self.describe(),
+        )
+        return (tokens, now, 0.0), result
+
+
+class SlidingWindowPolicy:
+    """滑动窗口计数：按上一个窗口的计数加权估算最近 window 秒内的请求数
+
+    Args:
+        limit: 窗口内允许的请求数
+        window: 窗口长度（秒）
+    """
+
+    name = "sliding_window"
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+
+    @property
+    def ttl(self) -> float:
+        return self.window * 2
+
+    @property
+    def max_cost(self) -> int:
+        return self.limit
+
+    def describe(self) -> str:
+        return f"{self.limit};w={round(self.window)}"
+
+    def evaluate(self, state: Optional[State], now: float, cost: int = 1) -> Tuple[State, RateLimitResult]:
+        window_start = math.floor(now / self.window) * self.window
+        previous, current = 0.0, 0.0
+        if state is not None:
+            if state[0] == window_start:
+                previous, current = state[1], state[2]
+            elif state[0] == window_start - self.window:
+                previous = state[2]
+
+        elapsed = now - window_start
+        estimated = previous * (1 - elapsed / self.window) + current
+        allowed = estimated + cost <= self.limit
+        if allowed:
+            current += cost
+            estimated += cost
+
+        retry_after = 0.0
+        if not allowed:
+            if current + cost <= self.limit:
+                # 本窗口内等上一个窗口的权重衰减到足够小即可
+                weight = (self.limit - current - cost) / previous
+                retry_after = window_start + self.window * (1 - weight) - now
+            else:
+                # 需要等到下一个窗口，并让本窗口的计数衰减
+                weight = max(0.0, (self.limit - cost) / current) if current else 0.0
+                retry_after = window_start + self.window * (2 - weight) - now
+
+        result = RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=max(0, int(self.limit - estimated)),
+            reset_after=window_start + self.window - now if current else 0.0,
+            retry_after=max(0.0, retry_after),
+            policy=self.describe(),
+        )
+        return (window_start, previous, current), result
+
+
+class MemoryRateLimitBackend:
+    """进程内限流状态"""
+
+    # 只做内存操作，可以直接在事件循环中调用
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._states: Dict[str, Tuple[State, float]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, policy: Any, now: float, cost: int = 1) -> RateLimitResult:
+        with self._lock:
+            entry = self._states.get(key)
+            state = entry[0] if entry is not None and entry[1] > now else None
+            new_state, result = policy.evaluate(state, now, cost)
+            self._states[key] = (new_state, now + policy.ttl)
+            if len(self._states) > self.max_keys:
+                self._purge(now)
+            return result
+
+    def _purge(self, now: float) -> None:
+        expired = [key for key, (_, expires_at) in self._states.items() if expires_at <= now]
+        for key in expired:
+            del self._states[key]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+
+class SQLiteRateLimitBackend:
+    """基于SQLite的限流状态，同一台机器上的多个worker进程共享
+
+    Args:
+        path: 数据库文件路径
+        purge_interval: 每处理多少次请求清理一次过期状态
+    """
+
+    # 读写数据库文件（可能等待其他进程的写锁），需要在线程池中调用
+    blocking = True
+
+    def __init__(self, path: str, purge_interval: int = 1000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.purge_interval = purge_interval
+        self._hits = 0
+        self._lock = threading.Lock()
+        # 显式管理事务，用 BEGIN IMMEDIATE 保证读-改-写在多进程间是原子的
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                a REAL NOT NULL,
+                b REAL NOT NULL,
+                c REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+
+    def hit(self, key: str, policy: Any, now: float, cost: int = 1) -> RateLimitResult:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT a, b, c, expires_at FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                state = (row[0], row[1], row[2]) if row is not None and row[3] > now else None
+                new_state, result = policy.evaluate(state, now, cost)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, a, b, c, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, *new_state, now + policy.ttl),
+                )
+                self._hits += 1
+                if self._hits % self.purge_interval == 0:
+                    self._conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM rate_limits")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_policy(rule: Dict[str, Any]):
+    """根据规则配置创建限流策略"""
+    policy = rule.get("policy", "token_bucket")
+    if policy == "token_bucket":
+        return TokenBucketPolicy(rate=float(rule["rate"]), burst=int(rule["burst"]))
+    if policy == "sliding_window":
+        return SlidingWindowPolicy(limit=int(rule["limit"]), window=float(rule["window"]))
+    raise ValueError(f"未知的限流策略: {policy}")
+
+
+class RateLimiter:
+    """按规则名和键执行限流
+
+    Args:
+        backend: 限流状态后端
+        rules: 规则名 -> 规则配置（policy、策略参数、key）
+        clock: 当前时间函数，测试时可替换
+    """
+
+    def __init__(self, backend: Any, rules: Dict[str, Dict[str, Any]], clock: Callable[[], float] = time.time):
+        self.backend = backend
+        self.rules = rules
+        self.clock = clock
+        self._policies = {name: build_policy(rule) for name, rule in rules.items()}
+        self._rejected: Dict[str, int] = {}
+
+    def key_type(self, rule_name: str) -> str:
+        """规则的限流键类型：user（按用户）或 ip（按客户端IP）"""
+        return self.rules.get(rule_name, {}).get("key", "user")
+
+    def max_cost(self, rule_name: str) -> Optional[int]:
+        """规则单次请求允许扣除的最大额度，规则未配置时返回 None"""
+        policy = self._policies.get(rule_name)
+        return policy.max_cost if policy is not None else None
+
+    def hit(self, rule_name: str, key: str, cost: int = 1) -> Optional[RateLimitResult]:
+        """记录一次请求并返回判定结果，规则未配置时返回 None（不限流）"""
+        policy = self._policies.get(rule_name)
+        if policy is None:
+            return None
+        result = self.backend.hit(f"{rule_name}:{key}", policy, self.clock(), cost)
+        if not result.allowed:
+            self._rejected[rule_name] = self._rejected.get(rule_name, 0) + 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rules": list(self.rules), "rejected": dict(self._rejected)}
+
+
+def rate_limit_headers(result: RateLimitResult) -> Dict[str, str]:
+    """生成标准限流响应头（IETF RateLimit 头草案，被拒绝时附带 Retry-After）"""
+    headers = {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(math.ceil(result.reset_after)),
+        "RateLimit-Policy": result.policy,
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+    return headers
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """获取全局限流器（按配置懒加载），未启用时返回 None"""
+    global _rate_limiter
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        if settings.RATE_LIMIT_BACKEND == "sqlite":
+            backend = SQLiteRateLimitBackend(settings.RATE_LIMIT_SQLITE_PATH)
+        else:
+            backend = MemoryRateLimitBackend()
+        _rate_limiter = RateLimiter(backend, settings.RATE_LIMIT_RULES)
+        app_logger.info(f"限流已启用 [后端: {settings.RATE_LIMIT_BACKEND}, 规则: {', '.join(settings.RATE_LIMIT_RULES)}]")
+    return _rate_limiter
@@ -0,0 +1,290 @@
+"""
+查询路由
+
+在调用agent之前用本地的轻量分类器（长度、代码、URL、关键词等特征）估计问题复杂度，
+为每个查询选择模型和工具集：
+- simple：简短的概念性问题，不挂载工具，直接回答
+- standard：需要查阅文档的问题，只挂载 context7-mcp
+- full：包含URL或较复杂的问题，挂载全部工具
+
+路由在 fastagent.config.yaml 的 routing 节中配置，每个路由对应池中每个实例里预先创建的一个agent。
+"""
+import hashlib
+import re
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.utils.text_utils import extract_urls
+
+ROUTE_SIMPLE = "simple"
+ROUTE_STANDARD = "standard"
+ROUTE_FULL = "full"
+# 分类结果对应的路由未配置时，依次尝试更完整的路由
+_FALLBACKS = {
+    ROUTE_SIMPLE: [ROUTE_SIMPLE, ROUTE_STANDARD, ROUTE_FULL],
+    ROUTE_STANDARD: [ROUTE_STANDARD, ROUTE_FULL],
+    ROUTE_FULL: [ROUTE_FULL],
+}
+
+DEFAULT_DOC_KEYWORDS = [
+    "文档", "用法", "怎么用", "如何使用", "示例", "例子", "参数", "配置", "版本", "安装", "报错", "错误",
+    "api", "sdk", "example", "how to", "usage", "install", "config", "error", "exception", "version",
+]
+DEFAULT_SIMPLE_KEYWORDS = [
+    "是什么", "什么是", "区别", "含义", "解释", "简述", "what is", "difference", "explain", "meaning",
+]
+
+_CODE_PATTERNS = re.compile(
+    r"```|^\s*(def |class |import |from \S+ import |function |const |let |var |public |#include)"
+    r"|Traceback \(most recent call last\)|;\s*$|=>|</\w+>",
+    re.MULTILINE,
+)
+
+
+class QueryFeatures(NamedTuple):
+    """分类器使用的查询特征"""
+    length: int
+    lines: int
+    has_code: bool
+    url_count: int
+    doc_keywords: int
+    simple_keywords: int
+
+
+def _count_keywords(text: str, keywords: Iterable[str]) -> int:
+    return sum(1 for keyword in keywords if keyword in text)
+
+
+class QueryClassifier:
+    """基于规则的查询复杂度分类器
+
+    Args:
+        simple_max_chars: 不超过该长度且没有代码、URL和文档类关键词的问题视为简单问题
+        complex_min_chars: 超过该长度的问题直接使用完整路由
+        doc_keywords: 提示需要查阅文档的关键词
+        simple_keywords: 提示概念性问题的关键词（可放宽简单问题的长度限制）
+    """
+
+    def __init__(
+        self,
+        simple_max_chars: int = 80,
+        complex_min_chars: int = 600,
+        doc_keywords: Optional[List[str]] = None,
+        simple_keywords: Optional[List[str]] = None,
+    ):
+        self.simple_max_chars = simple_max_chars
+        self.complex_min_chars = complex_min_chars
+        self.doc_keywords = [k.lower() for k in (doc_keywords or DEFAULT_DOC_KEYWORDS)]
+        self.simple_keywords = [k.lower() for k in (simple_keywords or DEFAULT_SIMPLE_KEYWORDS)]
+
+    def features(self, query: str) -> QueryFeatures:
+        text = query.lower()
+        return QueryFeatures(
+            length=len(query.strip()),
+            lines=query.strip().count("\n") + 1,
+            has_code=bool(_CODE_PATTERNS.search(query)),
+            url_count=len(extract_urls(query)),
+            doc_keywords=_count_keywords(text, self.doc_keywords),
+            simple_keywords=_count_keywords(text, self.simple_keywords),
+        )
+
+    def classify(self, query: str) -> str:
+        """返回 simple / standard / full 之一"""
+        f = self.features(query)
+        if f.url_count or f.length > self.complex_min_chars:
+            return ROUTE_FULL
+        if f.has_code or f.doc_keywords:
+            return ROUTE_STANDARD
+        # 概念性问题允许稍长一些
+        limit = self.simple_max_chars * (2 if f.simple_keywords else 1)
+        if f.length <= limit and f.lines <= 2:
+            return ROUTE_SIMPLE
+        return ROUTE_STANDARD
+
+
+class QueryRoute:
+    """一条路由：使用的模型、工具和计价
+
+    Args:
+        name: 路由名
+        model: fast-agent 模型字符串
+        servers: 挂载的MCP服务器
+        instruction: 该路由agent的系统提示词
+        input_cost_per_1k: 每1000个输入token的价格
+        output_cost_per_1k: 每1000个输出token的价格
+        cached_input_cost_per_1k: 每1000个命中提供商前缀缓存的输入token的价格，默认与 input_cost_per_1k 相同
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        servers: List[str],
+        instruction: str,
+        input_cost_per_1k: float = 0.0,
+        output_cost_per_1k: float = 0.0,
+        cached_input_cost_per_1k: Optional[float] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.servers = list(servers)
+        self.instruction = instruction
+        self.input_cost_per_1k = input_cost_per_1k
+        self.output_cost_per_1k = output_cost_per_1k
+        self.cached_input_cost_per_1k = input_cost_per_1k if cached_input_cost_per_1k is None else cached_input_cost_per_1k
+        # 提示词或工具变更后旧的缓存答案自动失效
+        self.instruction_version = hashlib.sha256(
+            f"{instruction}\n{','.join(self.servers)}".encode("utf-8")
+        ).hexdigest()[:12]
+
+    @property
+    def agent_name(self) -> str:
+        return f"tech_assistant_{self.name}"
+
+    def cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """估计的调用成本，cached_tokens 为 prompt_tokens 中命中提供商前缀缓存的部分"""
+        return (
+            (prompt_tokens - cached_tokens) * self.input_cost_per_1k
+            + cached_tokens * self.cached_input_cost_per_1k
+            + completion_tokens * self.output_cost_per_1k
+        ) / 1000
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """输入token中命中提供商前缀缓存的部分（OpenAI 为 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens）"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return cached or getattr(usage, "prompt_cache_hit_tokens", None) or 0
+
+
+def count_tokens(usages: List[Any]) -> Tuple[int, int, int]:
+    """汇总一次调用中每轮模型请求的 usage，返回 (输入token, 输出token, 命中缓存的输入token)"""
+    usages = [u for u in usages if u is not None]
+    return (
+        sum(getattr(u, "prompt_tokens", 0) or 0 for u in usages),
+        sum(getattr(u, "completion_tokens", 0) or 0 for u in usages),
+        sum(cached_prompt_tokens(u) for u in usages),
+    )
+
+
+def percentile(values: List[float], percentile: float) -> Optional[float]:
+    """最近邻秩法计算分位数（percentile 取 0-100），没有数据时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class RouteStats:
+    """单条路由的延迟和成本统计（延迟分位数基于最近的 window 次调用）"""
+
+    def __init__(self, window: int = 500):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.total_latency = 0.0
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def record(
+        self, latency: float, prompt_tokens: int, completion_tokens: int, cost: float, ok: bool, cached_tokens: int = 0
+    ) -> None:
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_latency += latency
+        self._latencies.append(latency)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.cost += cost
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        p50 = percentile(latencies, 50)
+        p95 = percentile(latencies, 95)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency": round(self.total_latency / self.requests, 3) if self.requests else None,
+            "p50_latency": round(p50, 3) if p50 is not None else None,
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "total_cost": round(self.cost, 6),
+            "avg_cost": round(self.cost / self.requests, 6) if self.requests else 0.0,
+        }
+
+
+class QueryRouter:
+    """为查询选择路由并记录每条路由的统计
+
+    Args:
+        routes: 路由名 -> 路由
+        default_route: 分类结果及其后备路由都未配置时使用的路由
+        classifier: 查询分类器
+    """
+
+    def __init__(self, routes: Dict[str, QueryRoute], default_route: str, classifier: QueryClassifier):
+        if default_route not in routes:
+            raise ValueError(f"默认路由 {default_route} 未配置")
+        self.routes = routes
+        self.default_route = default_route
+        self.classifier = classifier
+        self._stats = {name: RouteStats() for name in routes}
+        self._lock = threading.Lock()
+
+    def route(self, query: str) -> QueryRoute:
+        tier = self.classifier.classify(query)
+        for name in _FALLBACKS.get(tier, [tier]):
+            if name in self.routes:
+                return self.routes[name]
+        return self.routes[self.default_route]
+
+    def record(self, route: QueryRoute, latency: float, usages: List[Any], ok: bool = True) -> None:
+        """记录一次调用的耗时和用量（usages 为本次调用中每轮模型请求的 usage）"""
+        prompt_tokens, completion_tokens, cached_tokens = count_tokens(usages)
+        cost = route.cost(prompt_tokens, completion_tokens, cached_tokens)
+        with self._lock:
+            self._stats[route.name].record(latency, prompt_tokens, completion_tokens, cost, ok, cached_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: dict(self._stats[name].snapshot(), model=route.model, servers=route.servers)
+                for name, route in self.routes.items()
+            }
+
+
+def build_router(config: Dict[str, Any], default_model: str, instruction_for) -> QueryRouter:
+    """根据 fastagent.config.yaml 的 routing 节创建路由器
+
+    Args:
+        config: routing 配置，为空时只有一条使用默认模型和全部工具的 full 路由
+        default_model: 路由未指定模型时使用的模型
+        instruction_for: 根据工具列表生成系统提示词的函数
+    """
+    route_configs = config.get("routes") or {ROUTE_FULL: {"servers": ["fetch", "context7-mcp"]}}
+    routes = {}
+    for name, route_config in route_configs.items():
+        route_config = route_config or {}
+        servers = route_config.get("servers", [])
+        routes[name] = QueryRoute(
+            name=name,
+            model=route_config.get("model", default_model),
+            servers=servers,
+            instruction=instruction_for(servers),
+            input_cost_per_1k=float(route_config.get("input_cost_per_1k", 0.0)),
+            output_cost_per_1k=float(route_config.get("output_cost_per_1k", 0.0)),
+            cached_input_cost_per_1k=(
+                float(route_config["cached_input_cost_per_1k"]) if "cached_input_cost_per_1k" in route_config else None
+            ),
+        )
+    classifier = QueryClassifier(**(config.get("classifier") or {}))
+    default_route = config.get("default_route", ROUTE_FULL if ROUTE_FULL in routes else next(iter(routes)))
+    return QueryRouter(routes, default_route, classifier)
@@ -0,0 +1,196 @@
+"""
+MCP工具调用结果的记录和复用
+
+生成答案时记录每次工具调用的参数和结果，随助手消息保存到 chat_tool_results；
+重新生成答案时，模型以相同参数调用同一工具且结果仍在有效期内（REGENERATE_TOOL_MAX_AGE，
+可按工具在 REGENERATE_TOOL_MAX_AGES 中单独设置）时直接返回保存的结果，不再调用工具，
+重新生成只花费模型调用的时间。
+"""
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mcp.types import CallToolResult
+
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.models.chat import ChatToolResult
+from app.services import metrics
+from app.services.usage_service import record_tool_call
+
+# 当前调用中记录工具结果的列表，为 None 时不记录
+captured_tool_calls: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "captured_tool_calls", default=None
+)
+
+
+def _call_key(tool_name: str, arguments: Optional[dict]) -> Tuple[str, str]:
+    return tool_name, json.dumps(arguments or {}, ensure_ascii=False, sort_keys=True)
+
+
+def max_age(tool_name: str) -> float:
+    """工具结果的有效期（秒），工具名形如 <服务器>-<工具>，按最长的匹配前缀取值"""
+    matches = [prefix for prefix in settings.REGENERATE_TOOL_MAX_AGES if tool_name.startswith(prefix)]
+    if matches:
+        return settings.REGENERATE_TOOL_MAX_AGES[max(matches, key=len)]
+    return settings.REGENERATE_TOOL_MAX_AGE
+
+
+class ToolResultStats:
+    """工具结果复用统计"""
+
+    def __init__(self):
+        self.reused = 0
+        self.stale = 0
+        self.rerun = 0
+        self.saved_seconds = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "reused": self.reused,
+            "stale": self.stale,
+            "rerun": self.rerun,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+_stats = ToolResultStats()
+
+
+def get_tool_result_stats() -> Dict[str, Any]:
+    """获取工具结果复用统计"""
+    return _stats.snapshot()
+
+
+class StoredToolResults:
+    """一条助手消息保存的工具结果，按工具名和参数查找
+
+    Args:
+        records: 保存的工具结果
+        now: 判断有效期使用的当前时间，默认为调用时的时间
+    """
+
+    def __init__(self, records: Iterable[ChatToolResult], now: Optional[datetime] = None):
+        self._now = now
+        self._entries: Dict[Tuple[str, str], ChatToolResult] = {}
+        for record in records:
+            if not record.is_error:
+                self._entries[_call_key(record.tool_name, json.loads(record.arguments or "{}"))] = record
+        self.reused = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, tool_name: str, arguments: Optional[dict]) -> Optional[Dict[str, Any]]:
+        """返回仍在有效期内的工具结果（记录格式），没有时返回 None"""
+        record = self._entries.get(_call_key(tool_name, arguments))
+        if record is None:
+            return None
+        age = ((self._now or datetime.now()) - record.called_at.replace(tzinfo=None)).total_seconds()
+        if age > max_age(tool_name):
+            self.stale += 1
+            _stats.stale += 1
+            return None
+        self.reused += 1
+        _stats.reused += 1
+        _stats.saved_seconds += record.duration or 0.0
+        return {
+            "tool_name": record.tool_name,
+            "arguments": arguments or {},
+            "result": CallToolResult.model_validate_json(record.result),
+            "is_error": False,
+            "duration": record.duration or 0.0,
+            "called_at": record.called_at,
+        }
+
+
+# 重新生成答案时可复用的工具结果，为 None 时总是调用工具
+stored_tool_results: contextvars.ContextVar[Optional[StoredToolResults]] = contextvars.ContextVar(
+    "stored_tool_results", default=None
+)
+
+
+@contextmanager
+def capture_tool_calls() -> Iterator[List[Dict[str, Any]]]:
+    """记录代码块内agent调用的工具结果（包括复用的结果）"""
+    calls: List[Dict[str, Any]] = []
+    token = captured_tool_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        captured_tool_calls.reset(token)
+
+
+@contextmanager
+def reuse_tool_results(stored: StoredToolResults) -> Iterator[StoredToolResults]:
+    """代码块内agent的工具调用优先使用保存的结果"""
+    token = stored_tool_results.set(stored)
+    try:
+        yield stored
+    finally:
+        stored_tool_results.reset(token)
+
+
+def split_tool_name(name: str, servers: Iterable[str]) -> Tuple[str, str]:
+    """把形如 <服务器>-<工具> 的工具名拆分为 (服务器, 工具)，服务器名本身可能包含 -，按最长的匹配取值"""
+    matches = [server for server in servers if name.startswith(f"{server}-")]
+    if not matches:
+        return "", name
+    server = max(matches, key=len)
+    return server, name[len(server) + 1:]
+
+
+def install_tool_reuse(agent: Any) -> None:
+    """记录agent的MCP工具调用结果，重新生成答案时复用仍在有效期内的结果"""
+    call_tool = agent.call_tool
+    servers = list(getattr(agent, "server_names", None) or [])
+
+    async def call_tool_with_reuse(name: str, arguments: Optional[dict] = None) -> CallToolResult:
+        stored = stored_tool_results.get()
+        entry = stored.lookup(name, arguments) if stored is not None else None
+        if entry is not None:
+            app_logger.info(f"复用保存的工具结果: {name}")
+        else:
+            if stored is not None:
+                _stats.rerun += 1
+            record_tool_call()
+            started = time.monotonic()
+            called_at = datetime.now()
+            result = await call_tool(name, arguments)
+            entry = {
+                "tool_name": name,
+                "arguments": arguments or {},
+                "result": result,
+                "is_error": bool(getattr(result, "isError", False)),
+                "duration": time.monotonic() - started,
+                "called_at": called_at,
+            }
+            metrics.TOOL_CALL_SECONDS.observe(
+                entry["duration"], *split_tool_name(name, servers), "error" if entry["is_error"] else "ok"
+            )
+        calls = captured_tool_calls.get()
+        if calls is not None:
+            calls.append(entry)
+        return entry["result"]
+
+    # 与 install_tool_timeout 相同，替换 aggregator（即agent本身）的 call_tool
+    agent.call_tool = call_tool_with_reuse
+
+
+def to_records(calls: Optional[List[Dict[str, Any]]]) -> List[ChatToolResult]:
+    """把记录的工具调用转换为数据库记录"""
+    return [
+        ChatToolResult(
+            tool_name=call["tool_name"],
+            arguments=json.dumps(call["arguments"], ensure_ascii=False),
+            result=call["result"].model_dump_json(exclude_none=True),
+            is_error=call["is_error"],
+            duration=round(call["duration"], 4),
+            called_at=call["called_at"],
+        )
+        for call in calls or []
+    ]
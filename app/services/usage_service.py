@@ -0,0 +1,233 @@
+"""
+模型用量和成本统计
+
+每次agent调用结束后记录输入、输出和命中提供商前缀缓存的token数、模型请求次数、实际执行的MCP工具调用次数，
+以及按路由价格（fastagent.config.yaml 的 routing 节）估计的成本。用量随助手消息保存到 message_usage，
+同时累加到按用户、日期和路由汇总的 daily_usage（删除消息后汇总仍保留），管理员通过 /api/admin/usage 查看。
+"""
+import contextvars
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app.core.logging import app_logger
+from app.models.chat import ChatMessage
+from app.models.usage import DailyUsage, MessageUsage
+from app.services.routing import QueryRoute, count_tokens
+
+SOURCE_AGENT = "agent"
+SOURCE_CACHE = "cache"
+SOURCE_COALESCED = "coalesced"
+SOURCE_ERROR = "error"
+
+
+class QueryUsage:
+    """一次查询（可能包含多次模型请求和工具调用）的用量"""
+
+    def __init__(self):
+        self.route: Optional[str] = None
+        self.model: Optional[str] = None
+        self.cache_hit = False
+        self.failed = False
+        self.agent_calls = 0
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.tool_calls = 0
+        self.cost = 0.0
+
+    @property
+    def source(self) -> str:
+        """答案的来源：查询失败、调用了模型、命中答案缓存，或等待了另一个请求中相同查询的结果"""
+        if self.failed:
+            return SOURCE_ERROR
+        if self.agent_calls:
+            return SOURCE_AGENT
+        return SOURCE_CACHE if self.cache_hit else SOURCE_COALESCED
+
+    def add_call(self, llm_calls: int, prompt_tokens: int, completion_tokens: int, cached_tokens: int, cost: float) -> None:
+        """累加一次agent调用的用量"""
+        self.agent_calls += 1
+        self.llm_calls += llm_calls
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.cost += cost
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "model": self.model,
+            "source": self.source,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "tool_calls": self.tool_calls,
+            "cost": round(self.cost, 6),
+        }
+
+
+# 当前查询的用量，为 None 时不记录
+current_usage: contextvars.ContextVar[Optional[QueryUsage]] = contextvars.ContextVar("current_usage", default=None)
+
+
+@contextmanager
+def capture_usage() -> Iterator[QueryUsage]:
+    """记录代码块内agent调用的用量
+
+    相同查询合并执行时，用量记录在实际发起调用的请求中，等待结果的请求不重复计算。
+    """
+    usage = QueryUsage()
+    token = current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_usage.reset(token)
+
+
+def set_route(route: QueryRoute, cache_hit: bool = False) -> None:
+    """记录查询选择的路由，以及是否命中答案缓存"""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.route = route.name
+        usage.model = route.model
+        usage.cache_hit = usage.cache_hit or cache_hit
+
+
+def record_call(route: QueryRoute, usages: List[Any]) -> None:
+    """记录一次agent调用的模型用量，usages 为调用中每轮模型请求的 usage"""
+    prompt_tokens, completion_tokens, cached_tokens = count_tokens(usages)
+    cost = route.cost(prompt_tokens, completion_tokens, cached_tokens)
+    app_logger.info(
+        f"模型用量 (路由: {route.name}): 请求 {len(usages)} 次，输入 {prompt_tokens} token"
+        f"（命中缓存 {cached_tokens}），输出 {completion_tokens} token，估计成本 {cost:.6f}"
+    )
+    usage = current_usage.get()
+    if usage is not None:
+        usage.add_call(len(usages), prompt_tokens, completion_tokens, cached_tokens, cost)
+
+
+def record_failure() -> None:
+    """记录查询失败（包括未能调用agent，例如agent池已满），失败前产生的用量仍然计入"""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.failed = True
+
+
+def record_tool_call() -> None:
+    """记录一次实际执行的MCP工具调用（复用保存的结果不计入）"""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.tool_calls += 1
+
+
+def _add_daily(db: Session, user_id: int, day: date, usage: QueryUsage) -> None:
+    """把一次查询的用量累加到当天的汇总（并发写入时由唯一约束合并）"""
+    values = {
+        "queries": 1,
+        "cache_hits": 1 if usage.source == SOURCE_CACHE else 0,
+        "coalesced": 1 if usage.source == SOURCE_COALESCED else 0,
+        "llm_calls": usage.llm_calls,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": usage.cached_tokens,
+        "tool_calls": usage.tool_calls,
+        "cost": usage.cost,
+    }
+    statement = insert(DailyUsage).values(user_id=user_id, day=day, route=usage.route or "", **values)
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id", "day", "route"],
+        set_={name: getattr(DailyUsage, name) + getattr(statement.excluded, name) for name in values},
+    )
+    db.execute(statement)
+
+
+def to_record(
+    db: Session, user_id: int, usage: Optional[QueryUsage], record: Optional[MessageUsage] = None
+) -> Optional[MessageUsage]:
+    """把查询的用量转换为消息的用量记录（record 不为 None 时更新该记录），并累加到当天的汇总（随消息一起提交）"""
+    if usage is None:
+        return record
+    now = datetime.now()
+    _add_daily(db, user_id, now.date(), usage)
+    if record is None:
+        record = MessageUsage(user_id=user_id)
+    record.created_at = now
+    for key, value in usage.to_dict().items():
+        setattr(record, key, value)
+    return record
+
+
+_TOTAL_COLUMNS = (
+    "queries", "cache_hits", "coalesced", "llm_calls", "prompt_tokens", "completion_tokens",
+    "cached_tokens", "tool_calls", "cost",
+)
+GROUP_BY = ("user", "day", "route", "session")
+
+
+def _row(key_names: List[str], values: Any) -> Dict[str, Any]:
+    keys, totals = values[:len(key_names)], values[len(key_names):]
+    row = {name: key.isoformat() if isinstance(key, date) else key for name, key in zip(key_names, keys)}
+    for name, value in zip(_TOTAL_COLUMNS, totals):
+        row[name] = round(value or 0.0, 6) if name == "cost" else int(value or 0)
+    return row
+
+
+def usage_report(
+    db: Session,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[int] = None,
+    group_by: str = "user",
+    limit: int = 100,
+) -> Dict[str, Any]:
+    """按用户、日期、路由或会话汇总用量
+
+    Args:
+        start: 起始日期（含），默认不限
+        end: 结束日期（含），默认不限
+        user_id: 只统计该用户
+        group_by: user、day、route 从每日汇总统计；session 从消息的用量记录统计（不含已删除的消息）
+        limit: 最多返回的分组数
+    """
+    if group_by == "session":
+        columns = [
+            func.count(MessageUsage.message_id),
+            func.sum(case((MessageUsage.source == SOURCE_CACHE, 1), else_=0)),
+            func.sum(case((MessageUsage.source == SOURCE_COALESCED, 1), else_=0)),
+        ] + [func.sum(getattr(MessageUsage, name)) for name in _TOTAL_COLUMNS[3:]]
+        query = db.query(MessageUsage.user_id, ChatMessage.session_id, *columns).join(
+            ChatMessage, ChatMessage.id == MessageUsage.message_id
+        )
+        if start is not None:
+            query = query.filter(func.date(MessageUsage.created_at) >= start.isoformat())
+        if end is not None:
+            query = query.filter(func.date(MessageUsage.created_at) <= end.isoformat())
+        if user_id is not None:
+            query = query.filter(MessageUsage.user_id == user_id)
+        query = query.group_by(MessageUsage.user_id, ChatMessage.session_id)
+        key_names = ["user_id", "session_id"]
+    else:
+        group_column = {"user": DailyUsage.user_id, "day": DailyUsage.day, "route": DailyUsage.route}[group_by]
+        query = db.query(group_column, *[func.sum(getattr(DailyUsage, name)) for name in _TOTAL_COLUMNS])
+        if start is not None:
+            query = query.filter(DailyUsage.day >= start)
+        if end is not None:
+            query = query.filter(DailyUsage.day <= end)
+        if user_id is not None:
+            query = query.filter(DailyUsage.user_id == user_id)
+        query = query.group_by(group_column)
+        key_names = ["user_id" if group_by == "user" else group_by]
+
+    rows = [_row(key_names, row) for row in query.all()]
+    totals = {name: sum(row[name] for row in rows) for name in _TOTAL_COLUMNS}
+    totals["cost"] = round(totals["cost"], 6)
+    # 按日期分组时从最近的一天开始，其他分组按成本从高到低
+    rows.sort(key=lambda row: row["day"] if group_by == "day" else row["cost"], reverse=True)
+    return {"group_by": group_by, "totals": totals, "groups": rows[:limit]}
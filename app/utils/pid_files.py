@@ -0,0 +1,92 @@
+"""
+按进程写入的统计文件
+
+多个进程各自把累计统计写入 {prefix}{pid}.json，读取方汇总目录下的所有文件（计数需要包括已退出的进程）。
+进程重启后旧文件不会被覆盖，为避免文件无限增加，读取方把已退出进程的文件并入自己的汇总文件
+{prefix}rollup-{pid}.json 后删除；读取方退出后，它的汇总文件同样会被其他进程合并。
+"""
+import glob
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import psutil
+
+from app.core.logging import app_logger
+
+ROLLUP = "rollup-"
+
+_lock = threading.Lock()
+
+
+def write_json(path: str, data: Dict[str, Any]) -> None:
+    """先写入临时文件再替换，读取方不会读到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_pid(path: str, prefix: str) -> Optional[int]:
+    """从文件名中取出写入进程（或汇总文件所属进程）的pid"""
+    stem = os.path.basename(path)[len(prefix):-len(".json")]
+    if stem.startswith(ROLLUP):
+        stem = stem[len(ROLLUP):]
+    return int(stem) if stem.isdigit() else None
+
+
+def stats_files(directory: str, prefix: str) -> List[str]:
+    """目录下的所有统计文件，包括汇总文件"""
+    return [
+        path for path in glob.glob(os.path.join(directory, f"{glob.escape(prefix)}*.json"))
+        if file_pid(path, prefix) is not None
+    ]
+
+
+def compact(directory: str, prefix: str, merge: Callable[[List[Dict[str, Any]]], Dict[str, Any]]) -> int:
+    """把已退出进程的统计文件合并到本进程的汇总文件，返回合并的文件数
+
+    先把文件重命名为本进程独有的名字再合并，多个进程同时合并时每个文件只会被一个进程合并。
+
+    Args:
+        directory: 统计文件目录
+        prefix: 文件名前缀
+        merge: 合并多份统计，第一份为本进程已有的汇总（没有时不传入）
+    """
+    with _lock:
+        claimed = []
+        for path in stats_files(directory, prefix):
+            pid = file_pid(path, prefix)
+            if pid == os.getpid() or psutil.pid_exists(pid):
+                continue
+            claimed_path = f"{path}.{os.getpid()}.compacting"
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                # 已被其他进程合并
+                continue
+            claimed.append(claimed_path)
+        if not claimed:
+            return 0
+
+        rollup_path = os.path.join(directory, f"{prefix}{ROLLUP}{os.getpid()}.json")
+        contents = [read_json(path) for path in [rollup_path, *claimed]]
+        try:
+            write_json(rollup_path, merge([data for data in contents if data is not None]))
+        except Exception as e:
+            app_logger.warning(f"合并统计文件失败: {str(e)}")
+            for path in claimed:
+                os.replace(path, path[:-len(f".{os.getpid()}.compacting")])
+            return 0
+        for path in claimed:
+            os.remove(path)
+        return len(claimed)
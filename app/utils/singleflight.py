@@ -0,0 +1,66 @@
+"""
+单飞（single-flight）请求合并工具
+
+相同键的调用正在执行时，后来的调用直接等待已有调用的结果，而不是重复执行。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Flight:
+    """一次正在执行的调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发的异步调用
+
+    每个等待者都通过 asyncio.shield 等待共享任务，某个等待者被取消（例如客户端断开）
+    不会影响其他等待者；只有当所有等待者都离开时，共享任务才会被取消。
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._cancelled = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 func，若相同键的调用已在执行则等待其结果"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            self._leaders += 1
+            flight.task.add_done_callback(lambda task, k=key, f=flight: self._forget(k, f, task))
+        else:
+            self._coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 最后一个等待者也离开了，没有人需要这个结果
+                flight.task.cancel()
+                self._cancelled += 1
+
+    def _forget(self, key: str, flight: _Flight, task: asyncio.Task) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 所有等待者都已离开时异常无人读取，这里读取一次以避免告警
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """合并统计信息"""
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self._leaders,
+            "coalesced": self._coalesced,
+            "cancelled": self._cancelled,
+        }
@@ -49,4 +49,81 @@ def extract_marked_content(text, start_marker="$$$ANSWER_START$$$", end_marker="
         return extracted_content
     else:
         app_logger.warning("未找到特殊标记，返回原始内容")
-        return text 
\ No newline at end of file
+        return text 
+
+
+class AnswerStreamExtractor:
+    """流式提取标记之间的内容
+
+    逐段接收模型输出，只产出 start_marker 与 end_marker 之间的文本。
+    标记可能被拆分在两个分片之间，因此会暂存末尾可能属于标记的部分字符。
+    """
+
+    def __init__(self, start_marker="$$$ANSWER_START$$$", end_marker="$$$ANSWER_END$$$"):
+        self.start_marker = start_marker
+        self.end_marker = end_marker
+        self.raw = ""
+        self.answer = ""
+        self.found_start = False
+        self.found_end = False
+        self._buffer = ""
+        self._leading = True
+
+    def _emit(self, text):
+        # 与 extract_marked_content 一致，去掉答案开头的空白
+        if self._leading:
+            text = text.lstrip()
+            if text:
+                self._leading = False
+        self.answer += text
+        return text
+
+    def feed(self, chunk):
+        """输入一个分片，返回可以立即输出给用户的文本"""
+        if not chunk:
+            return ""
+        self.raw += chunk
+        if self.found_end:
+            return ""
+
+        self._buffer += chunk
+        output = ""
+
+        if not self.found_start:
+            index = self._buffer.find(self.start_marker)
+            if index == -1:
+                # 只保留可能构成开始标记前缀的尾部
+                self._buffer = self._buffer[-(len(self.start_marker) - 1):]
+                return ""
+            self.found_start = True
+            self._buffer = self._buffer[index + len(self.start_marker):]
+
+        index = self._buffer.find(self.end_marker)
+        if index != -1:
+            self.found_end = True
+            output = self._emit(self._buffer[:index].rstrip())
+            self._buffer = ""
+            return output
+
+        # 末尾可能是结束标记的前缀，暂不输出；结束标记前的空白也暂缓输出
+        keep = len(self.end_marker) - 1
+        if len(self._buffer) > keep:
+            segment = self._buffer[:-keep]
+            ready = segment.rstrip()
+            output = self._emit(ready)
+            self._buffer = segment[len(ready):] + self._buffer[-keep:]
+        return output
+
+    def finish(self):
+        """输入结束，返回剩余可输出的文本"""
+        if self.found_start and not self.found_end:
+            remaining = self._emit(self._buffer.rstrip())
+            self._buffer = ""
+            return remaining
+        return ""
+
+    def final_answer(self):
+        """最终答案：找到标记时为标记间内容，否则与 extract_marked_content 一样返回原文"""
+        if self.found_start:
+            return self.answer.strip()
+        return extract_marked_content(self.raw)
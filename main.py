@@ -29,13 +29,20 @@ import time
 
 from app.core.logging import app_logger, log_startup_info, log_request_info, log_error
 from app.core.config import settings
-from app.api.routes import user_router, chat_routes, health, query_router
+from app.api.routes import user_router, chat_routes, health, query_router, job_router, admin_router
 from app.core.database import init_db
 from app.services.user_service import create_initial_admin
 from app.core.database import SessionLocal
 from app.services.mcp_service import retry_verify_mcp_servers
 from app.utils.port_checker import check_port_availability
-from app.services.agent_service import get_agent_instance, close_agent_instance
+from app.services.agent_service import get_agent_pool, close_agent_pool
+from app.services import cassette
+from app.services.job_service import get_job_worker_pool
+from app.services.admission import AdmissionRejectedError
+from app.services.cancellation import ClientDisconnectedError
+from app.services.deadline import deadline_scope, parse_timeout, route_timeout
+from app.services.compression import CompressionMiddleware
+from app.services import metrics
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -55,15 +62,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求截止时间中间件
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """按请求头或路由默认值设置请求的截止时间，供后续各阶段分配剩余时间"""
+    timeout = parse_timeout(
+        request.headers.get(settings.REQUEST_DEADLINE_HEADER), route_timeout(request.url.path)
+    )
+    with deadline_scope(timeout):
+        return await call_next(request)
+
 # 日志中间件
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
-    response = await call_next(request)
-    process_time = (time.time() - start_time) * 1000
+    status_code = 500
+    metrics.HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        process_time = (time.time() - start_time) * 1000
+        metrics.observe_request(request.method, request.scope, status_code, process_time / 1000)
     log_request_info(request.method, request.url.path, response.status_code, process_time)
     return response
 
+# 响应压缩（最后添加，位于最外层，压缩其他中间件处理后的响应）
+app.add_middleware(CompressionMiddleware)
+
 # 使用新的lifespan上下文管理器替代过时的on_event
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -103,37 +130,52 @@ async def lifespan(app: FastAPI):
     if admin_user:
         app_logger.info(f"已创建初始管理员账户: {admin_user.username}")
     
-    # 记录MCP服务器使用SSE连接方式
-    app_logger.info("使用SSE方式连接MCP服务器...")
-    try:
-        await retry_verify_mcp_servers()
-        app_logger.info("MCP服务器已配置为使用SSE连接方式")
-        
-        # 预初始化FastAgent实例
-        app_logger.info("预初始化FastAgent实例...")
-        await get_agent_instance()
-        app_logger.info("FastAgent实例初始化完成，服务器已就绪")
-    except Exception as e:
-        app_logger.error(f"初始化FastAgent实例时出错: {str(e)}")
-        app_logger.warning("继续启动服务器，但Agent功能可能不可用")
+    if cassette.is_replaying():
+        # 回放录像时不需要agent池和MCP服务器
+        app_logger.info(f"回放录像模式，agent调用由 {settings.CASSETTE_DIR} 中的录像 {settings.CASSETTE_NAME} 提供")
+        cassette.get_player()
+    else:
+        # 记录MCP服务器使用SSE连接方式
+        app_logger.info("使用SSE方式连接MCP服务器...")
+        try:
+            await retry_verify_mcp_servers()
+            app_logger.info("MCP服务器已配置为使用SSE连接方式")
+            
+            # 预初始化FastAgent池
+            app_logger.info("预初始化FastAgent池...")
+            await get_agent_pool()
+            app_logger.info("FastAgent池初始化完成，服务器已就绪")
+        except Exception as e:
+            app_logger.error(f"初始化FastAgent池时出错: {str(e)}")
+            app_logger.warning("继续启动服务器，但Agent功能可能不可用")
+    
+    # 启动异步查询任务worker池（会恢复上次未完成的任务）
+    get_job_worker_pool().start()
+    
+    # 定期写入本进程的指标快照，多个worker时由 /metrics 汇总
+    if settings.METRICS_ENABLED:
+        metrics.install_service_metrics()
+        metrics.get_snapshot_writer().start()
     
     yield
     
     # 关闭事件
     app_logger.info("服务器关闭中...")
     
-    # 关闭FastAgent实例
-    app_logger.info("关闭FastAgent实例...")
+    # 停止查询任务worker，执行中的任务会在下次启动时重新排队
+    await get_job_worker_pool().stop()
+    await metrics.get_snapshot_writer().stop()
+    
+    # 关闭FastAgent池
+    app_logger.info("关闭FastAgent池...")
     # 使用超时保护，确保关闭操作不会阻塞太久
     try:
-        # 创建一个带超时的任务来关闭FastAgent实例
-        close_task = asyncio.create_task(close_agent_instance())
-        await asyncio.wait_for(close_task, timeout=10.0)
-        app_logger.info("FastAgent实例关闭成功")
+        await asyncio.wait_for(close_agent_pool(), timeout=10.0)
+        app_logger.info("FastAgent池关闭成功")
     except asyncio.TimeoutError:
-        app_logger.warning("关闭FastAgent实例超时，强制关闭")
+        app_logger.warning("关闭FastAgent池超时，强制关闭")
     except Exception as e:
-        app_logger.error(f"关闭FastAgent实例时出错: {str(e)}")
+        app_logger.error(f"关闭FastAgent池时出错: {str(e)}")
     
     # 恢复原始信号处理器
     signal.signal(signal.SIGINT, original_sigint_handler)
@@ -150,6 +192,8 @@ api_router = APIRouter(prefix="/api")
 # 注册用户和聊天路由
 api_router.include_router(user_router, prefix="/users", tags=["users"])
 api_router.include_router(chat_routes, prefix="/sessions", tags=["chat"])
+api_router.include_router(job_router, prefix="/jobs", tags=["jobs"])
+api_router.include_router(admin_router, prefix="/admin", tags=["admin"])
 
 # 注册健康检查路由（不带/api前缀）
 app.include_router(health, tags=["health"])
@@ -173,9 +217,25 @@ async def http_exception_handler(request, exc):
     app_logger.warning(f"HTTP异常: {exc.status_code} - {exc.detail}")
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
+@app.exception_handler(AdmissionRejectedError)
+async def admission_rejected_handler(request, exc):
+    app_logger.warning(f"请求被准入控制拒绝: {request.url.path} - {str(exc)}")
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(ClientDisconnectedError)
+async def client_disconnected_handler(request, exc):
+    # 客户端已断开，响应不会被收到，499仅用于访问日志
+    app_logger.info(f"客户端在查询完成前断开: {request.url.path}")
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     log_error(f"未处理的异常: {str(exc)}", exc_info=True)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+响应压缩基准测试
+
+从被测服务取得各端点的原始（未压缩）响应，用 app/services/compression.py 中间件相同的方式
+（一次性响应整体压缩，SSE/NDJSON逐片段压缩并flush）按每种可用算法的默认级别和带宽优先级别压缩，
+报告每个端点节省的字节数和每次响应消耗的CPU时间：
+
+- 从服务取得响应：注册一个用户，在一个会话中提出若干问题生成历史，再读取会话详情、历史消息等端点
+- --synthetic：不连接服务，生成包含 N 条长Markdown答案的会话作为响应
+
+用法：
+    python scripts/test/compression_benchmark.py --base-url http://localhost:8002 --questions 10
+    python scripts/test/compression_benchmark.py --synthetic 40 --output compression.json
+
+br 和 zstd 需要安装 brotli、zstandard 包，未安装时只测试 gzip。
+被测服务需关闭限流（RATE_LIMIT_ENABLED=false），建议连接离线替身（见 app/offline）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.core.config import settings
+from app.services.compression import available_encodings, create_encoder
+
+API_PREFIX = "/api"
+# 原始响应不压缩
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def measure(chunks: List[bytes], encoding: str, level: int, repeat: int) -> Dict[str, Any]:
+    """按中间件的方式压缩响应 repeat 次，返回压缩后的字节数和每次的CPU时间中位数"""
+    streamed = len(chunks) > 1
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        started = time.thread_time()
+        encoder = create_encoder(encoding, level)
+        if streamed:
+            output = b"".join(encoder.compress(chunk, flush=True) for chunk in chunks) + encoder.finish()
+        else:
+            output = encoder.compress(chunks[0]) + encoder.finish()
+        samples.append(time.thread_time() - started)
+        size = len(output)
+    original = sum(len(chunk) for chunk in chunks)
+    cpu = statistics.median(samples)
+    return {
+        "encoding": encoding,
+        "level": level,
+        "bytes_in": original,
+        "bytes_out": size,
+        "saved_bytes": original - size,
+        "saved_percent": round((1 - size / original) * 100, 1) if original else 0.0,
+        "cpu_ms": round(cpu * 1000, 3),
+        "cpu_us_per_kb": round(cpu * 1e6 / (original / 1024), 2) if original else 0.0,
+    }
+
+
+def synthetic_payloads(answers: int, seed: int = 1) -> Dict[str, List[bytes]]:
+    """生成包含 answers 条长Markdown答案的会话响应和一次流式查询的事件"""
+    rng = random.Random(seed)
+    words = [
+        "路由", "依赖注入", "中间件", "请求体", "响应模型", "数据库", "会话", "异步", "校验", "异常处理",
+        "FastAPI", "Pydantic", "SQLAlchemy", "uvicorn", "async", "await", "Depends", "HTTPException",
+        "status_code", "response_model", "BaseModel", "Session", "commit", "query", "filter",
+    ]
+
+    def answer(index: int) -> str:
+        parts = [f"# 答案{index}\n"]
+        for section in range(rng.randint(3, 6)):
+            parts.append(f"## {rng.choice(words)}{section}\n")
+            parts.append("".join(rng.choice(words) + rng.choice(["，", "。", " ", "的", "和"]) for _ in range(80)))
+            name = rng.choice(words).lower()
+            parts.append(
+                f"\n```python\n@app.get(\"/{name}/{{item_id}}\")\nasync def read_{name}_{index}(item_id: int):\n"
+                f"    return {{\"{name}\": item_id, \"value\": {rng.randint(0, 10000)}}}\n```\n"
+            )
+            parts += [f"- {rng.choice(words)}：{rng.choice(words)}{rng.choice(words)}" for _ in range(rng.randint(2, 5))]
+        return "\n".join(parts)
+
+    messages = []
+    for index in range(answers):
+        messages.append({"id": 2 * index + 1, "role": "user", "content": f"第{index}个问题：{rng.choice(words)}怎么用？",
+                         "session_id": 1, "created_at": datetime.now().isoformat()})
+        messages.append({"id": 2 * index + 2, "role": "assistant", "content": answer(index),
+                         "session_id": 1, "created_at": datetime.now().isoformat()})
+    history = json.dumps(messages, ensure_ascii=False).encode()
+    session = json.dumps({"id": 1, "title": "基准测试", "messages": messages}, ensure_ascii=False).encode()
+    events = [f"data: {json.dumps({'type': 'session', 'session_id': 1})}\n\n".encode()]
+    for word in answer(answers).split("\n"):
+        events.append(f"data: {json.dumps({'type': 'delta', 'content': word + chr(10)}, ensure_ascii=False)}\n\n".encode())
+    return {
+        "GET /api/sessions/{session_id}": [session],
+        "GET /api/sessions/history/{session_id}": [history],
+        "POST /api/sessions/query/stream": events,
+    }
+
+
+async def server_payloads(client: httpx.AsyncClient, questions: int) -> Dict[str, List[bytes]]:
+    """在被测服务上生成会话历史并取得各端点的原始响应"""
+    username = f"bench_{uuid.uuid4().hex[:6]}"
+    password = "benchmark123"
+    response = await client.post(
+        API_PREFIX + "/users/register",
+        json={"username": username, "email": f"{username}@loadtest.example.com", "password": password},
+    )
+    response.raise_for_status()
+    response = await client.post(API_PREFIX + "/users/token", json={"username": username, "password": password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}", **IDENTITY}
+
+    session_id = None
+    for index in range(questions):
+        body = {"query": f"第{index}个问题：如何在FastAPI中定义路由？", "session_id": session_id}
+        response = await client.post(API_PREFIX + "/sessions/query", headers=headers, json=body)
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+
+    payloads: Dict[str, List[bytes]] = {}
+    endpoints = {
+        "GET /api/sessions/": "/sessions/",
+        "GET /api/sessions/{session_id}": f"/sessions/{session_id}",
+        "GET /api/sessions/{session_id}/messages": f"/sessions/{session_id}/messages",
+        "GET /api/sessions/history/{session_id}": f"/sessions/history/{session_id}",
+    }
+    for name, path in endpoints.items():
+        response = await client.get(API_PREFIX + path, headers=headers)
+        response.raise_for_status()
+        payloads[name] = [response.content]
+
+    # 流式响应按服务端发出的片段记录
+    chunks = []
+    body = {"query": "如何在FastAPI中定义路由？", "session_id": session_id}
+    async with client.stream("POST", API_PREFIX + "/sessions/query/stream", headers=headers, json=body) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            chunks.append(chunk)
+    payloads["POST /api/sessions/query/stream"] = chunks
+    return payloads
+
+
+def run_benchmark(payloads: Dict[str, List[bytes]], repeat: int) -> Dict[str, Any]:
+    """对每个端点按每种算法的默认级别和带宽优先级别压缩"""
+    results = {}
+    for name, chunks in payloads.items():
+        route = name.split(" ", 1)[1]
+        rows = []
+        for encoding in available_encodings():
+            levels = [settings.COMPRESSION_LEVELS[encoding], settings.COMPRESSION_BANDWIDTH_LEVELS[encoding]]
+            for level in dict.fromkeys(levels):
+                rows.append(measure(chunks, encoding, level, repeat))
+        results[name] = {
+            "chunks": len(chunks),
+            "bandwidth_route": route in settings.COMPRESSION_BANDWIDTH_ROUTES,
+            "results": rows,
+        }
+    return {"timestamp": datetime.now().isoformat(), "repeat": repeat, "endpoints": results}
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    for name, endpoint in report["endpoints"].items():
+        marker = "（带宽优先）" if endpoint["bandwidth_route"] else ""
+        print(f"\n{name}{marker}  片段数: {endpoint['chunks']}")
+        print(f"  {'算法':<6}{'级别':>6}{'原始字节':>12}{'压缩后':>10}{'节省':>8}{'CPU(ms)':>10}{'us/KB':>9}")
+        for row in endpoint["results"]:
+            print(
+                f"  {row['encoding']:<6}{row['level']:>8}{row['bytes_in']:>14}{row['bytes_out']:>12}"
+                f"{row['saved_percent']:>9}%{row['cpu_ms']:>10}{row['cpu_us_per_kb']:>10}"
+            )
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    if args.synthetic:
+        payloads = synthetic_payloads(args.synthetic)
+    else:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=httpx.Timeout(300)) as client:
+            payloads = await server_payloads(client, args.questions)
+    report = run_benchmark(payloads, args.repeat)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FastAgent API 响应压缩基准测试")
+    parser.add_argument("--base-url", default="http://localhost:8002", help="被测服务地址")
+    parser.add_argument("--questions", type=int, default=10, help="生成会话历史时提出的问题数")
+    parser.add_argument("--synthetic", type=int, help="不连接服务，生成包含该数量答案的会话")
+    parser.add_argument("--repeat", type=int, default=20, help="每种算法和级别重复压缩的次数")
+    parser.add_argument("--output", help="保存结果的JSON文件")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+FastAgent API 负载测试脚本
+
+按 load_scenarios.yaml 中的场景并发调用API，统计每个端点的吞吐量、p50/p95/p99延迟和错误率：
+- closed（闭环）：固定数量的虚拟用户，每个用户完成一个请求、等待思考时间后再发下一个
+- open（开环）：按泊松过程以固定速率发起请求，不等待之前的请求完成（用于观察过载时的表现）
+
+结果保存为JSON；指定基线时与基线比较，超过阈值的退化会列出并以退出码1结束，可用于发布前检查。
+
+用法：
+    python scripts/test/load_test.py --scenario mixed --output results.json
+    python scripts/test/load_test.py --scenario mixed --save-baseline baseline.json
+    python scripts/test/load_test.py --scenario mixed --baseline baseline.json
+
+被测服务需关闭限流（RATE_LIMIT_ENABLED=false），建议连接离线替身（见 app/offline）以得到可重复的结果。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import yaml
+
+API_PREFIX = "/api"
+DEFAULT_SCENARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_scenarios.yaml")
+
+# 默认退化阈值：延迟和吞吐为相对变化，错误率为绝对变化
+DEFAULT_THRESHOLDS = {
+    "p50_increase": 0.25,
+    "p95_increase": 0.25,
+    "p99_increase": 0.35,
+    "throughput_decrease": 0.15,
+    "error_rate_increase": 0.02,
+    "min_latency_delta": 0.05,  # 延迟增加不足该值（秒）时不视为退化，避免噪声
+}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class EndpointStats:
+    """单个端点的延迟和状态统计"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+
+    def record(self, latency: float, status: str, ok: bool) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        count = len(self.latencies)
+
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput": round(count / duration, 3) if duration > 0 else 0.0,
+            "mean": rounded(sum(self.latencies) / count) if count else None,
+            "p50": rounded(percentile(self.latencies, 50)),
+            "p95": rounded(percentile(self.latencies, 95)),
+            "p99": rounded(percentile(self.latencies, 99)),
+            "max": rounded(max(self.latencies)) if count else None,
+            "statuses": dict(sorted(self.statuses.items())),
+        }
+
+
+class Recorder:
+    """按端点收集结果"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+
+    def record(self, name: str, latency: float, status: str, ok: bool) -> None:
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = EndpointStats()
+        stats.record(latency, status, ok)
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        total = EndpointStats()
+        for name, stats in self.endpoints.items():
+            if ":" in name:
+                # 派生指标（如流式首个片段时间）不是独立的请求
+                continue
+            for latency in stats.latencies:
+                total.latencies.append(latency)
+            total.errors += stats.errors
+            for status, count in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + count
+        return {
+            "endpoints": {name: stats.summary(duration) for name, stats in sorted(self.endpoints.items())},
+            "total": total.summary(duration),
+        }
+
+
+class VirtualUser:
+    """一个虚拟用户：持有令牌和自己的会话"""
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.token: Optional[str] = None
+        self.sessions: List[int] = []
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+
+class LoadTest:
+    """按场景执行负载测试
+
+    Args:
+        client: 指向被测服务的HTTP客户端
+        scenario: 场景配置（见 load_scenarios.yaml）
+        rng: 随机数生成器
+    """
+
+    def __init__(self, client: httpx.AsyncClient, scenario: Dict[str, Any], rng: Optional[random.Random] = None):
+        self.client = client
+        self.scenario = scenario
+        self.rng = rng or random.Random(scenario.get("seed"))
+        self.recorder = Recorder()
+        self.users: List[VirtualUser] = []
+        self.operations: Dict[str, Callable[[VirtualUser], Awaitable[None]]] = {
+            "login": self.login,
+            "create_session": self.create_session,
+            "list_sessions": self.list_sessions,
+            "query": self.query,
+            "query_stream": self.query_stream,
+            "history": self.history,
+            "bulk_delete": self.bulk_delete,
+        }
+        weights = scenario.get("weights") or {"query": 1}
+        unknown = set(weights) - set(self.operations)
+        if unknown:
+            raise ValueError(f"未知的操作: {', '.join(sorted(unknown))}")
+        self._names = list(weights)
+        self._weights = [float(weights[name]) for name in self._names]
+        queries = scenario.get("queries") or ["什么是Python？"]
+        self._queries = [q if isinstance(q, dict) else {"text": q, "weight": 1} for q in queries]
+
+    async def _request(self, name: str, method: str, path: str, user: Optional[VirtualUser] = None, **kwargs) -> Optional[httpx.Response]:
+        """发送请求并记录延迟和状态，2xx视为成功"""
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, API_PREFIX + path, headers=user.headers if user else None, **kwargs
+            )
+        except httpx.HTTPError as e:
+            self.recorder.record(name, time.perf_counter() - start, type(e).__name__, False)
+            return None
+        self.recorder.record(name, time.perf_counter() - start, str(response.status_code), response.is_success)
+        return response
+
+    # 场景操作
+
+    async def login(self, user: VirtualUser) -> None:
+        response = await self._request(
+            "login", "POST", "/users/token", json={"username": user.username, "password": user.password}
+        )
+        if response is not None and response.is_success:
+            user.token = response.json()["access_token"]
+
+    async def create_session(self, user: VirtualUser) -> None:
+        response = await self._request("create_session", "POST", "/sessions/", user, json={"title": "load test"})
+        if response is not None and response.is_success:
+            user.sessions.append(response.json()["id"])
+
+    async def list_sessions(self, user: VirtualUser) -> None:
+        await self._request("list_sessions", "GET", "/sessions/", user)
+
+    def _pick_query(self) -> str:
+        return self.rng.choices(self._queries, weights=[q.get("weight", 1) for q in self._queries])[0]["text"]
+
+    def _pick_session(self, user: VirtualUser) -> Optional[int]:
+        return self.rng.choice(user.sessions) if user.sessions else None
+
+    async def query(self, user: VirtualUser) -> None:
+        body = {"query": self._pick_query(), "session_id": self._pick_session(user),
+                "use_cache": bool(self.scenario.get("use_cache", True))}
+        response = await self._request("query", "POST", "/sessions/query", user, json=body)
+        if response is not None and response.is_success and body["session_id"] is None:
+            user.sessions.append(response.json()["session_id"])
+
+    async def query_stream(self, user: VirtualUser) -> None:
+        """流式查询：分别记录首个答案片段的时间和整个流的时间"""
+        body = {"query": self._pick_query(), "session_id": self._pick_session(user),
+                "use_cache": bool(self.scenario.get("use_cache", True))}
+        start = time.perf_counter()
+        first_delta = None
+        status = "200"
+        ok = True
+        try:
+            async with self.client.stream(
+                "POST", API_PREFIX + "/sessions/query/stream", headers=user.headers, json=body
+            ) as response:
+                status = str(response.status_code)
+                ok = response.is_success
+                async for line in response.aiter_lines():
+                    if line.startswith("event: delta") and first_delta is None:
+                        first_delta = time.perf_counter() - start
+                    elif line.startswith("event: error"):
+                        ok = False
+        except httpx.HTTPError as e:
+            status, ok = type(e).__name__, False
+        self.recorder.record("query_stream", time.perf_counter() - start, status, ok)
+        if first_delta is not None:
+            self.recorder.record("query_stream:first_delta", first_delta, status, ok)
+
+    async def history(self, user: VirtualUser) -> None:
+        session_id = self._pick_session(user)
+        if session_id is not None:
+            await self._request("history", "GET", f"/sessions/history/{session_id}", user)
+
+    async def bulk_delete(self, user: VirtualUser) -> None:
+        """删除某个会话中最早的一半消息"""
+        session_id = self._pick_session(user)
+        if session_id is None:
+            return
+        response = await self._request("history", "GET", f"/sessions/history/{session_id}", user)
+        if response is None or not response.is_success:
+            return
+        ids = [message["id"] for message in response.json()]
+        if ids:
+            await self._request(
+                "bulk_delete", "DELETE", f"/sessions/{session_id}/messages", user,
+                json={"message_ids": ids[:max(1, len(ids) // 2)]}
+            )
+
+    # 执行
+
+    async def setup(self) -> None:
+        """注册并登录虚拟用户，每个用户先创建一个会话（不计入结果）"""
+        prefix = self.scenario.get("user_prefix") or f"load_{uuid.uuid4().hex[:6]}"
+        password = self.scenario.get("password", "loadtest123")
+        self.users = [VirtualUser(f"{prefix}_{i}", password) for i in range(int(self.scenario.get("users", 10)))]
+        for user in self.users:
+            response = await self.client.post(
+                API_PREFIX + "/users/register",
+                json={"username": user.username, "email": f"{user.username}@loadtest.example.com", "password": password},
+            )
+            if not response.is_success and response.status_code != 400:
+                # 400表示用户已存在（固定 user_prefix 时复用之前的用户）
+                raise RuntimeError(f"虚拟用户 {user.username} 注册失败: {response.status_code} {response.text}")
+            response = await self.client.post(
+                API_PREFIX + "/users/token", json={"username": user.username, "password": password}
+            )
+            if not response.is_success:
+                raise RuntimeError(f"虚拟用户 {user.username} 登录失败: {response.status_code} {response.text}")
+            user.token = response.json()["access_token"]
+            response = await self.client.post(API_PREFIX + "/sessions/", headers=user.headers, json={"title": "load test"})
+            if response.is_success:
+                user.sessions.append(response.json()["id"])
+        self.recorder = Recorder()
+
+    async def _run_operation(self, user: VirtualUser) -> None:
+        name = self.rng.choices(self._names, weights=self._weights)[0]
+        await self.operations[name](user)
+
+    async def _closed_loop(self, deadline: float) -> None:
+        think_time = float(self.scenario.get("think_time", 0.0))
+
+        async def worker(user: VirtualUser) -> None:
+            while time.perf_counter() < deadline:
+                await self._run_operation(user)
+                if think_time:
+                    await asyncio.sleep(self.rng.expovariate(1.0 / think_time))
+
+        await asyncio.gather(*(worker(user) for user in self.users))
+
+    async def _open_loop(self, deadline: float) -> None:
+        rate = float(self.scenario.get("rate", 1.0))
+        max_in_flight = int(self.scenario.get("max_in_flight", 1000))
+        in_flight: set = set()
+        dropped = 0
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if time.perf_counter() >= deadline:
+                break
+            if len(in_flight) >= max_in_flight:
+                # 客户端自身的保护上限，超出的到达记为丢弃
+                dropped += 1
+                continue
+            task = asyncio.create_task(self._run_operation(self.rng.choice(self.users)))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        self.dropped = dropped
+
+    async def run(self) -> Dict[str, Any]:
+        await self.setup()
+        arrival = self.scenario.get("arrival", "closed")
+        duration = float(self.scenario.get("duration", 60))
+        self.dropped = 0
+        started_at = datetime.now().isoformat()
+        start = time.perf_counter()
+        if arrival == "open":
+            await self._open_loop(start + duration)
+        elif arrival == "closed":
+            await self._closed_loop(start + duration)
+        else:
+            raise ValueError(f"未知的到达模型: {arrival}")
+        elapsed = time.perf_counter() - start
+        report = self.recorder.report(elapsed)
+        report.update(
+            scenario=self.scenario.get("name"),
+            arrival=arrival,
+            users=len(self.users),
+            rate=self.scenario.get("rate") if arrival == "open" else None,
+            duration=round(elapsed, 3),
+            dropped=self.dropped,
+            started_at=started_at,
+        )
+        return report
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], thresholds: Optional[Dict[str, float]] = None) -> List[str]:
+    """与基线比较，返回超过阈值的退化（为空表示通过）"""
+    limits = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    regressions = []
+    sections = {"total": (baseline.get("total"), current.get("total"))}
+    for name, before in (baseline.get("endpoints") or {}).items():
+        sections[name] = (before, (current.get("endpoints") or {}).get(name))
+
+    for name, (before, after) in sections.items():
+        if not before or not after or not before.get("count"):
+            continue
+        for key in ("p50", "p95", "p99"):
+            old, new = before.get(key), after.get(key)
+            if old is None or new is None:
+                continue
+            if new - old > limits["min_latency_delta"] and new > old * (1 + limits[f"{key}_increase"]):
+                regressions.append(f"{name} {key} {old:.3f}s -> {new:.3f}s (+{(new / old - 1) * 100:.0f}%)")
+        if after["error_rate"] - before["error_rate"] > limits["error_rate_increase"]:
+            regressions.append(f"{name} 错误率 {before['error_rate']:.2%} -> {after['error_rate']:.2%}")
+        if before["throughput"] and after["throughput"] < before["throughput"] * (1 - limits["throughput_decrease"]):
+            regressions.append(f"{name} 吞吐量 {before['throughput']:.2f}/s -> {after['throughput']:.2f}/s")
+    return regressions
+
+
+def load_scenario(name: str, path: str = DEFAULT_SCENARIO_FILE) -> Dict[str, Any]:
+    """读取场景配置，场景中未设置的项使用 defaults"""
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    scenarios = config.get("scenarios") or {}
+    if name not in scenarios:
+        raise ValueError(f"{path} 中没有场景 {name}，可用的场景: {', '.join(scenarios) or '无'}")
+    scenario = {**(config.get("defaults") or {}), **(scenarios[name] or {}), "name": name}
+    scenario["thresholds"] = {**(config.get("thresholds") or {}), **(scenario.get("thresholds") or {})}
+    return scenario
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n场景 {report['scenario']}（{report['arrival']}）持续 {report['duration']:.1f}s")
+    print(f"{'端点':<26}{'请求数':>8}{'吞吐/s':>9}{'错误率':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = dict(report["endpoints"], 合计=report["total"])
+    for name, stats in rows.items():
+        def fmt(value):
+            return f"{value:.3f}" if value is not None else "-"
+        print(
+            f"{name:<26}{stats['count']:>8}{stats['throughput']:>9.2f}{stats['error_rate']:>9.2%}"
+            f"{fmt(stats['p50']):>9}{fmt(stats['p95']):>9}{fmt(stats['p99']):>9}"
+        )
+    if report.get("dropped"):
+        print(f"开环模式下因达到 max_in_flight 丢弃的到达: {report['dropped']}")
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    scenario = load_scenario(args.scenario, args.scenarios)
+    for key in ("duration", "users", "rate", "arrival"):
+        value = getattr(args, key)
+        if value is not None:
+            scenario[key] = value
+
+    timeout = httpx.Timeout(float(scenario.get("request_timeout", 300)))
+    limits = httpx.Limits(max_connections=int(scenario.get("max_connections", 200)))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        report = await LoadTest(client, scenario).run()
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, scenario.get("thresholds"))
+        if regressions:
+            print("\n相对基线的退化：")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\n与基线相比没有超过阈值的退化")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FastAgent API 负载测试")
+    parser.add_argument("--base-url", default="http://localhost:8002", help="被测服务地址")
+    parser.add_argument("--scenario", default="mixed", help="场景名")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIO_FILE, help="场景配置文件")
+    parser.add_argument("--arrival", choices=["open", "closed"], help="覆盖场景的到达模型")
+    parser.add_argument("--duration", type=float, help="覆盖场景的持续时间（秒）")
+    parser.add_argument("--users", type=int, help="覆盖场景的虚拟用户数")
+    parser.add_argument("--rate", type=float, help="覆盖开环模式的到达速率（请求/秒）")
+    parser.add_argument("--output", help="保存本次结果的JSON文件")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--baseline", help="与该基线比较，退化超过阈值时退出码为1")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
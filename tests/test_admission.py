@@ -0,0 +1,166 @@
+import asyncio
+import unittest
+
+from app.services.admission import AdmissionController, AdmissionRejectedError, LANE_BATCH, LANE_INTERACTIVE
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    """准入控制测试"""
+
+    async def test_limit_bounds_concurrency(self):
+        """测试同时执行的调用数不超过并发限制"""
+        controller = AdmissionController(initial_limit=2, max_limit=2)
+        running = 0
+        peak = 0
+
+        async def work():
+            nonlocal running, peak
+            async with controller.admit():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        self.assertEqual(peak, 2)
+        stats = controller.stats()
+        self.assertEqual(stats["admitted"], 6)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    async def test_queue_full_rejected(self):
+        """测试等待队列已满时立即拒绝"""
+        controller = AdmissionController(initial_limit=1, max_limit=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with self.assertRaises(AdmissionRejectedError) as ctx:
+            async with controller.admit():
+                pass
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(controller.stats()["rejected_queue_full"], 1)
+        release.set()
+        await asyncio.gather(holder, queued)
+
+    async def test_predicted_wait_exceeds_deadline(self):
+        """测试预计等待时间超过请求时限时提前拒绝"""
+        controller = AdmissionController(initial_limit=1, max_limit=1)
+        async with controller.admit():
+            await asyncio.sleep(0.05)
+
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with self.assertRaises(AdmissionRejectedError):
+            async with controller.admit(max_wait=0.001):
+                pass
+        self.assertEqual(controller.stats()["rejected_deadline"], 1)
+        release.set()
+        await holder
+
+    async def test_limit_adapts_to_latency(self):
+        """测试延迟正常时增加并发限制，延迟超标时减少"""
+        controller = AdmissionController(initial_limit=2, max_limit=8, latency_threshold=0.02)
+        for _ in range(4):
+            async with controller.admit():
+                pass
+        self.assertEqual(controller.limit, 3)
+
+        async with controller.admit():
+            await asyncio.sleep(0.05)
+        self.assertEqual(controller.limit, 2)
+
+    async def test_failure_decreases_limit(self):
+        """测试调用出错时减少并发限制，取消时不调整"""
+        controller = AdmissionController(initial_limit=4, max_limit=8)
+        with self.assertRaises(RuntimeError):
+            async with controller.admit():
+                raise RuntimeError("provider error")
+        self.assertEqual(controller.limit, 3)
+
+        async def cancelled():
+            async with controller.admit():
+                await asyncio.sleep(1)
+
+        task = asyncio.create_task(cancelled())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(controller.limit, 3)
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    async def test_fair_between_users(self):
+        """测试一个用户大量排队时其他用户不必等其全部完成"""
+        controller = AdmissionController(initial_limit=1, max_limit=1, max_user_queue=20)
+        order = []
+
+        async def work(user):
+            async with controller.admit(user=user):
+                order.append(user)
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.create_task(work("heavy")) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(work("light")))
+        await asyncio.gather(*tasks)
+        self.assertLessEqual(order.index("light"), 2)
+
+    async def test_priority_lane_served_first(self):
+        """测试交互通道的请求先于批量通道"""
+        controller = AdmissionController(initial_limit=1, max_limit=1, max_user_in_flight=5)
+        order = []
+
+        async def work(name, lane):
+            async with controller.admit(user=name, lane=lane):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.create_task(work(f"batch{i}", LANE_BATCH)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(work("interactive", LANE_INTERACTIVE)))
+        await asyncio.gather(*tasks)
+        self.assertEqual(order[1], "interactive")
+
+    async def test_user_in_flight_cap(self):
+        """测试单个用户同时执行的调用数不超过上限，超出排队上限返回429"""
+        controller = AdmissionController(initial_limit=4, max_limit=4, max_user_in_flight=1, max_user_queue=2)
+        running = 0
+        peak = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal running, peak
+            async with controller.admit(user=1):
+                running += 1
+                peak = max(peak, running)
+                await release.wait()
+                running -= 1
+
+        tasks = [asyncio.create_task(work()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        with self.assertRaises(AdmissionRejectedError) as ctx:
+            async with controller.admit(user=1):
+                pass
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertEqual(controller.user_stats()["1"]["queued"], 2)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(peak, 1)
+        self.assertEqual(controller.user_stats()["1"]["admitted"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
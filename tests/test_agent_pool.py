@@ -0,0 +1,195 @@
+import asyncio
+import unittest
+from contextlib import asynccontextmanager
+
+from app.services.agent_pool import AgentPool, AgentPoolTimeoutError
+from app.services.agent_supervisor import AgentSupervisor
+
+
+class FakeAgentFactory:
+    """模拟 FastAgent.run() 的上下文工厂"""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+
+    def __call__(self):
+        @asynccontextmanager
+        async def run():
+            self.created += 1
+            instance = FakeAgent(self.created)
+            try:
+                yield instance
+            finally:
+                instance.closed = True
+                self.closed += 1
+        return run()
+
+
+class FakeAgent:
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+
+class TestAgentPool(unittest.IsolatedAsyncioTestCase):
+    """agent池单元测试"""
+
+    async def test_start_only_once(self):
+        """测试并发初始化只创建一次实例"""
+        factory = FakeAgentFactory()
+        pool = AgentPool(factory, size=3)
+        await asyncio.gather(pool.start(), pool.start(), pool.start())
+        self.assertEqual(factory.created, 3)
+        await pool.close()
+        self.assertEqual(factory.closed, 3)
+
+    async def test_checkout_and_stats(self):
+        """测试借用、归还和统计"""
+        pool = AgentPool(FakeAgentFactory(), size=2)
+        async with pool.checkout() as first:
+            async with pool.checkout() as second:
+                self.assertIsNot(first, second)
+                stats = pool.stats()
+                self.assertEqual(stats["busy"], 2)
+                self.assertEqual(stats["idle"], 0)
+        stats = pool.stats()
+        self.assertEqual(stats["busy"], 0)
+        self.assertEqual(stats["total_acquired"], 2)
+        await pool.close()
+
+    async def test_release_unknown_instance(self):
+        """测试归还不属于本池或已归还的实例不影响使用中的计数"""
+        pool = AgentPool(FakeAgentFactory(), size=2)
+        instance = await pool.acquire()
+        pool.release(FakeAgent(99))
+        self.assertEqual(pool.stats()["busy"], 1)
+        pool.release(instance)
+        pool.release(instance)
+        stats = pool.stats()
+        self.assertEqual(stats["busy"], 0)
+        self.assertEqual(stats["idle"], 2)
+        await pool.close()
+
+    async def test_acquire_timeout(self):
+        """测试池满时等待超时"""
+        pool = AgentPool(FakeAgentFactory(), size=1)
+        instance = await pool.acquire()
+        with self.assertRaises(AgentPoolTimeoutError):
+            await pool.acquire(timeout=0.05)
+        self.assertEqual(pool.stats()["total_timeouts"], 1)
+        self.assertEqual(pool.stats()["waiters"], 0)
+        pool.release(instance)
+        await pool.close()
+
+    async def test_waiter_gets_released_instance(self):
+        """测试归还后等待者可以拿到实例"""
+        pool = AgentPool(FakeAgentFactory(), size=1)
+        instance = await pool.acquire()
+        waiter = asyncio.create_task(pool.acquire(timeout=1))
+        await asyncio.sleep(0)
+        self.assertEqual(pool.stats()["waiters"], 1)
+        pool.release(instance)
+        self.assertIs(await waiter, instance)
+        pool.release(instance)
+        await pool.close()
+
+
+class TestAgentRecycling(unittest.IsolatedAsyncioTestCase):
+    """agent实例重建和监督测试"""
+
+    async def test_replace_waits_for_in_flight_call(self):
+        """测试替换后新请求使用新实例，进行中的调用结束后才关闭旧实例"""
+        factory = FakeAgentFactory()
+        pool = AgentPool(factory, size=1)
+        old = await pool.acquire()
+        self.assertTrue(await pool.replace(old))
+        new = await pool.acquire(timeout=1)
+        self.assertIsNot(new, old)
+        self.assertFalse(old.closed)
+
+        pool.release(old)
+        await asyncio.sleep(0.01)
+        self.assertTrue(old.closed)
+        pool.release(new)
+        self.assertEqual(pool.stats()["replaced"], {"manual": 1})
+        await pool.close()
+        self.assertEqual(factory.closed, 2)
+
+    async def test_idle_instance_replaced_immediately(self):
+        """测试空闲实例被替换后立即关闭且不再借出"""
+        pool = AgentPool(FakeAgentFactory(), size=1)
+        await pool.start()
+        [old] = pool.instances()
+        await pool.replace(old)
+        await asyncio.sleep(0.01)
+        self.assertTrue(old.closed)
+        async with pool.checkout(timeout=1) as agent:
+            self.assertEqual(agent.number, 2)
+        await pool.close()
+
+    async def test_recycle_after_max_requests(self):
+        """测试实例处理的请求数达到上限后在后台重建"""
+        pool = AgentPool(FakeAgentFactory(), size=1, max_requests=2)
+        for _ in range(2):
+            async with pool.checkout() as agent:
+                self.assertEqual(agent.number, 1)
+        await asyncio.sleep(0.01)
+        async with pool.checkout() as agent:
+            self.assertEqual(agent.number, 2)
+        self.assertEqual(pool.stats()["replaced"], {"max_requests": 1})
+        await pool.close()
+
+    async def test_failed_rebuild_keeps_old_instance(self):
+        """测试新实例初始化失败时继续使用旧实例"""
+        factory = FakeAgentFactory()
+        pool = AgentPool(factory, size=1)
+        await pool.start()
+        [old] = pool.instances()
+
+        def broken():
+            raise RuntimeError("MCP server unavailable")
+        pool._factory = broken
+        self.assertFalse(await pool.replace(old))
+        self.assertEqual(pool.instances(), [old])
+        self.assertEqual(pool.stats()["replace_failures"], 1)
+        await pool.close()
+
+    async def test_supervisor_replaces_unhealthy_instance(self):
+        """测试健康检查失败的实例被重建"""
+        async def health_check(agent):
+            if not agent.healthy:
+                raise RuntimeError("connection lost")
+
+        pool = AgentPool(FakeAgentFactory(), size=2)
+        await pool.start()
+        first, second = pool.instances()
+        second.healthy = False
+        supervisor = AgentSupervisor(pool, health_check=health_check)
+        await supervisor.check_once()
+        self.assertEqual([agent.number for agent in pool.instances()], [1, 3])
+        self.assertEqual(supervisor.stats()["probe_failures"], 1)
+        self.assertEqual(supervisor.stats()["last_error"], "connection lost")
+        await pool.close()
+
+    async def test_supervisor_recycles_oldest_on_memory_growth(self):
+        """测试进程内存增长超过上限时重建最早的实例"""
+        usage = [100]
+        pool = AgentPool(FakeAgentFactory(), size=2)
+        await pool.start()
+        supervisor = AgentSupervisor(
+            pool, health_check=None, max_memory_growth=50, memory_usage=lambda: usage[0]
+        )
+        await supervisor.check_once()
+        usage[0] = 200
+        await supervisor.check_once()
+        self.assertEqual([agent.number for agent in pool.instances()], [2, 3])
+        await supervisor.check_once()
+        self.assertEqual(len(pool.instances()), 2)
+        self.assertEqual(pool.stats()["replaced"], {"memory": 1})
+        await pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+
+from app.services.batch_service import run_batch
+
+
+class TestRunBatch(unittest.IsolatedAsyncioTestCase):
+    """批量查询执行测试"""
+
+    async def test_completion_order_and_parallelism_cap(self):
+        """测试结果按完成顺序返回，同时执行的条目数不超过上限"""
+        running = 0
+        peak = 0
+
+        async def handler(delay):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(delay)
+            running -= 1
+            return delay
+
+        items = [0.05, 0.01, 0.03, 0.02]
+        results = [(index, result) async for index, result, _ in run_batch(items, handler, parallelism=2)]
+        self.assertEqual(peak, 2)
+        self.assertEqual(sorted(results), list(enumerate(items)))
+        self.assertEqual(results[0], (1, 0.01))
+
+    async def test_errors_returned_per_item(self):
+        """测试单个条目失败不影响其他条目"""
+        async def handler(value):
+            if value < 0:
+                raise ValueError("negative")
+            return value
+
+        results = {index: (result, error) async for index, result, error in run_batch([1, -1, 2], handler, 3)}
+        self.assertEqual(results[0], (1, None))
+        self.assertIsInstance(results[1][1], ValueError)
+        self.assertEqual(results[2], (2, None))
+
+    async def test_same_chain_runs_in_order(self):
+        """测试同一会话的条目按提交顺序依次执行"""
+        order = []
+
+        async def handler(item):
+            session, delay = item
+            order.append(("start", item))
+            await asyncio.sleep(delay)
+            order.append(("end", item))
+            return item
+
+        items = [("a", 0.03), ("b", 0.01), ("a", 0.01)]
+        async for _ in run_batch(items, handler, parallelism=3, chain_key=lambda item: item[0]):
+            pass
+        self.assertLess(order.index(("end", ("a", 0.03))), order.index(("start", ("a", 0.01))))
+        self.assertLess(order.index(("start", ("b", 0.01))), order.index(("end", ("a", 0.03))))
+
+    async def test_stop_iteration_cancels_pending(self):
+        """测试提前停止迭代时取消未完成的条目"""
+        cancelled = []
+
+        async def handler(delay):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        batch = run_batch([0.01, 5], handler, parallelism=2)
+        async for index, _, _ in batch:
+            break
+        await batch.aclose()
+        await asyncio.sleep(0)
+        self.assertEqual(cancelled, [5])
+
+    async def test_on_abandon_receives_pending_tasks(self):
+        """测试提前停止迭代时由 on_abandon 处理未完成的条目"""
+        abandoned = []
+
+        async def handler(delay):
+            await asyncio.sleep(delay)
+            return delay
+
+        batch = run_batch([0.01, 0.05], handler, parallelism=2, on_abandon=abandoned.append)
+        async for index, _, _ in batch:
+            break
+        await batch.aclose()
+        self.assertEqual(len(abandoned), 1)
+        self.assertEqual(await abandoned[0], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from app.services.cache_service import AnswerCache, make_cache_key, normalize_query
+
+
+class TestCacheKey(unittest.TestCase):
+    """缓存键归一化测试"""
+
+    def test_whitespace_and_case_folded(self):
+        """测试空白和大小写不影响缓存键"""
+        self.assertEqual(
+            make_cache_key("How  to configure\nFastAPI ", "deepseek-chat", "v1"),
+            make_cache_key("how to configure fastapi", "deepseek-chat", "v1"),
+        )
+
+    def test_urls_sorted(self):
+        """测试URL顺序不影响缓存键"""
+        first = normalize_query("对比 https://a.example.com/x 和 @https://b.example.com/y")
+        second = normalize_query("对比 @https://b.example.com/y 和 https://a.example.com/x")
+        self.assertEqual(first, second)
+
+    def test_model_and_instruction_version(self):
+        """测试模型和提示词版本参与缓存键"""
+        key = make_cache_key("问题", "deepseek-chat", "v1")
+        self.assertNotEqual(key, make_cache_key("问题", "gpt-4.1", "v1"))
+        self.assertNotEqual(key, make_cache_key("问题", "deepseek-chat", "v2"))
+
+
+class TestAnswerCache(unittest.TestCase):
+    """两级答案缓存测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_memory_lru_eviction(self):
+        """测试内存LRU淘汰"""
+        cache = AnswerCache(memory_size=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.stats()["memory_evictions"], 1)
+
+    def test_disk_tier_survives_restart(self):
+        """测试磁盘缓存在重启后仍然有效"""
+        cache = AnswerCache(disk_path=self.path)
+        cache.set("key", "答案")
+        cache.close()
+
+        reopened = AnswerCache(disk_path=self.path)
+        self.assertEqual(reopened.get("key"), "答案")
+        self.assertEqual(reopened.stats()["disk_hits"], 1)
+        # 第二次从内存命中
+        reopened.get("key")
+        self.assertEqual(reopened.stats()["memory_hits"], 1)
+        reopened.close()
+
+    def test_ttl_expiry(self):
+        """测试过期条目不会返回"""
+        cache = AnswerCache(disk_path=self.path)
+        cache.set("key", "value", ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("key"))
+        stats = cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertGreaterEqual(stats["expired"], 1)
+        cache.close()
+
+    def test_disk_size_bound(self):
+        """测试磁盘缓存超出字节上限时淘汰最久未访问的条目"""
+        cache = AnswerCache(memory_size=1, disk_path=self.path, disk_max_bytes=25)
+        cache.set("a", "x" * 10)
+        time.sleep(0.001)
+        cache.set("b", "y" * 10)
+        time.sleep(0.001)
+        cache.set("c", "z" * 10)
+        stats = cache.stats()
+        self.assertLessEqual(stats["disk_bytes"], 25)
+        self.assertEqual(stats["disk_evictions"], 1)
+        self.assertIsNone(cache.get("a"))
+        cache.close()
+
+    def test_async_disk_io_off_event_loop(self):
+        """测试异步接口在线程池中读写磁盘缓存，内存命中不进入线程池"""
+        cache = AnswerCache(memory_size=1, disk_path=self.path)
+        loop_thread = threading.get_ident()
+        disk_threads = []
+        for name in ("_get_disk", "_set_disk"):
+            original = getattr(cache, name)
+
+            def wrapped(*args, _original=original):
+                disk_threads.append(threading.get_ident())
+                return _original(*args)
+
+            setattr(cache, name, wrapped)
+
+        async def run():
+            await cache.set_async("a", "1")
+            await cache.set_async("b", "2")
+            self.assertEqual(await cache.get_async("b"), "2")
+            calls = len(disk_threads)
+            self.assertEqual(await cache.get_async("a"), "1")
+            return calls
+
+        calls_before_disk_read = asyncio.run(run())
+        # 两次写入磁盘，内存命中 b 不读磁盘，a 已被内存LRU淘汰需要读磁盘
+        self.assertEqual(calls_before_disk_read, 2)
+        self.assertEqual(len(disk_threads), 3)
+        self.assertNotIn(loop_thread, disk_threads)
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        cache.close()
+
+    def test_no_eviction_under_size_bound(self):
+        """测试未超过字节上限时写入不触发淘汰扫描"""
+        cache = AnswerCache(disk_path=self.path, disk_max_bytes=25)
+        with patch.object(cache, "_evict_disk", wraps=cache._evict_disk) as evict:
+            cache.set("a", "x" * 10)
+            cache.set("a", "y" * 10)
+            cache.set("b", "z" * 10)
+            evict.assert_not_called()
+            cache.set("c", "w" * 10)
+            evict.assert_called_once()
+        self.assertLessEqual(cache.stats()["disk_bytes"], 25)
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
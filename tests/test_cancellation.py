@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from app.services import cancellation
+from app.services.cancellation import (
+    POLICY_CANCEL, POLICY_FINISH, ClientDisconnectedError, DisconnectStats, run_until_disconnected,
+)
+
+
+class TestRunUntilDisconnected(unittest.IsolatedAsyncioTestCase):
+    """客户端断开处理测试"""
+
+    def setUp(self):
+        self.stats = DisconnectStats()
+        patcher = patch.object(cancellation, "_stats", self.stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_returns_result_while_connected(self):
+        """测试客户端未断开时正常返回结果并记录耗时"""
+        async def work():
+            await asyncio.sleep(0.02)
+            return "answer"
+
+        async def connected():
+            return False
+
+        result = await run_until_disconnected(work(), connected, poll_interval=0.005)
+        self.assertEqual(result, "answer")
+        await asyncio.sleep(0)
+        self.assertEqual(self.stats.completed, 1)
+        self.assertEqual(self.stats.disconnects, 0)
+
+    async def test_cancel_policy_cancels_call(self):
+        """测试 cancel 策略下断开后取消调用，并按平均耗时估算节省的时间"""
+        self.stats.record_completed(10.0)
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def disconnected():
+            return True
+
+        with self.assertRaises(ClientDisconnectedError):
+            await run_until_disconnected(work(), disconnected, poll_interval=0.01, policy=POLICY_CANCEL)
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        self.assertEqual(self.stats.cancelled, 1)
+        self.assertGreater(self.stats.saved_seconds, 9.0)
+
+    async def test_finish_policy_runs_in_background(self):
+        """测试 finish 策略下断开后调用在后台执行完"""
+        finished = asyncio.Event()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            finished.set()
+            return "answer"
+
+        async def disconnected():
+            return True
+
+        with self.assertRaises(ClientDisconnectedError):
+            await run_until_disconnected(work(), disconnected, poll_interval=0.01, policy=POLICY_FINISH)
+        self.assertEqual(cancellation.get_disconnect_stats()["running_in_background"], 1)
+        await asyncio.wait_for(finished.wait(), timeout=1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.stats.finished_in_background, 1)
+        self.assertEqual(self.stats.cancelled, 0)
+        self.assertEqual(cancellation.get_disconnect_stats()["running_in_background"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
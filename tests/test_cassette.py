@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import httpx
+from mcp.types import CallToolResult, TextContent
+from openai import AsyncOpenAI
+
+from app.offline.llm_server import create_llm_app
+from app.offline.profiles import OfflineProfile, ServiceProfile
+from app.services.cassette import (
+    CassetteMissError, CassettePlayer, CassetteRecorder, Recording, current_recording, install_tool_recorder,
+)
+from app.services.llm_client import _ChatCompletions, stream_sink
+from app.services.llm_failover import LLMProvider, ProviderRegistry
+
+
+class TestCassette(unittest.IsolatedAsyncioTestCase):
+    """agent调用录制和回放测试"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "test.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _completions(self):
+        profile = OfflineProfile("test", {"llm": ServiceProfile(options={"answer_tokens": 3})}, seed=1)
+        client = AsyncOpenAI(
+            api_key="offline", base_url="http://offline/v1", max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=create_llm_app(profile))),
+        )
+        return _ChatCompletions(LLMProvider("offline", client), ProviderRegistry(backups=[]))
+
+    async def _record(self, query="什么是Python？"):
+        """录制一次包含工具调用和流式模型调用的agent调用"""
+        async def call_tool(name, arguments=None):
+            await asyncio.sleep(0.01)
+            return CallToolResult(content=[TextContent(type="text", text="page")])
+
+        agent = SimpleNamespace(call_tool=call_tool)
+        install_tool_recorder(agent)
+        completions = self._completions()
+        deltas = []
+
+        async def run():
+            recording = Recording("key-1", query, "full", "deepseek-chat")
+            current_recording.set(recording)
+            stream_sink.set(deltas.append)
+            await agent.call_tool("fetch-fetch", {"url": "https://example.com"})
+            completion = await completions.create(model="deepseek-chat", messages=[{"role": "user", "content": query}])
+            CassetteRecorder(self.path).save(recording, completion.choices[0].message.content)
+            return completion
+
+        completion = await asyncio.create_task(run())
+        return completion, deltas
+
+    async def test_record_and_replay(self):
+        """测试录制的工具调用、模型响应和流式片段可以按原样回放"""
+        completion, deltas = await self._record()
+        self.assertTrue(deltas)
+
+        player = CassettePlayer.load(self.path, time_scale=0)
+        [recording] = player.recordings
+        self.assertEqual([e["type"] for e in recording["events"]], ["tool", "llm"])
+        self.assertEqual(recording["events"][0]["arguments"], {"url": "https://example.com"})
+
+        replayed, usages = [], []
+        response = await player.play("key-1", "什么是Python？", sink=replayed.append, on_usage=usages.append)
+        self.assertEqual(response, completion.choices[0].message.content)
+        self.assertEqual(replayed, deltas)
+        self.assertEqual(usages[0].completion_tokens, completion.usage.completion_tokens)
+
+    async def test_replay_keeps_scaled_timeline(self):
+        """测试回放按录制的时间线乘以缩放系数等待"""
+        recording = {
+            "key": "k", "query": "q", "duration": 2.0, "response": "answer",
+            "events": [{"type": "llm", "start": 0.5, "duration": 1.0, "deltas": [[0.2, "a"], [0.8, "b"]]}],
+        }
+        slept = []
+
+        async def sleep(seconds):
+            slept.append(seconds)
+
+        player = CassettePlayer([recording], time_scale=0.5, sleep=sleep)
+        self.assertEqual(await player.play("k", "q"), "answer")
+        # 模拟的等待不推进时钟，每次等待的时长即目标时刻：原时间线的一半
+        for seconds, expected in zip(slept, [0.25, 0.35, 0.65, 0.75, 1.0]):
+            self.assertAlmostEqual(seconds, expected, places=2)
+        self.assertEqual(len(slept), 5)
+
+    async def test_miss_policy(self):
+        """测试按查询文本匹配，找不到时按配置依次使用录像或报错"""
+        recordings = [
+            {"key": "k1", "query": "q1", "duration": 0, "response": "a1", "events": []},
+            {"key": "k2", "query": "q2", "duration": 0, "response": "a2", "events": []},
+        ]
+        player = CassettePlayer(recordings, time_scale=0)
+        self.assertEqual(await player.play("other", " q2 "), "a2")
+        self.assertEqual([await player.play("x", "x") for _ in range(3)], ["a1", "a2", "a1"])
+        self.assertEqual(player.stats()["misses"], 3)
+        with self.assertRaises(CassetteMissError):
+            await CassettePlayer(recordings, on_miss="error").play("x", "x")
+
+
+if __name__ == "__main__":
+    unittest.main()
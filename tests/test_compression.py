@@ -0,0 +1,117 @@
+import asyncio
+import json
+import unittest
+import zlib
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.services import compression
+from app.services.compression import CompressionMiddleware, negotiate
+
+
+def _app(events: asyncio.Queue = None):
+    app = FastAPI()
+
+    @app.get("/api/sessions/history/{session_id}")
+    async def history(session_id: int):
+        return [{"id": i, "role": "assistant", "content": "## 标题\n\n" + "长答案内容 " * 100} for i in range(20)]
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def event_stream():
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    # 与 main.py 相同，经过 BaseHTTPMiddleware 时一次性响应也会分成多个片段
+    @app.middleware("http")
+    async def passthrough(request, call_next):
+        return await call_next(request)
+
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+class TestNegotiate(unittest.TestCase):
+    """压缩算法协商测试"""
+
+    def test_negotiate(self):
+        """测试按q值和服务端优先顺序选择算法，不支持或拒绝时不压缩"""
+        self.assertEqual(negotiate("gzip, deflate"), "gzip")
+        self.assertIsNone(negotiate("deflate"))
+        self.assertIsNone(negotiate("gzip;q=0"))
+        self.assertIsNone(negotiate(None))
+        self.assertEqual(negotiate("*"), compression.available_encodings()[0])
+        if "br" in compression.ENCODERS:
+            self.assertEqual(negotiate("gzip, br;q=0.5"), "gzip")
+            self.assertEqual(negotiate("gzip, br"), "br")
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+    """响应压缩中间件测试"""
+
+    async def test_json_compressed_above_threshold(self):
+        """测试较大的JSON响应被压缩，较小的响应不压缩，两者都带 Vary 头"""
+        transport = httpx.ASGITransport(app=_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/api/sessions/history/1", headers={"Accept-Encoding": "gzip"})
+            small = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+            plain = await client.get("/api/sessions/history/1", headers={"Accept-Encoding": "identity"})
+
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(len(response.json()), 20)
+        self.assertLess(int(response.headers["content-length"]), len(plain.content) / 5)
+        self.assertNotIn("content-encoding", small.headers)
+        self.assertEqual(small.headers["vary"], "Accept-Encoding")
+        self.assertNotIn("content-encoding", plain.headers)
+
+        stats = compression.get_compression_stats()["endpoints"]["GET /api/sessions/history/{session_id}"]
+        self.assertGreaterEqual(stats["compressed"], 1)
+        self.assertGreater(stats["saved_bytes"], 0)
+        self.assertEqual(stats["streamed"], 0)
+
+    async def test_stream_not_buffered(self):
+        """测试SSE每个事件压缩后立即发出，客户端收到后即可解压出完整事件"""
+        events: asyncio.Queue = asyncio.Queue()
+        sent: asyncio.Queue = asyncio.Queue()
+        scope = {
+            "type": "http", "method": "GET", "path": "/stream", "raw_path": b"/stream", "query_string": b"",
+            "headers": [(b"accept-encoding", b"gzip")], "http_version": "1.1", "scheme": "http",
+            "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+        }
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        task = asyncio.create_task(_app(events)(scope, receive, sent.put))
+        start = await asyncio.wait_for(sent.get(), 1)
+        self.assertIn((b"content-encoding", b"gzip"), start["headers"])
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for index in range(3):
+            event = f"data: {json.dumps({'type': 'delta', 'content': f'片段{index}'}, ensure_ascii=False)}\n\n"
+            await events.put(event)
+            message = await asyncio.wait_for(sent.get(), 1)
+            self.assertTrue(message["more_body"])
+            self.assertEqual(decompressor.decompress(message["body"]).decode(), event)
+
+        await events.put(None)
+        final = await asyncio.wait_for(sent.get(), 1)
+        self.assertFalse(final["more_body"])
+        decompressor.decompress(final["body"])
+        self.assertTrue(decompressor.eof)
+        await task
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from mcp import types
+from mcp.server.lowlevel import Server
+from mcp.shared.memory import create_connected_server_and_client_session
+
+from app.mcp_servers.context7_proxy import CachingToolProxy, build_proxy_server
+from app.core.config import settings
+from app.services.cache_service import AnswerCache
+from app.services.mcp_service import get_mcp_proxy_stats, write_proxy_stats
+
+
+def build_fake_context7(calls):
+    """模拟 context7-mcp 的本地MCP服务器，记录每次工具调用"""
+    server = Server("fake-context7")
+
+    @server.list_tools()
+    async def list_tools():
+        schema = {"type": "object", "properties": {}}
+        return [
+            types.Tool(name="resolve-library-id", description="resolve", inputSchema=schema),
+            types.Tool(name="get-library-docs", description="docs", inputSchema=schema),
+            types.Tool(name="ping", description="not cached", inputSchema=schema),
+        ]
+
+    @server.call_tool()
+    async def call_tool(name, arguments):
+        calls.append((name, arguments))
+        if arguments.get("fail"):
+            raise RuntimeError("upstream failure")
+        return [types.TextContent(type="text", text=f"{name}:{arguments.get('libraryName', '')}")]
+
+    return server
+
+
+class TestContext7Proxy(unittest.IsolatedAsyncioTestCase):
+    """context7-mcp 缓存代理测试"""
+
+    async def asyncSetUp(self):
+        self.calls = []
+        self.reports = []
+        self.cache = AnswerCache(memory_size=16)
+
+    async def test_results_cached_by_arguments(self):
+        """测试相同参数的调用只转发一次，参数不同或不缓存的工具照常转发"""
+        ttls = {"resolve-library-id": 60, "get-library-docs": 60}
+        async with create_connected_server_and_client_session(build_fake_context7(self.calls)) as upstream:
+            proxy = CachingToolProxy(upstream, self.cache, ttls, on_stats=self.reports.append)
+            async with create_connected_server_and_client_session(build_proxy_server(proxy)) as client:
+                tools = await client.list_tools()
+                self.assertEqual(len(tools.tools), 3)
+
+                first = await client.call_tool("resolve-library-id", {"libraryName": "fastapi"})
+                second = await client.call_tool("resolve-library-id", {"libraryName": "fastapi"})
+                self.assertEqual(first.content[0].text, "resolve-library-id:fastapi")
+                self.assertEqual(second.content[0].text, first.content[0].text)
+
+                await client.call_tool("resolve-library-id", {"libraryName": "pydantic"})
+                await client.call_tool("ping", {})
+                await client.call_tool("ping", {})
+
+        self.assertEqual(
+            [name for name, _ in self.calls],
+            ["resolve-library-id", "resolve-library-id", "ping", "ping"],
+        )
+        stats = proxy.stats()["tools"]["resolve-library-id"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertGreater(stats["saved_seconds"], 0)
+        self.assertTrue(self.reports)
+
+    async def test_errors_not_cached(self):
+        """测试上游返回错误时不缓存，并把错误传给调用方"""
+        ttls = {"get-library-docs": 60}
+        async with create_connected_server_and_client_session(build_fake_context7(self.calls)) as upstream:
+            proxy = CachingToolProxy(upstream, self.cache, ttls)
+            async with create_connected_server_and_client_session(build_proxy_server(proxy)) as client:
+                for _ in range(2):
+                    result = await client.call_tool("get-library-docs", {"fail": True})
+                    self.assertTrue(result.isError)
+                    self.assertIn("upstream failure", result.content[0].text)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(proxy.stats()["tools"]["get-library-docs"]["errors"], 2)
+
+
+class TestProxyStatsFiles(unittest.TestCase):
+    """代理统计文件汇总测试"""
+
+    def test_exited_proxy_stats_compacted(self):
+        """测试已退出代理进程的统计合并到汇总文件，文件数不随进程重启增加"""
+        stats = {"tools": {"get-library-docs": {"hits": 1, "misses": 1, "saved_seconds": 0.5}}}
+        with tempfile.TemporaryDirectory() as directory, patch.object(settings, "MCP_PROXY_STATS_DIR", directory):
+            write_proxy_stats("context7-mcp", stats)
+            for pid in (2 ** 22 + 12345, 2 ** 22 + 12346):
+                with open(os.path.join(directory, f"context7-mcp-{pid}.json"), "w", encoding="utf-8") as f:
+                    json.dump(stats, f)
+            totals = get_mcp_proxy_stats("context7-mcp")
+            files = sorted(os.listdir(directory))
+            again = get_mcp_proxy_stats("context7-mcp")
+
+        self.assertEqual(files, sorted([f"context7-mcp-{os.getpid()}.json", f"context7-mcp-rollup-{os.getpid()}.json"]))
+        for result in (totals, again):
+            self.assertEqual(result["processes"], 1)
+            self.assertEqual(result["hits"], 3)
+            self.assertEqual(result["tools"]["get-library-docs"]["saved_seconds"], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from app.core.config import settings
+from app.services.deadline import (
+    DeadlineExceededError, budget, deadline_scope, install_tool_timeout, parse_timeout, remaining,
+)
+
+
+class TestDeadline(unittest.IsolatedAsyncioTestCase):
+    """请求截止时间测试"""
+
+    def test_parse_timeout(self):
+        """测试请求头中的超时时间无效时使用默认值，过大时截断"""
+        self.assertEqual(parse_timeout("30", 180.0), 30.0)
+        self.assertEqual(parse_timeout("abc", 180.0), 180.0)
+        self.assertEqual(parse_timeout("-1", 180.0), 180.0)
+        self.assertEqual(parse_timeout(None, 180.0), 180.0)
+        self.assertEqual(parse_timeout("100000", 180.0), settings.REQUEST_DEADLINE_MAX)
+
+    def test_nested_scope_keeps_earlier_deadline(self):
+        """测试内层的截止时间不会晚于外层"""
+        self.assertIsNone(remaining())
+        with deadline_scope(10):
+            with deadline_scope(100):
+                self.assertLessEqual(remaining(), 10)
+            with deadline_scope(1):
+                self.assertLessEqual(remaining(), 1)
+            self.assertGreater(remaining(), 1)
+        self.assertIsNone(remaining())
+
+    def test_budget_shares(self):
+        """测试各阶段按比例和预留时间分配剩余时间"""
+        self.assertEqual(budget(0.5, default=30.0), 30.0)
+        with deadline_scope(10):
+            self.assertAlmostEqual(budget(0.5), 5.0, places=1)
+            self.assertAlmostEqual(budget(reserve=2.0), 8.0, places=1)
+            self.assertEqual(budget(0.5, default=1.0), 1.0)
+        with deadline_scope(1):
+            # 剩余时间不足预留时间时不再预留
+            self.assertAlmostEqual(budget(reserve=2.0), 1.0, places=1)
+        with deadline_scope(0):
+            with self.assertRaises(DeadlineExceededError):
+                budget()
+
+    async def test_tool_call_limited_by_deadline(self):
+        """测试工具调用超过剩余时间预算时返回工具错误"""
+        async def slow_tool(name, arguments=None):
+            await asyncio.sleep(5)
+
+        agent = SimpleNamespace(call_tool=slow_tool)
+        install_tool_timeout(agent)
+        with deadline_scope(0.1):
+            result = await agent.call_tool("fetch-fetch", {"url": "https://example.com"})
+        self.assertTrue(result.isError)
+
+
+if __name__ == "__main__":
+    unittest.main()
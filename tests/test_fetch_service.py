@@ -0,0 +1,137 @@
+import tempfile
+import unittest
+
+import httpx
+
+from app.services.fetch_service import FetchError, PageCache, PageFetcher, check_public_url, html_to_markdown
+
+PAGE = """<html><head><title>Doc</title><script>var x = 1;</script></head>
+<body><nav>menu</nav><h1>Guide</h1><p>Use <code>pip install</code> to <a href="/install">install</a>.</p>
+<ul><li>one</li><li>two</li></ul><pre>print("hi")</pre></body></html>"""
+
+
+class TestHtmlToMarkdown(unittest.TestCase):
+    """HTML转Markdown测试"""
+
+    def test_structure_kept_and_noise_removed(self):
+        """测试保留标题、代码、链接和列表，去掉脚本和导航"""
+        markdown = html_to_markdown(PAGE)
+        self.assertIn("# Guide", markdown)
+        self.assertIn("`pip install`", markdown)
+        self.assertIn("[install](/install)", markdown)
+        self.assertIn("- one", markdown)
+        self.assertIn('```\nprint("hi")\n```', markdown)
+        self.assertNotIn("var x", markdown)
+        self.assertNotIn("menu", markdown)
+
+
+class TestPageFetcher(unittest.IsolatedAsyncioTestCase):
+    """带缓存的网页抓取测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.requests = []
+        self.responses = {}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        handler = self.responses[str(request.url)]
+        return handler(request)
+
+    def _fetcher(self, **kwargs) -> PageFetcher:
+        cache = PageCache(self.temp_dir.name, max_bytes=kwargs.pop("max_bytes", 1024 * 1024))
+        # 测试环境没有DNS，默认不检查地址，检查地址的测试使用IP地址
+        kwargs.setdefault("url_guard", None)
+        return PageFetcher(cache, transport=httpx.MockTransport(self._handler), **kwargs)
+
+    async def test_rejects_private_addresses(self):
+        """测试拒绝非 http/https 和非公网地址，包括重定向到内网地址"""
+        for url in [
+            "file:///etc/passwd", "http://127.0.0.1:8002/health", "http://10.0.0.5/", "http://[::1]/",
+            "http://169.254.169.254/latest/meta-data/", "http://[::ffff:192.168.1.1]/",
+        ]:
+            with self.assertRaises(FetchError, msg=url):
+                await check_public_url(url)
+        await check_public_url("https://93.184.216.34/docs")
+
+        self.responses["http://93.184.216.34/old"] = lambda request: httpx.Response(
+            302, headers={"location": "/new"}
+        )
+        self.responses["http://93.184.216.34/new"] = lambda request: httpx.Response(200, text="新页面")
+        self.responses["http://93.184.216.34/metadata"] = lambda request: httpx.Response(
+            302, headers={"location": "http://169.254.169.254/latest/meta-data/"}
+        )
+        fetcher = self._fetcher(url_guard=check_public_url)
+        self.assertEqual((await fetcher.fetch("http://93.184.216.34/old")).content, "新页面")
+        with self.assertRaises(FetchError):
+            await fetcher.fetch("http://93.184.216.34/metadata")
+        with self.assertRaises(FetchError):
+            await fetcher.fetch("http://127.0.0.1/")
+        self.assertNotIn("169.254.169.254", [request.url.host for request in self.requests])
+        self.assertNotIn("127.0.0.1", [request.url.host for request in self.requests])
+
+    async def test_cache_hit_and_conditional_revalidation(self):
+        """测试缓存命中不发请求，过期后用ETag校验并复用内容"""
+        def page(request):
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, text=PAGE, headers={"content-type": "text/html", "etag": '"v1"'})
+
+        self.responses["https://docs.example.com/a"] = page
+        fetcher = self._fetcher(default_ttl=3600)
+        first = await fetcher.fetch("https://docs.example.com/a")
+        second = await fetcher.fetch("https://docs.example.com/a")
+        self.assertFalse(first.from_cache)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first.content_type, "text/markdown")
+        self.assertEqual(len(self.requests), 1)
+
+        # 强制过期后应发送条件请求
+        fetcher.cache.touch("https://docs.example.com/a", ttl=-1)
+        third = await fetcher.fetch("https://docs.example.com/a")
+        self.assertEqual(third.content, first.content)
+        self.assertEqual(self.requests[-1].headers["if-none-match"], '"v1"')
+        self.assertEqual(fetcher.stats()["revalidated"], 1)
+        await fetcher.close()
+
+    async def test_negative_cache(self):
+        """测试失败的URL在退避期内不再发请求"""
+        self.responses["https://down.example.com/"] = lambda request: httpx.Response(503)
+        fetcher = self._fetcher()
+        with self.assertRaises(FetchError):
+            await fetcher.fetch("https://down.example.com/")
+        with self.assertRaises(FetchError):
+            await fetcher.fetch("https://down.example.com/")
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(fetcher.stats()["negative_hits"], 1)
+        await fetcher.close()
+
+    async def test_content_addressed_and_lru_eviction(self):
+        """测试相同内容只保存一份，超出大小上限时淘汰最久未访问的页面"""
+        text = "x" * 400
+        for name in ("a", "b", "c"):
+            self.responses[f"https://example.com/{name}"] = (
+                lambda request, body=text + name: httpx.Response(200, text=body)
+            )
+        self.responses["https://example.com/copy"] = lambda request: httpx.Response(200, text=text + "a")
+
+        fetcher = self._fetcher(max_bytes=1000)
+        await fetcher.fetch("https://example.com/a")
+        await fetcher.fetch("https://example.com/copy")
+        self.assertEqual(fetcher.cache.stats()["blobs"], 1)
+
+        await fetcher.fetch("https://example.com/b")
+        await fetcher.fetch("https://example.com/c")
+        stats = fetcher.cache.stats()
+        self.assertLessEqual(stats["bytes"], 1000)
+        self.assertIsNone(fetcher.cache.lookup("https://example.com/a"))
+        self.assertIsNotNone(fetcher.cache.lookup("https://example.com/c"))
+        await fetcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import patch
+
+import psutil
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base_class import Base
+from app.models.chat import ChatMessage
+from app.models.job import QueryJob
+from app.services import chat_service, job_service
+from app.services.user_service import create_user
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class TestQueryJobs(unittest.IsolatedAsyncioTestCase):
+    """异步查询任务测试"""
+
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.db = TestingSessionLocal()
+        self.user = create_user(self.db, "jobuser", "job@example.com", "password123")
+        self.session_id = chat_service.prepare_query_session(self.db, self.user.id, "问题")
+        self.patches = [
+            patch.object(job_service, "SessionLocal", TestingSessionLocal),
+            patch.object(job_service, "tech_assistant_query", self.fake_query),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    async def fake_query(self, query, use_cache=True, **kwargs):
+        await asyncio.sleep(0.01)
+        return f"$$$ANSWER_START$$$答案: {query}$$$ANSWER_END$$$"
+
+    async def test_job_runs_and_saves_message(self):
+        """测试任务执行后保存答案到会话"""
+        pool = job_service.QueryJobWorkerPool(workers=1)
+        pool.start()
+        job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+        pool.submit(job.id)
+
+        finished = await pool.wait(self.db, job.id, self.user.id, timeout=2)
+        await pool.stop()
+
+        self.assertEqual(finished.status, job_service.JOB_SUCCEEDED)
+        self.assertEqual(finished.answer, "答案: 问题")
+        roles = [m.role for m in self.db.query(ChatMessage).order_by(ChatMessage.id)]
+        self.assertEqual(roles, ["user", "assistant"])
+
+    async def test_agent_failure_marks_job_failed(self):
+        """测试agent调用失败时任务失败，不把错误保存为答案"""
+        async def failing_query(query, raise_errors=False, **kwargs):
+            if not raise_errors:
+                return "$$$ANSWER_START$$$## 处理查询时出错$$$ANSWER_END$$$"
+            raise RuntimeError("模型不可用")
+
+        pool = job_service.QueryJobWorkerPool(workers=1)
+        with patch.object(job_service, "tech_assistant_query", failing_query):
+            pool.start()
+            job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+            pool.submit(job.id)
+            finished = await pool.wait(self.db, job.id, self.user.id, timeout=2)
+            await pool.stop()
+
+        self.assertEqual(finished.status, job_service.JOB_FAILED)
+        self.assertEqual(finished.error, "模型不可用")
+        self.assertIsNone(finished.answer)
+        roles = [m.role for m in self.db.query(ChatMessage)]
+        self.assertEqual(roles, ["user"])
+
+    async def test_interrupted_jobs_recovered(self):
+        """测试进程重启后恢复执行中被中断的任务（执行它的进程已退出）"""
+        job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+        job_service._claim_job(self.db, job.id)
+        self.db.query(QueryJob).filter(QueryJob.id == job.id).update({"worker": "999999999:0.000"})
+        self.db.commit()
+
+        pool = job_service.QueryJobWorkerPool(workers=1)
+        pool.start()
+        finished = await pool.wait(self.db, job.id, self.user.id, timeout=2)
+        await pool.stop()
+
+        self.assertEqual(finished.status, job_service.JOB_SUCCEEDED)
+        self.assertEqual(finished.attempts, 2)
+
+    async def test_running_job_of_live_worker_not_recovered(self):
+        """测试其他仍在运行的进程正在执行的任务不会被恢复，超过租期后才恢复"""
+        job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+        job_service._claim_job(self.db, job.id)
+        # 父进程仍在运行，模拟另一个worker进程
+        other = f"{os.getppid()}:{psutil.Process(os.getppid()).create_time():.3f}"
+        self.db.query(QueryJob).filter(QueryJob.id == job.id).update({"worker": other})
+        self.db.commit()
+
+        pool = job_service.QueryJobWorkerPool(workers=1)
+        pool._recover_jobs()
+        self.assertEqual(pool.queue_depth(), 0)
+        self.db.expire_all()
+        self.assertEqual(self.db.get(QueryJob, job.id).status, job_service.JOB_RUNNING)
+
+        with patch.object(job_service.settings, "QUERY_JOB_LEASE", 0):
+            pool._recover_jobs()
+        self.assertEqual(pool.queue_depth(), 1)
+        self.db.expire_all()
+        self.assertEqual(self.db.get(QueryJob, job.id).status, job_service.JOB_QUEUED)
+
+    async def test_job_runs_once_when_queued_twice(self):
+        """测试多个进程排队同一任务时只执行一次"""
+        calls = []
+
+        async def counting_query(query, **kwargs):
+            calls.append(query)
+            return await self.fake_query(query)
+
+        pool = job_service.QueryJobWorkerPool(workers=2)
+        with patch.object(job_service, "tech_assistant_query", counting_query):
+            pool.start()
+            job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+            pool.submit(job.id)
+            pool.submit(job.id)
+            finished = await pool.wait(self.db, job.id, self.user.id, timeout=2)
+            await pool.stop()
+
+        self.assertEqual(finished.status, job_service.JOB_SUCCEEDED)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.db.query(ChatMessage).filter(ChatMessage.role == "assistant").count(), 1)
+
+    async def test_cancel_queued_job(self):
+        """测试取消排队中的任务"""
+        job = job_service.create_job(self.db, self.user.id, self.session_id, "问题")
+        self.assertTrue(job_service.cancel_job(self.db, job.id, self.user.id))
+        self.assertFalse(job_service._claim_job(self.db, job.id))
+        self.db.expire_all()
+        self.assertEqual(self.db.get(QueryJob, job.id).status, job_service.JOB_CANCELLED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+
+from app.services.deadline import DeadlineExceededError, deadline_scope
+from app.services.llm_client import _ChatCompletions, stream_sink
+from app.services.llm_failover import LLMProvider, ProviderHealth, ProviderRegistry
+
+
+def make_completion(text):
+    return ChatCompletion.model_validate({
+        "id": "c", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+    })
+
+
+def server_error():
+    request = httpx.Request("POST", "https://llm.example.com/v1/chat/completions")
+    return openai.InternalServerError("down", response=httpx.Response(500, request=request), body=None)
+
+
+class FakeClient:
+    """模拟 OpenAI 兼容客户端：按设定的延迟返回答案或抛出异常"""
+
+    def __init__(self, text="ok", delay=0.0, error=None):
+        self.text = text
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self.cancelled = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **arguments):
+        self.calls.append(arguments)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return make_completion(self.text)
+
+
+class TestProviderFailover(unittest.IsolatedAsyncioTestCase):
+    """LLM提供商故障转移和对冲请求测试"""
+
+    def _completions(self, primary_client, backup_client, **registry_kwargs):
+        primary = LLMProvider("primary", primary_client)
+        backup = LLMProvider("backup", backup_client, model="backup-model")
+        registry = ProviderRegistry(backups=[backup], **registry_kwargs)
+        return _ChatCompletions(primary, registry), registry
+
+    async def test_failover_on_server_error(self):
+        """测试主提供商返回服务端错误时切换到备用提供商并使用其模型"""
+        backup_client = FakeClient(text="from backup")
+        completions, registry = self._completions(FakeClient(error=server_error()), backup_client)
+        completion = await completions.create(model="primary-model", messages=[])
+        self.assertEqual(completion.choices[0].message.content, "from backup")
+        self.assertEqual(backup_client.calls[0]["model"], "backup-model")
+        stats = registry.stats()
+        self.assertEqual(stats["failovers"], 1)
+        self.assertEqual(stats["providers"]["primary"]["failures"], 1)
+
+    async def test_non_retryable_error_raised(self):
+        """测试与提供商无关的错误不切换"""
+        backup_client = FakeClient()
+        completions, _ = self._completions(FakeClient(error=ValueError("bad")), backup_client)
+        with self.assertRaises(ValueError):
+            await completions.create(model="m", messages=[])
+        self.assertEqual(backup_client.calls, [])
+
+    async def test_unhealthy_primary_skipped(self):
+        """测试连续失败的提供商在冷却期内排到备用提供商之后"""
+        primary_client = FakeClient(error=server_error())
+        completions, registry = self._completions(
+            primary_client, FakeClient(), health_factory=lambda: ProviderHealth(failure_threshold=2)
+        )
+        for _ in range(3):
+            await completions.create(model="m", messages=[])
+        self.assertEqual(len(primary_client.calls), 2)
+        self.assertFalse(registry.stats()["providers"]["primary"]["available"])
+
+    async def test_hedged_request_wins_and_cancels_primary(self):
+        """测试主提供商变慢时发出对冲请求，先返回的结果生效并取消另一个请求"""
+        primary_client = FakeClient(text="slow", delay=5)
+        completions, registry = self._completions(
+            primary_client, FakeClient(text="fast"), hedge_enabled=True, hedge_default_delay=0.05
+        )
+        completion = await completions.create(model="m", messages=[])
+        self.assertEqual(completion.choices[0].message.content, "fast")
+        await asyncio.sleep(0)
+        self.assertTrue(primary_client.cancelled)
+        stats = registry.stats()
+        self.assertEqual((stats["hedges"], stats["hedge_wins"]), (1, 1))
+
+    async def test_no_hedge_when_primary_fast(self):
+        """测试主提供商在等待时间内返回时不发出对冲请求"""
+        backup_client = FakeClient()
+        completions, registry = self._completions(
+            FakeClient(text="primary"), backup_client, hedge_enabled=True, hedge_default_delay=1
+        )
+        completion = await completions.create(model="m", messages=[])
+        self.assertEqual(completion.choices[0].message.content, "primary")
+        self.assertEqual(backup_client.calls, [])
+        self.assertEqual(registry.stats()["hedges"], 0)
+
+    async def test_hedge_delay_uses_latency_percentile(self):
+        """测试对冲等待时间取主提供商的延迟分位数，并不低于最短等待时间"""
+        registry = ProviderRegistry(
+            backups=[LLMProvider("backup", FakeClient())], hedge_enabled=True,
+            hedge_percentile=95, hedge_min_delay=0.5, hedge_min_samples=5,
+        )
+        primary = LLMProvider("primary", FakeClient())
+        self.assertEqual(registry.hedge_delay(primary), registry.hedge_default_delay)
+        for latency in (1, 2, 3, 4, 10):
+            registry.record_success(primary, latency)
+        self.assertEqual(registry.hedge_delay(primary), 10)
+        self.assertIsNone(ProviderRegistry().hedge_delay(primary))
+
+    async def test_stream_sink_receives_only_one_provider(self):
+        """测试流式调用时只转发一个提供商的输出"""
+        class StreamingClient(FakeClient):
+            async def create(self, stream=False, stream_options=None, **arguments):
+                self.calls.append(arguments)
+                text = self.text
+
+                async def chunks():
+                    await asyncio.sleep(self.delay)
+                    yield SimpleNamespace(
+                        id="c", created=0, model="m", usage=None,
+                        choices=[SimpleNamespace(
+                            delta=SimpleNamespace(content=text, tool_calls=None), finish_reason="stop"
+                        )],
+                    )
+                return chunks()
+
+        received = []
+        stream_sink.set(received.append)
+        try:
+            completions, _ = self._completions(
+                StreamingClient(text="slow", delay=5), StreamingClient(text="fast"),
+                hedge_enabled=True, hedge_default_delay=0.05,
+            )
+            completion = await completions.create(model="m", messages=[])
+        finally:
+            stream_sink.set(None)
+        self.assertEqual(received, ["fast"])
+        self.assertEqual(completion.choices[0].message.content, "fast")
+
+    async def test_no_failover_after_deadline(self):
+        """测试剩余时间用完后不再切换备用提供商，单次请求超时不超过剩余时间"""
+        primary_client = FakeClient(error=server_error(), delay=0.1)
+        backup_client = FakeClient()
+        completions, _ = self._completions(primary_client, backup_client)
+        with deadline_scope(0.05):
+            with self.assertRaises(DeadlineExceededError):
+                await completions.create(model="m", messages=[])
+        self.assertLessEqual(primary_client.calls[0]["timeout"], 0.05)
+        self.assertEqual(backup_client.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import unittest
+
+import httpx
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "test", "load_test.py")
+_spec = importlib.util.spec_from_file_location("load_test", _SCRIPT)
+load_test = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(load_test)
+
+
+def _report(p95=0.5, error_rate=0.0, throughput=10.0):
+    stats = {"count": 100, "error_rate": error_rate, "throughput": throughput, "p50": 0.2, "p95": p95, "p99": p95}
+    return {"endpoints": {"query": stats}, "total": stats}
+
+
+class TestLoadTestStats(unittest.TestCase):
+    """负载测试统计和基线比较测试"""
+
+    def test_percentile(self):
+        """测试最近秩法分位数"""
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(load_test.percentile(values, 50), 50.0)
+        self.assertEqual(load_test.percentile(values, 99), 99.0)
+        self.assertEqual(load_test.percentile([3.0], 95), 3.0)
+        self.assertIsNone(load_test.percentile([], 50))
+
+    def test_compare_detects_regressions(self):
+        """测试延迟、错误率和吞吐量超过阈值时报告退化"""
+        baseline = _report()
+        self.assertEqual(load_test.compare(baseline, _report(p95=0.55)), [])
+        regressions = load_test.compare(baseline, _report(p95=0.9, error_rate=0.05, throughput=5.0))
+        self.assertTrue(any("p95" in line for line in regressions))
+        self.assertTrue(any("错误率" in line for line in regressions))
+        self.assertTrue(any("吞吐量" in line for line in regressions))
+
+    def test_compare_ignores_small_absolute_changes(self):
+        """测试延迟绝对增加很小时不视为退化"""
+        baseline = _report(p95=0.01)
+        self.assertEqual(load_test.compare(baseline, _report(p95=0.03)), [])
+        self.assertTrue(load_test.compare(baseline, _report(p95=0.03), {"min_latency_delta": 0.0}))
+
+    def test_shipped_scenarios_load(self):
+        """测试 load_scenarios.yaml 中的场景都能解析并合并默认值"""
+        for name in ("mixed", "query_only", "crud", "overload"):
+            scenario = load_test.load_scenario(name)
+            self.assertIn("p95_increase", scenario["thresholds"])
+            self.assertTrue(scenario["queries"])
+        with self.assertRaises(ValueError):
+            load_test.load_scenario("missing")
+
+
+class TestLoadTestRun(unittest.TestCase):
+    """使用模拟服务端执行负载测试"""
+
+    def _handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/users/register"):
+            return httpx.Response(201, json={})
+        if path.endswith("/users/token"):
+            return httpx.Response(200, json={"access_token": "token"})
+        if path == "/api/sessions/" and request.method == "POST":
+            return httpx.Response(201, json={"id": 1})
+        if path.startswith("/api/sessions/history/"):
+            return httpx.Response(200, json=[{"id": 1}, {"id": 2}])
+        if path == "/api/sessions/1/messages":
+            self.deleted.append(json.loads(request.content)["message_ids"])
+            return httpx.Response(200, json={"deleted_count": 1})
+        return httpx.Response(500)
+
+    def _run(self, **scenario):
+        self.deleted = []
+        scenario = {"users": 2, "duration": 0.2, "think_time": 0, "seed": 1, **scenario}
+
+        async def run():
+            transport = httpx.MockTransport(self._handler)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await load_test.LoadTest(client, scenario, random.Random(1)).run()
+
+        return asyncio.run(run())
+
+    def test_closed_loop_report(self):
+        """测试闭环模式按端点统计请求数和错误率"""
+        report = self._run(weights={"history": 1, "bulk_delete": 1, "list_sessions": 1})
+        endpoints = report["endpoints"]
+        self.assertGreater(endpoints["history"]["count"], 0)
+        self.assertEqual(endpoints["history"]["error_rate"], 0.0)
+        self.assertEqual(endpoints["list_sessions"]["error_rate"], 1.0)
+        self.assertIn([1], self.deleted)
+        self.assertEqual(report["total"]["count"], sum(e["count"] for e in endpoints.values()))
+
+    def test_open_loop_report(self):
+        """测试开环模式按速率发起请求"""
+        report = self._run(arrival="open", rate=200, weights={"history": 1})
+        self.assertEqual(report["arrival"], "open")
+        self.assertGreater(report["endpoints"]["history"]["count"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
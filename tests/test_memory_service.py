@@ -0,0 +1,99 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api.schemas import MessageCreate
+from app.db.base_class import Base
+from app.models.chat import ChatSessionSummary
+from app.services import chat_service, memory_service
+from app.services.user_service import create_user
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class TestSessionMemory(unittest.TestCase):
+    """会话记忆测试"""
+
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.db = TestingSessionLocal()
+        self.user = create_user(self.db, "memoryuser", "memory@example.com", "password123")
+        self.session_id = chat_service.prepare_query_session(self.db, self.user.id, "什么是FastAPI？")
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def _add(self, role, content):
+        chat_service.add_message(self.db, self.session_id, self.user.id, MessageCreate(role=role, content=content))
+
+    def _add_turns(self, count):
+        for index in range(count):
+            self._add("assistant", f"# 回答{index}\n\n这是第{index}个回答。" + "细节" * 40)
+            self._add("user", f"第{index + 1}个问题")
+
+    def test_estimate_tokens(self):
+        """测试中文按字、其他字符按每4个估计token"""
+        self.assertEqual(memory_service.estimate_tokens("你好"), 2)
+        self.assertEqual(memory_service.estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(memory_service.estimate_tokens(""), 0)
+
+    def test_first_question_has_no_context(self):
+        """测试会话的第一个问题不带上下文，当前问题不计入历史"""
+        self.assertEqual(memory_service.build_session_context(self.db, self.session_id, "什么是FastAPI？"), "")
+        self.assertEqual(memory_service.compose_query("问题", ""), "问题")
+
+    def test_recent_turns_within_budget(self):
+        """测试最近的对话按时间顺序放入上下文"""
+        self._add("assistant", "FastAPI 是一个 Python Web 框架。")
+        self._add("user", "它支持异步吗？")
+        context = memory_service.build_session_context(self.db, self.session_id, "它支持异步吗？")
+        self.assertIn("### 最近的对话", context)
+        self.assertLess(context.index("用户: 什么是FastAPI？"), context.index("助手: FastAPI 是一个"))
+        self.assertNotIn("它支持异步吗", context)
+        self.assertNotIn("摘要", context)
+
+    def test_old_turns_summarized_incrementally(self):
+        """测试超出预算的早期对话压缩进摘要，并随窗口滑动增量更新"""
+        self._add_turns(6)
+        context = memory_service.build_session_context(self.db, self.session_id, token_budget=250)
+        self.assertIn("### 更早对话的摘要", context)
+        self.assertIn("- 用户: 什么是FastAPI？", context)
+        self.assertLessEqual(memory_service.estimate_tokens(context.split("### 最近的对话")[1]), 250)
+        first = self.db.query(ChatSessionSummary).one()
+        first_boundary = first.last_message_id
+
+        self._add_turns(2)
+        context = memory_service.build_session_context(self.db, self.session_id, token_budget=250)
+        summary = self.db.query(ChatSessionSummary).one()
+        self.assertGreater(summary.last_message_id, first_boundary)
+        self.assertIn("助手: 这是第0个回答。；回答0", context)
+
+    def test_summary_respects_budget_and_resets_after_clear(self):
+        """测试摘要不超过预算，清空会话消息后摘要被丢弃"""
+        self._add_turns(10)
+        memory_service.build_session_context(self.db, self.session_id, token_budget=200, summary_tokens=60)
+        summary = self.db.query(ChatSessionSummary).one()
+        self.assertLessEqual(memory_service.estimate_tokens(summary.content), 60)
+
+        chat_service.clear_session_messages(self.db, self.session_id, self.user.id)
+        self.assertEqual(self.db.query(ChatSessionSummary).count(), 0)
+        self.assertEqual(memory_service.build_session_context(self.db, self.session_id), "")
+
+    def test_summary_deleted_with_session(self):
+        """测试删除会话时一并删除摘要"""
+        self._add_turns(6)
+        memory_service.build_session_context(self.db, self.session_id, token_budget=250)
+        self.assertEqual(self.db.query(ChatSessionSummary).count(), 1)
+
+        self.assertTrue(chat_service.delete_session(self.db, self.session_id, self.user.id))
+        self.assertEqual(self.db.query(ChatSessionSummary).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.api.routes.health import router as health_router
+from app.core.config import settings
+from app.services import metrics
+from app.services.metrics import Registry, merge_snapshots, render
+from app.services.tool_results import split_tool_name
+
+
+def _snapshot(pid: int, requests: int, in_flight: int):
+    """模拟一个worker进程写入的快照"""
+    registry = Registry()
+    histogram = registry.histogram("test_seconds", "耗时", ("route",), buckets=(0.1, 1.0))
+    for _ in range(requests):
+        histogram.observe(0.5, "/api/sessions/query")
+    registry.counter("test_total", "次数").inc(amount=requests)
+    registry.gauge("test_in_flight", "执行中").set(in_flight)
+    snapshot = registry.snapshot()
+    snapshot["pid"] = pid
+    return snapshot
+
+
+class TestMetrics(unittest.TestCase):
+    """监控指标测试"""
+
+    def test_render_histogram(self):
+        """测试直方图按累计桶输出，标签值转义"""
+        registry = Registry()
+        histogram = registry.histogram("latency_seconds", "耗时", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, '/a"b')
+        histogram.observe(0.5, '/a"b')
+        histogram.observe(5.0, '/a"b')
+        merged, _ = merge_snapshots([registry.snapshot()])
+        output = render(merged)
+
+        self.assertIn("# TYPE fastagent_latency_seconds histogram", output)
+        self.assertIn('fastagent_latency_seconds_bucket{route="/a\\"b",le="0.1"} 1', output)
+        self.assertIn('fastagent_latency_seconds_bucket{route="/a\\"b",le="1"} 2', output)
+        self.assertIn('fastagent_latency_seconds_bucket{route="/a\\"b",le="+Inf"} 3', output)
+        self.assertIn('fastagent_latency_seconds_count{route="/a\\"b"} 3', output)
+        self.assertIn('fastagent_latency_seconds_sum{route="/a\\"b"} 5.55', output)
+
+    def test_merge_workers(self):
+        """测试汇总多个worker的快照：计数器和直方图包括已退出的进程，仪表只统计仍在运行的进程"""
+        live = _snapshot(os.getpid(), requests=2, in_flight=3)
+        exited = _snapshot(2 ** 22 + 12345, requests=5, in_flight=7)
+        merged, processes = merge_snapshots([live, exited])
+
+        self.assertEqual(processes, 1)
+        self.assertEqual(merged["fastagent_test_total"]["values"][()], 7)
+        self.assertEqual(merged["fastagent_test_in_flight"]["values"][()], 3)
+        counts, total = merged["fastagent_test_seconds"]["values"][("/api/sessions/query",)]
+        self.assertEqual(counts, [0, 7, 0])
+        self.assertAlmostEqual(total, 3.5)
+
+    def test_collect_reads_snapshot_files(self):
+        """测试 /metrics 读取其他worker写入的快照文件"""
+        with tempfile.TemporaryDirectory() as directory, patch.object(settings, "METRICS_DIR", directory):
+            metrics.write_snapshot()
+            other = _snapshot(os.getppid(), requests=1, in_flight=1)
+            with open(os.path.join(directory, f"worker-{os.getppid()}.json"), "w", encoding="utf-8") as f:
+                f.write(json.dumps(other))
+            output = metrics.collect()
+
+        self.assertIn("fastagent_metrics_processes 2", output)
+        self.assertIn("fastagent_test_total 1", output)
+        self.assertIn("# TYPE fastagent_http_request_duration_seconds histogram", output)
+
+    def test_exited_snapshots_compacted(self):
+        """测试已退出进程的快照合并到汇总文件后删除，计数不丢失"""
+        exited_pids = [2 ** 22 + 12345, 2 ** 22 + 12346]
+        with tempfile.TemporaryDirectory() as directory, patch.object(settings, "METRICS_DIR", directory):
+            for pid in exited_pids:
+                with open(os.path.join(directory, f"worker-{pid}.json"), "w", encoding="utf-8") as f:
+                    f.write(json.dumps(_snapshot(pid, requests=2, in_flight=1)))
+            first = metrics.collect()
+            files = sorted(os.listdir(directory))
+            second = metrics.collect()
+
+        self.assertEqual(files, [f"worker-rollup-{os.getpid()}.json"])
+        for output in (first, second):
+            self.assertIn("fastagent_test_total 4", output)
+            self.assertIn('fastagent_test_seconds_count{route="/api/sessions/query"} 4', output)
+            self.assertNotIn("fastagent_test_in_flight", output)
+
+    def test_db_statement_timing(self):
+        """测试按语句类型统计数据库语句耗时"""
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine)
+
+        def count(operation):
+            value = metrics.DB_STATEMENT_SECONDS.samples().get((operation,))
+            return sum(value[0]) if value else 0
+
+        before = count("SELECT"), count("OTHER")
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("  select 2"))
+            conn.execute(text("CREATE TABLE t (id INTEGER)"))
+        self.assertEqual(count("SELECT"), before[0] + 2)
+        self.assertEqual(count("OTHER"), before[1] + 1)
+
+    def test_install_service_metrics_once(self):
+        """测试重复注册已有统计的指标不会报错"""
+        metrics.install_service_metrics()
+        metrics.install_service_metrics()
+        self.assertIn("fastagent_agent_pool_busy", metrics.registry.snapshot()["metrics"])
+
+    def test_monitoring_requires_token(self):
+        """测试 /metrics 和 /health 的详细统计需要监控令牌"""
+        app = FastAPI()
+        app.include_router(health_router)
+        client = TestClient(app)
+        headers = {"Authorization": "Bearer secret-token"}
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(settings, "METRICS_DIR", directory), \
+                patch.object(settings, "MONITORING_TOKEN", "secret-token"):
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+            self.assertEqual(client.get("/metrics", headers=headers).status_code, 200)
+
+            basic = client.get("/health").json()
+            self.assertEqual(basic["status"], "healthy")
+            self.assertNotIn("routing", basic)
+            self.assertIn("routing", client.get("/health", headers=headers).json())
+
+    def test_split_tool_name(self):
+        """测试按服务器名拆分工具名，服务器名可能包含 -"""
+        servers = ["fetch", "context7-mcp"]
+        self.assertEqual(split_tool_name("context7-mcp-get-library-docs", servers), ("context7-mcp", "get-library-docs"))
+        self.assertEqual(split_tool_name("fetch-fetch", servers), ("fetch", "fetch"))
+        self.assertEqual(split_tool_name("unknown", servers), ("", "unknown"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import random
+import unittest
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from app.offline.llm_server import FakeLLM, create_llm_app
+from app.offline.mcp_servers import create_context7_server, create_fetch_server
+from app.offline.profiles import LatencyDistribution, OfflineProfile, ServiceProfile, load_profile
+
+_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "fetch-fetch",
+        "parameters": {
+            "type": "object",
+            "properties": {"url": {"type": "string"}, "max_length": {"type": "integer"}},
+            "required": ["url"],
+        },
+    },
+}]
+
+
+class TestOfflineProfiles(unittest.TestCase):
+    """离线替身配置测试"""
+
+    def test_shipped_profiles_load(self):
+        """测试 fastagent.offline.yaml 中的配置都能解析"""
+        for name in ("instant", "realistic", "degraded"):
+            profile = load_profile(name)
+            self.assertEqual(profile.ports["llm"], 8090)
+            self.assertGreaterEqual(profile.service("llm").latency.sample(profile.rng("llm")), 0.0)
+        with self.assertRaises(ValueError):
+            load_profile("missing")
+
+    def test_latency_sampling_is_reproducible(self):
+        """测试相同种子得到相同的延迟序列，且延迟不为负"""
+        latency = LatencyDistribution.from_config({"distribution": "normal", "mean": 0.1, "stddev": 1.0})
+        first = [latency.sample(random.Random(1)) for _ in range(3)]
+        second = [latency.sample(random.Random(1)) for _ in range(3)]
+        self.assertEqual(first, second)
+        rng = random.Random(2)
+        self.assertTrue(all(latency.sample(rng) >= 0 for _ in range(100)))
+        self.assertEqual(LatencyDistribution.from_config(0.5).sample(rng), 0.5)
+
+
+class TestFakeLLM(unittest.IsolatedAsyncioTestCase):
+    """LLM替身测试：通过 OpenAI 客户端调用"""
+
+    def _client(self, **service_config):
+        profile = OfflineProfile("test", {"llm": ServiceProfile.from_config(service_config)}, seed=1)
+        transport = httpx.ASGITransport(app=create_llm_app(profile))
+        return AsyncOpenAI(
+            api_key="offline", base_url="http://offline/v1",
+            http_client=httpx.AsyncClient(transport=transport), max_retries=0,
+        )
+
+    async def test_marker_wrapped_answer(self):
+        """测试非流式调用返回带标记的答案和用量"""
+        client = self._client(answer_tokens=5)
+        completion = await client.chat.completions.create(
+            model="deepseek-chat", messages=[{"role": "user", "content": "什么是Python？"}]
+        )
+        content = completion.choices[0].message.content
+        self.assertTrue(content.startswith("$$$ANSWER_START$$$"))
+        self.assertTrue(content.endswith("$$$ANSWER_END$$$"))
+        self.assertEqual(completion.usage.completion_tokens, 7)
+
+    async def test_stream_tool_call_then_answer(self):
+        """测试流式调用先返回工具调用，有工具结果后返回答案"""
+        client = self._client(tool_call_rate=1.0, answer_tokens=3)
+        messages = [{"role": "user", "content": "总结 https://example.com/docs"}]
+        stream = await client.chat.completions.create(
+            model="deepseek-chat", messages=messages, tools=_TOOLS, stream=True,
+            stream_options={"include_usage": True},
+        )
+        chunks = [chunk async for chunk in stream]
+        tool_call = next(c.choices[0].delta.tool_calls[0] for c in chunks if c.choices and c.choices[0].delta.tool_calls)
+        self.assertEqual(tool_call.function.name, "fetch-fetch")
+        self.assertIn("https://example.com/docs", tool_call.function.arguments)
+        self.assertIsNotNone(chunks[-1].usage)
+
+        messages += [
+            {"role": "assistant", "tool_calls": [tool_call.model_dump(exclude={"index"})]},
+            {"role": "tool", "tool_call_id": tool_call.id, "content": "page"},
+        ]
+        stream = await client.chat.completions.create(
+            model="deepseek-chat", messages=messages, tools=_TOOLS, stream=True
+        )
+        text = "".join([c.choices[0].delta.content or "" async for c in stream if c.choices])
+        self.assertIn("$$$ANSWER_END$$$", text)
+
+    async def test_fault_injection(self):
+        """测试按错误率返回配置的状态码"""
+        client = self._client(error_rate=1.0, error_status=503)
+        with self.assertRaises(openai.InternalServerError) as context:
+            await client.chat.completions.create(model="m", messages=[{"role": "user", "content": "q"}])
+        self.assertEqual(context.exception.status_code, 503)
+
+    async def test_token_rate_paces_stream(self):
+        """测试按输出速度在分片之间等待"""
+        delays = []
+
+        async def sleep(seconds):
+            delays.append(seconds)
+
+        fake = FakeLLM(ServiceProfile(tokens_per_second=10, options={"answer_tokens": 4}), random.Random(1), sleep)
+        body = {"messages": [{"role": "user", "content": "q"}]}
+        [_ async for _ in fake.stream(body, fake.plan(body))]
+        self.assertEqual(delays.count(0.1), 6)
+
+
+class TestFakeMCPServers(unittest.IsolatedAsyncioTestCase):
+    """MCP替身测试"""
+
+    async def test_fetch_truncates_like_real_server(self):
+        """测试 fetch 替身按 max_length 截断并提示下一个 start_index"""
+        profile = OfflineProfile("test", {"fetch": ServiceProfile(options={"page_chars": 500})})
+        server = create_fetch_server(profile)
+        result = await server.call_tool("fetch", {"url": "https://example.com", "max_length": 100})
+        self.assertIn("start_index of 100", result[0].text)
+
+    async def test_context7_fault_injection(self):
+        """测试 context7 替身按错误率返回工具错误"""
+        profile = OfflineProfile("test", {"context7-mcp": ServiceProfile(error_rate=1.0)})
+        server = create_context7_server(profile)
+        with self.assertRaises(Exception):
+            await server.call_tool("resolve-library-id", {"libraryName": "fastapi"})
+        profile = OfflineProfile("test", {})
+        result = await create_context7_server(profile).call_tool(
+            "get-library-docs", {"context7CompatibleLibraryID": "/offline/fastapi", "tokens": 100}
+        )
+        self.assertLessEqual(len(result[0].text), 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
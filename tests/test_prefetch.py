@@ -0,0 +1,116 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from app.core.config import settings
+from app.services.fetch_service import PageCache, PageFetcher
+from app.services.memory_service import estimate_tokens
+from app.services.prefetch import PrefetchedPage, allocate_budget, prefetch_urls, start_prefetch, trim_to_tokens
+from app.services.routing import QueryClassifier
+
+
+class TestPrefetchBudget(unittest.TestCase):
+    """预先抓取内容的token预算测试"""
+
+    def test_trim_to_tokens(self):
+        """测试截断后的估计token数不超过预算"""
+        text = "中文内容" * 100 + "english words " * 100
+        trimmed = trim_to_tokens(text, 150)
+        self.assertLessEqual(estimate_tokens(trimmed), 150)
+        self.assertGreater(estimate_tokens(trimmed), 140)
+        self.assertEqual(trim_to_tokens("short", 10), "short")
+
+    def test_short_pages_leave_budget_to_long_pages(self):
+        """测试较短页面用不完的预算留给较长的页面，失败的页面不占预算"""
+        pages = [
+            PrefetchedPage("https://a", content="短" * 10),
+            PrefetchedPage("https://b", content="长" * 1000),
+            PrefetchedPage("https://c", error="HTTP 404"),
+        ]
+        allocate_budget(pages, 100)
+        self.assertFalse(pages[0].truncated)
+        self.assertTrue(pages[1].truncated)
+        self.assertTrue(pages[1].content.startswith("长" * 90 + "\n"))
+
+
+class TestPrefetch(unittest.IsolatedAsyncioTestCase):
+    """链接预先抓取测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def _fetcher(self, delays):
+        async def handler(request: httpx.Request) -> httpx.Response:
+            delay = delays.get(str(request.url), 0)
+            await asyncio.sleep(delay)
+            return httpx.Response(200, text=f"<h1>{request.url.path}</h1>", headers={"content-type": "text/html"})
+
+        return PageFetcher(PageCache(self.temp_dir.name), transport=httpx.MockTransport(handler), url_guard=None)
+
+    async def test_concurrent_fetch_with_timeout(self):
+        """测试链接并发抓取，超时和失败的链接单独报告，整体耗时不超过单个链接的超时"""
+        fetcher = await self._fetcher({"https://example.com/slow": 5, "https://example.com/b": 0.2})
+        urls = ["https://example.com/a", "https://example.com/b", "https://example.com/slow"]
+        with patch("app.services.prefetch.get_page_fetcher", return_value=fetcher), \
+                patch.object(settings, "PREFETCH_TIMEOUT", 0.5):
+            start = asyncio.get_running_loop().time()
+            result = await prefetch_urls(urls)
+            elapsed = asyncio.get_running_loop().time() - start
+        await fetcher.close()
+
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual([page.error is None for page in result.pages], [True, True, False])
+        self.assertFalse(result.complete)
+        section = result.section()
+        self.assertIn("# /a", section)
+        self.assertIn("https://example.com/slow", section.split("\n\n")[-1])
+        # 有链接抓取失败时保留URL，仍可使用fetch工具
+        query = "总结 https://example.com/a 的内容"
+        self.assertEqual(result.routing_query(query), query)
+
+    async def test_complete_prefetch_routes_without_fetch(self):
+        """测试链接全部抓取成功时按去掉URL后的问题选择路由"""
+        fetcher = await self._fetcher({})
+        query = "总结 https://example.com/a 的内容"
+        with patch("app.services.prefetch.get_page_fetcher", return_value=fetcher):
+            result = await start_prefetch(query)
+        await fetcher.close()
+
+        self.assertTrue(result.complete)
+        self.assertEqual(result.routing_query(query), "总结 的内容")
+        classifier = QueryClassifier()
+        self.assertEqual(classifier.classify(query), "full")
+        self.assertNotEqual(classifier.classify(result.routing_query(query)), "full")
+
+    async def test_urls_beyond_limit_left_to_fetch_tool(self):
+        """测试超过 PREFETCH_MAX_URLS 的链接不抓取，作为未能预先获取的链接报告，并保留fetch工具"""
+        fetcher = await self._fetcher({})
+        urls = [f"https://example.com/{index}" for index in range(7)]
+        query = "比较这些页面 " + " ".join(urls)
+        with patch("app.services.prefetch.get_page_fetcher", return_value=fetcher), \
+                patch.object(settings, "PREFETCH_MAX_URLS", 5):
+            result = await start_prefetch(query)
+        await fetcher.close()
+
+        self.assertEqual([page.url for page in result.pages], urls[:5])
+        self.assertEqual(result.skipped, urls[5:])
+        self.assertFalse(result.complete)
+        self.assertIn("https://example.com/5、https://example.com/6", result.section().split("\n\n")[-1])
+        self.assertEqual(result.routing_query(query), query)
+        self.assertEqual(QueryClassifier().classify(result.routing_query(query)), "full")
+
+    async def test_disabled_or_no_urls(self):
+        """测试未启用或问题中没有链接时不抓取"""
+        self.assertIsNone(start_prefetch("什么是Python？"))
+        with patch.object(settings, "PREFETCH_ENABLED", False):
+            self.assertIsNone(start_prefetch("总结 https://example.com"))
+
+
+if __name__ == "__main__":
+    unittest.main()
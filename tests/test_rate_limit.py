@@ -0,0 +1,184 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import dependencies
+from app.services.rate_limit import (
+    MemoryRateLimitBackend,
+    RateLimiter,
+    SlidingWindowPolicy,
+    SQLiteRateLimitBackend,
+    TokenBucketPolicy,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRateLimitPolicies(unittest.TestCase):
+    """限流策略测试"""
+
+    def test_token_bucket_burst_and_refill(self):
+        """测试令牌桶允许突发，之后按速率恢复"""
+        policy = TokenBucketPolicy(rate=1.0, burst=3)
+        state = None
+        for _ in range(3):
+            state, result = policy.evaluate(state, 0.0)
+            self.assertTrue(result.allowed)
+        state, result = policy.evaluate(state, 0.0)
+        self.assertFalse(result.allowed)
+        self.assertAlmostEqual(result.retry_after, 1.0)
+
+        state, result = policy.evaluate(state, 1.0)
+        self.assertTrue(result.allowed)
+        self.assertEqual(result.remaining, 0)
+
+    def test_sliding_window_weights_previous_window(self):
+        """测试滑动窗口会计入上一个窗口的请求"""
+        policy = SlidingWindowPolicy(limit=4, window=10)
+        state = None
+        for _ in range(4):
+            state, result = policy.evaluate(state, 5.0)
+            self.assertTrue(result.allowed)
+        state, result = policy.evaluate(state, 6.0)
+        self.assertFalse(result.allowed)
+
+        # 新窗口开始后上一个窗口的4个请求仍按剩余比例计入
+        state, result = policy.evaluate(state, 12.0)
+        self.assertFalse(result.allowed)
+        self.assertGreater(result.retry_after, 0)
+        state, result = policy.evaluate(state, 12.0 + result.retry_after + 0.01)
+        self.assertTrue(result.allowed)
+
+
+class TestRateLimitBackends(unittest.TestCase):
+    """限流后端测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.rules = {"login": {"policy": "sliding_window", "limit": 2, "window": 60, "key": "ip"}}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _exercise(self, backend):
+        clock = FakeClock()
+        limiter = RateLimiter(backend, self.rules, clock=clock)
+        self.assertTrue(limiter.hit("login", "ip:1").allowed)
+        self.assertTrue(limiter.hit("login", "ip:1").allowed)
+        self.assertFalse(limiter.hit("login", "ip:1").allowed)
+        # 不同的键互不影响，未配置的规则不限流
+        self.assertTrue(limiter.hit("login", "ip:2").allowed)
+        self.assertIsNone(limiter.hit("unknown", "ip:1"))
+        self.assertEqual(limiter.stats()["rejected"], {"login": 1})
+
+    def test_memory_backend(self):
+        """测试内存后端"""
+        self._exercise(MemoryRateLimitBackend())
+
+    def test_sqlite_backend_shared(self):
+        """测试SQLite后端在多个连接（模拟多个worker）之间共享限额"""
+        path = os.path.join(self.temp_dir.name, "rate_limit.db")
+        self._exercise(SQLiteRateLimitBackend(path))
+
+        clock = FakeClock()
+        first = RateLimiter(SQLiteRateLimitBackend(path), self.rules, clock=clock)
+        second = RateLimiter(SQLiteRateLimitBackend(path), self.rules, clock=clock)
+        self.assertTrue(first.hit("login", "ip:3").allowed)
+        self.assertTrue(second.hit("login", "ip:3").allowed)
+        self.assertFalse(first.hit("login", "ip:3").allowed)
+
+
+class TestRateLimitDependency(unittest.TestCase):
+    """限流路由依赖测试"""
+
+    def test_headers_and_rejection(self):
+        """测试响应中带有限流头，超限时返回429和Retry-After"""
+        rules = {"login": {"policy": "token_bucket", "rate": 0.5, "burst": 2, "key": "ip"}}
+        limiter = RateLimiter(MemoryRateLimitBackend(), rules, clock=FakeClock())
+
+        with patch.object(dependencies.settings, "RATE_LIMIT_RULES", rules), \
+                patch.object(dependencies, "get_rate_limiter", return_value=limiter):
+            app = FastAPI()
+
+            @app.post("/token", dependencies=[Depends(dependencies.rate_limit("login"))])
+            async def token():
+                return {"ok": True}
+
+            client = TestClient(app)
+            response = client.post("/token")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["RateLimit-Limit"], "2")
+            self.assertEqual(response.headers["RateLimit-Remaining"], "1")
+
+            client.post("/token")
+            response = client.post("/token")
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers["Retry-After"], "2")
+
+    def test_sqlite_backend_off_event_loop(self):
+        """测试SQLite后端在线程池中读写，不阻塞事件循环"""
+        rules = {"login": {"policy": "token_bucket", "rate": 0.5, "burst": 2, "key": "ip"}}
+        with tempfile.TemporaryDirectory() as directory:
+            backend = SQLiteRateLimitBackend(os.path.join(directory, "rate_limit.db"))
+            limiter = RateLimiter(backend, rules, clock=FakeClock())
+            threads = []
+            hit = backend.hit
+
+            def record_thread(*args):
+                threads.append(threading.current_thread())
+                return hit(*args)
+
+            with patch.object(dependencies.settings, "RATE_LIMIT_RULES", rules), \
+                    patch.object(dependencies, "get_rate_limiter", return_value=limiter), \
+                    patch.object(backend, "hit", side_effect=record_thread):
+                app = FastAPI()
+
+                @app.post("/token", dependencies=[Depends(dependencies.rate_limit("login"))])
+                async def token():
+                    return {"ok": True, "loop_thread": threading.current_thread().name}
+
+                response = TestClient(app).post("/token")
+            backend.close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["RateLimit-Remaining"], "1")
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0].name, response.json()["loop_thread"])
+
+    def test_cost_above_burst_rejected_upfront(self):
+        """测试扣除额度超过令牌桶容量时直接返回413，不消耗额度"""
+        rules = {"batch_query": {"policy": "token_bucket", "rate": 0.2, "burst": 3, "key": "user"}}
+        limiter = RateLimiter(MemoryRateLimitBackend(), rules, clock=FakeClock())
+        self.assertEqual(limiter.max_cost("batch_query"), 3)
+        self.assertIsNone(limiter.max_cost("unknown"))
+
+        with patch.object(dependencies, "get_rate_limiter", return_value=limiter):
+            app = FastAPI()
+
+            @app.post("/batch")
+            async def batch(cost: int):
+                return await dependencies.charge_rate_limit("batch_query", "user:1", cost=cost)
+
+            client = TestClient(app)
+            response = client.post("/batch", params={"cost": 4})
+            self.assertEqual(response.status_code, 413)
+            self.assertIn("3", response.json()["detail"])
+
+            response = client.post("/batch", params={"cost": 3})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["RateLimit-Remaining"], "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
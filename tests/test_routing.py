@@ -0,0 +1,87 @@
+import unittest
+from types import SimpleNamespace
+
+from app.services.routing import (
+    ROUTE_FULL,
+    ROUTE_SIMPLE,
+    ROUTE_STANDARD,
+    QueryClassifier,
+    build_router,
+)
+
+
+def fake_instruction(servers):
+    return "tools: " + ",".join(servers)
+
+
+class TestQueryClassifier(unittest.TestCase):
+    """查询复杂度分类器测试"""
+
+    def setUp(self):
+        self.classifier = QueryClassifier(simple_max_chars=40, complex_min_chars=300)
+
+    def test_short_conceptual_query_is_simple(self):
+        """测试简短的概念性问题使用简单路由"""
+        self.assertEqual(self.classifier.classify("什么是GIL？"), ROUTE_SIMPLE)
+        self.assertEqual(self.classifier.classify("进程和线程的区别"), ROUTE_SIMPLE)
+
+    def test_code_and_doc_queries_are_standard(self):
+        """测试包含代码或文档类关键词的问题使用标准路由"""
+        self.assertEqual(self.classifier.classify("FastAPI 依赖注入怎么用"), ROUTE_STANDARD)
+        self.assertEqual(self.classifier.classify("为什么\n```\nx = 1\n```"), ROUTE_STANDARD)
+
+    def test_url_and_long_queries_are_full(self):
+        """测试包含URL或很长的问题使用完整路由"""
+        self.assertEqual(self.classifier.classify("总结 https://docs.python.org/3/ 的内容"), ROUTE_FULL)
+        self.assertEqual(self.classifier.classify("为什么" * 200), ROUTE_FULL)
+
+
+class TestQueryRouter(unittest.TestCase):
+    """查询路由器测试"""
+
+    def test_default_config_has_single_full_route(self):
+        """测试未配置路由时所有查询使用挂载全部工具的完整路由"""
+        router = build_router({}, "model-a", fake_instruction)
+        self.assertEqual(list(router.routes), [ROUTE_FULL])
+        route = router.route("什么是GIL？")
+        self.assertEqual(route.name, ROUTE_FULL)
+        self.assertEqual(route.model, "model-a")
+        self.assertEqual(route.servers, ["fetch", "context7-mcp"])
+
+    def test_missing_route_falls_back_to_fuller_route(self):
+        """测试分类结果对应的路由未配置时使用更完整的路由"""
+        config = {"routes": {"standard": {"servers": ["context7-mcp"]}, "full": {"servers": ["fetch"]}}}
+        router = build_router(config, "model-a", fake_instruction)
+        self.assertEqual(router.route("什么是GIL？").name, ROUTE_STANDARD)
+
+    def test_instruction_version_depends_on_tools(self):
+        """测试不同工具集的路由使用不同的缓存版本"""
+        config = {"routes": {"simple": {"servers": []}, "full": {"servers": ["fetch"]}}}
+        router = build_router(config, "model-a", fake_instruction)
+        self.assertNotEqual(
+            router.routes["simple"].instruction_version, router.routes["full"].instruction_version
+        )
+        self.assertEqual(router.routes["simple"].instruction, "tools: ")
+
+    def test_stats_record_latency_tokens_and_cost(self):
+        """测试按路由统计延迟、token用量和成本"""
+        config = {"routes": {"full": {"model": "model-b", "input_cost_per_1k": 1.0, "output_cost_per_1k": 2.0}}}
+        router = build_router(config, "model-a", fake_instruction)
+        route = router.routes["full"]
+        usages = [SimpleNamespace(prompt_tokens=1000, completion_tokens=500), None]
+        router.record(route, 2.0, usages)
+        router.record(route, 4.0, [], ok=False)
+
+        stats = router.stats()["full"]
+        self.assertEqual(stats["model"], "model-b")
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["prompt_tokens"], 1000)
+        self.assertEqual(stats["completion_tokens"], 500)
+        self.assertAlmostEqual(stats["total_cost"], 2.0)
+        self.assertEqual(stats["p50_latency"], 2.0)
+        self.assertEqual(stats["p95_latency"], 4.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
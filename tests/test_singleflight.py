@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from app.utils.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    """单飞请求合并测试"""
+
+    async def test_identical_calls_coalesced(self):
+        """测试相同键的并发调用只执行一次"""
+        flights = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+        self.assertEqual(results, ["answer"] * 5)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flights.stats()["coalesced"], 4)
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    async def test_waiter_cancel_does_not_affect_others(self):
+        """测试一个等待者取消后其他等待者仍能拿到结果"""
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return 42
+
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertEqual(await second, 42)
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.assertEqual(flights.stats()["cancelled"], 0)
+
+    async def test_all_waiters_cancelled_cancels_call(self):
+        """测试所有等待者都取消时取消共享调用"""
+        flights = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.create_task(flights.do("key", work))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        self.assertEqual(flights.stats()["cancelled"], 1)
+
+    async def test_exception_shared(self):
+        """测试异常会传递给所有等待者"""
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        results = await asyncio.gather(
+            flights.do("key", work), flights.do("key", work), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from app.utils.text_utils import AnswerStreamExtractor, extract_marked_content
+
+
+def feed_all(extractor, chunks):
+    output = "".join(extractor.feed(chunk) for chunk in chunks)
+    return output + extractor.finish()
+
+
+class TestAnswerStreamExtractor(unittest.TestCase):
+    """流式答案提取测试"""
+
+    def test_markers_split_across_chunks(self):
+        """测试标记被拆分在多个分片中"""
+        raw = "先调用工具...$$$ANSWER_START$$$\n## 标题\n正文内容\n$$$ANSWER_END$$$ 结束"
+        for size in (1, 2, 3, 7, 50):
+            chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+            extractor = AnswerStreamExtractor()
+            output = feed_all(extractor, chunks)
+            self.assertEqual(output, "## 标题\n正文内容")
+            self.assertEqual(extractor.final_answer(), extract_marked_content(raw))
+
+    def test_no_text_before_start_marker(self):
+        """测试开始标记之前的内容不会输出"""
+        extractor = AnswerStreamExtractor()
+        self.assertEqual(extractor.feed("我将使用fetch工具获取页面 $$"), "")
+        self.assertEqual(extractor.feed("$ANSWER_ST"), "")
+        self.assertFalse(extractor.found_start)
+
+    def test_text_after_end_marker_ignored(self):
+        """测试结束标记之后的内容不会输出"""
+        extractor = AnswerStreamExtractor()
+        feed_all(extractor, ["$$$ANSWER_START$$$答案$$$ANSWER_END$$$", "多余内容"])
+        self.assertEqual(extractor.final_answer(), "答案")
+
+    def test_missing_markers_fallback(self):
+        """测试没有标记时返回原文"""
+        extractor = AnswerStreamExtractor()
+        output = feed_all(extractor, ["没有标记的", "回答"])
+        self.assertEqual(output, "")
+        self.assertEqual(extractor.final_answer(), "没有标记的回答")
+
+    def test_missing_end_marker(self):
+        """测试缺少结束标记时输出开始标记之后的全部内容"""
+        extractor = AnswerStreamExtractor()
+        output = feed_all(extractor, ["$$$ANSWER_START$$$ 部分", "答案"])
+        self.assertEqual(output, "部分答案")
+        self.assertEqual(extractor.final_answer(), "部分答案")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from mcp.types import CallToolResult, TextContent
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api.schemas import MessageCreate
+from app.core.config import settings
+from app.db.base_class import Base
+from app.models.chat import ChatToolResult
+from app.services import chat_service, memory_service
+from app.services.tool_results import (
+    StoredToolResults, capture_tool_calls, install_tool_reuse, reuse_tool_results, to_records,
+)
+from app.services.user_service import create_user
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _agent():
+    calls = []
+
+    async def call_tool(name, arguments=None):
+        calls.append((name, arguments))
+        return CallToolResult(content=[TextContent(type="text", text=f"{name} 第{len(calls)}次调用")])
+
+    agent = SimpleNamespace(call_tool=call_tool)
+    install_tool_reuse(agent)
+    return agent, calls
+
+
+class TestToolResultReuse(unittest.IsolatedAsyncioTestCase):
+    """工具结果记录和复用测试"""
+
+    async def test_capture_and_reuse(self):
+        """测试记录的工具结果在有效期内以相同参数调用时被复用"""
+        agent, calls = _agent()
+        with capture_tool_calls() as captured:
+            await agent.call_tool("fetch-fetch", {"url": "https://example.com"})
+        records = to_records(captured)
+        self.assertEqual(records[0].tool_name, "fetch-fetch")
+
+        stored = StoredToolResults(records)
+        with reuse_tool_results(stored), capture_tool_calls() as captured:
+            result = await agent.call_tool("fetch-fetch", {"url": "https://example.com"})
+            await agent.call_tool("fetch-fetch", {"url": "https://example.com/other"})
+        self.assertEqual(result.content[0].text, "fetch-fetch 第1次调用")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(stored.reused, 1)
+        # 复用的结果保留原来的调用时间，有效期从实际调用工具时算起
+        self.assertEqual(to_records(captured)[0].called_at, records[0].called_at)
+
+    async def test_stale_and_error_results_rerun(self):
+        """测试超过有效期或出错的结果不复用"""
+        old = datetime.now() - timedelta(seconds=settings.REGENERATE_TOOL_MAX_AGE + 10)
+        stale = ChatToolResult(
+            tool_name="fetch-fetch", arguments='{"url": "https://a"}', is_error=False, duration=1.0, called_at=old,
+            result=CallToolResult(content=[TextContent(type="text", text="old")]).model_dump_json(),
+        )
+        docs = ChatToolResult(
+            tool_name="context7-mcp-get-library-docs", arguments="{}", is_error=False, duration=1.0, called_at=old,
+            result=CallToolResult(content=[TextContent(type="text", text="docs")]).model_dump_json(),
+        )
+        failed = ChatToolResult(
+            tool_name="fetch-fetch", arguments='{"url": "https://b"}', is_error=True, duration=1.0,
+            called_at=datetime.now(), result=CallToolResult(content=[], isError=True).model_dump_json(),
+        )
+        stored = StoredToolResults([stale, docs, failed])
+        self.assertIsNone(stored.lookup("fetch-fetch", {"url": "https://a"}))
+        self.assertIsNone(stored.lookup("fetch-fetch", {"url": "https://b"}))
+        # context7-mcp 的文档有效期更长
+        self.assertIsNotNone(stored.lookup("context7-mcp-get-library-docs", {}))
+        self.assertEqual((stored.stale, stored.reused), (1, 1))
+
+
+class TestRegenerateStorage(unittest.TestCase):
+    """助手消息的工具结果保存测试"""
+
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.db = TestingSessionLocal()
+        self.user = create_user(self.db, "toolsuser", "tools@example.com", "password123")
+        self.session_id = chat_service.prepare_query_session(self.db, self.user.id, "第一个问题")
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def _tool_call(self, text):
+        return {
+            "tool_name": "fetch-fetch", "arguments": {"url": "https://example.com"}, "is_error": False,
+            "result": CallToolResult(content=[TextContent(type="text", text=text)]),
+            "duration": 0.5, "called_at": datetime.now(),
+        }
+
+    def test_replace_answer_and_question(self):
+        """测试保存、替换答案的工具结果，并找到答案对应的问题和之前的上下文"""
+        message = chat_service.add_message(
+            self.db, self.session_id, self.user.id, MessageCreate(role="assistant", content="答案1"),
+            [self._tool_call("page")]
+        )
+        self.assertEqual(len(message.tool_results), 1)
+        question = chat_service.get_question(self.db, message)
+        self.assertEqual(question.content, "第一个问题")
+        chat_service.prepare_query_session(self.db, self.user.id, "第二个问题", self.session_id)
+        self.assertEqual(memory_service.build_session_context(self.db, self.session_id, before_id=question.id), "")
+
+        updated = chat_service.replace_answer(
+            self.db, message.id, self.session_id, self.user.id, "答案2", [self._tool_call("new"), self._tool_call("x")]
+        )
+        self.assertEqual(updated.content, "答案2")
+        self.assertEqual(self.db.query(ChatToolResult).count(), 2)
+
+        # 删除消息时一并删除工具结果
+        chat_service.delete_message(self.db, message.id, self.session_id, self.user.id)
+        self.assertEqual(self.db.query(ChatToolResult).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api.schemas import MessageCreate
+from app.db.base_class import Base
+from app.models.usage import DailyUsage, MessageUsage
+from app.services import agent_service, chat_service, usage_service
+from app.services.agent_pool import AgentPoolTimeoutError
+from app.services.routing import QueryRoute
+from app.services.usage_service import capture_usage, record_call, record_tool_call, set_route, usage_report
+from app.services.user_service import create_user
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+ROUTE = QueryRoute(
+    "full", "deepseek-chat", ["fetch"], "", input_cost_per_1k=2.0, output_cost_per_1k=8.0, cached_input_cost_per_1k=0.5
+)
+
+
+def _usage(prompt_tokens=1000, completion_tokens=500, cached_tokens=400, tool_calls=2):
+    """模拟一次调用了模型和工具的查询"""
+    with capture_usage() as usage:
+        set_route(ROUTE)
+        details = SimpleNamespace(cached_tokens=cached_tokens)
+        record_call(ROUTE, [
+            SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=0, prompt_tokens_details=details),
+            SimpleNamespace(prompt_tokens=0, completion_tokens=completion_tokens),
+        ])
+        for _ in range(tool_calls):
+            record_tool_call()
+    return usage
+
+
+class TestQueryUsage(unittest.TestCase):
+    """查询用量记录测试"""
+
+    def test_tokens_and_cost(self):
+        """测试累加每轮模型请求的token，命中前缀缓存的输入token按缓存价格计算"""
+        usage = _usage()
+        self.assertEqual((usage.llm_calls, usage.prompt_tokens, usage.completion_tokens), (2, 1000, 500))
+        self.assertEqual((usage.cached_tokens, usage.tool_calls), (400, 2))
+        # 600 * 2.0 + 400 * 0.5 + 500 * 8.0 = 5400（每1000个token）
+        self.assertAlmostEqual(usage.cost, 5.4)
+        self.assertEqual(usage.source, usage_service.SOURCE_AGENT)
+
+        # DeepSeek 以 prompt_cache_hit_tokens 返回命中缓存的token
+        with capture_usage() as deepseek:
+            record_call(ROUTE, [SimpleNamespace(prompt_tokens=100, completion_tokens=0, prompt_cache_hit_tokens=100)])
+        self.assertEqual(deepseek.cached_tokens, 100)
+
+    def test_source_without_agent_call(self):
+        """测试没有调用模型的查询按是否命中答案缓存区分来源，不在记录范围内时不记录"""
+        with capture_usage() as cached:
+            set_route(ROUTE, cache_hit=True)
+        self.assertEqual((cached.source, cached.route, cached.cost), (usage_service.SOURCE_CACHE, "full", 0.0))
+        with capture_usage() as coalesced:
+            set_route(ROUTE)
+        self.assertEqual(coalesced.source, usage_service.SOURCE_COALESCED)
+        record_call(ROUTE, [SimpleNamespace(prompt_tokens=1, completion_tokens=1)])
+        record_tool_call()
+
+
+class TestFailedQueryUsage(unittest.IsolatedAsyncioTestCase):
+    """失败查询的用量来源测试"""
+
+    async def test_failure_before_agent_call(self):
+        """测试未能调用agent（agent池已满）或调用失败时来源记为 error，而不是 coalesced"""
+        async def pool_full(*args, **kwargs):
+            raise AgentPoolTimeoutError("agent池已满")
+
+        with patch.object(agent_service, "_query_agent", pool_full), capture_usage() as usage:
+            with self.assertRaises(AgentPoolTimeoutError):
+                await agent_service.tech_assistant_query("什么是FastAPI？", use_cache=False)
+        self.assertEqual(usage.source, usage_service.SOURCE_ERROR)
+
+        async def agent_error(*args, **kwargs):
+            raise RuntimeError("上游错误")
+
+        with patch.object(agent_service, "_query_agent", agent_error), capture_usage() as usage:
+            answer = await agent_service.tech_assistant_query("什么是FastAPI？", use_cache=False)
+        self.assertIn("处理查询时出错", answer)
+        self.assertEqual(usage.source, usage_service.SOURCE_ERROR)
+
+
+class TestUsageStorage(unittest.TestCase):
+    """消息用量和每日汇总的保存测试"""
+
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.db = TestingSessionLocal()
+        self.user = create_user(self.db, "usageuser", "usage@example.com", "password123")
+        self.session_id = chat_service.prepare_query_session(self.db, self.user.id, "问题")
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def _answer(self, usage):
+        return chat_service.add_message(
+            self.db, self.session_id, self.user.id, MessageCreate(role="assistant", content="答案"), usage=usage
+        )
+
+    def test_message_usage_and_daily_rollup(self):
+        """测试用量随消息保存并累加到每日汇总，删除消息后汇总保留"""
+        first = self._answer(_usage())
+        with capture_usage() as cached:
+            set_route(ROUTE, cache_hit=True)
+        self._answer(cached)
+        self.assertEqual(first.usage.prompt_tokens, 1000)
+        self.assertEqual(first.usage.source, usage_service.SOURCE_AGENT)
+
+        [daily] = self.db.query(DailyUsage).all()
+        self.assertEqual((daily.queries, daily.cache_hits, daily.tool_calls), (2, 1, 2))
+        self.assertAlmostEqual(daily.cost, 5.4)
+
+        # 重新生成时替换消息的用量，汇总中累加重新生成的用量
+        chat_service.replace_answer(
+            self.db, first.id, self.session_id, self.user.id, "新答案", usage=_usage(prompt_tokens=2000, cached_tokens=0)
+        )
+        self.assertEqual(self.db.query(MessageUsage).filter_by(message_id=first.id).one().prompt_tokens, 2000)
+        self.db.refresh(daily)
+        self.assertEqual(daily.queries, 3)
+
+        chat_service.delete_message(self.db, first.id, self.session_id, self.user.id)
+        self.assertEqual(self.db.query(MessageUsage).count(), 1)
+        self.assertEqual(self.db.query(DailyUsage).one().queries, 3)
+
+    def test_usage_report(self):
+        """测试按用户、路由和会话汇总用量"""
+        self._answer(_usage())
+        self._answer(_usage(tool_calls=0))
+        by_user = usage_report(self.db, group_by="user")
+        self.assertEqual(by_user["groups"][0]["user_id"], self.user.id)
+        self.assertEqual(by_user["totals"]["prompt_tokens"], 2000)
+        self.assertEqual(by_user["totals"]["tool_calls"], 2)
+        self.assertEqual(usage_report(self.db, group_by="route")["groups"][0]["route"], "full")
+        by_session = usage_report(self.db, group_by="session")
+        self.assertEqual(by_session["groups"][0]["session_id"], self.session_id)
+        self.assertAlmostEqual(by_session["totals"]["cost"], 10.8)
+        self.assertEqual(usage_report(self.db, user_id=self.user.id + 1)["groups"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()